@@ -1,22 +1,84 @@
 from aiohttp import web
 import handlers
+import db_connection
 import logging
+import logs
+import metrics
+import tracing
+import admission
+import migrations
+import archiver
+import group_commit
+import memory_storage
 import cfg
 
 
-def run():
-    app = web.Application()
-    logging.basicConfig(level=logging.DEBUG)
+async def _mark_ready(app: web.Application):
+    app['ready'] = True
+
+
+async def _mark_not_ready(app: web.Application):
+    app['ready'] = False  # load balancers stop sending requests before the connections are closed
+
+
+def make_app() -> web.Application:
+    """
+    :return: the application with all its routes, middlewares and hooks, not started yet
+    """
+    # requests shed by the admission control are counted by metrics.middleware, and aren`t traced
+    app = web.Application(middlewares=[logs.request_context, metrics.middleware, admission.middleware,
+                                       tracing.middleware, handlers.db_unavailable])
+
+    app.on_startup.append(admission.init_admission)
+    if cfg.STORAGE_BACKEND == 'memory':
+        app.on_startup.append(memory_storage.open_memory_storage)
+    else:
+        app.on_startup.append(migrations.migrate_on_startup)
+        app.on_startup.append(db_connection.init_pool)
+        app.on_startup.append(db_connection.warm_up_pool)
+        app.on_startup.append(db_connection.init_replicas)
+        app.on_startup.append(db_connection.init_matching_index)
+        app.on_startup.append(archiver.start_archiver)
+        app.on_startup.append(group_commit.start_group_commit)
+    app.on_startup.append(_mark_ready)
+    app.on_shutdown.append(_mark_not_ready)
+    if cfg.STORAGE_BACKEND == 'memory':
+        app.on_cleanup.append(memory_storage.close_memory_storage)
+    else:
+        app.on_cleanup.append(db_connection.stop_matching_index)
+        app.on_cleanup.append(archiver.stop_archiver)
+        app.on_cleanup.append(group_commit.stop_group_commit)
+        app.on_cleanup.append(db_connection.close_replicas)
+        app.on_cleanup.append(db_connection.close_pool)
 
     app.add_routes([web.post('/couriers', handlers.post_couriers), web.post('/couriers/', handlers.post_couriers),
                     web.post('/orders', handlers.post_orders), web.post('/orders/', handlers.post_orders),
                     web.patch(r'/couriers/{courier_id:\d+}', handlers.patch_couriers_id),
-                    web.patch(r'/couriers/{courier_id:\d+/}', handlers.patch_couriers_id),
+                    web.patch(r'/couriers/{courier_id:\d+}/', handlers.patch_couriers_id),
                     web.post('/orders/complete', handlers.post_orders_complete),
                     web.post('/orders/complete/', handlers.post_orders_complete),
                     web.post('/orders/assign', handlers.post_orders_assign), web.post('/orders/assign/', handlers.post_orders_assign),
 
-                    web.get('/', handlers.get_root), web.get(r'/couriers/{courier_id:\d+}', handlers.get_couriers_id)])
+                    web.get('/', handlers.get_root), web.get(r'/couriers/{courier_id:\d+}', handlers.get_couriers_id),
+                    web.get('/metrics', handlers.get_metrics), web.get('/ready', handlers.get_ready)])
+    if cfg.STORAGE_BACKEND != 'memory':
+        # the batch assignment and the exports are made by the queries of db_connection only
+        app.add_routes([web.post('/orders/assign/batch', handlers.post_orders_assign_batch),
+                        web.post('/orders/assign/batch/', handlers.post_orders_assign_batch),
+                        web.get('/orders/export', handlers.get_orders_export),
+                        web.get('/orders/export/', handlers.get_orders_export),
+                        web.get('/assignments/export', handlers.get_assignments_export),
+                        web.get('/assignments/export/', handlers.get_assignments_export)])
+    if cfg.TRACE_ADMIN_ENABLED:
+        app.add_routes([web.get('/admin/traces', handlers.get_admin_traces)])
+    return app
 
-    web.run_app(app, port=8080, access_log=logging.getLogger('aiohttp.server'))
+
+def run():
+    logs.setup()
+    app = make_app()
+    try:
+        web.run_app(app, port=cfg.SERVER_PORT, access_log=logging.getLogger('aiohttp.server'))
+    finally:
+        logs.stop()
 
@@ -0,0 +1,135 @@
+"""
+Admission control of the requests (cfg.ADMISSION_ENABLED). Routes are put into classes by cfg.ADMISSION_ROUTES and
+every class has a gate of cfg.ADMISSION_CLASSES: at most so many of its requests are served at once, the next ones
+wait in a bounded queue in the order they came. A request that finds the queue full, or waits in it for longer than
+its class allows, is shed with 503 and Retry-After before its body is read, so under a burst the requests that can`t
+be served soon are rejected at once instead of piling up on the pool of connections and timing out there.
+A burst of one class, e.g. bulk POST /orders, only fills its own queue and doesn`t slow down the others.
+"""
+import asyncio
+import collections
+import logging
+import time
+from typing import Dict, Optional
+
+from aiohttp import web
+
+import cfg
+import metrics
+
+
+class Shed(Exception):
+    """
+    The request is not admitted, reason is 'queue_full' or 'timeout'.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Gate:
+    """
+    Limit of the requests of a class served at once with the queue of the ones waiting for their turn.
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int, max_wait: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiters = collections.deque()  # futures of the waiting requests, resolved when it`s their turn
+
+    async def enter(self) -> float:
+        """
+        Waits for the turn of the request, it must call leave when it`s served.
+        :return: seconds waited
+        :raise Shed: if the queue is full or the turn didn`t come in max_wait seconds
+        """
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return 0.0
+        if len(self.waiters) >= self.queue_size:
+            raise Shed('queue_full')
+        future = asyncio.get_event_loop().create_future()
+        self.waiters.append(future)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except BaseException as error:
+            # timed out or cancelled, e.g. the client is gone; the turn given to it meanwhile is passed on
+            if future.done() and not future.cancelled():
+                self.leave()
+            else:
+                self._forget(future)
+            if isinstance(error, asyncio.TimeoutError):
+                raise Shed('timeout')
+            raise
+        return time.monotonic() - start
+
+    def leave(self):
+        """
+        Gives the place of a served request to the first waiting one, the number of the active requests stays the same.
+        """
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def _forget(self, future: asyncio.Future):
+        try:
+            self.waiters.remove(future)
+        except ValueError:
+            pass  # it`s been taken by leave already
+
+
+gates: Dict[str, Gate] = {}  # by class, created on startup
+
+
+def gate_of(request: web.Request) -> Optional[Gate]:
+    """
+    :return: gate of the class of the route of the request, None if the route isn`t limited
+    """
+    resource = request.match_info.route.resource
+    if resource is None:
+        return None  # not found, it`s answered without any work
+    route = resource.canonical.rstrip('/') or '/'
+    return gates.get(cfg.ADMISSION_ROUTES.get((request.method, route), 'default'))
+
+
+@web.middleware
+async def middleware(request: web.Request, handler):
+    gate = gate_of(request)
+    if gate is None:
+        return await handler(request)
+    try:
+        waited = await gate.enter()
+    except Shed as shed:
+        metrics.admission_shed.labels(gate.name, shed.reason).inc()
+        logging.info('middleware: request=%s; shed by the %s gate: %s', request, gate.name, shed.reason)
+        raise web.HTTPServiceUnavailable(headers={'Retry-After': str(cfg.ADMISSION_RETRY_AFTER)})
+    metrics.admission_wait.labels(gate.name).observe(waited)
+    try:
+        return await handler(request)
+    finally:
+        gate.leave()
+
+
+metrics.register_callback('admission_requests', 'Requests served and waiting at the gates, by class and state.',
+                          'gauge', ('class', 'state'),
+                          lambda: [((x.name, state), value) for x in gates.values()
+                                   for state, value in (('active', x.active), ('queued', len(x.waiters)))])
+
+
+async def init_admission(app: web.Application):
+    """
+    on_startup hook of the application, creates the gates of cfg.ADMISSION_CLASSES.
+    :param app: application that is being started
+    """
+    gates.clear()
+    if cfg.ADMISSION_ENABLED:
+        for name, (limit, queue_size, max_wait) in cfg.ADMISSION_CLASSES.items():
+            gates[name] = Gate(name, limit, queue_size, max_wait)
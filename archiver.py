@@ -0,0 +1,119 @@
+"""
+Moves completed orders out of the hot tables orders and delivery_hours_of_orders into orders_history
+and delivery_hours_history, so the hot tables stay sized to the open work the assignment and the patch look through.
+An order is archived once its assignment is finished, i.e. no courier has it as the current one: then neither
+the completion nor the crediting of the earnings reads its orders anymore. Ratings and earnings are kept
+in the aggregates, backfill.py rebuilds them from both the hot and the history tables.
+The app runs the archiver in background every cfg.ARCHIVE_INTERVAL seconds (cfg.ARCHIVE_ENABLED).
+Usage: python archiver.py
+"""
+import asyncio
+import logging
+from typing import List, Optional
+
+import aiomysql
+from aiohttp import web
+
+import cfg
+import db_connection
+import metrics
+
+_archived = 0  # orders moved by this process
+
+metrics.register_callback('orders_archived_total', 'Completed orders moved to orders_history.', 'counter', (),
+                          lambda: [((), _archived)])
+
+
+async def archive_batch(cur: aiomysql.Cursor, after_id: int, size: int) -> (int, Optional[int]):
+    """
+    Moves up to size archivable orders with ids greater than after_id, in the transaction of the cursor.
+    Orders locked by the requests are skipped, they are archived by one of the next passes.
+    :return: tuple of the number of moved orders and the greatest id among them, None if there was nothing to move
+    """
+    await cur.execute('''SELECT orders.order_id FROM orders
+        WHERE orders.is_completed = 1 AND orders.order_id > %s AND NOT EXISTS
+            (SELECT 1 FROM couriers WHERE couriers.current_assignment_id = orders.assignment_id)
+        ORDER BY orders.order_id LIMIT %s FOR UPDATE OF orders SKIP LOCKED''', (after_id, size))
+    ids: List[int] = [x['order_id'] for x in await cur.fetchall()]
+    if not ids:
+        return 0, None
+    placeholders = ', '.join(['%s'] * len(ids))
+    await cur.execute(f'''INSERT INTO orders_history (order_id, weight, region, assigned_courier_id, is_completed,
+        assignment_id, completion_timestamp)
+        SELECT order_id, weight, region, assigned_courier_id, is_completed, assignment_id, completion_timestamp
+        FROM orders WHERE order_id IN ({placeholders})''', ids)
+    await cur.execute(f'''INSERT INTO delivery_hours_history (order_id, start_minute, stop_minute)
+        SELECT order_id, start_minute, stop_minute FROM delivery_hours_of_orders WHERE order_id IN ({placeholders})''',
+                      ids)
+    await cur.execute(f'DELETE FROM delivery_hours_of_orders WHERE order_id IN ({placeholders})', ids)
+    await cur.execute(f'DELETE FROM orders WHERE order_id IN ({placeholders})', ids)
+    return len(ids), ids[-1]
+
+
+async def archive() -> int:
+    """
+    Archives all archivable orders in batches of cfg.ARCHIVE_BATCH_SIZE, each one in its own transaction,
+    pausing for cfg.ARCHIVE_BATCH_PAUSE seconds between them. An interrupted pass loses nothing,
+    the batches moved so far are committed and the next pass picks up the rest.
+    Needs the pool of db_connection to be initialized.
+    :return: number of moved orders
+    """
+    global _archived
+    moved = 0
+    after_id = 0
+    while True:
+        async with db_connection.acquire() as conn:
+            cur = await conn.cursor()
+            await conn.begin()
+            count, last_id = await archive_batch(cur, after_id, cfg.ARCHIVE_BATCH_SIZE)
+            await conn.commit()  # an exception leaves the transaction to be rolled back by acquire
+        if last_id is None:
+            break
+        moved += count
+        _archived += count
+        after_id = last_id
+        await asyncio.sleep(cfg.ARCHIVE_BATCH_PAUSE)
+    logging.info('archive: moved %s completed orders to the history', moved)
+    return moved
+
+
+async def _archive_periodically():
+    while True:
+        try:
+            await archive()
+        except Exception as error:
+            logging.error('_archive_periodically: failed to archive orders: %s', error)
+        await asyncio.sleep(cfg.ARCHIVE_INTERVAL)
+
+
+async def start_archiver(app: web.Application):
+    """
+    on_startup hook of the application, starts the periodic archiving.
+    :param app: application that is being started
+    """
+    if cfg.ARCHIVE_ENABLED:
+        app['archiver'] = asyncio.ensure_future(_archive_periodically())
+
+
+async def stop_archiver(app: web.Application):
+    """
+    on_cleanup hook of the application, stops the periodic archiving, the batch being moved is rolled back.
+    :param app: application that is being shut down
+    """
+    archiver = app.get('archiver')
+    if archiver is not None:
+        archiver.cancel()
+
+
+async def _main():
+    await db_connection.init_pool(None)
+    try:
+        await archive()
+    finally:
+        await db_connection.close_pool(None)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(_main())
@@ -0,0 +1,82 @@
+"""
+Rebuilds the rating and earnings aggregates (couriers_regions_stats, couriers_earnings) from the delivery history
+in orders, orders_history and assignments. Needed once for the data stored before the aggregates were introduced,
+and safe to repeat any time, as the aggregates are recomputed from scratch in one transaction.
+Usage: python backfill.py
+"""
+import aiomysql
+import asyncio
+import logging
+import cfg
+
+# orders still in the hot table and the ones moved to the history by archiver.py
+ALL_ORDERS = '''(SELECT order_id, region, assigned_courier_id, is_completed, assignment_id, completion_timestamp
+    FROM orders UNION ALL
+    SELECT order_id, region, assigned_courier_id, is_completed, assignment_id, completion_timestamp
+    FROM orders_history)'''
+
+
+async def backfill_courier_stats(cur: aiomysql.Cursor):
+    """
+    :param cur: cursor of a connection using the database of the app, the caller commits the transaction
+    """
+    # assignments made before the aggregates know neither their courier nor its type, those are taken from the orders
+    # and the couriers, the type could have been changed since then, but there is nothing better to take it from
+    await cur.execute(f'''UPDATE assignments AS a JOIN
+        (SELECT assignment_id, MIN(assigned_courier_id) AS courier_id, MAX(completion_timestamp) AS last_completion
+         FROM {ALL_ORDERS} AS all_orders WHERE assignment_id IS NOT NULL GROUP BY assignment_id) AS o
+        ON o.assignment_id = a.assignment_id
+        SET a.courier_id = COALESCE(a.courier_id, o.courier_id), a.last_completion_timestamp = o.last_completion''')
+    await cur.execute('''UPDATE assignments AS a JOIN couriers AS c ON c.courier_id = a.courier_id
+        SET a.courier_type = c.courier_type WHERE a.courier_type IS NULL''')
+
+    await cur.execute('DELETE FROM couriers_regions_stats')
+    # the delivery of an order takes the time since the previous completion in its assignment
+    # or since the assignment itself, the same way post_orders_complete_execute_queries counts it
+    await cur.execute(f'''INSERT INTO couriers_regions_stats (courier_id, region, completed_count, delivery_seconds_sum)
+        SELECT courier_id, region, COUNT(*), SUM(GREATEST(0, TIMESTAMPDIFF(SECOND, previous, completion_timestamp)))
+        FROM (SELECT o.assigned_courier_id AS courier_id, o.region, o.completion_timestamp,
+                     COALESCE(LAG(o.completion_timestamp) OVER (PARTITION BY o.assignment_id
+                                                                ORDER BY o.completion_timestamp, o.order_id),
+                              a.assignment_timestamp) AS previous
+              FROM {ALL_ORDERS} AS o JOIN assignments AS a ON a.assignment_id = o.assignment_id
+              WHERE o.is_completed = 1 AND o.assigned_courier_id IS NOT NULL) AS deliveries
+        GROUP BY courier_id, region''')
+
+    coefficients = ' '.join('WHEN %s THEN %s' for _ in cfg.EARNINGS_COEFFICIENTS)
+    await cur.execute('DELETE FROM couriers_earnings')
+    await cur.execute('UPDATE assignments SET is_credited = 0')
+    # an assignment is finished when none of its orders is left to deliver and at least one of them was delivered
+    await cur.execute(f'''UPDATE assignments AS a JOIN
+        (SELECT assignment_id FROM {ALL_ORDERS} AS all_orders WHERE assignment_id IS NOT NULL GROUP BY assignment_id
+         HAVING SUM(is_completed = 0) = 0 AND SUM(is_completed) > 0) AS finished
+        ON finished.assignment_id = a.assignment_id
+        SET a.is_credited = 1 WHERE a.courier_id IS NOT NULL''')
+    await cur.execute(f'''INSERT INTO couriers_earnings (courier_id, completed_assignments, earnings)
+        SELECT a.courier_id, COUNT(*), SUM(%s * CASE a.courier_type {coefficients} ELSE 0 END)
+        FROM assignments AS a JOIN couriers AS c ON c.courier_id = a.courier_id
+        WHERE a.is_credited = 1 GROUP BY a.courier_id''',
+                      (cfg.EARNINGS_BASE, *(x for item in cfg.EARNINGS_COEFFICIENTS.items() for x in item)))
+
+
+async def backfill():
+    conn = await aiomysql.connect(host=cfg.DB_HOST, password=cfg.DB_PASSWORD, port=cfg.DB_PORT, user=cfg.DB_USER,
+                                  db=cfg.DATABASE, cursorclass=aiomysql.DictCursor, autocommit=False,
+                                  init_command="SET time_zone = '+00:00'")
+    cur = await conn.cursor()
+    try:
+        await conn.begin()
+        await backfill_courier_stats(cur)
+        await conn.commit()
+        logging.info('backfill: rating and earnings aggregates are rebuilt')
+    except Exception:
+        await conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(backfill())
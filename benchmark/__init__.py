@@ -0,0 +1,5 @@
+"""
+Benchmarks of the candy delivery app. Every module of the package is runnable with python -m benchmark.<module>,
+see its docstring for the options. They need a running MySQL server and truncate the tables they use,
+so point them at a database of their own (--database, candy_delivery_bench by default), never at the production one.
+"""
@@ -0,0 +1,172 @@
+"""
+Priority routes under a flood of bulk imports, with and without the admission control of admission.py.
+The app of Application.make_app is served in-process; GET /couriers/{id} (with the profile cache off)
+and POST /orders/complete are sent by a fixed number of clients, first alone, then while many more clients keep
+POSTing large batches of new orders. For the priority routes the report has p50/p99 latency and the statuses,
+for the bulk imports the orders written per second and the requests shed with 503.
+With the admission control on the p99 of the priority routes should stay near the one measured without the flood.
+
+    python -m benchmark.admission_load --couriers 2000 --orders 50000 --bulk-clients 64 --bulk-batch 2000
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+from typing import List
+
+import aiohttp
+from aiohttp import web
+
+import Application
+import admission
+import cache
+import cfg
+import db_connection
+import metrics
+from benchmark import common, traffic
+from benchmark.http_load import percentile
+
+PORT = 8093
+BASE_URL = f'http://127.0.0.1:{PORT}'
+
+
+async def send(session: aiohttp.ClientSession, method: str, path: str, body=None) -> int:
+    try:
+        async with session.request(method, f'{BASE_URL}{path}', json=body) as response:
+            await response.read()
+            return response.status
+    except aiohttp.ClientError:
+        return 0
+
+
+async def prepare(rng: random.Random, args: argparse.Namespace) -> (List[int], List):
+    """
+    Stores the couriers and the orders and assigns the orders to the couriers.
+    :return: ids of the couriers, bodies of POST /orders/complete of the assigned orders
+    """
+    couriers = common.make_couriers(rng, args.couriers, args.regions)
+    orders = common.make_orders(rng, args.orders, args.regions)
+    await db_connection.post_couriers_execute_queries({'data': couriers})
+    await db_connection.post_orders_execute_queries({'data': orders})
+    completions = []
+    for courier in couriers:
+        ok, assignment = await db_connection.post_orders_assign_execute_queries({'courier_id': courier['courier_id']})
+        for order in assignment.get('orders', []) if ok else []:
+            completions.append(traffic.completion(rng, courier['courier_id'], order['id'], assignment['assign_time']))
+    rng.shuffle(completions)
+    return [x['courier_id'] for x in couriers], completions
+
+
+async def measure(name: str, session: aiohttp.ClientSession, rng: random.Random, args: argparse.Namespace,
+                  courier_ids: List[int], completions: List, order_ids, bulk_clients: int):
+    latencies = {'GET /couriers/{id}': [], 'POST /orders/complete': []}
+    statuses = {route: Counter() for route in latencies}
+    bulk = Counter()
+    imported = 0
+    stopped = asyncio.Event()
+    requests = iter(range(args.requests))
+
+    async def priority_client():
+        for _ in requests:
+            if completions and rng.random() < args.complete_share:
+                route = 'POST /orders/complete'
+                start = time.perf_counter()
+                status = await send(session, 'POST', '/orders/complete', completions.pop())
+            else:
+                route = 'GET /couriers/{id}'
+                start = time.perf_counter()
+                status = await send(session, 'GET', f'/couriers/{rng.choice(courier_ids)}')
+            latencies[route].append(time.perf_counter() - start)
+            statuses[route][status] += 1
+
+    async def bulk_client():
+        nonlocal imported
+        while not stopped.is_set():
+            batch = common.make_orders(rng, args.bulk_batch, args.regions, next(order_ids))
+            status = await send(session, 'POST', '/orders', {'data': batch})
+            bulk[status] += 1
+            if status == 201:
+                imported += len(batch)
+            else:
+                await asyncio.sleep(0.1)  # a client backing off after 503 as told by Retry-After, but sooner
+
+    shed_before = sum(x.value for x in metrics.admission_shed.children.values())
+    bulk_tasks = [asyncio.ensure_future(bulk_client()) for _ in range(bulk_clients)]
+    await asyncio.sleep(args.warm_up if bulk_clients else 0)
+    start = time.perf_counter()
+    await asyncio.gather(*(priority_client() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    stopped.set()
+    await asyncio.gather(*bulk_tasks)
+    shed = sum(x.value for x in metrics.admission_shed.children.values()) - shed_before
+
+    print(f'{name}:')
+    for route, values in latencies.items():
+        values.sort()
+        print(f'{route:>24}: {len(values) / elapsed:8.1f} rps, p50 {percentile(values, 0.5) * 1000:8.2f} ms, '
+              f'p99 {percentile(values, 0.99) * 1000:8.2f} ms, statuses {dict(statuses[route])}')
+    if bulk_clients:
+        print(f'{"POST /orders":>24}: {imported / elapsed:8.0f} orders/s, statuses {dict(bulk)}')
+    print(f'{"":>24}  {shed:.0f} requests shed')
+
+
+async def run(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    cache.profiles.maxsize = 0  # every read goes to the DB
+    cfg.ARCHIVE_ENABLED = False
+    cfg.DB_POOL_MAXSIZE = args.pool_size
+    await common.prepare_database()
+    runner = web.AppRunner(Application.make_app(), access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, '127.0.0.1', PORT).start()
+        await common.truncate_tables()
+        await db_connection.rebuild_matching_index()  # loaded on startup, before the tables were emptied
+        timeout = aiohttp.ClientTimeout(total=args.timeout)
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            courier_ids, completions = await prepare(rng, args)
+            share = len(completions) // 3
+            order_ids = itertools.count(args.orders + 1, args.bulk_batch)  # first ids of the batches
+            print(f'{len(courier_ids)} couriers, {len(completions)} assigned orders, pool of {args.pool_size}')
+
+            await measure('priority routes alone', session, rng, args, courier_ids, completions[:share], order_ids, 0)
+            cfg.ADMISSION_ENABLED = False
+            await admission.init_admission(None)
+            await measure('with bulk imports, no admission control', session, rng, args, courier_ids,
+                          completions[share:2 * share], order_ids, args.bulk_clients)
+            cfg.ADMISSION_ENABLED = True
+            await admission.init_admission(None)
+            await measure('with bulk imports, admission control', session, rng, args, courier_ids,
+                          completions[2 * share:], order_ids, args.bulk_clients)
+    finally:
+        if db_connection.pool is not None:
+            await common.truncate_tables()
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--couriers', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=50000)
+    parser.add_argument('--regions', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=20000, help='requests to the priority routes per measurement')
+    parser.add_argument('--concurrency', type=int, default=16, help='clients of the priority routes')
+    parser.add_argument('--complete-share', type=float, default=0.3,
+                        help='share of POST /orders/complete among the priority requests')
+    parser.add_argument('--bulk-clients', type=int, default=64, help='clients POSTing orders at once')
+    parser.add_argument('--bulk-batch', type=int, default=2000, help='orders in a POST /orders')
+    parser.add_argument('--warm-up', type=float, default=2, help='seconds the bulk imports run before the measurement')
+    parser.add_argument('--pool-size', type=int, default=cfg.DB_POOL_MAXSIZE)
+    parser.add_argument('--timeout', type=float, default=60, help='seconds a request may take')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
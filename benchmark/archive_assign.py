@@ -0,0 +1,111 @@
+"""
+Latency of POST /orders/assign with the candidates looked up in the DB while millions of completed orders
+of finished assignments are kept in the hot tables, and after archiver.py moved them to the history tables.
+The history is generated by the server itself, so seeding 10M orders doesn`t go through the network.
+
+    python -m benchmark.archive_assign --history 10000000 --open-orders 20000 --assigns 200
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import archiver
+import cfg
+import db_connection
+import matching
+from benchmark import common
+from benchmark.assign_latency import measure
+
+ORDERS_PER_ASSIGNMENT = 10
+HISTORY_COURIERS = 1000  # couriers the history was delivered by, none of them has a current assignment
+SEED_CHUNK = 100000  # orders generated per statement
+
+
+async def seed_history(history: int, regions: int):
+    """
+    Stores history completed orders in finished assignments of ORDERS_PER_ASSIGNMENT orders each.
+    """
+    async with db_connection.acquire() as conn:
+        cur = await conn.cursor()
+        await cur.execute('SET SESSION cte_max_recursion_depth = %s', (SEED_CHUNK,))
+        await cur.executemany("INSERT INTO couriers (courier_id, courier_type) VALUES (%s, 'car')",
+                              [(courier_id,) for courier_id in range(1, HISTORY_COURIERS + 1)])
+        sequence = f'WITH RECURSIVE seq (n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < {SEED_CHUNK - 1})'
+        for first in range(0, history, SEED_CHUNK):
+            count = min(SEED_CHUNK, history - first)
+            await cur.execute(f'''INSERT INTO assignments (assignment_id, assignment_timestamp, courier_id, courier_type,
+                last_completion_timestamp, is_credited)
+                {sequence} SELECT %s + n DIV {ORDERS_PER_ASSIGNMENT} + 1, '2021-01-01' + INTERVAL (%s + n) MINUTE,
+                    1 + MOD((%s + n) DIV {ORDERS_PER_ASSIGNMENT}, {HISTORY_COURIERS}), 'car',
+                    '2021-01-01' + INTERVAL (%s + n + {ORDERS_PER_ASSIGNMENT}) MINUTE, 1
+                FROM seq WHERE n < %s AND MOD(n, {ORDERS_PER_ASSIGNMENT}) = 0''',
+                              (first // ORDERS_PER_ASSIGNMENT, first, first, first, count))
+            await cur.execute(f'''INSERT INTO orders (order_id, weight, region, assigned_courier_id, is_completed,
+                assignment_id, completion_timestamp)
+                {sequence} SELECT %s + n + 1, 0.01 + MOD((%s + n) * 7919, 5000) / 100, 1 + MOD(%s + n, {regions}),
+                    1 + MOD((%s + n) DIV {ORDERS_PER_ASSIGNMENT}, {HISTORY_COURIERS}), 1,
+                    (%s + n) DIV {ORDERS_PER_ASSIGNMENT} + 1, '2021-01-01' + INTERVAL (%s + n + 1) MINUTE
+                FROM seq WHERE n < %s''', (first, first, first, first, first, first, count))
+            await cur.execute(f'''INSERT INTO delivery_hours_of_orders (order_id, start_minute, stop_minute)
+                {sequence} SELECT %s + n + 1, MOD(%s + n, 46) * 30, MOD(%s + n, 46) * 30 + 60
+                FROM seq WHERE n < %s''', (first, first, first, count))
+            await conn.commit()
+        await cur.execute('ANALYZE TABLE orders, delivery_hours_of_orders')
+        await cur.fetchall()
+
+
+async def run(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    cfg.ARCHIVE_BATCH_SIZE = args.batch_size
+    cfg.ARCHIVE_BATCH_PAUSE = 0
+    await common.prepare_database()
+    await db_connection.init_pool(None)
+    try:
+        await common.truncate_tables()
+        start = time.perf_counter()
+        await seed_history(args.history, args.regions)
+        print(f'{args.history} completed orders seeded in {time.perf_counter() - start:.1f} s')
+        first_id = args.history + 1
+        for first in range(first_id, first_id + args.open_orders, 50000):
+            orders = common.make_orders(rng, min(50000, first_id + args.open_orders - first), args.regions, first)
+            await db_connection.post_orders_execute_queries({'data': orders})
+        couriers = common.make_couriers(rng, 2 * args.assigns, args.regions, first_id=HISTORY_COURIERS + 1)
+        await db_connection.post_couriers_execute_queries({'data': couriers})
+        print(f'{args.open_orders} open orders')
+
+        matching.index.ready = False
+        measured = range(HISTORY_COURIERS + 1, HISTORY_COURIERS + 2 * args.assigns + 1)
+        await measure('hot', measured[:args.assigns])
+
+        start = time.perf_counter()
+        moved = await archiver.archive()
+        elapsed = time.perf_counter() - start
+        print(f'    archived {moved} orders in {elapsed:.1f} s, {moved / elapsed:.0f} orders/s')
+        async with db_connection.acquire() as conn:
+            cur = await conn.cursor()
+            await cur.execute('ANALYZE TABLE orders, delivery_hours_of_orders')
+            await cur.fetchall()
+
+        await measure('split', measured[args.assigns:])
+    finally:
+        await common.truncate_tables()
+        await db_connection.close_pool(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--history', type=int, default=10000000, help='completed orders of finished assignments')
+    parser.add_argument('--open-orders', type=int, default=20000)
+    parser.add_argument('--assigns', type=int, default=200, help='assignments measured before and after archiving')
+    parser.add_argument('--regions', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=cfg.ARCHIVE_BATCH_SIZE, help='orders archived per transaction')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Latency of POST /orders/assign versus the number of open orders, with the candidates found in the in-process
+index of open orders and in the DB.
+
+    python -m benchmark.assign_latency --open-orders 1000 10000 100000 --assigns 200
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import db_connection
+import matching
+from benchmark import common
+
+
+async def measure(name: str, courier_ids: range):
+    timings = []
+    assigned = 0
+    for courier_id in courier_ids:
+        start = time.perf_counter()
+        all_valid, response = await db_connection.post_orders_assign_execute_queries({'courier_id': courier_id})
+        timings.append(time.perf_counter() - start)
+        assert all_valid
+        assigned += len(response['orders'])
+    timings.sort()
+    print(f'    {name:>5}: median {statistics.median(timings) * 1000:8.2f} ms, '
+          f'p95 {timings[int(len(timings) * 0.95)] * 1000:8.2f} ms, {assigned / len(timings):.1f} orders per assignment')
+
+
+async def run(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    await common.prepare_database()
+    await db_connection.init_pool(None)
+    try:
+        for open_orders in args.open_orders:
+            await common.truncate_tables()
+            for first_id in range(1, open_orders + 1, 50000):
+                orders = common.make_orders(rng, min(50000, open_orders + 1 - first_id), args.regions, first_id)
+                await db_connection.post_orders_execute_queries({'data': orders})
+            couriers = common.make_couriers(rng, 2 * args.assigns, args.regions)
+            await db_connection.post_couriers_execute_queries({'data': couriers})
+            print(f'{open_orders} open orders')
+
+            matching.index.ready = False
+            await measure('db', range(1, args.assigns + 1))
+            await db_connection.rebuild_matching_index()
+            await measure('index', range(args.assigns + 1, 2 * args.assigns + 1))
+    finally:
+        await common.truncate_tables()
+        await db_connection.close_pool(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--open-orders', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--assigns', type=int, default=200, help='assignments measured per mode')
+    parser.add_argument('--regions', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
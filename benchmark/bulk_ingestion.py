@@ -0,0 +1,60 @@
+"""
+Rows per second written by the ingestion of POST /orders and POST /couriers batches of different sizes.
+
+    python -m benchmark.bulk_ingestion --sizes 1000 10000 100000
+
+Rows are counted over all tables the batch is written to (orders + delivery_hours_of_orders,
+couriers + couriers_regions + couriers_working_hours). courier_id is a smallint, so courier batches are capped
+at 65535 items.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import db_connection
+from benchmark import common
+
+MAX_COURIERS = 65535
+
+
+async def measure(name: str, coroutine, items: list, rows: int):
+    start = time.perf_counter()
+    all_valid, ids = await coroutine({'data': items})
+    elapsed = time.perf_counter() - start
+    assert all_valid, f'{name}: {len(ids)} items were rejected'
+    print(f'{name:>9} {len(items):>8} items {rows:>9} rows {elapsed:>9.3f} s {rows / elapsed:>12.0f} rows/s')
+
+
+async def run(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    await common.prepare_database()
+    await db_connection.init_pool(None)
+    try:
+        for size in args.sizes:
+            await common.truncate_tables()
+            orders = common.make_orders(rng, size, args.regions)
+            rows = len(orders) + sum(len(x['delivery_hours']) for x in orders)
+            await measure('orders', db_connection.post_orders_execute_queries, orders, rows)
+
+            couriers = common.make_couriers(rng, min(size, MAX_COURIERS), args.regions)
+            rows = len(couriers) + sum(len(x['regions']) + len(x['working_hours']) for x in couriers)
+            await measure('couriers', db_connection.post_couriers_execute_queries, couriers, rows)
+    finally:
+        await common.truncate_tables()
+        await db_connection.close_pool(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--regions', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
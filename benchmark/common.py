@@ -0,0 +1,87 @@
+"""
+Helpers shared by the benchmarks: options of the DB to run against, preparation of its schema and synthetic data.
+"""
+import argparse
+import random
+from typing import List, Dict
+
+import aiomysql
+
+import cfg
+import db_connection
+import init
+
+TABLES = ('delivery_hours_of_orders', 'orders', 'couriers_working_hours', 'couriers_regions', 'couriers_regions_stats',
+          'couriers_earnings', 'couriers', 'assignments', 'orders_history', 'delivery_hours_history')
+COURIER_TYPES = ('foot', 'bike', 'car')
+
+
+def add_db_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--db-host', default=cfg.DB_HOST)
+    parser.add_argument('--db-port', type=int, default=cfg.DB_PORT)
+    parser.add_argument('--db-user', default=cfg.DB_USER)
+    parser.add_argument('--db-password', default=cfg.DB_PASSWORD)
+    parser.add_argument('--database', default='candy_delivery_bench',
+                        help='database the benchmark runs in, its tables are truncated')
+
+
+def apply_db_arguments(args: argparse.Namespace):
+    """
+    Points cfg, and so the pool of db_connection, at the DB passed in the command line.
+    """
+    cfg.DB_HOST = args.db_host
+    cfg.DB_PORT = args.db_port
+    cfg.DB_USER = args.db_user
+    cfg.DB_PASSWORD = args.db_password
+    cfg.DATABASE = args.database
+
+
+async def prepare_database():
+    """
+    Creates the benchmark database with the schema of the app if it doesn`t exist yet.
+    """
+    conn = await aiomysql.connect(host=cfg.DB_HOST, port=cfg.DB_PORT, user=cfg.DB_USER, password=cfg.DB_PASSWORD,
+                                  autocommit=True)
+    cur = await conn.cursor()
+    await cur.execute(f'CREATE DATABASE IF NOT EXISTS `{cfg.DATABASE}`')
+    conn.close()
+    await init.init()
+
+
+async def truncate_tables():
+    """
+    Empties all tables but weights, needs the pool of db_connection to be initialized.
+    """
+    async with db_connection.acquire() as conn:
+        cur = await conn.cursor()
+        await cur.execute('SET FOREIGN_KEY_CHECKS = 0')
+        for table in TABLES:
+            await cur.execute(f'TRUNCATE TABLE `{table}`')
+        await cur.execute('SET FOREIGN_KEY_CHECKS = 1')
+        await conn.commit()
+
+
+def random_time_ranges(rng: random.Random, count: int) -> List[str]:
+    """
+    :return: list of count non-crossing ranges in HH:MM-HH:MM format, sorted by their start
+    """
+    starts = sorted(rng.sample(range(0, 24 * 60, 30), count))
+    ranges = []
+    for i, start in enumerate(starts):
+        limit = starts[i + 1] if i + 1 < len(starts) else 24 * 60 - 1
+        stop = min(start + rng.choice((30, 60, 120, 240)), limit)
+        ranges.append(f'{start // 60:02}:{start % 60:02}-{stop // 60:02}:{stop % 60:02}')
+    return ranges
+
+
+def make_couriers(rng: random.Random, count: int, regions: int, first_id: int = 1) -> List[Dict]:
+    return [{'courier_id': courier_id, 'courier_type': rng.choice(COURIER_TYPES),
+             'regions': rng.sample(range(1, regions + 1), rng.randint(1, min(3, regions))),
+             'working_hours': random_time_ranges(rng, rng.randint(1, 3))}
+            for courier_id in range(first_id, first_id + count)]
+
+
+def make_orders(rng: random.Random, count: int, regions: int, first_id: int = 1) -> List[Dict]:
+    return [{'order_id': order_id, 'weight': round(rng.uniform(0.01, 50), 2), 'region': rng.randint(1, regions),
+             'delivery_hours': random_time_ranges(rng, rng.randint(1, 2))}
+            for order_id in range(first_id, first_id + count)]
@@ -0,0 +1,126 @@
+"""
+Throughput and latency of POST /orders/complete written one transaction per completion and by the group commit
+of group_commit.py with several windows. For every mode the same number of open assignments is seeded, then all their
+orders are completed by --concurrency requests in flight, and the commits and the fsyncs of the redo log the server
+made are taken from the difference of its status counters. Every completion is checked to be valid and committed.
+
+    python -m benchmark.completion_groups --completions 20000 --concurrency 256 --windows 0 0.001 0.005 0.02
+"""
+import argparse
+import asyncio
+import datetime
+import random
+import statistics
+import time
+from typing import Dict, List
+
+import cfg
+import db_connection
+import group_commit
+from benchmark import common
+
+ORDERS_PER_COURIER = 10
+STATUS = ('Com_commit', 'Innodb_os_log_fsyncs')
+
+
+async def seed(completions: int) -> List[Dict]:
+    """
+    Stores couriers with open assignments of ORDERS_PER_COURIER orders, completions orders in all.
+    :return: bodies of the completions of all the orders
+    """
+    couriers = (completions + ORDERS_PER_COURIER - 1) // ORDERS_PER_COURIER
+    assigned_at = datetime.datetime(2021, 1, 10, 9)
+    async with db_connection.acquire() as conn:
+        cur = await conn.cursor()
+        await cur.executemany("INSERT INTO couriers (courier_id, courier_type) VALUES (%s, 'car')",
+                              [(x,) for x in range(1, couriers + 1)])
+        await cur.executemany('''INSERT INTO assignments (assignment_id, assignment_timestamp, courier_id, courier_type)
+            VALUES (%s, %s, %s, 'car')''', [(x, assigned_at, x) for x in range(1, couriers + 1)])
+        await cur.execute('UPDATE couriers SET current_assignment_id = courier_id')
+        orders = [(x, 1 + (x - 1) // ORDERS_PER_COURIER) for x in range(1, completions + 1)]
+        await cur.executemany('''INSERT INTO orders (order_id, weight, region, assigned_courier_id, is_completed,
+            assignment_id) VALUES (%s, 1, 1, %s, 0, %s)''', [(x, courier, courier) for x, courier in orders])
+        await conn.commit()
+    complete_time = (assigned_at + datetime.timedelta(minutes=30)).isoformat() + 'Z'
+    return [{'courier_id': courier, 'order_id': x, 'complete_time': complete_time} for x, courier in orders]
+
+
+async def server_status() -> Dict[str, int]:
+    async with db_connection.acquire() as conn:
+        cur = await conn.cursor()
+        await cur.execute(f'SHOW GLOBAL STATUS WHERE Variable_name IN ({", ".join(["%s"] * len(STATUS))})', STATUS)
+        return {x['Variable_name']: int(x['Value']) for x in await cur.fetchall()}
+
+
+async def measure(name: str, requests: List[Dict], concurrency: int, complete):
+    latencies = []
+    queue = iter(requests)
+
+    async def worker():
+        for request in queue:
+            start = time.perf_counter()
+            all_valid, _ = await complete(request)
+            latencies.append(time.perf_counter() - start)
+            assert all_valid, f'completion {request} failed'
+
+    before = await server_status()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    after = await server_status()
+
+    async with db_connection.acquire() as conn:
+        cur = await conn.cursor()
+        await cur.execute('SELECT COUNT(*) AS count FROM orders WHERE is_completed = 0')
+        assert (await cur.fetchone())['count'] == 0, 'some orders are left open'
+        await cur.execute('SELECT COUNT(*) AS count FROM couriers WHERE current_assignment_id IS NOT NULL')
+        assert (await cur.fetchone())['count'] == 0, 'some finished assignments are left current'
+    latencies.sort()
+    commits, fsyncs = (after[x] - before[x] for x in STATUS)
+    print(f'{name:>14}: {len(requests) / elapsed:8.1f} completions/s, median {statistics.median(latencies) * 1000:7.2f} ms, '
+          f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.2f} ms, {commits:6} commits, {fsyncs:6} log fsyncs')
+
+
+async def run(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    await common.prepare_database()
+    await db_connection.init_pool(None)
+    try:
+        for window in args.windows:
+            await common.truncate_tables()
+            requests = await seed(args.completions)
+            rng.shuffle(requests)
+            if not window:
+                await measure('one by one', requests, args.concurrency, db_connection.post_orders_complete_execute_queries)
+                continue
+            cfg.COMPLETE_GROUP_COMMIT = True
+            cfg.COMPLETE_GROUP_WINDOW = window
+            await group_commit.start_group_commit(None)
+            try:
+                await measure(f'window {window * 1000:g} ms', requests, args.concurrency,
+                              group_commit.post_orders_complete_execute_queries)
+            finally:
+                await group_commit.stop_group_commit(None)
+    finally:
+        await common.truncate_tables()
+        await db_connection.close_pool(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--completions', type=int, default=20000, help='orders completed per mode')
+    parser.add_argument('--concurrency', type=int, default=256, help='completions in flight at once')
+    parser.add_argument('--windows', type=float, nargs='+', default=[0, 0.001, 0.005, 0.02],
+                        help='seconds a group waits for more completions, 0 for a transaction per completion')
+    parser.add_argument('--max-size', type=int, default=cfg.COMPLETE_GROUP_MAX_SIZE, help='completions per group')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    cfg.COMPLETE_GROUP_MAX_SIZE = args.max_size
+    cfg.DB_POOL_MAXSIZE = max(cfg.DB_POOL_MAXSIZE, min(args.concurrency, 100))
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
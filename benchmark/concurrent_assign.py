@@ -0,0 +1,75 @@
+"""
+Hundreds of POST /orders/assign running in parallel for couriers with overlapping regions: throughput,
+lock-wait failures and a check that no order was handed to two couriers and no assignment exceeds the capacity.
+
+    python -m benchmark.concurrent_assign --couriers 500 --orders 20000 --regions 5
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+from decimal import Decimal
+
+import cfg
+import db_connection
+from benchmark import common
+
+
+async def run(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    cfg.DB_POOL_MAXSIZE = args.pool_size
+    await common.prepare_database()
+    await db_connection.init_pool(None)
+    try:
+        await common.truncate_tables()
+        await db_connection.post_orders_execute_queries({'data': common.make_orders(rng, args.orders, args.regions)})
+        couriers = common.make_couriers(rng, args.couriers, args.regions)
+        await db_connection.post_couriers_execute_queries({'data': couriers})
+        if cfg.MATCHING_INDEX_ENABLED:
+            await db_connection.rebuild_matching_index()
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(db_connection.post_orders_assign_execute_queries({'courier_id': x['courier_id']})
+                                         for x in couriers))
+        elapsed = time.perf_counter() - start
+
+        failed = sum(1 for all_valid, _ in results if not all_valid)
+        handed = Counter(order['id'] for all_valid, response in results if all_valid for order in response['orders'])
+        print(f'{len(couriers)} parallel assigns in {elapsed:.3f} s: {len(couriers) / elapsed:.0f} assigns/s, '
+              f'{failed} failed, {len(handed)} orders assigned')
+        doubled = [order_id for order_id, times in handed.items() if times > 1]
+        assert not doubled, f'orders handed to several couriers: {doubled[:10]}'
+
+        async with db_connection.acquire() as conn:
+            cur = await conn.cursor()
+            await cur.execute('''SELECT orders.assigned_courier_id, SUM(orders.weight) AS total, weights.max_weight
+                FROM orders JOIN couriers ON couriers.courier_id = orders.assigned_courier_id
+                JOIN weights ON weights.courier_type = couriers.courier_type
+                GROUP BY orders.assigned_courier_id, weights.max_weight''')
+            overloaded = [x for x in await cur.fetchall() if x['total'] > Decimal(x['max_weight'])]
+            await cur.execute('SELECT COUNT(*) AS assigned FROM orders WHERE assigned_courier_id IS NOT NULL')
+            in_db = (await cur.fetchone())['assigned']
+        assert not overloaded, f'assignments over the capacity: {overloaded[:10]}'
+        assert in_db == len(handed), f'{in_db} orders are assigned in the DB, {len(handed)} in the responses'
+        print('no order is assigned twice, every assignment fits the capacity of its courier')
+    finally:
+        await common.truncate_tables()
+        await db_connection.close_pool(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--couriers', type=int, default=500, help='assigns run in parallel, one per courier')
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--regions', type=int, default=5)
+    parser.add_argument('--pool-size', type=int, default=cfg.DB_POOL_MAXSIZE)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+GET /couriers/{id} of couriers with a long delivery history: rating and earnings read from the aggregates
+versus computed from the whole history at read time, the cost of a completion maintaining the aggregates,
+and the time backfill.py takes to rebuild them.
+
+    python -m benchmark.courier_stats --couriers 3 --history 100000 --reads 200
+"""
+import argparse
+import asyncio
+import datetime
+import random
+import statistics
+import time
+
+import backfill
+import db_connection
+from benchmark import common
+
+ORDERS_PER_ASSIGNMENT = 10
+HISTORY_START = datetime.datetime(2021, 1, 1)
+
+# what GET /couriers/{id} would have to run per request without the aggregates
+READ_TIME_RATING = '''SELECT MIN(average) AS fastest FROM
+    (SELECT region, AVG(GREATEST(0, TIMESTAMPDIFF(SECOND, previous, completion_timestamp))) AS average
+     FROM (SELECT o.region, o.completion_timestamp,
+                  COALESCE(LAG(o.completion_timestamp) OVER (PARTITION BY o.assignment_id
+                                                             ORDER BY o.completion_timestamp, o.order_id),
+                           a.assignment_timestamp) AS previous
+           FROM orders AS o JOIN assignments AS a ON a.assignment_id = o.assignment_id
+           WHERE o.assigned_courier_id = %s AND o.is_completed = 1) AS deliveries
+     GROUP BY region) AS regions'''
+READ_TIME_EARNINGS = '''SELECT COUNT(*) AS finished FROM
+    (SELECT assignment_id FROM orders WHERE assigned_courier_id = %s GROUP BY assignment_id
+     HAVING SUM(is_completed = 0) = 0) AS assignments'''
+
+
+def print_timings(name: str, timings: list):
+    timings.sort()
+    print(f'    {name:>22}: median {statistics.median(timings) * 1000:9.2f} ms, '
+          f'p95 {timings[int(len(timings) * 0.95)] * 1000:9.2f} ms')
+
+
+async def seed_history(rng: random.Random, courier_id: int, history: int, first_order_id: int, first_assignment_id: int):
+    """
+    Stores history completed orders of the courier, in finished assignments of ORDERS_PER_ASSIGNMENT orders.
+    """
+    assignments, orders = [], []
+    moment = HISTORY_START
+    for number in range(history // ORDERS_PER_ASSIGNMENT):
+        assignment_id = first_assignment_id + number
+        assignments.append((assignment_id, moment, courier_id, 'bike', moment, 1))
+        for _ in range(ORDERS_PER_ASSIGNMENT):
+            moment += datetime.timedelta(seconds=rng.randint(60, 3600))
+            orders.append((first_order_id + len(orders), round(rng.uniform(0.01, 1.5), 2), rng.randint(1, 3),
+                           courier_id, 1, assignment_id, moment))
+        assignments[-1] = assignments[-1][:4] + (moment, 1)
+        moment += datetime.timedelta(seconds=rng.randint(60, 3600))
+    async with db_connection.acquire() as conn:
+        cur = await conn.cursor()
+        await cur.execute('''INSERT INTO couriers (courier_id, courier_type) VALUES (%s, 'bike')''', (courier_id,))
+        await cur.executemany('''INSERT INTO couriers_regions (courier_id, region) VALUES (%s, %s)''',
+                              [(courier_id, region) for region in (1, 2, 3)])
+        await cur.execute('''INSERT INTO couriers_working_hours (courier_id, start_minute, stop_minute)
+            VALUES (%s, 0, 1439)''', (courier_id,))
+        for i in range(0, len(assignments), 10000):
+            await cur.executemany('''INSERT INTO assignments (assignment_id, assignment_timestamp, courier_id, courier_type,
+                last_completion_timestamp, is_credited) VALUES (%s, %s, %s, %s, %s, %s)''', assignments[i:i + 10000])
+        for i in range(0, len(orders), 10000):
+            await cur.executemany('''INSERT INTO orders (order_id, weight, region, assigned_courier_id, is_completed,
+                assignment_id, completion_timestamp) VALUES (%s, %s, %s, %s, %s, %s, %s)''', orders[i:i + 10000])
+        await conn.commit()
+
+
+async def measure_reads(courier_ids: list, reads: int):
+    aggregated, read_time = [], []
+    for number in range(reads):
+        courier_id = courier_ids[number % len(courier_ids)]
+        start = time.perf_counter()
+        all_valid, profile = await db_connection.get_couriers_id_execute_queries(courier_id)
+        aggregated.append(time.perf_counter() - start)
+        assert all_valid and profile is not None
+        async with db_connection.acquire() as conn:
+            cur = await conn.cursor()
+            start = time.perf_counter()
+            await cur.execute(READ_TIME_RATING, (courier_id,))
+            await cur.fetchall()
+            await cur.execute(READ_TIME_EARNINGS, (courier_id,))
+            await cur.fetchall()
+            read_time.append(time.perf_counter() - start)
+    print_timings('aggregates', aggregated)
+    print_timings('computed at read time', read_time)
+
+
+async def measure_completions(rng: random.Random, courier_id: int, count: int):
+    """
+    Assigns count fresh orders to the courier and completes them one by one.
+    """
+    orders = common.make_orders(rng, count, 3, first_id=10 ** 9)
+    for order in orders:
+        order['weight'] = 0.01
+        order['delivery_hours'] = ['00:00-23:59']
+    await db_connection.post_orders_execute_queries({'data': orders})
+    all_valid, response = await db_connection.post_orders_assign_execute_queries({'courier_id': courier_id})
+    assert all_valid and len(response['orders']) == count
+    timings = []
+    moment = datetime.datetime.utcnow()
+    for order in response['orders']:
+        moment += datetime.timedelta(minutes=10)
+        start = time.perf_counter()
+        all_valid, _ = await db_connection.post_orders_complete_execute_queries(
+            {'courier_id': courier_id, 'order_id': order['id'], 'complete_time': moment.isoformat() + 'Z'})
+        timings.append(time.perf_counter() - start)
+        assert all_valid
+    print_timings('completion', timings)
+
+
+async def run(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    await common.prepare_database()
+    await db_connection.init_pool(None)
+    try:
+        await common.truncate_tables()
+        courier_ids = list(range(1, args.couriers + 1))
+        start = time.perf_counter()
+        for courier_id in courier_ids:
+            await seed_history(rng, courier_id, args.history, first_order_id=(courier_id - 1) * args.history + 1,
+                               first_assignment_id=(courier_id - 1) * args.history // ORDERS_PER_ASSIGNMENT + 1)
+        print(f'{args.couriers} couriers with {args.history} completed orders each, '
+              f'seeded in {time.perf_counter() - start:.1f} s')
+
+        start = time.perf_counter()
+        await backfill.backfill()
+        print(f'    {"backfill":>22}: {time.perf_counter() - start:9.2f} s')
+
+        await measure_reads(courier_ids, args.reads)
+        await measure_completions(rng, courier_ids[0], args.completions)
+    finally:
+        await common.truncate_tables()
+        await db_connection.close_pool(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--couriers', type=int, default=3)
+    parser.add_argument('--history', type=int, default=100000, help='completed orders per courier')
+    parser.add_argument('--reads', type=int, default=200, help='GET /couriers/{id} measured per mode')
+    parser.add_argument('--completions', type=int, default=100, help='completions measured on top of the history')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
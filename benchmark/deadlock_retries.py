@@ -0,0 +1,100 @@
+"""
+POST /orders/assign and PATCH /couriers/{id} of the same couriers running in parallel over a few regions, so their
+transactions lock the same couriers and orders in different order and InnoDB picks victims of deadlocks among them.
+The rounds are run with the transactions retried by db_connection._transaction and then, for the reference, with
+a single attempt. Every request is valid, so none may fail: the retries, by reason, and the requests that would have
+been answered 503 are counted, and with the retries on no request may be answered 400.
+
+    python -m benchmark.deadlock_retries --couriers 200 --orders 20000 --regions 2 --rounds 10
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+
+import cfg
+import db_connection
+import metrics
+from benchmark import common
+
+REASONS = ('deadlock', 'lock_wait_timeout', 'connection')
+
+
+def retries() -> Counter:
+    return Counter({x: metrics.db_retries.labels(x).value for x in REASONS})
+
+
+async def call(outcomes: Counter, request):
+    try:
+        ok, _ = await request
+    except db_connection.DBUnavailable as error:
+        outcomes[f'503 {error.reason}'] += 1
+    else:
+        outcomes['ok' if ok else '400'] += 1
+
+
+async def measure(name: str, rng: random.Random, courier_ids: list, rounds: int, regions: int):
+    outcomes = Counter()
+    before = retries()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        requests = []
+        for courier_id in courier_ids:
+            patch = {'regions': rng.sample(range(1, regions + 1), rng.randint(1, regions)),
+                     'courier_type': rng.choice(common.COURIER_TYPES)}
+            requests.append(db_connection.post_orders_assign_execute_queries({'courier_id': courier_id}))
+            requests.append(db_connection.patch_couriers_id_execute_queries(courier_id, patch))
+        rng.shuffle(requests)
+        await asyncio.gather(*(call(outcomes, x) for x in requests))
+    elapsed = time.perf_counter() - start
+    retried = retries() - before
+    total = sum(outcomes.values())
+    print(f'{name:>14}: {total / elapsed:7.0f} requests/s; '
+          f'{", ".join(f"{count} {outcome}" for outcome, count in sorted(outcomes.items()))}; '
+          f'retried {", ".join(f"{retried[x]:.0f} on {x}" for x in REASONS)}')
+    return outcomes
+
+
+async def run(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    cfg.DB_POOL_MAXSIZE = args.pool_size
+    cfg.MATCHING_INDEX_ENABLED = args.index  # without the index the assigns lock the open orders in the DB
+    await common.prepare_database()
+    await db_connection.init_pool(None)
+    try:
+        await common.truncate_tables()
+        await db_connection.post_orders_execute_queries({'data': common.make_orders(rng, args.orders, args.regions)})
+        couriers = common.make_couriers(rng, args.couriers, args.regions)
+        await db_connection.post_couriers_execute_queries({'data': couriers})
+        if cfg.MATCHING_INDEX_ENABLED:
+            await db_connection.rebuild_matching_index()
+        courier_ids = [x['courier_id'] for x in couriers]
+
+        outcomes = await measure('retried', rng, courier_ids, args.rounds, args.regions)
+        attempts, cfg.DB_RETRY_ATTEMPTS = cfg.DB_RETRY_ATTEMPTS, 1
+        await measure('single attempt', rng, courier_ids, args.rounds, args.regions)
+        cfg.DB_RETRY_ATTEMPTS = attempts
+        assert not outcomes['400'], f'{outcomes["400"]} valid requests were answered 400'
+    finally:
+        await common.truncate_tables()
+        await db_connection.close_pool(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--couriers', type=int, default=200, help='couriers assigned and patched at once in a round')
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--regions', type=int, default=2, help='fewer regions make more of the orders contended')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--index', action='store_true', help='match the orders by the in-process index')
+    parser.add_argument('--pool-size', type=int, default=cfg.DB_POOL_MAXSIZE)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+GET /orders/export of millions of orders, served in-process and read by a client that checks every line.
+The resident memory of the process is sampled during the export, its peak shows that the memory doesn`t grow with
+the number of orders exported. The export is made at once and then in two requests, the second one resuming after
+the last order of the first one; both must give every order once, in the order of the ids. With --archive the orders
+are moved to the history tables by archiver.py and exported again. With --buffered the same orders are also read
+by a buffered cursor, as the other queries of db_connection are, for the reference.
+
+    python -m benchmark.export_orders --orders 10000000 --archive
+"""
+import argparse
+import asyncio
+import os
+import resource
+import time
+
+import aiohttp
+from aiohttp import web
+
+import Application
+import archiver
+import cfg
+import db_connection
+import serialization
+from benchmark import common
+from benchmark.archive_assign import seed_history
+
+PORT = 8092
+RSS_SAMPLE_INTERVAL = 0.05  # seconds
+PAGE_BYTES = os.sysconf('SC_PAGE_SIZE')
+
+
+def rss() -> int:
+    """
+    :return: resident memory of the process, bytes
+    """
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * PAGE_BYTES
+
+
+class PeakRss:
+    """
+    Samples the resident memory of the process in background while in the with-block.
+    """
+
+    def __init__(self):
+        self.before = self.peak = 0
+        self._task = None
+
+    async def _sample(self):
+        while True:
+            self.peak = max(self.peak, rss())
+            await asyncio.sleep(RSS_SAMPLE_INTERVAL)
+
+    async def __aenter__(self):
+        self.before = self.peak = rss()
+        self._task = asyncio.ensure_future(self._sample())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        self.peak = max(self.peak, rss())
+
+
+async def export(session: aiohttp.ClientSession, query: dict, after: int) -> (int, int, int):
+    """
+    Reads the export line by line, checking that the ids go up.
+    :return: number of orders, bytes of the body, id of the last order
+    """
+    count = size = 0
+    buffer = b''
+    async with session.get(f'http://127.0.0.1:{PORT}/orders/export', params={**query, 'after': str(after)}) as response:
+        assert response.status == 200, f'export failed with {response.status}'
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+            lines = (buffer + chunk).split(b'\n')
+            buffer = lines.pop()
+            for line in lines:
+                order_id = serialization.loads(line)['order_id']
+                assert order_id > after, f'order {order_id} came after {after}'
+                after = order_id
+                count += 1
+    assert not buffer, 'the last line is incomplete'
+    return count, size, after
+
+
+async def measure(name: str, session: aiohttp.ClientSession, orders: int, split: int):
+    async with PeakRss() as memory:
+        start = time.perf_counter()
+        count, size, _ = await export(session, {}, 0)
+        elapsed = time.perf_counter() - start
+    assert count == orders, f'{count} of {orders} orders exported'
+    print(f'{name:>14}: {count / elapsed:9.0f} orders/s, {size / elapsed / 1024 ** 2:6.1f} MiB/s, {size / 1024 ** 2:8.1f} MiB '
+          f'in {elapsed:6.1f} s; RSS {memory.before / 1024 ** 2:6.1f} MiB before, peak {memory.peak / 1024 ** 2:6.1f} MiB')
+
+    first, _, last = await export(session, {'limit': str(split)}, 0)
+    rest, _, _ = await export(session, {}, last)
+    assert (first, first + rest) == (split, orders), f'resumed export gave {first} + {rest} of {orders} orders'
+    print(f'{"":>14}  resumed after order {last}: {first} + {rest} orders')
+
+
+async def measure_buffered(orders: int):
+    async with PeakRss() as memory:
+        start = time.perf_counter()
+        async with db_connection.acquire() as conn:
+            cur = await conn.cursor()
+            await cur.execute('''SELECT order_id, weight, region, assigned_courier_id, assignment_id, is_completed,
+                completion_timestamp FROM orders ORDER BY order_id''')
+            rows = len(await cur.fetchall())
+        elapsed = time.perf_counter() - start
+    assert rows == orders, f'{rows} of {orders} orders read'
+    print(f'{"buffered":>14}: {rows / elapsed:9.0f} orders/s in {elapsed:6.1f} s; '
+          f'RSS {memory.before / 1024 ** 2:6.1f} MiB before, peak {memory.peak / 1024 ** 2:6.1f} MiB')
+
+
+async def run(args: argparse.Namespace):
+    cfg.MATCHING_INDEX_ENABLED = False  # the open orders aren`t needed, and none is open
+    cfg.ARCHIVE_ENABLED = False
+    cfg.EXPORT_PAGE_SIZE = args.page_size
+    cfg.ARCHIVE_BATCH_PAUSE = 0
+    await common.prepare_database()
+    runner = web.AppRunner(Application.make_app(), access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, '127.0.0.1', PORT).start()
+        await common.truncate_tables()
+        start = time.perf_counter()
+        await seed_history(args.orders, args.regions)
+        print(f'{args.orders} orders seeded in {time.perf_counter() - start:.1f} s, page of {args.page_size} orders')
+        timeout = aiohttp.ClientTimeout(total=None)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            await measure('hot tables', session, args.orders, args.orders // 3)
+            if args.buffered:
+                await measure_buffered(args.orders)
+            if args.archive:
+                moved = await archiver.archive()
+                print(f'{moved} orders archived')
+                await measure('archived', session, args.orders, args.orders // 3)
+        print(f'peak RSS of the process {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB')
+    finally:
+        if db_connection.pool is not None:
+            await common.truncate_tables()
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--orders', type=int, default=10000000)
+    parser.add_argument('--regions', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=cfg.EXPORT_PAGE_SIZE, help='orders read by one query')
+    parser.add_argument('--archive', action='store_true', help='export again after the orders are archived')
+    parser.add_argument('--buffered', action='store_true',
+                        help='read the orders by a buffered cursor too, it holds all of them in memory at once')
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
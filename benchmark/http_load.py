@@ -0,0 +1,210 @@
+"""
+Load test of the HTTP API. Synthetic couriers, orders, assignments, reads, patches and completions are replayed
+route by route with the configured concurrency against the app of Application.make_app served in-process,
+or against a running instance (--base-url). For every route the report has the throughput, p50/p95/p99 latency,
+error rate and DB round trips per request (from the difference of GET /metrics before and after the route).
+The report is printed or written (--output) as JSON, so the runs can be compared over time.
+
+    python -m benchmark.http_load --couriers 2000 --orders 50000 --concurrency 32 --output load.json
+    python -m benchmark.http_load --start-mysql 3307 --hours peaked --weights light
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import aiohttp
+from aiohttp import web
+
+import Application
+import db_connection
+from benchmark import common, mysql_server, traffic
+
+PORT = 8090
+
+Request = Tuple[str, str, object]  # method, path, json body
+
+
+def percentile(ordered: List[float], share: float) -> float:
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+async def db_round_trips(session: aiohttp.ClientSession, base_url: str) -> float:
+    """
+    :return: number of statements run by the app so far, from its db_query_duration_seconds metric
+    """
+    async with session.get(f'{base_url}/metrics') as response:
+        text = await response.text()
+    return sum(float(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+               if line.startswith('db_query_duration_seconds_count'))
+
+
+async def replay(session: aiohttp.ClientSession, base_url: str, requests: List[Request], concurrency: int,
+                 expected: int) -> (Dict, List):
+    """
+    Sends the requests with at most concurrency of them in flight at once.
+    :param expected: status of a successful response, any other one is counted as an error
+    :return: tuple of the report on the route and the list of the bodies of the responses, in the order of the requests,
+    None for the unsuccessful ones
+    """
+    queue = iter(enumerate(requests))
+    latencies = []
+    statuses = {}
+    responses = [None] * len(requests)
+
+    async def worker():
+        for index, (method, path, body) in queue:
+            start = time.perf_counter()
+            try:
+                async with session.request(method, f'{base_url}{path}', json=body) as response:
+                    data = await response.read()
+                    status = response.status
+            except aiohttp.ClientError:
+                status = 'connection error'
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == expected:
+                responses[index] = json.loads(data) if data else None
+
+    before = await db_round_trips(session, base_url)
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    after = await db_round_trips(session, base_url)
+
+    latencies.sort()
+    errors = len(requests) - statuses.get(expected, 0)
+    report = {'requests': len(requests), 'seconds': round(elapsed, 3), 'rps': round(len(requests) / elapsed, 1),
+              'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+              'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+              'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+              'error_rate': round(errors / len(requests), 4),
+              'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+              'db_round_trips_per_request': round((after - before) / len(requests), 2)}
+    return report, responses
+
+
+async def run_load(args: argparse.Namespace, base_url: str) -> Dict:
+    rng = random.Random(args.seed)
+    routes = {}
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=args.timeout)) as session:
+        async def phase(name: str, requests: List[Request], expected: int) -> List:
+            if not requests:
+                return []
+            report, responses = await replay(session, base_url, requests, args.concurrency, expected)
+            routes[name] = report
+            print(f'{name:>26}: {report["rps"]:9.1f} rps, p50 {report["p50_ms"]:8.2f} ms, p99 {report["p99_ms"]:8.2f} ms, '
+                  f'{report["error_rate"] * 100:5.1f}% errors, {report["db_round_trips_per_request"]:6.1f} queries',
+                  file=sys.stderr)
+            return responses
+
+        couriers = traffic.couriers(rng, args.couriers, args.regions, args.hours)
+        await phase('POST /couriers', [('POST', '/couriers', {'data': couriers[i:i + args.batch_size]})
+                                       for i in range(0, len(couriers), args.batch_size)], 201)
+        orders = traffic.orders(rng, args.orders, args.regions, args.hours, args.weights)
+        await phase('POST /orders', [('POST', '/orders', {'data': orders[i:i + args.batch_size]})
+                                     for i in range(0, len(orders), args.batch_size)], 201)
+        del orders
+
+        courier_ids = [x['courier_id'] for x in couriers]
+        assignments = await phase('POST /orders/assign', [('POST', '/orders/assign', {'courier_id': x})
+                                                          for x in courier_ids], 200)
+        await phase('GET /couriers/{id}', [('GET', f'/couriers/{rng.choice(courier_ids)}', None)
+                                           for _ in range(args.reads)], 200)
+
+        completions = []
+        for courier_id, assignment in zip(courier_ids, assignments):
+            if assignment is None:
+                continue
+            for order in assignment.get('orders', []):
+                if rng.random() < args.complete_share:
+                    completions.append(('POST', '/orders/complete', traffic.completion(
+                        rng, courier_id, order['id'], assignment['assign_time'])))
+        rng.shuffle(completions)
+        await phase('POST /orders/complete', completions, 200)
+
+        await phase('PATCH /couriers/{id}', [('PATCH', f'/couriers/{courier_id}',
+                                              traffic.courier_patch(rng, args.regions, args.hours))
+                                             for courier_id in rng.sample(courier_ids, min(args.patches, len(courier_ids)))],
+                    200)
+    return routes
+
+
+def git_revision() -> str:
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+async def run(args: argparse.Namespace):
+    container = None
+    runner = None
+    try:
+        if args.start_mysql:
+            container = await mysql_server.start(args.start_mysql)
+        if args.base_url:
+            base_url = args.base_url.rstrip('/')
+            await db_connection.init_pool(None)  # to empty the tables the running instance uses
+        else:
+            await common.prepare_database()
+            runner = web.AppRunner(Application.make_app(), access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, '127.0.0.1', PORT).start()
+            base_url = f'http://127.0.0.1:{PORT}'
+        await common.truncate_tables()
+        if runner is not None:
+            await db_connection.rebuild_matching_index()  # loaded on startup, before the tables were emptied
+
+        started_at = datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+        routes = await run_load(args, base_url)
+        report = {'started_at': started_at, 'revision': git_revision(), 'target': args.base_url or 'in-process',
+                  'config': {key: value for key, value in vars(args).items()
+                             if key not in ('db_password', 'output', 'base_url')},
+                  'routes': routes}
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(report, output, indent=2)
+        else:
+            json.dump(report, sys.stdout, indent=2)
+            print()
+    finally:
+        if db_connection.pool is not None:
+            await common.truncate_tables()
+        if runner is not None:
+            await runner.cleanup()
+        elif db_connection.pool is not None:
+            await db_connection.close_pool(None)
+        if container is not None:
+            mysql_server.stop(container)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--base-url', help='URL of a running instance of the app, it must use the --database')
+    parser.add_argument('--start-mysql', type=int, metavar='PORT',
+                        help=f'start a {mysql_server.IMAGE} container on the port of the localhost for the run')
+    parser.add_argument('--couriers', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=50000)
+    parser.add_argument('--regions', type=int, default=20)
+    parser.add_argument('--hours', choices=traffic.HOURS_DISTRIBUTIONS, default='uniform')
+    parser.add_argument('--weights', choices=traffic.WEIGHT_DISTRIBUTIONS, default='uniform')
+    parser.add_argument('--batch-size', type=int, default=500, help='couriers or orders per POST request')
+    parser.add_argument('--reads', type=int, default=5000, help='GET /couriers/{id} requests')
+    parser.add_argument('--patches', type=int, default=500, help='PATCH /couriers/{id} requests')
+    parser.add_argument('--complete-share', type=float, default=0.8, help='share of the assigned orders completed')
+    parser.add_argument('--concurrency', type=int, default=32, help='requests in flight at once')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds per request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file the JSON report is written to, stdout by default')
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
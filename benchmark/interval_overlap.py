@@ -0,0 +1,101 @@
+"""
+EXPLAIN and timing of the search for orders whose delivery windows overlap the working hours of a courier,
+done with the four-way OR predicate the schema with TIME columns used (no index can serve it, so it`s emulated
+with IGNORE INDEX over the same data) and with the half-open a.start < b.stop AND b.start < a.stop form
+served by the delivery_interval index.
+
+    python -m benchmark.interval_overlap --windows 1000000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import db_connection
+import validation
+from benchmark import common
+
+COURIER_ID = 1
+CHUNK = 50000
+
+CANDIDATES = '''SELECT DISTINCT dhof.order_id FROM couriers_working_hours AS cwh
+    JOIN delivery_hours_of_orders AS dhof {hint} ON {overlap}
+    WHERE cwh.courier_id = %s'''
+
+BEFORE = ('IGNORE INDEX (delivery_interval)',
+          '''(cwh.start_minute <= dhof.start_minute AND dhof.start_minute <= cwh.stop_minute AND
+              cwh.stop_minute <= dhof.stop_minute OR
+              cwh.start_minute <= dhof.start_minute AND dhof.start_minute <= dhof.stop_minute AND
+              dhof.stop_minute <= cwh.stop_minute OR
+              dhof.start_minute <= cwh.start_minute AND cwh.start_minute <= dhof.stop_minute AND
+              dhof.stop_minute <= cwh.stop_minute OR
+              dhof.start_minute <= cwh.start_minute AND cwh.start_minute <= cwh.stop_minute AND
+              cwh.stop_minute <= dhof.stop_minute)''')
+AFTER = ('', 'dhof.start_minute < cwh.stop_minute AND cwh.start_minute < dhof.stop_minute')
+
+
+async def seed(rng: random.Random, windows: int, regions: int):
+    await common.truncate_tables()
+    async with db_connection.acquire() as conn:
+        cur = await conn.cursor()
+        for first_id in range(1, windows + 1, CHUNK):
+            orders = common.make_orders(rng, min(CHUNK, windows + 1 - first_id), regions, first_id)
+            valid, _ = validation.validate_batch(orders, validation.ORDER)
+            # one window per order, so the table holds exactly the requested number of windows
+            await db_connection._insert_orders(cur, [(i, (*row[:3], row[3][:1])) for i, row in valid])
+            await conn.commit()
+        couriers = [{'courier_id': COURIER_ID, 'courier_type': 'car', 'regions': [1],
+                     'working_hours': ['09:00-11:00', '18:00-19:30']}]
+        valid, _ = validation.validate_batch(couriers, validation.COURIER)
+        await db_connection._insert_couriers(cur, valid)
+        await cur.execute('ANALYZE TABLE delivery_hours_of_orders, couriers_working_hours')
+        await conn.commit()
+
+
+async def measure(name: str, hint: str, overlap: str, repeat: int):
+    query = CANDIDATES.format(hint=hint, overlap=overlap)
+    async with db_connection.acquire() as conn:
+        cur = await conn.cursor()
+        await cur.execute('EXPLAIN ' + query, (COURIER_ID,))
+        print(f'{name}: EXPLAIN')
+        for row in await cur.fetchall():
+            print(f'    table={row["table"]} type={row["type"]} key={row["key"]} rows={row["rows"]} '
+                  f'filtered={row["filtered"]} extra={row["Extra"]}')
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            await cur.execute(query, (COURIER_ID,))
+            found = len(await cur.fetchall())
+            timings.append(time.perf_counter() - start)
+            await conn.rollback()
+        print(f'{name}: {found} orders found, median {statistics.median(timings) * 1000:.1f} ms '
+              f'over {repeat} runs')
+
+
+async def run(args: argparse.Namespace):
+    await common.prepare_database()
+    await db_connection.init_pool(None)
+    try:
+        await seed(random.Random(args.seed), args.windows, args.regions)
+        await measure('before', *BEFORE, args.repeat)
+        await measure('after', *AFTER, args.repeat)
+    finally:
+        await common.truncate_tables()
+        await db_connection.close_pool(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--windows', type=int, default=1000000)
+    parser.add_argument('--regions', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+CPU time of the event loop thread spent on POST /orders with the logging of the app at INFO, records queued
+and payloads sampled, versus the previous DEBUG path: DEBUG level, records written synchronously by the loop
+and every payload dumped in full. Records are written to /dev/null, so only their cost on the loop is measured.
+
+    python -m benchmark.logging_overhead --batch-sizes 100 1000 10000 --requests 10
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import time
+
+import cfg
+import db_connection
+import logs
+from benchmark import common
+
+
+def setup_previous(stream):
+    """
+    The logging as it was set up before: basicConfig at DEBUG, written synchronously, all payloads logged.
+    """
+    logs.stop()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(stream)
+    handler.addFilter(logs.RequestIdFilter())
+    handler.setFormatter(logging.Formatter(cfg.LOG_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+    cfg.LOG_PAYLOAD_SAMPLE_RATE = 1
+    cfg.LOG_PAYLOAD_MAX_CHARS = 10 ** 9
+
+
+def setup_current(stream):
+    cfg.LOG_PAYLOAD_SAMPLE_RATE = 0.01
+    cfg.LOG_PAYLOAD_MAX_CHARS = 2048
+    logs.setup('INFO', stream)
+
+
+async def measure(rng: random.Random, batch_size: int, requests: int, first_id: int) -> list:
+    timings = []
+    for number in range(requests):
+        orders = common.make_orders(rng, batch_size, 20, first_id + number * batch_size)
+        logs.start_request()
+        start = time.thread_time()
+        all_valid, _ = await db_connection.post_orders_execute_queries({'data': orders})
+        timings.append(time.thread_time() - start)
+        assert all_valid
+    return timings
+
+
+async def run(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    await common.prepare_database()
+    await db_connection.init_pool(None)
+    first_id = 1
+    try:
+        with open(os.devnull, 'w') as devnull:
+            for batch_size in args.batch_sizes:
+                await common.truncate_tables()
+                results = {}
+                for name, setup in (('DEBUG', setup_previous), ('INFO', setup_current)):
+                    setup(devnull)
+                    results[name] = await measure(rng, batch_size, args.requests, first_id)
+                    first_id += batch_size * args.requests
+                    logs.stop()
+                print(f'{batch_size} orders per request')
+                for name, timings in results.items():
+                    print(f'    {name:>5}: median CPU time {statistics.median(timings) * 1000:9.2f} ms, '
+                          f'{statistics.median(timings) / batch_size * 10 ** 6:7.2f} us per order')
+    finally:
+        await common.truncate_tables()
+        await db_connection.close_pool(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--requests', type=int, default=10, help='requests measured per batch size and logging setup')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
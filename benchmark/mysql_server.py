@@ -0,0 +1,53 @@
+"""
+A throwaway MySQL server in a docker container for the benchmarks that are run with --start-mysql.
+"""
+import asyncio
+import logging
+import subprocess
+import time
+from typing import Sequence
+
+import aiomysql
+
+import cfg
+
+IMAGE = 'mysql:8.0'
+ROOT_PASSWORD = 'benchmark'
+STARTUP_TIMEOUT = 180  # seconds, the first start of the image initializes its data directory
+
+
+async def start(port: int, options: Sequence[str] = ()) -> str:
+    """
+    Starts the server on the port of the localhost, waits until it accepts connections and points cfg at it.
+    :param options: options of mysqld, e.g. --server-id=2
+    :return: id of the container, to be passed to stop
+    """
+    container = subprocess.run(['docker', 'run', '--detach', '--rm', '--publish', f'127.0.0.1:{port}:3306',
+                                '--env', f'MYSQL_ROOT_PASSWORD={ROOT_PASSWORD}', IMAGE, *options],
+                               check=True, capture_output=True, text=True).stdout.strip()
+    cfg.DB_HOST, cfg.DB_PORT, cfg.DB_USER, cfg.DB_PASSWORD = '127.0.0.1', port, 'root', ROOT_PASSWORD
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            conn = await aiomysql.connect(host=cfg.DB_HOST, port=cfg.DB_PORT, user=cfg.DB_USER, password=cfg.DB_PASSWORD)
+        except aiomysql.OperationalError:
+            if time.monotonic() > deadline:
+                stop(container)
+                raise
+            await asyncio.sleep(1)
+        else:
+            conn.close()
+            logging.info('mysql_server: container %s accepts connections on port %s', container[:12], port)
+            return container
+
+
+def stop(container: str):
+    subprocess.run(['docker', 'stop', container], check=False, capture_output=True)
+
+
+def address(container: str) -> str:
+    """
+    :return: IP address of the container, the other containers connect to its port 3306 there
+    """
+    return subprocess.run(['docker', 'inspect', '--format', '{{.NetworkSettings.IPAddress}}', container],
+                          check=True, capture_output=True, text=True).stdout.strip()
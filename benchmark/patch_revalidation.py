@@ -0,0 +1,177 @@
+"""
+PATCH /couriers/{id} of couriers with large open assignments: for every combination of the patched fields
+the orders left assigned are checked against the ones the courier is still able to deliver, computed here
+(after a change of the type the ones left must also fit its carrying capacity together, as chosen by the solver),
+as well as the stored regions and working hours and the clearing of an emptied assignment.
+Prints the latency and the number of statements of every patch.
+
+    python -m benchmark.patch_revalidation --open-orders 100 1000 10000
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from decimal import Decimal
+
+import cfg
+import db_connection
+import solver
+import tracing
+from benchmark import common
+
+FIELDS = ('courier_type', 'regions', 'working_hours')
+MAX_WEIGHTS = {'foot': 10, 'bike': 15, 'car': 50}
+REGIONS = (1, 2, 3, 4)
+
+
+def minutes(time_range: str) -> tuple:
+    """
+    :return: (start, stop) of the HH:MM-HH:MM range in minutes of the day
+    """
+    start, stop = ((int(x[:2]) * 60 + int(x[3:])) for x in time_range.split('-'))
+    return start, stop
+
+
+def overlaps(windows, hours) -> bool:
+    return any(start < stop_hour and start_hour < stop for start, stop in windows for start_hour, stop_hour in hours)
+
+
+class Courier:
+    """
+    A courier of type car working all day in REGIONS with an open assignment of the orders stored by seed.
+    """
+    _next_courier_id = 1
+    _next_order_id = 1
+
+    def __init__(self):
+        self.courier_id = Courier._next_courier_id
+        Courier._next_courier_id += 1
+        self.orders = {}  # order_id: (weight, region, windows)
+
+    async def seed(self, rng: random.Random, open_orders: int, weight: Decimal = None):
+        """
+        :param weight: weight of every order, random by default
+        """
+        for _ in range(open_orders):
+            windows = [minutes(x) for x in common.random_time_ranges(rng, rng.randint(1, 2))]
+            self.orders[Courier._next_order_id] = (weight or Decimal(str(round(rng.uniform(0.01, 50), 2))),
+                                                   rng.choice(REGIONS), windows)
+            Courier._next_order_id += 1
+        async with db_connection.acquire() as conn:
+            cur = await conn.cursor()
+            await cur.execute("INSERT INTO couriers (courier_id, courier_type) VALUES (%s, 'car')", (self.courier_id,))
+            await cur.executemany('INSERT INTO couriers_regions (courier_id, region) VALUES (%s, %s)',
+                                  [(self.courier_id, region) for region in REGIONS])
+            await cur.execute('''INSERT INTO couriers_working_hours (courier_id, start_minute, stop_minute)
+                VALUES (%s, 0, 1439)''', (self.courier_id,))
+            await cur.execute("INSERT INTO assignments (courier_id, courier_type) VALUES (%s, 'car')", (self.courier_id,))
+            assignment_id = cur.lastrowid
+            await cur.execute('UPDATE couriers SET current_assignment_id = %s WHERE courier_id = %s',
+                              (assignment_id, self.courier_id))
+            for chunk in range(0, open_orders, 10000):
+                ids = list(self.orders)[chunk:chunk + 10000]
+                await cur.executemany('''INSERT INTO orders (order_id, weight, region, assigned_courier_id, is_completed,
+                    assignment_id) VALUES (%s, %s, %s, %s, 0, %s)''',
+                                      [(x, self.orders[x][0], self.orders[x][1], self.courier_id, assignment_id)
+                                       for x in ids])
+                await cur.executemany('''INSERT INTO delivery_hours_of_orders (order_id, start_minute, stop_minute)
+                    VALUES (%s, %s, %s)''', [(x, start, stop) for x in ids for start, stop in self.orders[x][2]])
+            await conn.commit()
+
+    def eligible(self, patch: dict) -> set:
+        max_weight = MAX_WEIGHTS[patch.get('courier_type', 'car')]
+        regions = set(patch.get('regions', REGIONS))
+        hours = [minutes(x) for x in patch.get('working_hours', ['00:00-23:59'])]
+        eligible = {order_id for order_id, (weight, region, windows) in self.orders.items()
+                    if weight <= max_weight and region in regions and overlaps(windows, hours)}
+        if 'courier_type' not in patch:
+            return eligible
+        return set(solver.select_orders([(x, self.orders[x][0]) for x in sorted(eligible)], max_weight))
+
+    async def check(self, patch: dict, expected: set):
+        async with db_connection.acquire() as conn:
+            cur = await conn.cursor()
+            await cur.execute('SELECT order_id FROM orders WHERE assigned_courier_id = %s', (self.courier_id,))
+            assigned = {x['order_id'] for x in await cur.fetchall()}
+            await cur.execute('SELECT region FROM couriers_regions WHERE courier_id = %s', (self.courier_id,))
+            regions = {x['region'] for x in await cur.fetchall()}
+            await cur.execute('SELECT start_minute, stop_minute FROM couriers_working_hours WHERE courier_id = %s',
+                              (self.courier_id,))
+            hours = {(x['start_minute'], x['stop_minute']) for x in await cur.fetchall()}
+            await cur.execute('SELECT courier_type, current_assignment_id FROM couriers WHERE courier_id = %s',
+                              (self.courier_id,))
+            courier = await cur.fetchone()
+        assert assigned == expected, f'{len(assigned ^ expected)} orders are assigned wrong after the patch {patch}'
+        assert regions == set(patch.get('regions', REGIONS))
+        assert hours == {minutes(x) for x in patch.get('working_hours', ['00:00-23:59'])}
+        assert courier['courier_type'] == patch.get('courier_type', 'car')
+        assert (courier['current_assignment_id'] is None) == (not expected), 'the emptied assignment is left current'
+
+
+def make_patch(rng: random.Random, fields: tuple) -> dict:
+    patch = {}
+    if 'courier_type' in fields:
+        patch['courier_type'] = 'bike'
+    if 'regions' in fields:
+        patch['regions'] = rng.sample(REGIONS, 2)
+    if 'working_hours' in fields:
+        patch['working_hours'] = common.random_time_ranges(rng, rng.randint(1, 2))
+    return patch
+
+
+async def measure(name: str, courier: Courier, patch: dict):
+    expected = courier.eligible(patch)
+    trace = tracing.Trace(name, 'PATCH', f'/couriers/{courier.courier_id}', requested=False)
+    tracing.start(trace)
+    start = time.perf_counter()
+    try:
+        all_valid, _ = await db_connection.patch_couriers_id_execute_queries(str(courier.courier_id), patch)
+    finally:
+        tracing.finish(trace)
+    elapsed = time.perf_counter() - start
+    assert all_valid, f'patch {patch} failed'
+    await courier.check(patch, expected)
+    print(f'    {name:>40}: {elapsed * 1000:9.2f} ms, {len(trace.spans):3} statements, '
+          f'{len(courier.orders) - len(expected):6} orders de-assigned')
+
+
+async def run(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    cfg.TRACE_EXPLAIN_THRESHOLD = float('inf')  # the statements are only counted
+    await common.prepare_database()
+    await db_connection.init_pool(None)
+    try:
+        await common.truncate_tables()
+        for open_orders in args.open_orders:
+            print(f'{open_orders} orders in the open assignment')
+            for size in range(1, len(FIELDS) + 1):
+                for fields in itertools.combinations(FIELDS, size):
+                    courier = Courier()
+                    await courier.seed(rng, open_orders)
+                    await measure(' + '.join(fields), courier, make_patch(rng, fields))
+            courier = Courier()
+            await courier.seed(rng, open_orders)
+            await measure('regions, all orders de-assigned', courier, {'regions': [5]})
+        courier = Courier()
+        await courier.seed(rng, 4, Decimal(9))
+        await measure('courier_type, over the capacity together', courier, {'courier_type': 'foot'})
+        print('every patch left assigned exactly the orders the courier can deliver')
+    finally:
+        await common.truncate_tables()
+        await db_connection.close_pool(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--open-orders', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='sizes of the open assignments patched')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""
+Query-plan regression check of the statements of db_connection. The coroutines of db_connection are run
+against a seeded database with every statement they send kept by tracing, then each distinct statement is explained
+with EXPLAIN FORMAT=JSON. The check fails (exits with 1) if a statement reads a table by a full scan, sorts by filesort
+or is estimated to examine more rows than its budget. Statements of the bulk jobs (loading of the index of open orders,
+archiver.py, backfill.py) read whole tables by design, their plans are only reported.
+The indexes the plans rely on are added to the existing databases by migrations.migrate_indexes.
+
+    python -m benchmark.plan_check --couriers 2000 --orders 100000
+    python -m benchmark.plan_check --start-mysql 3307 --verbose
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+from typing import Dict, List
+
+import aiomysql
+
+import archiver
+import backfill
+import cache
+import cfg
+import db_connection
+import tracing
+from benchmark import common, mysql_server
+
+# tables a full scan of which is cheap whatever the data: weights has a row per courier type
+SMALL_TABLES = {'weights'}
+
+# statements allowed to examine more rows than --rows-budget: (fragment of the fingerprint, share of --orders, why)
+BUDGETS = (
+    ('FROM couriers_working_hours AS cwh JOIN delivery_hours_of_orders AS dhof', 0.25,
+     'the lookup of the assignment while the index of open orders isn`t loaded goes through the open orders '
+     'of the regions of the courier'),
+)
+
+
+class Plan:
+    __slots__ = ('rows_examined', 'full_scans', 'filesort', 'temporary')
+
+    def __init__(self):
+        self.rows_examined = 0.0
+        self.full_scans = []
+        self.filesort = False
+        self.temporary = False
+
+
+def _table(table: Dict, loops: float, plan: Plan) -> float:
+    """
+    :param loops: how many times the table is read, rows produced by the tables joined before it
+    :return: rows produced by the join up to this table
+    """
+    examined = table.get('rows_examined_per_scan', 0)
+    plan.rows_examined += loops * examined
+    name = table.get('table_name', '?')
+    # derived tables and materialized subqueries are named <derived2>, <subquery3>, their own plans are walked below
+    if table.get('access_type') == 'ALL' and not name.startswith('<') and name not in SMALL_TABLES:
+        plan.full_scans.append(name)
+    for key, value in table.items():
+        if isinstance(value, (dict, list)):
+            _walk(value, 1, plan)
+    return table.get('rows_produced_per_join', loops * examined)
+
+
+def _walk(node, loops: float, plan: Plan):
+    if isinstance(node, list):
+        for item in node:
+            _walk(item, loops, plan)
+        return
+    if not isinstance(node, dict):
+        return
+    if node.get('using_filesort'):
+        plan.filesort = True
+    if node.get('using_temporary_table'):
+        plan.temporary = True
+    if 'nested_loop' in node:
+        produced = loops
+        for item in node['nested_loop']:
+            produced = _table(item['table'], produced, plan)
+    if 'table' in node:
+        _table(node['table'], loops, plan)
+    for key, value in node.items():
+        if key not in ('nested_loop', 'table'):
+            _walk(value, loops, plan)
+
+
+def analyze(explain: Dict) -> Plan:
+    """
+    :param explain: output of EXPLAIN FORMAT=JSON
+    """
+    plan = Plan()
+    _walk(explain, 1, plan)
+    return plan
+
+
+def is_explainable(statement: str) -> bool:
+    words = statement.split(None, 1)
+    verb = words[0].upper() if words else ''
+    # plain INSERT ... VALUES has no plan to speak of
+    return verb in ('SELECT', 'UPDATE', 'DELETE') or verb == 'INSERT' and ' SELECT ' in statement.upper()
+
+
+def budget_of(sql: str, default: int, orders: int) -> int:
+    for fragment, share, _ in BUDGETS:
+        if fragment in sql:
+            return max(default, int(share * orders))
+    return default
+
+
+class Capture:
+    """
+    Statements sent by the coroutines run in its phases, by their fingerprints.
+    """
+
+    def __init__(self):
+        self.statements: Dict[str, Dict] = {}
+
+    async def phase(self, name: str, coroutine, bulk: bool = False):
+        """
+        :param bulk: the phase is a bulk job, its statements are expected to read whole tables
+        """
+        trace = tracing.Trace(name, 'RUN', name, requested=False, keep_statements=True)
+        tracing.start(trace)
+        try:
+            result = await coroutine
+        finally:
+            tracing.finish(trace)
+        for span in trace.spans:
+            if 'statement' not in span or not is_explainable(span['statement']):
+                continue
+            seen = self.statements.setdefault(span['sql'], {'statement': span['statement'], 'phases': [], 'bulk': True})
+            if name not in seen['phases']:
+                seen['phases'].append(name)
+            seen['bulk'] = seen['bulk'] and bulk
+        return result
+
+
+async def seed(rng: random.Random, args: argparse.Namespace) -> List[Dict]:
+    """
+    Fills the tables with open, assigned and completed orders, so the optimizer sees the data of a running service.
+    :return: the seeded couriers
+    """
+    couriers = common.make_couriers(rng, args.couriers, args.regions)
+    for i in range(0, args.orders, 10000):
+        await db_connection.post_orders_execute_queries(
+            {'data': common.make_orders(rng, min(10000, args.orders - i), args.regions, first_id=i + 1)})
+    await db_connection.post_couriers_execute_queries({'data': couriers})
+    for courier in couriers[:len(couriers) // 2]:
+        all_valid, response = await db_connection.post_orders_assign_execute_queries(
+            {'courier_id': courier['courier_id']})
+        if not all_valid or not response.get('orders'):
+            continue
+        for order in response['orders']:
+            if rng.random() < args.complete_share:
+                await db_connection.post_orders_complete_execute_queries(
+                    {'courier_id': courier['courier_id'], 'order_id': order['id'],
+                     'complete_time': response['assign_time'] + 'Z'})
+    async with db_connection.acquire() as conn:
+        cur = await conn.cursor()
+        for table in common.TABLES:
+            await cur.execute(f'ANALYZE TABLE `{table}`')
+            await cur.fetchall()
+    return couriers
+
+
+async def capture(rng: random.Random, args: argparse.Namespace, couriers: List[Dict]) -> Capture:
+    """
+    Runs every coroutine of db_connection the handlers use, on both paths of the assignment.
+    """
+    captured = Capture()
+    first_courier = args.couriers + 1
+    first_order = args.orders + 1
+    new_couriers = common.make_couriers(rng, 10, args.regions, first_id=first_courier)
+    # an id that is already stored takes the batch through the lookup of the existing ids
+    await captured.phase('POST /couriers', db_connection.post_couriers_execute_queries(
+        {'data': new_couriers + [couriers[0]]}))
+    await captured.phase('POST /orders', db_connection.post_orders_execute_queries(
+        {'data': common.make_orders(rng, 100, args.regions, first_id=first_order) + common.make_orders(rng, 1, 1)}))
+
+    await captured.phase('POST /orders/assign (DB)', db_connection.post_orders_assign_execute_queries(
+        {'courier_id': first_courier}))
+    await captured.phase('load of the index', db_connection.rebuild_matching_index(), bulk=True)
+    await captured.phase('POST /orders/assign (index)', db_connection.post_orders_assign_execute_queries(
+        {'courier_id': first_courier + 1}))
+    await captured.phase('POST /orders/assign/batch', db_connection.post_orders_assign_batch_execute_queries(
+        {'courier_ids': [first_courier + 2, first_courier + 3]}))
+    # the current assignment is returned again
+    all_valid, assignment = await captured.phase('POST /orders/assign (index)',
+                                                 db_connection.post_orders_assign_execute_queries(
+                                                     {'courier_id': first_courier + 2}))
+
+    cache.profiles.clear()
+    await captured.phase('GET /couriers/{id}', db_connection.get_couriers_id_execute_queries(couriers[0]['courier_id']))
+
+    if all_valid and assignment.get('orders'):
+        for order in assignment['orders']:
+            # the last completion finishes the assignment and credits the earnings
+            await captured.phase('POST /orders/complete', db_connection.post_orders_complete_execute_queries(
+                {'courier_id': first_courier + 2, 'order_id': order['id'],
+                 'complete_time': assignment['assign_time'] + 'Z'}))
+
+    patch = {'courier_type': 'foot', 'regions': [1], 'working_hours': common.random_time_ranges(rng, 1)}
+    for key, value in patch.items():
+        await captured.phase('PATCH /couriers/{id}', db_connection.patch_couriers_id_execute_queries(
+            str(first_courier + 3), {key: value}))
+
+    await captured.phase('archiver', archiver.archive(), bulk=True)
+    async with db_connection.acquire() as conn:
+        cur = await conn.cursor()
+        await captured.phase('backfill', backfill.backfill_courier_stats(cur), bulk=True)
+        await conn.rollback()
+    return captured
+
+
+async def explain(statement: str) -> Dict:
+    async with db_connection.acquire() as conn:
+        cur = await conn.cursor(aiomysql.Cursor)  # EXPLAIN itself isn`t one of the statements of the app
+        await cur.execute('EXPLAIN FORMAT=JSON ' + statement)
+        return json.loads((await cur.fetchone())[0])
+
+
+async def check(captured: Capture, args: argparse.Namespace) -> bool:
+    failures = 0
+    for sql, seen in captured.statements.items():
+        plan = analyze(await explain(seen['statement']))
+        budget = budget_of(sql, args.rows_budget, args.orders)
+        problems = []
+        if plan.full_scans:
+            problems.append(f'full scan of {", ".join(plan.full_scans)}')
+        if plan.filesort:
+            problems.append('filesort')
+        if plan.rows_examined > budget:
+            problems.append(f'examines ~{plan.rows_examined:.0f} rows, the budget is {budget}')
+        failed = bool(problems) and not seen['bulk']
+        failures += failed
+        status = 'FAIL' if failed else 'bulk' if seen['bulk'] else 'ok'
+        if failed or args.verbose:
+            print(f'[{status}] {", ".join(seen["phases"])}: {sql}')
+            for problem in problems:
+                print(f'       {problem}')
+            if plan.temporary:
+                print('       uses a temporary table')
+    print(f'{len(captured.statements)} statements explained, {failures} with plans over the limits')
+    return not failures
+
+
+async def run(args: argparse.Namespace) -> bool:
+    rng = random.Random(args.seed)
+    container = None
+    # no EXPLAIN of slow statements while they are captured, the spans of a phase aren`t capped
+    cfg.TRACE_EXPLAIN_THRESHOLD = float('inf')
+    cfg.TRACE_MAX_SPANS = sys.maxsize
+    try:
+        if args.start_mysql:
+            container = await mysql_server.start(args.start_mysql)
+        await common.prepare_database()
+        await db_connection.init_pool(None)
+        await common.truncate_tables()
+        couriers = await seed(rng, args)
+        captured = await capture(rng, args, couriers)
+        return await check(captured, args)
+    finally:
+        if db_connection.pool is not None:
+            await common.truncate_tables()
+            await db_connection.close_pool(None)
+        if container is not None:
+            mysql_server.stop(container)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--start-mysql', type=int, metavar='PORT',
+                        help=f'start a {mysql_server.IMAGE} container on the port of the localhost for the run')
+    parser.add_argument('--couriers', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--regions', type=int, default=20)
+    parser.add_argument('--complete-share', type=float, default=0.5, help='share of the assigned orders completed')
+    parser.add_argument('--rows-budget', type=int, default=1000, help='rows a statement may examine by its plan')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='print the plans within the limits too')
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    passed = asyncio.get_event_loop().run_until_complete(run(args))
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Routing of the reads between the primary and its read replicas of cfg.DB_REPLICAS. GET /couriers/{id} is read
+with the profile cache off from the primary alone and then through the replicas, with the throughput, the latency
+and the servers the reads went to. Then the couriers are read right after their PATCH, with and without the pinning
+to the primary, and the reads are made again while the replication is stopped and, for the containers started
+by the benchmark, while the replica is down, when all of them have to be served by the primary.
+
+    python -m benchmark.replica_routing --start-mysql 3307  # a source on 3307 and its replica on 3308
+    python -m benchmark.replica_routing --db-host 127.0.0.1 --db-port 3306 --replica 127.0.0.1:3307
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import Dict, List
+
+import aiomysql
+
+import cache
+import cfg
+import db_connection
+import metrics
+from benchmark import common, mysql_server
+
+REPLICATION_OPTIONS = ('--gtid-mode=ON', '--enforce-gtid-consistency=ON')
+SERVERS = ('primary', 'replica')
+
+
+async def start_replicated(port: int) -> List[str]:
+    """
+    Starts a source on the port and its replica on the next one, points cfg at the source and the replica.
+    :return: ids of the containers of the source and the replica
+    """
+    replica = await mysql_server.start(port + 1, ['--server-id=2', *REPLICATION_OPTIONS])
+    source = await mysql_server.start(port, ['--server-id=1', *REPLICATION_OPTIONS])  # cfg is pointed at the last one
+    conn = await aiomysql.connect(host=cfg.DB_HOST, port=port, user=cfg.DB_USER, password=cfg.DB_PASSWORD)
+    cur = await conn.cursor()
+    await cur.execute('SELECT @@GLOBAL.gtid_executed')
+    initialized, = await cur.fetchone()  # users created by the entrypoint of the image, the replica has its own
+    conn.close()
+    conn = await aiomysql.connect(host=cfg.DB_HOST, port=port + 1, user=cfg.DB_USER, password=cfg.DB_PASSWORD,
+                                  autocommit=True)
+    cur = await conn.cursor()
+    await cur.execute('RESET MASTER')
+    await cur.execute('SET GLOBAL gtid_purged = %s', (initialized,))
+    await cur.execute('''CHANGE REPLICATION SOURCE TO SOURCE_HOST = %s, SOURCE_PORT = 3306, SOURCE_USER = %s,
+        SOURCE_PASSWORD = %s, SOURCE_AUTO_POSITION = 1, GET_SOURCE_PUBLIC_KEY = 1''',
+                      (mysql_server.address(source), cfg.DB_USER, cfg.DB_PASSWORD))
+    await cur.execute('START REPLICA')
+    conn.close()
+    cfg.DB_REPLICAS = [(cfg.DB_HOST, port + 1)]
+    return [source, replica]
+
+
+async def wait_until(condition, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError('the replicas didn`t get to the expected state')
+        await asyncio.sleep(0.1)
+
+
+async def on_replicas(query: str) -> List[int]:
+    """
+    :return: the first value of the first row of the query on every replica
+    """
+    values = []
+    for replica in db_connection.replicas:
+        async with db_connection.acquire(replica.pool) as conn:
+            cur = await conn.cursor()
+            await cur.execute(query)
+            row = await cur.fetchone()
+            values.append(next(iter(row.values())) if row else None)
+    return values
+
+
+async def seed(rng: random.Random, couriers: int, regions: int) -> List[int]:
+    """
+    Stores the couriers and waits until the replicas have them.
+    :return: their ids
+    """
+    window, cfg.DB_READ_YOUR_WRITES_WINDOW = cfg.DB_READ_YOUR_WRITES_WINDOW, 0  # the reads that follow aren`t pinned
+    try:
+        data = common.make_couriers(rng, couriers, regions)
+        ok, ids = await db_connection.post_couriers_execute_queries({'data': data})
+        assert ok, f'couriers {ids} are invalid'
+    finally:
+        cfg.DB_READ_YOUR_WRITES_WINDOW = window
+    deadline = time.monotonic() + 60
+    while set(await on_replicas('SELECT COUNT(*) FROM couriers')) != {couriers}:
+        assert time.monotonic() < deadline, 'the couriers are not replicated in a minute'
+        await asyncio.sleep(0.1)
+    return ids
+
+
+def routed() -> Dict[str, float]:
+    return {x: metrics.db_reads.labels(x).value for x in SERVERS}
+
+
+async def measure(name: str, rng: random.Random, courier_ids: List[int], reads: int, concurrency: int):
+    latencies = []
+    queue = iter([rng.choice(courier_ids) for _ in range(reads)])
+
+    async def worker():
+        for courier_id in queue:
+            start = time.perf_counter()
+            ok, profile = await db_connection.get_couriers_id_execute_queries(courier_id)
+            latencies.append(time.perf_counter() - start)
+            assert ok and profile is not None, f'courier {courier_id} is not read'
+
+    before = routed()
+    retries = metrics.db_retries.labels('replica').value
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    after = routed()
+    latencies.sort()
+    servers = ', '.join(f'{x} {int(after[x] - before[x])}' for x in SERVERS)
+    print(f'{name:>22}: {reads / elapsed:8.1f} reads/s, median {statistics.median(latencies) * 1000:6.2f} ms, '
+          f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.2f} ms; read from {servers}, '
+          f'{int(metrics.db_retries.labels("replica").value - retries)} failed on a replica')
+
+
+async def read_your_writes(name: str, rng: random.Random, courier_ids: List[int], patches: int, regions: int):
+    """
+    Patches the regions of the couriers and reads every one of them right after its patch.
+    """
+    stale = 0
+    for courier_id in rng.sample(courier_ids, min(patches, len(courier_ids))):
+        patched = sorted(rng.sample(range(1, regions + 1), rng.randint(1, 3)))
+        ok, _ = await db_connection.patch_couriers_id_execute_queries(courier_id, {'regions': patched})
+        assert ok, f'courier {courier_id} is not patched'
+        ok, profile = await db_connection.get_couriers_id_execute_queries(courier_id)
+        stale += sorted(profile.data['regions']) != patched
+    print(f'{name:>22}: {stale} of {patches} couriers read back without their patch')
+
+
+async def run(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    containers = []
+    cache.profiles.maxsize = 0  # every read goes to the DB
+    try:
+        if args.start_mysql:
+            containers = await start_replicated(args.start_mysql)
+        elif args.replica:
+            cfg.DB_REPLICAS = [(host, int(port)) for host, port in (x.rsplit(':', 1) for x in args.replica)]
+        assert cfg.DB_REPLICAS, 'pass --start-mysql or at least one --replica'
+        await common.prepare_database()
+        await db_connection.init_pool(None)
+        await common.truncate_tables()
+        await db_connection.init_replicas(None)
+        await wait_until(lambda: all(x.healthy() for x in db_connection.replicas))
+        courier_ids = await seed(rng, args.couriers, args.regions)
+
+        replicas, db_connection.replicas = db_connection.replicas, []
+        await measure('primary only', rng, courier_ids, args.reads, args.concurrency)
+        db_connection.replicas = replicas
+        await measure(f'{len(replicas)} replicas', rng, courier_ids, args.reads, args.concurrency)
+
+        await read_your_writes('pinned to the primary', rng, courier_ids, args.patches, args.regions)
+        window, cfg.DB_READ_YOUR_WRITES_WINDOW = cfg.DB_READ_YOUR_WRITES_WINDOW, 0
+        await read_your_writes('not pinned', rng, courier_ids, args.patches, args.regions)
+        cfg.DB_READ_YOUR_WRITES_WINDOW = window
+
+        await on_replicas('STOP REPLICA SQL_THREAD')
+        await wait_until(lambda: not any(x.healthy() for x in replicas))
+        await measure('replication stopped', rng, courier_ids, args.reads, args.concurrency)
+        await on_replicas('START REPLICA SQL_THREAD')
+        await wait_until(lambda: all(x.healthy() for x in replicas))
+
+        if containers:
+            mysql_server.stop(containers.pop())
+            await measure('replica down', rng, courier_ids, args.reads, args.concurrency)
+    finally:
+        if db_connection.pool is not None:
+            await common.truncate_tables()
+            await db_connection.close_replicas(None)
+            await db_connection.close_pool(None)
+        for container in containers:
+            mysql_server.stop(container)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--replica', action='append', metavar='HOST:PORT',
+                        help='read replica of the --db-host, may be repeated')
+    parser.add_argument('--start-mysql', type=int, metavar='PORT',
+                        help=f'start {mysql_server.IMAGE} containers of a source on the port of the localhost '
+                             f'and its replica on the next one for the run')
+    parser.add_argument('--couriers', type=int, default=2000)
+    parser.add_argument('--regions', type=int, default=20)
+    parser.add_argument('--reads', type=int, default=20000, help='GET /couriers/{id} requests per measurement')
+    parser.add_argument('--patches', type=int, default=200, help='couriers read back right after their PATCH')
+    parser.add_argument('--concurrency', type=int, default=64, help='reads in flight at once')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Time the solver takes to choose the orders of an assignment out of 10, 100 and 1000 candidates,
+for both objectives. Doesn`t need the DB.
+
+    python -m benchmark.solver --candidates 10 100 1000
+"""
+import argparse
+import random
+import statistics
+import time
+
+import solver
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--candidates', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--max-weight', type=float, default=50)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    for objective in (solver.OBJECTIVE_ORDERS, solver.OBJECTIVE_WEIGHT):
+        for count in args.candidates:
+            timings = []
+            loads = []
+            for _ in range(args.repeat):
+                candidates = [(i, round(rng.uniform(0.01, args.max_weight), 2)) for i in range(count)]
+                weights = dict(candidates)
+                start = time.perf_counter()
+                chosen = solver.select_orders(candidates, args.max_weight, objective)
+                timings.append(time.perf_counter() - start)
+                loads.append(sum(weights[x] for x in chosen) / args.max_weight)
+            print(f'{objective:>6} {count:>5} candidates: median {statistics.median(timings) * 1e6:9.1f} us, '
+                  f'max {max(timings) * 1e6:9.1f} us, mean load {statistics.mean(loads):.1%}')
+
+
+if __name__ == '__main__':
+    main()
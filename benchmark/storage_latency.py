@@ -0,0 +1,99 @@
+"""
+Latency of the operations of the storage backends of storage.py, called directly, without HTTP.
+The couriers and the orders are registered in batches, then every courier gets an assignment, its profile is read,
+its orders are completed and it`s patched, one operation at a time; the report has p50/p99 latency of every operation
+for the memory backend with the journal synced to disk on every write, without it, and for MySQL if asked for.
+
+    python -m benchmark.storage_latency --couriers 2000 --orders 50000
+    python -m benchmark.storage_latency --couriers 2000 --orders 50000 --mysql --db-host 127.0.0.1
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+import cache
+import cfg
+import db_connection
+import memory_storage
+import storage
+from benchmark import common, traffic
+from benchmark.http_load import percentile
+
+
+async def measure(name: str, backend: storage.Storage, args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    couriers = common.make_couriers(rng, args.couriers, args.regions)
+    orders = common.make_orders(rng, args.orders, args.regions)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+
+    async def timed(operation: str, call: Callable, *call_args):
+        start = time.perf_counter()
+        result = await call(*call_args)
+        latencies[operation].append(time.perf_counter() - start)
+        return result
+
+    for i in range(0, len(couriers), args.batch):
+        await timed('post_couriers', backend.post_couriers, {'data': couriers[i:i + args.batch]})
+    for i in range(0, len(orders), args.batch):
+        await timed('post_orders', backend.post_orders, {'data': orders[i:i + args.batch]})
+    for courier in couriers:
+        courier_id = courier['courier_id']
+        ok, assignment = await timed('assign', backend.assign, {'courier_id': courier_id})
+        await timed('get_courier', backend.get_courier, courier_id)
+        for order in assignment.get('orders', []) if ok else []:
+            await timed('complete', backend.complete,
+                        traffic.completion(rng, courier_id, order['id'], assignment['assign_time']))
+        await timed('patch_courier', backend.patch_courier, courier_id,
+                    {'regions': rng.sample(range(1, args.regions + 1), 2)})
+
+    print(f'{name}:')
+    for operation, values in latencies.items():
+        values.sort()
+        print(f'{operation:>16}: {len(values):7} calls, p50 {percentile(values, 0.5) * 1000:8.3f} ms, '
+              f'p99 {percentile(values, 0.99) * 1000:8.3f} ms')
+
+
+async def run(args: argparse.Namespace):
+    cache.profiles.maxsize = 0  # every read goes to the backend
+    for fsync in (True, False):
+        cfg.MEMORY_JOURNAL_FSYNC = fsync
+        with tempfile.TemporaryDirectory() as directory:
+            backend = memory_storage.MemoryStorage(directory)
+            backend.open()
+            try:
+                await measure(f'memory, journal {"synced" if fsync else "not synced"}', backend, args)
+            finally:
+                backend.close()
+
+    if args.mysql:
+        await common.prepare_database()
+        await db_connection.init_pool(None)
+        try:
+            await common.truncate_tables()
+            await db_connection.rebuild_matching_index()
+            await measure('mysql', storage.MySQLStorage(), args)
+        finally:
+            await common.truncate_tables()
+            await db_connection.close_pool(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--couriers', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=50000)
+    parser.add_argument('--regions', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=1000, help='couriers or orders in a POST')
+    parser.add_argument('--mysql', action='store_true', help='measure the MySQL backend too')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Peak memory and throughput of POST /orders with huge bodies, loaded at once by request.json() versus parsed
+and validated batch by batch by the streaming ingestion. The app is served in-process on a local port,
+memory is traced by tracemalloc, so the bodies prepared by the client are excluded from the peak.
+
+    python -m benchmark.streaming_ingestion --orders 10000 100000 300000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import tracemalloc
+
+import aiohttp
+from aiohttp import web
+
+import cfg
+import db_connection
+import handlers
+import logs
+from benchmark import common
+
+PORT = 8089
+
+
+async def post(session: aiohttp.ClientSession, body: bytes, content_type: str) -> (float, float):
+    """
+    :return: tuple of seconds the request took and peak MiB allocated while it was served
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    async with session.post(f'http://127.0.0.1:{PORT}/orders', data=body,
+                            headers={'Content-Type': content_type}) as response:
+        await response.read()
+        assert response.status == 201, response.status
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1024 ** 2
+
+
+async def run(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    await common.prepare_database()
+    app = web.Application(middlewares=[logs.request_context], client_max_size=2 ** 40)
+    app.on_startup.append(db_connection.init_pool)
+    app.on_cleanup.append(db_connection.close_pool)
+    app.add_routes([web.post('/orders', handlers.post_orders)])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', PORT).start()
+    try:
+        async with aiohttp.ClientSession() as session:
+            for count in args.orders:
+                orders = common.make_orders(rng, count, 20)
+                bodies = {'buffered': (json.dumps({'data': orders}).encode(), 'application/json'),
+                          'streamed': (json.dumps({'data': orders}).encode(), 'application/json'),
+                          'ndjson': ('\n'.join(json.dumps(x) for x in orders).encode(), 'application/x-ndjson')}
+                del orders
+                print(f'{count} orders, {len(bodies["buffered"][0]) / 1024 ** 2:.1f} MiB of JSON')
+                for mode, (body, content_type) in bodies.items():
+                    cfg.STREAM_THRESHOLD_BYTES = 2 ** 40 if mode == 'buffered' else 0
+                    await common.truncate_tables()
+                    elapsed, peak = await post(session, body, content_type)
+                    print(f'    {mode:>8}: {elapsed:7.2f} s, {count / elapsed:9.0f} orders/s, peak {peak:8.1f} MiB')
+    finally:
+        await common.truncate_tables()
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--orders', type=int, nargs='+', default=[10000, 100000, 300000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Synthetic traffic of the HTTP API: couriers, orders, their patches and completions, with configurable number of regions
+and distributions of the working/delivery hours and of the weights of the orders.
+"""
+import datetime
+import random
+from typing import Dict, List
+
+from benchmark import common
+
+HOURS_DISTRIBUTIONS = ('uniform', 'peaked')
+WEIGHT_DISTRIBUTIONS = ('uniform', 'light')
+
+# peaks of the delivery hours: lunch and evening, (mean, standard deviation) of the start in minutes of the day
+_PEAKS = ((13 * 60, 60), (19 * 60, 90))
+
+
+def time_ranges(rng: random.Random, count: int, distribution: str) -> List[str]:
+    """
+    :return: list of count non-crossing ranges in HH:MM-HH:MM format
+    """
+    if distribution == 'uniform':
+        return common.random_time_ranges(rng, count)
+    starts = set()
+    while len(starts) < count:
+        mean, deviation = rng.choice(_PEAKS)
+        starts.add(min(max(int(rng.gauss(mean, deviation)) // 30 * 30, 0), 24 * 60 - 60))
+    starts = sorted(starts)
+    ranges = []
+    for i, start in enumerate(starts):
+        limit = starts[i + 1] if i + 1 < len(starts) else 24 * 60 - 1
+        stop = min(start + rng.choice((30, 60, 120)), limit)
+        ranges.append(f'{start // 60:02}:{start % 60:02}-{stop // 60:02}:{stop % 60:02}')
+    return ranges
+
+
+def weight(rng: random.Random, distribution: str) -> float:
+    if distribution == 'uniform':
+        return round(rng.uniform(0.01, 50), 2)
+    # most orders are a few kilograms, like real deliveries of sweets
+    return round(min(max(rng.expovariate(1 / 3), 0.01), 50), 2)
+
+
+def couriers(rng: random.Random, count: int, regions: int, hours: str, first_id: int = 1) -> List[Dict]:
+    return [{'courier_id': courier_id, 'courier_type': rng.choice(common.COURIER_TYPES),
+             'regions': rng.sample(range(1, regions + 1), rng.randint(1, min(3, regions))),
+             'working_hours': time_ranges(rng, rng.randint(1, 3), hours)}
+            for courier_id in range(first_id, first_id + count)]
+
+
+def orders(rng: random.Random, count: int, regions: int, hours: str, weights: str, first_id: int = 1) -> List[Dict]:
+    return [{'order_id': order_id, 'weight': weight(rng, weights), 'region': rng.randint(1, regions),
+             'delivery_hours': time_ranges(rng, rng.randint(1, 2), hours)}
+            for order_id in range(first_id, first_id + count)]
+
+
+def courier_patch(rng: random.Random, regions: int, hours: str) -> Dict:
+    patch = {}
+    for key in rng.sample(('courier_type', 'regions', 'working_hours'), rng.randint(1, 3)):
+        if key == 'courier_type':
+            patch[key] = rng.choice(common.COURIER_TYPES)
+        elif key == 'regions':
+            patch[key] = rng.sample(range(1, regions + 1), rng.randint(1, min(3, regions)))
+        else:
+            patch[key] = time_ranges(rng, rng.randint(1, 3), hours)
+    return patch
+
+
+def completion(rng: random.Random, courier_id: int, order_id: int, assign_time: str) -> Dict:
+    """
+    :return: body of POST /orders/complete for the order completed from 5 to 60 minutes after its assignment
+    """
+    assigned = datetime.datetime.fromisoformat(assign_time)
+    complete_time = assigned + datetime.timedelta(seconds=rng.randint(5 * 60, 60 * 60))
+    return {'courier_id': courier_id, 'order_id': order_id,
+            'complete_time': complete_time.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-4] + 'Z'}
@@ -0,0 +1,95 @@
+"""
+Time the app spends on a batch of POST /couriers and POST /orders outside of the DB: decoding of the body,
+validation of the items by the compiled validators of validation.py and encoding of the response,
+with each JSON encoder serialization.py can use. The double encoding of the responses the handlers did before
+(json.dumps of the body, then json.dumps of the string by web.json_response) is timed for the reference.
+No DB is needed.
+
+    python -m benchmark.validation_serialization --items 10000 --repeat 20 --invalid-share 0.01
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import serialization
+import validation
+from benchmark import common
+
+ENCODERS = ('json', 'orjson')
+
+
+def spoil(rng: random.Random, items: List[Dict], share: float):
+    """
+    Makes a share of the items invalid the ways the clients get them wrong.
+    """
+    for item in rng.sample(items, int(len(items) * share)):
+        key = rng.choice(sorted(item))
+        item[key] = rng.choice((None, '', -1, ['24:00-25:00'], {'nested': 1}))
+
+
+def timed(function: Callable, repeat: int) -> float:
+    """
+    :return: median of the times of the calls, in milliseconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def measure(name: str, body: bytes, validator: Callable, id_key: str, repeat: int):
+    data = serialization.loads(body)
+    valid, invalid = validation.validate_batch(data['data'], validator)
+    response = {name: [{'id': row[0]} for _, row in valid]}
+    if invalid:
+        response = {'validation_error': {name: [{'id': x} for x in validation.ids_at(data['data'], id_key, invalid)]}}
+
+    def validate():
+        validation.BATCH(data)
+        validation.validate_batch(data['data'], validator)
+
+    decode_ms = timed(lambda: serialization.loads(body), repeat)
+    validate_ms = timed(validate, repeat)
+    encode_ms = timed(lambda: serialization.dumps(response), repeat)
+    print(f'{serialization.encoder:>8} {name:>9}: decode {decode_ms:7.2f} ms, validate {validate_ms:7.2f} ms, '
+          f'encode {encode_ms:6.2f} ms, total {decode_ms + validate_ms + encode_ms:7.2f} ms, '
+          f'{len(invalid)} invalid items')
+    if serialization.encoder == 'json':
+        double_ms = timed(lambda: json.dumps(json.dumps(response)).encode(), repeat)
+        print(f'{"":>8} {name:>9}: encode {double_ms:6.2f} ms when the response is encoded twice')
+
+
+def run(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    validation.COURIER_TYPES.update(common.COURIER_TYPES)  # loaded from the table weights by the app
+    couriers = common.make_couriers(rng, args.items, args.regions)
+    orders = common.make_orders(rng, args.items, args.regions)
+    spoil(rng, couriers, args.invalid_share)
+    spoil(rng, orders, args.invalid_share)
+    bodies = {'couriers': json.dumps({'data': couriers}).encode(), 'orders': json.dumps({'data': orders}).encode()}
+    print(f'{args.items} items per batch, bodies of {len(bodies["couriers"])} and {len(bodies["orders"])} bytes')
+    for encoder in ENCODERS:
+        serialization.use(encoder)
+        if serialization.encoder != encoder:
+            continue  # not installed, the warning is logged
+        measure('couriers', bodies['couriers'], validation.COURIER, 'courier_id', args.repeat)
+        measure('orders', bodies['orders'], validation.ORDER, 'order_id', args.repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=10000, help='couriers or orders per batch')
+    parser.add_argument('--regions', type=int, default=20)
+    parser.add_argument('--invalid-share', type=float, default=0.01, help='share of the items made invalid')
+    parser.add_argument('--repeat', type=int, default=20, help='runs of every step, the median is printed')
+    parser.add_argument('--seed', type=int, default=0)
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
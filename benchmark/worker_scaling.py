@@ -0,0 +1,220 @@
+"""
+Throughput of GET /couriers/{id} and POST /orders/complete as the app is served by 1 to N worker processes
+(serving.py). For every number of workers the app is started as a separate process on --port, fed with couriers,
+orders and assignments, then the reads and the completions are replayed with --concurrency requests in flight,
+spread over --clients load generating processes, so the client isn`t the bottleneck before the server is.
+Prints rps, p50/p99 latency and the speedup over the first number of workers, and the JSON report with --output.
+
+    python -m benchmark.worker_scaling --workers 1 2 4 8 --clients 4 --concurrency 128
+    python -m benchmark.worker_scaling --start-mysql 3307 --event-loop uvloop --no-cache
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import aiohttp
+
+import cfg
+import db_connection
+from benchmark import common, mysql_server, traffic
+from benchmark.http_load import Request, percentile, replay
+
+# runs serving.py with cfg overridden by the JSON in the first argument
+SERVER = '''
+import json, sys
+import cfg
+for key, value in json.loads(sys.argv[1]).items():
+    setattr(cfg, key, value)
+import serving
+serving.run()
+'''
+
+
+def _client(base_url: str, requests: List[Request], concurrency: int, timeout: float) -> (List[float], Dict):
+    """
+    Sends the requests from a load generating process.
+    :return: tuple of the latencies of the requests and the numbers of the responses by status
+    """
+    latencies = []
+    statuses = {}
+
+    async def send():
+        queue = iter(requests)
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout),
+                                         connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+            async def worker():
+                for method, path, body in queue:
+                    start = time.perf_counter()
+                    try:
+                        async with session.request(method, f'{base_url}{path}', json=body) as response:
+                            await response.read()
+                            status = response.status
+                    except aiohttp.ClientError:
+                        status = 'connection error'
+                    latencies.append(time.perf_counter() - start)
+                    statuses[status] = statuses.get(status, 0) + 1
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    asyncio.new_event_loop().run_until_complete(send())
+    return latencies, statuses
+
+
+async def measure(pool: ProcessPoolExecutor, args: argparse.Namespace, base_url: str, requests: List[Request],
+                  expected: int) -> Dict:
+    loop = asyncio.get_event_loop()
+    slices = [requests[i::args.clients] for i in range(args.clients)]
+    start = time.perf_counter()
+    results = await asyncio.gather(*(loop.run_in_executor(pool, _client, base_url, part,
+                                                          max(1, args.concurrency // args.clients), args.timeout)
+                                     for part in slices if part))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(x for part, _ in results for x in part)
+    statuses = {}
+    for _, part in results:
+        for status, count in part.items():
+            statuses[status] = statuses.get(status, 0) + count
+    return {'requests': len(requests), 'seconds': round(elapsed, 3), 'rps': round(len(requests) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'error_rate': round((len(requests) - statuses.get(expected, 0)) / len(requests), 4),
+            'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)}}
+
+
+def start_server(args: argparse.Namespace, workers: int) -> subprocess.Popen:
+    overrides = {'DB_HOST': cfg.DB_HOST, 'DB_PORT': cfg.DB_PORT, 'DB_USER': cfg.DB_USER,
+                 'DB_PASSWORD': cfg.DB_PASSWORD, 'DATABASE': cfg.DATABASE, 'SERVER_PORT': args.port,
+                 'SERVER_WORKERS': workers, 'SERVER_EVENT_LOOP': args.event_loop, 'LOG_LEVEL': 'WARNING',
+                 'ARCHIVE_ENABLED': False}
+    if args.no_cache:
+        overrides['PROFILE_CACHE_MAXSIZE'] = 0
+    return subprocess.Popen([sys.executable, '-c', SERVER, json.dumps(overrides)])
+
+
+def stop_server(server: subprocess.Popen):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(cfg.SERVER_SHUTDOWN_TIMEOUT + 10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+async def wait_ready(session: aiohttp.ClientSession, base_url: str, server: subprocess.Popen, workers: int):
+    """
+    Waits until the app answers GET /ready from as many connections as there are workers, each accepted
+    by any of them, and a moment more for the rest to start.
+    """
+    answered = 0
+    deadline = time.monotonic() + 120
+    while answered < workers:
+        if server.poll() is not None:
+            raise RuntimeError(f'the server exited with {server.returncode}')
+        if time.monotonic() > deadline:
+            raise RuntimeError('the server isn`t ready in 120 s')
+        try:
+            async with session.get(f'{base_url}/ready', headers={'Connection': 'close'}) as response:
+                answered += response.status == 200
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    await asyncio.sleep(2)
+
+
+async def seed(session: aiohttp.ClientSession, args: argparse.Namespace, base_url: str) -> (List[Request], List[Request]):
+    """
+    Posts the couriers and orders and assigns the orders through the app.
+    :return: tuple of the reads and the completions of the assigned orders
+    """
+    rng = random.Random(args.seed)
+    couriers = traffic.couriers(rng, args.couriers, args.regions, 'uniform')
+    orders = traffic.orders(rng, args.orders, args.regions, 'uniform', 'uniform')
+    for name, items in (('couriers', couriers), ('orders', orders)):
+        await replay(session, base_url, [('POST', f'/{name}', {'data': items[i:i + 500]})
+                                         for i in range(0, len(items), 500)], 8, 201)
+    courier_ids = [x['courier_id'] for x in couriers]
+    _, assignments = await replay(session, base_url, [('POST', '/orders/assign', {'courier_id': x})
+                                                      for x in courier_ids], 8, 200)
+    completions = [('POST', '/orders/complete', traffic.completion(rng, courier_id, order['id'],
+                                                                     assignment['assign_time']))
+                   for courier_id, assignment in zip(courier_ids, assignments) if assignment is not None
+                   for order in assignment.get('orders', [])]
+    rng.shuffle(completions)
+    reads = [('GET', f'/couriers/{rng.choice(courier_ids)}', None) for _ in range(args.reads)]
+    return reads, completions
+
+
+async def run(args: argparse.Namespace):
+    container = None
+    results = {}
+    base_url = f'http://127.0.0.1:{args.port}'
+    pool = ProcessPoolExecutor(args.clients, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        if args.start_mysql:
+            container = await mysql_server.start(args.start_mysql)
+        await common.prepare_database()
+        await db_connection.init_pool(None)
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=args.timeout)) as session:
+            for workers in args.workers:
+                await common.truncate_tables()
+                server = start_server(args, workers)
+                try:
+                    await wait_ready(session, base_url, server, workers)
+                    reads, completions = await seed(session, args, base_url)
+                    results[workers] = {
+                        'GET /couriers/{id}': await measure(pool, args, base_url, reads, 200),
+                        'POST /orders/complete': await measure(pool, args, base_url, completions, 200)}
+                finally:
+                    stop_server(server)
+                for route, report in results[workers].items():
+                    speedup = report['rps'] / results[args.workers[0]][route]['rps']
+                    print(f'{workers:3} workers {route:>22}: {report["rps"]:9.1f} rps (x{speedup:4.2f}), '
+                          f'p50 {report["p50_ms"]:8.2f} ms, p99 {report["p99_ms"]:8.2f} ms, '
+                          f'{report["error_rate"] * 100:5.1f}% errors', file=sys.stderr)
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump({'config': {key: value for key, value in vars(args).items()
+                                      if key not in ('db_password', 'output')},
+                           'workers': results}, output, indent=2)
+    finally:
+        pool.shutdown()
+        if db_connection.pool is not None:
+            await common.truncate_tables()
+            await db_connection.close_pool(None)
+        if container is not None:
+            mysql_server.stop(container)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common.add_db_arguments(parser)
+    parser.add_argument('--start-mysql', type=int, metavar='PORT',
+                        help=f'start a {mysql_server.IMAGE} container on the port of the localhost for the run')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='numbers of worker processes')
+    parser.add_argument('--event-loop', choices=('asyncio', 'uvloop'), default=cfg.SERVER_EVENT_LOOP)
+    parser.add_argument('--no-cache', action='store_true', help='serve every read of a profile from the DB')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--couriers', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=50000)
+    parser.add_argument('--regions', type=int, default=20)
+    parser.add_argument('--reads', type=int, default=20000, help='GET /couriers/{id} requests')
+    parser.add_argument('--clients', type=int, default=4, help='load generating processes')
+    parser.add_argument('--concurrency', type=int, default=128, help='requests in flight at once over all clients')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds per request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file the JSON report is written to')
+    args = parser.parse_args()
+    common.apply_db_arguments(args)
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
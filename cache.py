@@ -0,0 +1,125 @@
+"""
+In-process read-through cache of the assembled courier profiles returned by GET /couriers/{id}.
+db_connection fills it on reads and after PATCH /couriers/{id}, and drops the profiles of the couriers changed by
+every committed write. The cache is per process, other instances of the app aren`t notified of the writes,
+so PROFILE_CACHE_TTL bounds the time they may serve an outdated profile.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, NamedTuple, Optional
+
+import cfg
+import metrics
+import serialization
+
+
+class Profile(NamedTuple):
+    data: Dict
+    etag: str  # strong entity tag of the profile, quoted, as sent in the ETag header
+    body: bytes  # the profile encoded once, sent as it is by every GET of the courier
+
+
+def make_profile(data: Dict) -> Profile:
+    body = serialization.dumps(data)
+    return Profile(data, f'"{hashlib.sha1(body).hexdigest()}"', body)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    :param if_none_match: value of the If-None-Match header of the request, None if there is no such header
+    :param etag: current entity tag of the resource
+    :return: True if the client already has the current representation, so 304 can be returned
+    """
+    if not if_none_match:
+        return False
+    tags = [x.strip() for x in if_none_match.split(',')]
+    # weak comparison, as RFC 7232 requires for If-None-Match
+    return '*' in tags or etag in (x[2:] if x.startswith('W/') else x for x in tags)
+
+
+class ProfileCache:
+    """
+    LRU cache with a TTL. Profiles read from the DB are stored only if their courier wasn`t invalidated since the read
+    started, so a read that raced with a write can`t put the profile from before the write back into the cache,
+    while the writes of other couriers don`t keep it from being stored.
+    """
+    TRACKED_INVALIDATIONS = 10000  # couriers whose last invalidation is remembered, the older ones are assumed recent
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: 'OrderedDict[int, tuple]' = OrderedDict()  # courier_id -> (Profile, expiration time)
+        self._generation = 0  # number of invalidations so far
+        # courier_id -> generation of its last invalidation, the oldest first
+        self._invalidated: 'OrderedDict[int, int]' = OrderedDict()
+        self._forgotten = 0  # generation of the last invalidation dropped from _invalidated, or of the last clear
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # dropped to keep the cache within maxsize
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, courier_id: int) -> Optional[Profile]:
+        entry = self._entries.get(courier_id)
+        if entry is not None and entry[1] <= time.monotonic():
+            del self._entries[courier_id]
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(courier_id)
+        self.hits += 1
+        return entry[0]
+
+    def token(self) -> int:
+        """
+        :return: token to pass to put, must be taken before the profile is read from the DB
+        """
+        return self._generation
+
+    def put(self, courier_id: int, profile: Profile, token: int) -> bool:
+        """
+        :return: True if the profile is stored, False if it could be outdated by an invalidation made since token
+        """
+        if max(self._invalidated.get(courier_id, 0), self._forgotten) > token or self.maxsize <= 0:
+            return False
+        self._entries[courier_id] = (profile, time.monotonic() + self.ttl)
+        self._entries.move_to_end(courier_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    def invalidate(self, courier_ids: Iterable[int]):
+        self._generation += 1
+        for courier_id in courier_ids:
+            self._invalidated[courier_id] = self._generation
+            self._invalidated.move_to_end(courier_id)
+            if self._entries.pop(courier_id, None) is not None:
+                self.invalidations += 1
+        while len(self._invalidated) > self.TRACKED_INVALIDATIONS:
+            _, self._forgotten = self._invalidated.popitem(last=False)
+
+    def clear(self):
+        self._generation += 1
+        self._forgotten = self._generation
+        self._invalidated.clear()
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'expirations': self.expirations, 'invalidations': self.invalidations}
+
+
+profiles = ProfileCache(cfg.PROFILE_CACHE_MAXSIZE, cfg.PROFILE_CACHE_TTL)
+
+metrics.register_callback('profile_cache_events_total', 'Lookups and removals of the courier profile cache, by event.',
+                          'counter', ('event',),
+                          lambda: [((event,), value) for event, value in profiles.stats().items() if event != 'size'])
+metrics.register_callback('profile_cache_size', 'Courier profiles in the cache.', 'gauge', (),
+                          lambda: [((), len(profiles))])
@@ -3,4 +3,107 @@ DB_HOST = '172.28.1.1'
 DB_USER = 'cda_python'
 DB_PASSWORD = 'PLACEHOLDER2'
 DB_PORT = 3306
-DB_ROOT_PASSWORD = 'PLACEHOLDER1'
\ No newline at end of file
+DB_ROOT_PASSWORD = 'PLACEHOLDER1'
+
+SERVER_PORT = 8080
+SERVER_WORKERS = 1  # processes serving the port, each with its own loop and pool; 0 for one per CPU
+SERVER_REUSE_PORT = True  # every worker binds the port with SO_REUSEPORT, False to share one socket bound before forking
+SERVER_EVENT_LOOP = 'asyncio'  # 'uvloop' to run the workers on uvloop if it`s installed (pip install uvloop)
+SERVER_SHUTDOWN_TIMEOUT = 30  # seconds the requests in flight are given to finish on SIGTERM
+SERVER_HEARTBEAT_INTERVAL = 1  # seconds between the heartbeats of a started worker
+SERVER_WORKER_TIMEOUT = 30  # seconds without a heartbeat after which a worker is considered hung and killed
+SERVER_RESTART_DELAY = 1  # seconds before a dead worker is started again, doubled while workers keep dying
+
+DB_POOL_MINSIZE = 5  # connections opened on startup and kept open
+DB_POOL_MAXSIZE = 50  # per worker, keep SERVER_WORKERS times it below max_connections of the MySQL server
+DB_POOL_ACQUIRE_TIMEOUT = 5  # seconds to wait for a free connection before giving up
+DB_POOL_RECYCLE = 3600  # seconds, idle connections older than that are reopened (should be < MySQL wait_timeout)
+DB_LOOKUP_CHUNK_SIZE = 1000  # ids per SELECT ... IN (...) when the bulk insert has to look up already registered ones
+DB_GROUP_CONCAT_MAX_LEN = 1048576  # bytes of GROUP_CONCAT of the exports, the MySQL default of 1024 cuts off ~120 ids
+DB_REPLICAS = []  # (host, port) of read replicas of DB_HOST, e.g. [('172.28.1.3', 3306)]; DB_USER needs REPLICATION CLIENT there
+DB_REPLICA_POOL_MAXSIZE = 20  # connections to each replica, per worker
+DB_REPLICA_MAX_LAG = 2  # seconds behind the primary a replica is still read from
+DB_REPLICA_CHECK_INTERVAL = 1  # seconds between the checks of the lag of the replicas
+DB_REPLICA_RETRY_INTERVAL = 10  # seconds a replica is skipped after a read failed on it
+DB_READ_YOUR_WRITES_WINDOW = 10  # seconds the reads of a courier written by the worker go to the primary, > max lag + check interval
+DB_REPLICA_ASSIGN_READS = True  # POST /orders/assign of a courier with an unfinished assignment is answered by a replica
+DB_RETRY_ATTEMPTS = 5  # times a transaction is run at most on deadlocks, lock wait timeouts and lost connections
+DB_RETRY_BASE_DELAY = 0.01  # seconds, the upper bound of the jittered pause before a retry doubles with every attempt
+DB_RETRY_MAX_DELAY = 0.2  # seconds, the upper bound of the pause doesn`t grow above it
+DB_RETRY_DEADLINE = 2  # seconds since the first attempt after which the transaction isn`t run again
+DB_RETRY_AFTER = 1  # seconds put to Retry-After of 503 answered when the DB is unavailable
+STORAGE_BACKEND = 'mysql'  # or 'memory': the in-process engine of memory_storage.py, no MySQL server, a single worker
+MEMORY_STORAGE_DIR = 'data'  # journal and snapshot of the 'memory' backend, None keeps nothing on disk
+MEMORY_JOURNAL_FSYNC = True  # fsync the journal after every write, False leaves it to the OS: a crash may lose the last ones
+MEMORY_SNAPSHOT_RECORDS = 100000  # journaled writes after which the snapshot is written, the loop waits for it meanwhile
+MIGRATION_LOCK_TIMEOUT = 600  # seconds an instance waits for another one migrating the schema before giving up
+
+ARCHIVE_ENABLED = True  # move completed orders of finished assignments to orders_history in background
+ARCHIVE_INTERVAL = 600  # seconds between passes of the archiver
+ARCHIVE_BATCH_SIZE = 1000  # orders moved per transaction
+ARCHIVE_BATCH_PAUSE = 0.05  # seconds between the batches, keeps the archiver from competing with the requests
+
+COMPLETE_GROUP_COMMIT = False  # queue POST /orders/complete and write the queued completions with one commit per group
+COMPLETE_GROUP_WINDOW = 0.005  # seconds a group waits for more completions after its first one came
+COMPLETE_GROUP_MAX_SIZE = 200  # completions written by one transaction, a full group is written at once
+
+MATCHING_INDEX_ENABLED = True  # look up orders for assignments in the in-process index instead of the DB, 1 worker only
+MATCHING_INDEX_REFRESH_INTERVAL = 300  # seconds between reloads of the index from the DB, 0 disables them
+
+ASSIGN_OBJECTIVE = 'orders'  # 'orders' to assign as many orders as possible, 'weight' to load couriers as fully as possible
+ASSIGN_DP_MAX_CANDIDATES = 64  # candidate sets up to this size are packed exactly for the 'weight' objective
+
+EARNINGS_BASE = 500  # paid for every completed assignment, multiplied by the coefficient of the courier type
+EARNINGS_COEFFICIENTS = {'foot': 2, 'bike': 5, 'car': 9}  # courier type at the moment of the assignment -> coefficient
+RATING_MAX_DELIVERY_SECONDS = 60 * 60  # average delivery time that and longer gives the rating of 0
+
+PROFILE_CACHE_MAXSIZE = 10000  # courier profiles kept in memory by each process, 0 disables the cache
+PROFILE_CACHE_TTL = 30  # seconds, bounds the time other instances of the app may serve a profile outdated by a write
+
+LOG_LEVEL = 'INFO'  # DEBUG logs every step of every request, use it only while debugging
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(request_id)s] %(message)s'
+LOG_PAYLOAD_SAMPLE_RATE = 0.01  # share of the requests with their payload logged, 0 to never log payloads
+LOG_PAYLOAD_MAX_CHARS = 2048  # payloads of the sampled requests are shortened to that
+
+JSON_ENCODER = 'orjson'  # or 'json' of the standard library, which is also used if orjson isn`t installed
+
+STREAM_THRESHOLD_BYTES = 1024 ** 2  # JSON bodies of POST /couriers and /orders larger than that are parsed as a stream
+STREAM_BATCH_SIZE = 1000  # streamed items validated and written at once
+STREAM_CHUNK_SIZE = 64 * 1024  # bytes read from the body at once
+STREAM_MAX_ITEM_BYTES = 1024 ** 2  # longer items (or NDJSON lines) make the body malformed
+STREAM_READ_TIMEOUT = 30  # seconds a streamed body may send nothing for, then it`s answered with 408
+
+EXPORT_PAGE_SIZE = 10000  # rows per query of GET /orders/export and /assignments/export, each page resumes after the last id
+EXPORT_FETCH_SIZE = 500  # rows taken from the unbuffered cursor at once
+EXPORT_CHUNK_BYTES = 64 * 1024  # NDJSON written to the response at once, the writes wait while the client doesn`t read
+
+TRACE_HEADER_ENABLED = False  # requests with the X-Debug-Trace header get their SQL traced and returned in that header
+TRACE_SAMPLE_RATE = 0  # share of the other requests traced, only the slow ones of them are kept
+TRACE_SLOW_REQUEST_SECONDS = 0.5  # traced requests at least that slow are kept for GET /admin/traces
+TRACE_EXPLAIN_THRESHOLD = 0.1  # seconds, EXPLAIN is captured for slower SELECT, UPDATE and DELETE statements
+TRACE_MAX_SPANS = 500  # statements recorded per request, the rest are only counted
+TRACE_RING_SIZE = 100  # traces kept for GET /admin/traces
+TRACE_HEADER_MAX_BYTES = 8192  # longer traces are only summarized in the header
+TRACE_ADMIN_ENABLED = False  # serve GET /admin/traces, it shows the statements of the requests, not their arguments
+TRACE_TOKEN = None  # if set, X-Debug-Trace and GET /admin/traces are honoured only with Authorization: Bearer <it>
+
+ADMISSION_ENABLED = True  # limit the requests served at once by every class of routes, shed the ones waiting too long
+ADMISSION_CLASSES = {  # class -> (requests served at once, requests waiting at most, seconds a request may wait)
+    'priority': (24, 500, 0.5),  # keep the sum of the first numbers near DB_POOL_MAXSIZE
+    'default': (16, 200, 1),
+    'bulk': (4, 20, 5),
+    'export': (2, 10, 5),
+}
+ADMISSION_ROUTES = {  # (method, route without the trailing slash) -> class, None if not limited, the rest are 'default'
+    ('POST', '/orders/complete'): 'priority',
+    ('GET', '/couriers/{courier_id}'): 'priority',
+    ('POST', '/couriers'): 'bulk',
+    ('POST', '/orders'): 'bulk',
+    ('GET', '/orders/export'): 'export',
+    ('GET', '/assignments/export'): 'export',
+    ('GET', '/'): None,
+    ('GET', '/metrics'): None,
+    ('GET', '/ready'): None,
+    ('GET', '/admin/traces'): None,
+}
+ADMISSION_RETRY_AFTER = 1  # seconds put to Retry-After of 503 answered to the shed requests
@@ -1,276 +1,1219 @@
 import aiomysql
+import asyncio
+import contextlib
+import datetime
+import functools
+import itertools
+import random
+import re
+import time
 import cfg  # configure file
-from typing import List, Dict  # type hints
+import cache
+import logs
+import matching
+import metrics
+import profiles
+import solver
+import tracing
+import validation
+from aiohttp import web
+from typing import List, Dict, Set, Optional, Iterable, Callable, Awaitable, AsyncIterable  # type hints
 import logging
 
 
-# all DB_connect coroutines are isolated for the convenience of work with the transactions and connections
+# all DB_connect coroutines are isolated for the convenience of work with the transactions and connections,
+# each of them borrows a connection from the application-wide pool and gives it back on return
 
-# TODO: use pools of connections instead
+pool = None  # aiomysql.Pool, created by init_pool on the application startup
 
+_QUERY_TABLE_RE = {'SELECT': re.compile(r'\bFROM\s+`?(\w+)', re.IGNORECASE),
+                   'DELETE': re.compile(r'\bFROM\s+`?(\w+)', re.IGNORECASE),
+                   'INSERT': re.compile(r'\bINTO\s+`?(\w+)', re.IGNORECASE),
+                   'UPDATE': re.compile(r'^\s*UPDATE\s+`?(\w+)', re.IGNORECASE)}
 
-async def post_couriers_execute_queries(json_request: Dict) -> (bool, Dict):
+
+@functools.lru_cache(maxsize=1024)
+def _query_name(query: str) -> str:
+    """
+    :return: name of the query for the metrics: its statement and the table it reads from or writes to,
+    e.g. "UPDATE orders", so the number of names is bounded whatever the arguments are
+    """
+    statement = query.split(None, 1)[0].upper() if query.strip() else ''
+    table_re = _QUERY_TABLE_RE.get(statement)
+    match = table_re.search(query) if table_re else None
+    return f'{statement} {match.group(1)}' if match else statement
+
+
+_EXPLAINABLE = {'SELECT', 'UPDATE', 'DELETE'}
+
+
+class _InstrumentedCursor(aiomysql.DictCursor):
+    """
+    DictCursor recording the time spent in every query and the number of rows it returned or affected,
+    and adding a span for it to the trace of the request if the request is traced.
+    """
+    _batch = False  # executemany runs execute for parts of the batch, the batch is recorded as a whole
+    _explained = True  # EXPLAIN of the slow statements is captured for their traces
+
+    async def execute(self, query, args=None):
+        if self._batch:
+            return await super().execute(query, args)
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await super().execute(query, args)
+            failed = False
+            return result
+        finally:
+            await self._record(query, args, time.perf_counter() - start, failed, False)
+
+    async def executemany(self, query, args):
+        start = time.perf_counter()
+        self._batch = True
+        failed = True
+        try:
+            result = await super().executemany(query, args)
+            failed = False
+            return result
+        finally:
+            self._batch = False
+            await self._record(query, args, time.perf_counter() - start, failed, True)
+
+    async def _record(self, query: str, args, seconds: float, failed: bool, batch: bool):
+        name = _query_name(query)
+        rows = max(self.rowcount or 0, 0)
+        metrics.observe_query(name, seconds, rows)
+        trace = tracing.current()
+        if trace is None:
+            return
+        if batch:
+            params = sum(len(x) for x in args or ())
+        else:
+            params = len(args) if isinstance(args, (tuple, list, dict)) else int(args is not None)
+        explain = None
+        if not failed and self._explained and seconds >= cfg.TRACE_EXPLAIN_THRESHOLD and name.split(' ', 1)[0] in _EXPLAINABLE:
+            explain = await self._explain()
+        trace.add_span(query, params, seconds, rows, failed, explain, getattr(self, '_executed', None))
+
+    async def _explain(self) -> List[Dict]:
+        """
+        :return: EXPLAIN of the last statement run by the cursor, made with a separate cursor of the same connection,
+        so the results of the statement are left as they are and it`s explained in the same transaction
+        """
+        cur = await self.connection.cursor(aiomysql.DictCursor)
+        try:
+            await cur.execute('EXPLAIN ' + self._executed)
+            return list(await cur.fetchall())
+        except aiomysql.Error as error:
+            return [{'error': str(error)}]
+        finally:
+            await cur.close()
+
+
+class _InstrumentedSSCursor(_InstrumentedCursor, aiomysql.SSDictCursor):
+    """
+    Unbuffered _InstrumentedCursor, the rows are read from the connection as they are fetched. The time recorded
+    is the time to the first row, and nothing else can be run on the connection until the result is read to its end,
+    so the statements aren`t explained.
+    """
+    _explained = False
+
+
+def _pool_connections():
+    if pool is None:
+        return []
+    return [(('used',), pool.size - pool.freesize), (('free',), pool.freesize), (('max',), pool.maxsize)]
+
+
+metrics.register_callback('db_pool_connections', 'Connections of the pool, by state.', 'gauge', ('state',),
+                          _pool_connections)
+metrics.register_callback('matching_index_orders', 'Open orders in the in-process index.', 'gauge', (),
+                          lambda: [((), len(matching.index))])
+
+
+async def _create_pool(host: str, port: int, minsize: int, maxsize: int) -> aiomysql.Pool:
+    # cursorclass=_InstrumentedCursor: SELECT`s result will be presented in dicts, queries are timed for the metrics
+    # each connection starts it`s own transaction so data can`t be corrupted
+    # time_zone: TIMESTAMP columns are read and written in UTC, the time zone of complete_time in requests
+    # group_concat_max_len: the ids of the orders of an assignment and the delivery hours of an order are exported
+    # by GROUP_CONCAT, which otherwise cuts its result off at 1024 bytes without an error
+    # pool_recycle: connections idle for longer than that are reopened instead of being reused,
+    # so we won`t get the ones already dropped by MySQL`s wait_timeout
+    return await aiomysql.create_pool(host=host, port=port, user=cfg.DB_USER, password=cfg.DB_PASSWORD,
+                                      db=cfg.DATABASE, cursorclass=_InstrumentedCursor, autocommit=False,
+                                      minsize=minsize, maxsize=maxsize,
+                                      pool_recycle=cfg.DB_POOL_RECYCLE,
+                                      init_command=f"SET time_zone = '+00:00', "
+                                                   f"SESSION group_concat_max_len = {int(cfg.DB_GROUP_CONCAT_MAX_LEN)}")
+
+
+async def init_pool(app: web.Application):
+    """
+    on_startup hook of the application, creates the pool of connections to the DB used by all coroutines of this module.
+    :param app: application that is being started
+    """
+    global pool
+    pool = await _create_pool(cfg.DB_HOST, cfg.DB_PORT, cfg.DB_POOL_MINSIZE, cfg.DB_POOL_MAXSIZE)
+    logging.info('init_pool: created pool of connections, minsize=%s, maxsize=%s', cfg.DB_POOL_MINSIZE, cfg.DB_POOL_MAXSIZE)
+    # the courier types are checked by the validation before a transaction is opened, weights is never changed by the app
+    async with acquire() as conn:
+        cur = await conn.cursor()
+        await cur.execute('SELECT courier_type FROM weights')
+        validation.COURIER_TYPES.update(x['courier_type'] for x in await cur.fetchall())
+
+
+async def warm_up_pool(app: web.Application):
+    """
+    on_startup hook of the application, checks the connections opened by the pool before the first requests come,
+    the ones the server has already dropped are reconnected.
+    :param app: application that is being started
+    """
+    async def ping():
+        async with acquire() as conn:
+            await conn.ping(reconnect=True)
+
+    await asyncio.gather(*(ping() for _ in range(cfg.DB_POOL_MINSIZE)))
+    logging.info('warm_up_pool: %s connections are ready', pool.size)
+
+
+async def close_pool(app: web.Application):
+    """
+    on_cleanup hook of the application, closes the pool after waiting for the borrowed connections to be released.
+    :param app: application that is being shut down
+    """
+    global pool
+    if pool is not None:
+        pool.close()
+        await pool.wait_closed()
+        pool = None
+        logging.info('close_pool: pool of connections is closed')
+
+
+@contextlib.asynccontextmanager
+async def acquire(source: Optional[aiomysql.Pool] = None):
+    """
+    Borrows a connection from the pool for the time of the with-block.
+    :param source: pool of a replica, the pool of the primary by default
+    :raise asyncio.TimeoutError: if no connection is freed in cfg.DB_POOL_ACQUIRE_TIMEOUT seconds
+    """
+    source = pool if source is None else source
+    start = time.perf_counter()
+    try:
+        conn = await asyncio.wait_for(source.acquire(), timeout=cfg.DB_POOL_ACQUIRE_TIMEOUT)
+    finally:
+        metrics.db_pool_acquire_wait.labels().observe(time.perf_counter() - start)
+    try:
+        yield conn
+    finally:
+        # autocommit is off, so even plain SELECTs leave a transaction open,
+        # and the pool closes connections returned in the middle of one instead of reusing them
+        if not conn.closed and conn.get_transaction_status():
+            try:
+                await conn.rollback()  # not counted by _rollback, nothing was written
+            except aiomysql.Error:
+                conn.close()
+        source.release(conn)
+
+
+async def _rollback(conn: aiomysql.Connection):
+    metrics.db_rollbacks.labels().inc()
+    await conn.rollback()
+
+
+class DBUnavailable(Exception):
+    """
+    The DB can`t serve the request now: no connection of the pool was freed in time, the server can`t be reached,
+    or the transaction kept failing on deadlocks and lock wait timeouts until its retries ran out.
+    Nothing is known to be wrong with the request, it`s answered with 503 and Retry-After by handlers.db_unavailable.
+    """
+
+    def __init__(self, reason: str, message: str):
+        """
+        :param reason: label of the db_unavailable_total metric
+        """
+        super().__init__(message)
+        self.reason = reason
+
+
+# errors of MySQL that roll back the transaction, whole (deadlock) or its last statement (lock wait timeout),
+# and succeed when the transaction is run again
+_RETRIED_ERRORS = {1213: 'deadlock', 1205: 'lock_wait_timeout'}
+# errors of the client meaning the connection is lost, the server rolls the transaction back
+_CONNECTION_ERRORS = {2003, 2006, 2013}  # can`t connect, server has gone away, lost connection during query
+
+
+def _error_kind(error: BaseException) -> Optional[str]:
+    """
+    :return: 'deadlock', 'lock_wait_timeout' or 'connection' for the errors the transaction is run again on,
+    'unavailable' for the other errors of the DB that tell nothing about the request, None for the rest
+    """
+    if isinstance(error, aiomysql.OperationalError) and error.args:
+        if error.args[0] in _RETRIED_ERRORS:
+            return _RETRIED_ERRORS[error.args[0]]
+        return 'connection' if error.args[0] in _CONNECTION_ERRORS else 'unavailable'
+    if isinstance(error, (asyncio.TimeoutError, OSError, aiomysql.InterfaceError)):
+        return 'unavailable'  # no connection of the pool was freed in time, or it`s closed
+    return None
+
+
+@contextlib.contextmanager
+def _unavailable_on_errors(name: str):
+    """
+    Raises DBUnavailable instead of the errors of the with-block that tell nothing about the request.
+    """
+    try:
+        yield
+    except DBUnavailable:
+        raise
+    except Exception as error:
+        if _error_kind(error) is None:
+            raise
+        raise DBUnavailable('unavailable', f'{name}: {error}') from error
+
+
+async def _quiet_rollback(conn: aiomysql.Connection):
+    """
+    Rolls back a transaction that failed, closes the connection if even that fails, so it`s not reused.
+    """
+    if conn.closed:
+        return
+    try:
+        await _rollback(conn)
+    except aiomysql.Error:
+        conn.close()
+
+
+async def _transaction(name: str, work: Callable[[aiomysql.Cursor], Awaitable[tuple]],
+                       rolled_back: Optional[Callable[[], None]] = None, retried: bool = True):
+    """
+    Runs the work in a transaction of its own, committed if the work returns (True, result) and rolled back
+    if it returns (False, result). On deadlocks, lock wait timeouts and lost connections the transaction is rolled back
+    and run again after a jittered exponential backoff, up to cfg.DB_RETRY_ATTEMPTS times
+    within cfg.DB_RETRY_DEADLINE seconds; every retry is counted in db_transaction_retries_total by its reason.
+    :param name: name of the transaction for the logs
+    :param work: coroutine function taking the cursor, it may be run several times, so it must change nothing
+    outside of the transaction but what rolled_back undoes
+    :param rolled_back: called after every rollback, undoes the changes of the work to the state of the process
+    :param retried: False if the work can`t be run again
+    :return: result returned by the work
+    :raise DBUnavailable: if the DB can`t be used, the retries ran out, or the connection was lost during the commit,
+    when it`s unknown whether the transaction was committed
+    :raise Exception: whatever else the work raised, the transaction is rolled back then
+    """
+    deadline = time.monotonic() + cfg.DB_RETRY_DEADLINE
+    for attempt in itertools.count(1):
+        committing = False
+        try:
+            async with acquire() as conn:
+                cur = await conn.cursor()
+                try:
+                    await conn.begin()
+                    commit, result = await work(cur)
+                    if commit:
+                        committing = True
+                        await conn.commit()
+                        return result
+                    await _rollback(conn)
+                except BaseException:
+                    await _quiet_rollback(conn)
+                    raise
+            if rolled_back is not None:
+                rolled_back()
+            return result
+        except Exception as error:
+            if rolled_back is not None and not committing:
+                rolled_back()
+            kind = _error_kind(error)
+            if kind is None:
+                raise
+            if committing:
+                raise DBUnavailable('commit', f'{name}: connection lost during the commit: {error}') from error
+            if kind == 'unavailable':
+                raise DBUnavailable(kind, f'{name}: {error}') from error
+            delay = random.uniform(0, min(cfg.DB_RETRY_MAX_DELAY, cfg.DB_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+            if not retried or attempt >= cfg.DB_RETRY_ATTEMPTS or time.monotonic() + delay > deadline:
+                raise DBUnavailable(kind, f'{name}: {error}, gave up after {attempt} attempts') from error
+            metrics.db_retries.labels(kind).inc()
+            logging.info('_transaction: %s failed: %s, retrying in %.3f s', name, error, delay)
+            await asyncio.sleep(delay)
+
+
+class _Replica:
+    """
+    Read replica of the DB with a pool of its own. Read-only queries are sent to it only while its lag,
+    checked by _monitor_replicas, is known to be within cfg.DB_REPLICA_MAX_LAG.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.name = f'{host}:{port}'
+        self.pool: Optional[aiomysql.Pool] = None  # created by _check_replica once the replica is reachable
+        self.lag: Optional[int] = None  # seconds behind the primary, None if unknown or the replication is stopped
+        self.failed_until = 0.0  # monotonic time the replica is skipped until after a read failed on it
+        self.reachable = True  # result of the last check, its changes are logged
+        self.status_query = 'SHOW REPLICA STATUS'  # MySQL before 8.0.22 knows only SHOW SLAVE STATUS
+
+    def healthy(self) -> bool:
+        return (self.pool is not None and self.lag is not None and self.lag <= cfg.DB_REPLICA_MAX_LAG
+                and time.monotonic() >= self.failed_until)
+
+    def load(self) -> int:
+        return self.pool.size - self.pool.freesize
+
+    def fail(self, error: Exception):
+        self.failed_until = time.monotonic() + cfg.DB_REPLICA_RETRY_INTERVAL
+        logging.warning('fail: read from replica %s failed: %s, reading from the primary for %s s',
+                        self.name, error, cfg.DB_REPLICA_RETRY_INTERVAL)
+
+
+replicas: List[_Replica] = []  # created by init_replicas from cfg.DB_REPLICAS
+_replica_monitor = None
+_replica_turn = itertools.count()  # round robin among the replicas that are loaded equally
+# courier_id -> monotonic time until which its reads go to the primary, in the order of the time,
+# as the window is the same for all of them
+_pinned: Dict[int, float] = {}
+
+# errors meaning the replica or the connection to it is lost, not that the query is wrong
+_REPLICA_ERRORS = (aiomysql.OperationalError, aiomysql.InterfaceError, OSError, asyncio.TimeoutError)
+
+metrics.register_callback('db_replica_lag_seconds', 'Seconds the replicas are behind the primary, by replica, '
+                          '-1 while unknown.', 'gauge', ('replica',),
+                          lambda: [((x.name,), -1 if x.lag is None else x.lag) for x in replicas])
+
+
+async def init_replicas(app: web.Application):
+    """
+    on_startup hook of the application, connects to the read replicas of cfg.DB_REPLICAS and starts checking their lag.
+    A replica that is unreachable is only logged, it`s connected to by the checks that follow.
+    :param app: application that is being started
+    """
+    global replicas, _replica_monitor
+    replicas = [_Replica(host, port) for host, port in cfg.DB_REPLICAS]
+    if not replicas:
+        return
+    await asyncio.gather(*(_check_replica(x) for x in replicas))
+    _replica_monitor = asyncio.ensure_future(_monitor_replicas())
+    logging.info('init_replicas: %s of %s replicas are healthy', sum(x.healthy() for x in replicas), len(replicas))
+
+
+async def close_replicas(app: web.Application):
+    """
+    on_cleanup hook of the application, stops checking the replicas and closes their pools.
+    :param app: application that is being shut down
+    """
+    global replicas, _replica_monitor
+    if _replica_monitor is not None:
+        _replica_monitor.cancel()
+        _replica_monitor = None
+    for replica in replicas:
+        if replica.pool is not None:
+            replica.pool.close()
+            await replica.pool.wait_closed()
+    replicas = []
+    _pinned.clear()
+
+
+async def _monitor_replicas():
+    while True:
+        await asyncio.sleep(cfg.DB_REPLICA_CHECK_INTERVAL)
+        await asyncio.gather(*(_check_replica(x) for x in replicas))
+
+
+async def _check_replica(replica: _Replica):
+    """
+    Updates the lag of the replica, connects to it first if it isn`t connected yet.
+    """
+    try:
+        if replica.pool is None:
+            replica.pool = await _create_pool(replica.host, replica.port, 1, cfg.DB_REPLICA_POOL_MAXSIZE)
+        async with acquire(replica.pool) as conn:
+            cur = await conn.cursor()
+            try:
+                await cur.execute(replica.status_query)
+            except aiomysql.ProgrammingError:
+                replica.status_query = 'SHOW SLAVE STATUS'
+                await cur.execute(replica.status_query)
+            status = await cur.fetchone()
+    except (aiomysql.Error, OSError, asyncio.TimeoutError) as error:
+        if replica.reachable:
+            logging.warning('_check_replica: replica %s is unavailable: %s', replica.name, error)
+        replica.reachable = False
+        replica.lag = None
+        return
+    if not replica.reachable:
+        logging.info('_check_replica: replica %s is available again', replica.name)
+    replica.reachable = True
+    lag = None
+    if status is not None:
+        lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    if lag is None and replica.lag is not None:
+        logging.warning('_check_replica: replication to %s is not running', replica.name)
+    elif lag is not None and lag > cfg.DB_REPLICA_MAX_LAG >= (replica.lag or 0):
+        logging.warning('_check_replica: replica %s is %s s behind the primary, not reading from it', replica.name, lag)
+    replica.lag = lag
+
+
+def _pin(courier_ids: Iterable[int]):
+    """
+    Sends the reads of the couriers to the primary for cfg.DB_READ_YOUR_WRITES_WINDOW seconds after they were written,
+    so a client never reads its write back from a replica that hasn`t replayed it yet.
+    """
+    if not replicas:
+        return
+    now = time.monotonic()
+    until = now + cfg.DB_READ_YOUR_WRITES_WINDOW
+    for courier_id in courier_ids:
+        _pinned.pop(courier_id, None)  # moved to the end, keeping the order of the time
+        _pinned[courier_id] = until
+    while _pinned:
+        oldest = next(iter(_pinned))
+        if _pinned[oldest] > now:
+            break
+        del _pinned[oldest]
+
+
+def _written(courier_ids: Iterable[int]):
+    """
+    Updates the in-process state after the writes of the couriers are committed.
+    """
+    courier_ids = list(courier_ids)
+    cache.profiles.invalidate(courier_ids)
+    _pin(courier_ids)
+
+
+def _replica_for(courier_id: Optional[int]) -> Optional[_Replica]:
+    """
+    :return: the least loaded healthy replica, None if there is none or the courier is pinned to the primary
+    """
+    if _pinned.get(courier_id, 0) > time.monotonic():
+        return None
+    healthy = [x for x in replicas if x.healthy()]
+    if not healthy:
+        return None
+    turn = next(_replica_turn) % len(healthy)
+    return min(healthy[turn:] + healthy[:turn], key=_Replica.load)  # min keeps the first of the equally loaded ones
+
+
+async def _read(courier_id: Optional[int], read: Callable[[aiomysql.Cursor], Awaitable], primary: bool = True):
+    """
+    Runs the read on a replica, or on the primary if no replica can be read from or the read failed on it.
+    :param courier_id: courier the read is about, its reads go to the primary for a while after it was written
+    :param read: coroutine function taking a cursor, it must not write anything
+    :param primary: False to return None instead of reading from the primary
+    :return: what the read returned
+    """
+    replica = _replica_for(courier_id)
+    if replica is not None:
+        try:
+            async with acquire(replica.pool) as conn:
+                result = await read(await conn.cursor())
+        except _REPLICA_ERRORS as error:
+            replica.fail(error)
+            metrics.db_retries.labels('replica').inc()
+        else:
+            metrics.db_reads.labels('replica').inc()
+            return result
+    if not primary:
+        return None
+    async with acquire() as conn:
+        result = await read(await conn.cursor())
+    metrics.db_reads.labels('primary').inc()
+    return result
+
+
+async def init_matching_index(app: web.Application):
+    """
+    on_startup hook of the application, loads the index of open orders and starts its periodic refresh,
+    which picks up the orders changed by other instances of the app.
+    :param app: application that is being started
+    """
+    if not cfg.MATCHING_INDEX_ENABLED:
+        return
+    await rebuild_matching_index()
+    if cfg.MATCHING_INDEX_REFRESH_INTERVAL:
+        app['matching_index_refresher'] = asyncio.ensure_future(_refresh_matching_index())
+
+
+async def stop_matching_index(app: web.Application):
+    """
+    on_cleanup hook of the application, stops the periodic refresh of the index of open orders.
+    :param app: application that is being shut down
+    """
+    refresher = app.get('matching_index_refresher')
+    if refresher is not None:
+        refresher.cancel()
+
+
+async def rebuild_matching_index():
+    """
+    Reloads the index of open orders from the DB, changes made by this process meanwhile are replayed over the snapshot.
+    """
+    matching.index.begin_rebuild()
+    try:
+        async with acquire() as conn:
+            cur = await conn.cursor()
+            orders = await _select_open_orders(cur)
+    except BaseException:
+        matching.index.abort_rebuild()
+        raise
+    matching.index.finish_rebuild(orders)
+    logging.info('rebuild_matching_index: loaded %s open orders', len(orders))
+
+
+async def _refresh_matching_index():
+    while True:
+        await asyncio.sleep(cfg.MATCHING_INDEX_REFRESH_INTERVAL)
+        try:
+            await rebuild_matching_index()
+        except Exception as error:
+            logging.error('_refresh_matching_index: failed to rebuild the index: %s', error)
+
+
+_rebuild_task = None
+
+
+def _schedule_matching_index_rebuild():
+    """
+    Starts rebuilding the index in background unless it`s already being rebuilt.
+    """
+    global _rebuild_task
+    if _rebuild_task is None or _rebuild_task.done():
+        _rebuild_task = asyncio.ensure_future(rebuild_matching_index())
+
+
+def _matching_index_stale() -> bool:
+    """
+    :return: True if the index is known to miss changes, i.e. a rebuild scheduled on a lost claim is pending
+    """
+    return _rebuild_task is not None and not _rebuild_task.done()
+
+
+async def _select_open_orders(cur: aiomysql.Cursor, order_ids: Optional[List[int]] = None) -> List[matching.OpenOrder]:
+    """
+    :param order_ids: ids of the orders to be looked up, all open orders are selected if it`s None
+    :return: orders that are neither completed nor assigned, with their delivery hours
+    """
+    condition = 'orders.is_completed = 0 AND orders.assigned_courier_id IS NULL'
+    if order_ids is not None:
+        if not order_ids:
+            return []
+        condition += f' AND orders.order_id IN ({", ".join(["%s"] * len(order_ids))})'
+    await cur.execute(f'''SELECT orders.order_id, orders.weight, orders.region, dhof.start_minute, dhof.stop_minute
+        FROM orders JOIN delivery_hours_of_orders AS dhof ON dhof.order_id = orders.order_id WHERE {condition}''',
+                      order_ids)
+    orders = {}
+    for row in await cur.fetchall():
+        if row['order_id'] not in orders:
+            orders[row['order_id']] = matching.OpenOrder(row['order_id'], row['weight'], row['region'], [])
+        orders[row['order_id']].windows.append((row['start_minute'], row['stop_minute']))
+    return list(orders.values())
+
+
+async def _reserve_index_candidates(cur: aiomysql.Cursor, courier_data: Dict, max_weight: int,
+                                    reserved: List[matching.OpenOrder]) -> List[matching.OpenOrder]:
+    """
+    Finds the orders for the new assignment of the courier in the index of open orders and takes them out of it,
+    so no other assignment of this process is offered them. The index is only a hint, they are still to be claimed.
+    :param courier_data: row of the courier from the table couriers
+    :param max_weight: carrying capacity of the courier
+    :param reserved: the orders taken out are appended to it, so they are put back if the transaction fails
+    before it`s known which of them are claimed
+    :return: orders that can be assigned to the courier, they are to be put back to the index if they aren`t claimed
+    """
+    courier_id = courier_data['courier_id']
+    await cur.execute('SELECT region FROM couriers_regions WHERE courier_id = %s', (courier_id,))
+    regions = [x['region'] for x in await cur.fetchall()]
+    await cur.execute('SELECT start_minute, stop_minute FROM couriers_working_hours WHERE courier_id = %s', (courier_id,))
+    hours = [(x['start_minute'], x['stop_minute']) for x in await cur.fetchall()]
+
+    candidates = matching.index.candidates(regions, max_weight, hours)
+    for order in candidates:
+        matching.index.discard(order.order_id)
+        reserved.append(order)
+    return candidates
+
+
+async def _claim_orders(cur: aiomysql.Cursor, order_ids: List[int]) -> Set[int]:
+    """
+    Locks the chosen orders that are still open. Rows locked by concurrent assignments are skipped instead of waited for,
+    so assignments of couriers with overlapping regions don`t queue up behind each other.
+    :return: ids of the locked orders, they can be assigned in this transaction
+    """
+    if not order_ids:
+        return set()
+    await cur.execute(f'''SELECT order_id FROM orders WHERE order_id IN ({", ".join(["%s"] * len(order_ids))})
+        AND is_completed = 0 AND assigned_courier_id IS NULL FOR UPDATE SKIP LOCKED''', order_ids)
+    return {x['order_id'] for x in await cur.fetchall()}
+
+
+async def _claim_missed_orders(cur: aiomysql.Cursor, courier_data: Dict, max_weight: int,
+                               candidates: List[matching.OpenOrder], claimed: Set[int],
+                               reserved: List[matching.OpenOrder]) -> Set[int]:
+    """
+    Checks a partial result of the index, or any result of a stale one, against the DB. The index misses the orders
+    written by another instance of the app or directly to the DB until it`s rebuilt, the query finds them,
+    so they are claimed within the capacity left and the index is rebuilt.
+    :param candidates: orders the index offered to the courier
+    :param claimed: ids of the orders already claimed for the assignment
+    :param reserved: the orders of the index claimed here are appended to it, see _assign_orders
+    :return: ids of the orders claimed here
+    """
+    weights = {x.order_id: x.weight for x in candidates}
+    room = max_weight - sum(weights[x] for x in claimed)
+    missed = [(x['order_id'], x['weight']) for x in await _select_assignable_orders(cur, courier_data)
+              if x['order_id'] not in claimed]
+    extra = await _claim_orders(cur, solver.select_orders(missed, room))
+    for order_id in extra:
+        order = matching.index.discard(order_id)
+        if order is not None:
+            reserved.append(order)  # left out by the solver before, it fits the capacity left now
+    if extra - weights.keys():
+        logging.warning('_claim_missed_orders: %s open orders were missing from the index, rebuilding the index',
+                        len(extra - weights.keys()))
+        _schedule_matching_index_rebuild()
+    return extra
+
+
+async def _select_existing_ids(cur: aiomysql.Cursor, table: str, id_column: str, ids: List[int]) -> Set[int]:
+    """
+    Looks up which of the ids are already present in the table, in chunks of cfg.DB_LOOKUP_CHUNK_SIZE ids per query.
+    """
+    existing = set()
+    for start in range(0, len(ids), cfg.DB_LOOKUP_CHUNK_SIZE):
+        chunk = ids[start:start + cfg.DB_LOOKUP_CHUNK_SIZE]
+        await cur.execute(f'SELECT {id_column} FROM {table} WHERE {id_column} IN ({", ".join(["%s"] * len(chunk))})',
+                          chunk)
+        existing.update(x[id_column] for x in await cur.fetchall())
+    return existing
+
+
+async def _insert_couriers(cur: aiomysql.Cursor, valid: List[tuple]):
+    """
+    Writes validated couriers with one multi-row INSERT per table
+    (aiomysql splits them into several statements only if they exceed its max_stmt_length).
+    :param valid: list of (index, values) returned by validation.validate_batch
+    """
+    await cur.executemany('INSERT INTO couriers (courier_id, courier_type) VALUES (%s, %s)',
+                          [(row[0], row[1]) for _, row in valid])
+    await cur.executemany('INSERT INTO couriers_regions (courier_id, region) VALUES (%s, %s)',
+                          [(row[0], region) for _, row in valid for region in row[2]])
+    await cur.executemany('INSERT INTO couriers_working_hours (courier_id, start_minute, stop_minute) '
+                          'VALUES (%s, %s, %s)',
+                          [(row[0], start, stop) for _, row in valid for start, stop in row[3]])
+
+
+async def _insert_orders(cur: aiomysql.Cursor, valid: List[tuple]):
+    """
+    Writes validated orders with one multi-row INSERT per table, see _insert_couriers.
+    :param valid: list of (index, values) returned by validation.validate_batch
+    """
+    await cur.executemany('INSERT INTO orders (order_id, weight, region, is_completed) VALUES (%s, %s, %s, %s)',
+                          [(row[0], row[1], row[2], 0) for _, row in valid])
+    await cur.executemany('INSERT INTO delivery_hours_of_orders (order_id, start_minute, stop_minute) '
+                          'VALUES (%s, %s, %s)',
+                          [(row[0], start, stop) for _, row in valid for start, stop in row[3]])
+
+
+async def _read_validated_batches(batches: AsyncIterable[List], validator: Callable[[object], tuple],
+                                  id_key: str) -> List[tuple]:
+    """
+    Reads the whole body streamed from the request and validates it batch by batch, before a connection is acquired,
+    so a slow client holds no transaction open and a malformed body is found before anything is written.
+    Only the ids and the validated rows of the items are kept, an id is valid only in its first occurrence
+    in the whole request.
+    :param id_key: name of the id in the items
+    :return: (ids, valid, invalid) of every batch, see _write_batches
+    :raise streaming.StreamFormatError: if the body is malformed
+    :raise streaming.StreamTimeoutError: if the client stops sending the body
+    """
+    seen_ids = set()
+    validated = []
+    async for items in batches:
+        valid, invalid = validation.validate_batch(items, validator, seen_ids)
+        validated.append((validation.ids_at(items, id_key, range(len(items))), valid, invalid))
+    return validated
+
+
+async def _write_batches(cur: aiomysql.Cursor, batches: List[tuple], insert: Callable, table: str,
+                         id_key: str, all_ids: List, history_table: Optional[str] = None) -> (List[tuple], List):
+    """
+    Writes the validated batches one after another in the transaction of the cursor.
+    If the insert of a batch fails on an id already present in the table, the batch is rolled back to the savepoint
+    made before it, those ids are looked up and the rest of the batch is written again.
+    :param batches: (ids, valid, invalid) of the lists of items from the request, in its order: ids of all the items
+    of the batch, see validation.ids_at, and the result of validation.validate_batch
+    :param insert: _insert_couriers or _insert_orders
+    :param table: table the ids of the items are the primary key of, named the same as id_key
+    :param id_key: name of the id in the items
+    :param all_ids: ids of all items read from the request are appended to it
+    :param history_table: table the items are archived to, their ids can`t be registered again either,
+    the ids of every batch are looked up there before it`s written
+    :return: tuple of the list of the values of written items and the list of ids of invalid items, in the order of the request
+    """
+    written = []
+    invalid_ids = []
+    for ids, valid, invalid in batches:
+        all_ids.extend(ids)
+        invalid = list(invalid)  # the batches are written again by the retries of the transaction
+        logging.debug('_write_batches: %s %s are valid, %s are not', len(valid), table, len(invalid))
+        if history_table is not None and valid:
+            archived = await _select_existing_ids(cur, history_table, id_key, [row[0] for _, row in valid])
+            if archived:
+                invalid.extend(i for i, row in valid if row[0] in archived)
+                valid = [(i, row) for i, row in valid if row[0] not in archived]
+        await cur.execute('SAVEPOINT ingested_batch')
+        try:
+            await insert(cur, valid)
+        except aiomysql.IntegrityError as error:
+            # the only constraint not checked by the validation is uniqueness of the ids among the registered items,
+            # so those are looked up and the rest of the batch is written again
+            logging.debug('_write_batches: bulk insert failed: %s, looking up registered ids', error)
+            await cur.execute('ROLLBACK TO SAVEPOINT ingested_batch')
+            metrics.db_retries.labels('registered_ids').inc()
+            existing = await _select_existing_ids(cur, table, id_key, [row[0] for _, row in valid])
+            invalid.extend(i for i, row in valid if row[0] in existing)
+            valid = [(i, row) for i, row in valid if row[0] not in existing]
+            await insert(cur, valid)
+        written.extend(row for _, row in valid)
+        invalid_ids.extend(ids[i] for i in sorted(invalid))
+    return written, invalid_ids
+
+
+async def post_couriers_execute_queries(json_request: Dict) -> (bool, List):
     """
     A coroutine for the associated handler-coroutine that 'talks' to the DB.
+    The whole batch is validated before a transaction is opened, then all valid couriers are inserted
+    with a few multi-row INSERTs and a single commit.
     :param json_request: dict loaded from request via standard library, schema is specified in the docs
     :return: tuple of bool and list, bool indicates if everything was processed correctly, list is a list of couriers' ids
     that were processed correctly (if all of them were),
     otherwise it`s a tuple of couriers' ids during the processing of which errors were encountered
     """
-    logging.info(f'post_couriers_execute_queries: json_request={json_request} entered')
-    conn = await aiomysql.connect(host=cfg.DB_HOST, port=cfg.DB_PORT,
-                                  user=cfg.DB_USER, password=cfg.DB_PASSWORD,
-                                  db=cfg.DATABASE, cursorclass=aiomysql.DictCursor, autocommit=False)
-    # cursorclass=aiomysql.DictCursor: SELECT`s result will be presented in dicts
-    # each connection starts it`s own transaction so data can`t be corrupted
+    items = json_request['data']
+    logging.info('post_couriers_execute_queries: %s couriers in request, entered; payload: %s',
+                 len(items), logs.payload(json_request))
+    valid, invalid = validation.validate_batch(items, validation.COURIER)
+    if not valid:
+        logging.info('post_couriers_execute_queries: no valid couriers in request, returning')
+        return not invalid, validation.ids_at(items, 'courier_id', invalid)
+    return await _post_couriers([(validation.ids_at(items, 'courier_id', range(len(items))), valid, invalid)])
 
-    cur = await conn.cursor()
-    validation_error = []
-    ok = []
-    # every step of range is a new element with courier data, outer cycle is outside of try/except,
-    # so one invalid element won`t stop others from being processed
-    # the same is the reason to make validation of data here
-
-    required_data = {"courier_id", "courier_type", "regions", "working_hours"}
-
-    for courier in json_request['data']:
-        await conn.begin()
-        if set(courier.keys()) != required_data:  # validate keys of the dict with info about courier
-            logging.info(f'post_couriers_execute_queries: json_request={json_request}; '
-                         f'invalid data on courier id={courier["courier_id"]}')
-            validation_error.append(courier['courier_id'])
-            await conn.rollback()
-            continue
-        if type(courier["courier_id"]) is not int or type(courier["courier_type"]) is not str or type(
-                courier["regions"]) is not list or any(
-            (type(x) is not int for x in courier["regions"])) or type(courier["working_hours"]) is not list or any(
-            (type(x) is not str for x in courier["working_hours"])):
-            # this one might be a bit extra due to broad exception further,
-            # but from time to time it`ll save us some time because we won`t have to connect to the DB and lock the table
-            logging.info(
-                f'post_couriers_execute_queries: json_request={json_request}; invalid data on courier id={courier["courier_id"]}')
-            validation_error.append(courier['courier_id'])
-            await conn.rollback()
-            continue
 
-        logging.debug(
-            f'post_couriers_execute_queries: json_request={json_request}; data on courier id={courier["courier_id"]} '
-            f'has not been suspended, proceeding')
-        try:
-            await cur.execute("INSERT INTO couriers (courier_id, courier_type) VALUES "
-                              "(%s, %s);", (courier['courier_id'], courier['courier_type']))
-            logging.debug(
-                f'post_couriers_execute_queries: json_request={json_request}; inserted data on courier id={courier["courier_id"]} '
-                f'into table couriers')
-            for region in courier['regions']:
-                await cur.execute("INSERT INTO couriers_regions (courier_id, region) VALUES ('%s', %s)", (courier['courier_id'], region))
-            logging.debug(
-                f'post_couriers_execute_queries: json_request={json_request}; inserted data on courier id={courier["courier_id"]} '
-                f'into table couriers_regions')
-            for wh in courier['working_hours']:
-                ranges = wh.split('-')
-                start = ranges[0]
-                end = ranges[1]
-                await cur.execute('''INSERT INTO couriers_working_hours (courier_id, time_range_start, time_range_stop)
-                    VALUES ('%s', STR_TO_DATE(%s, '%%H:%%i'), STR_TO_DATE(%s, '%%H:%%i'))''', (courier['courier_id'], start, end))
-            logging.debug(
-                f'post_couriers_execute_queries: json_request={json_request}; inserted data on courier id={courier["courier_id"]} '
-                f'into table couriers_working_hours')
+async def post_couriers_stream_execute_queries(batches: AsyncIterable[List]) -> (bool, List):
+    """
+    post_couriers_execute_queries for the couriers streamed from the request, validated batch by batch as they are read,
+    then written in a single transaction.
+    :param batches: lists of couriers in the order of the request, see streaming.request_batches
+    :return: see post_couriers_execute_queries
+    :raise streaming.StreamFormatError: if the body of the request turns out to be malformed, nothing is written then
+    :raise streaming.StreamTimeoutError: if the client stops sending the body, nothing is written then
+    """
+    validated = await _read_validated_batches(batches, validation.COURIER, 'courier_id')
+    return await _post_couriers(validated)
 
-        except Exception as error:
-            # catches invalid value types and invalid formats,
-            # broad Exception is used to prevent status 500 on badly formed requests
-            # (e.g. injections, which might be split and then indexed incorrectly, raising IndexError)
-            logging.debug(
-                f'post_couriers_execute_queries: json_request={json_request}; during the processing of courier with id={courier["courier_id"]}'
-                f'an exception occurred: {error}')
-            validation_error.append(courier['courier_id'])
-            await conn.rollback()  # rollback to the state of last valid insertion
-        else:
-            logging.debug(f'post_couriers_execute_queries: json_request={json_request}; courier id={courier["courier_id"]} '
-                          f'is fulfilled successfully')
-            ok.append(courier['courier_id'])
-            await conn.commit()  # only data on valid couriers is saved
 
-    if validation_error:
-        logging.info(f'post_couriers_execute_queries: json_request={json_request}; request has invalid data in it, returning')
-        conn.close()
-        return False, validation_error
+async def _post_couriers(batches: List[tuple]) -> (bool, List):
+    """
+    :param batches: batches to write, see _write_batches
+    :return: see post_couriers_execute_queries
+    """
+    all_ids = []
+
+    async def work(cur: aiomysql.Cursor) -> tuple:
+        all_ids.clear()
+        return True, await _write_batches(cur, batches, _insert_couriers, 'couriers', 'courier_id', all_ids)
+
+    try:
+        written, invalid = await _transaction('post_couriers', work)  # only valid couriers are saved
+    except DBUnavailable:
+        raise
+    except Exception as error:
+        # broad Exception is used to prevent status 500 on badly formed requests
+        logging.info('post_couriers_execute_queries: an exception occurred: %s, rolled back', error)
+        return False, all_ids
+    _written(row[0] for row in written)
+
+    if invalid:
+        logging.info('post_couriers_execute_queries: request has invalid data in it, returning')
+        return False, invalid
     else:
-        logging.info(f'post_couriers_execute_queries: json_request={json_request}; request has been fulfilled successfully, returning')
-        conn.close()
-        return True, ok
+        logging.info('post_couriers_execute_queries: request has been fulfilled successfully, returning')
+        return True, [row[0] for row in written]
+
+
+async def _replace_regions(cur: aiomysql.Cursor, courier_id: int, regions: List[int]) -> bool:
+    """
+    Makes the regions of the courier the passed ones, only the regions that changed are deleted or inserted.
+    :return: True if any region was removed, so the assigned orders have to be checked
+    """
+    await cur.execute('SELECT relation_id, region FROM couriers_regions WHERE courier_id = %s', (courier_id,))
+    stored = await cur.fetchall()
+    new = set(regions)
+    removed = [x['relation_id'] for x in stored if x['region'] not in new]
+    added = new - {x['region'] for x in stored}
+    if removed:
+        await cur.execute(f'DELETE FROM couriers_regions WHERE relation_id IN ({", ".join(["%s"] * len(removed))})',
+                          removed)
+    if added:
+        await cur.executemany('INSERT INTO couriers_regions (courier_id, region) VALUES (%s, %s)',
+                              [(courier_id, region) for region in sorted(added)])
+    return bool(removed)
+
+
+async def _replace_working_hours(cur: aiomysql.Cursor, courier_id: int, working_hours: List[tuple]) -> bool:
+    """
+    Makes the working hours of the courier the passed ones, only the ranges that changed are deleted or inserted.
+    :param working_hours: list of (start_minute, stop_minute)
+    :return: True if any range was removed, so the assigned orders have to be checked
+    """
+    await cur.execute('SELECT relation_id, start_minute, stop_minute FROM couriers_working_hours WHERE courier_id = %s',
+                      (courier_id,))
+    stored = await cur.fetchall()
+    new = set(working_hours)
+    removed = [x['relation_id'] for x in stored if (x['start_minute'], x['stop_minute']) not in new]
+    added = new - {(x['start_minute'], x['stop_minute']) for x in stored}
+    if removed:
+        await cur.execute(f'''DELETE FROM couriers_working_hours
+            WHERE relation_id IN ({", ".join(["%s"] * len(removed))})''', removed)
+    if added:
+        await cur.executemany('INSERT INTO couriers_working_hours (courier_id, start_minute, stop_minute) '
+                              'VALUES (%s, %s, %s)', [(courier_id, start, stop) for start, stop in sorted(added)])
+    return bool(removed)
+
+
+async def _deassign_ineligible_orders(cur: aiomysql.Cursor, courier_id: int, courier_type: Optional[str],
+                                      regions: Optional[List[int]], working_hours: Optional[List[tuple]]) -> int:
+    """
+    De-assigns the open orders of the courier that it can`t deliver after the patch, with a single UPDATE.
+    Only the changed fields are checked, None stands for a field that can`t make an order ineligible.
+    :return: number of de-assigned orders
+    """
+    conditions = []
+    args = [courier_id]
+    if courier_type is not None:
+        conditions.append('orders.weight > (SELECT max_weight FROM weights WHERE courier_type = %s)')
+        args.append(courier_type)
+    if regions is not None:
+        if regions:
+            conditions.append(f'orders.region NOT IN ({", ".join(["%s"] * len(regions))})')
+            args.extend(regions)
+        else:
+            conditions.append('TRUE')
+    if working_hours is not None:
+        # time ranges are half-open, so the ones that only touch each other don`t overlap
+        overlaps = ' OR '.join(['(dhof.start_minute < %s AND %s < dhof.stop_minute)'] * len(working_hours)) or 'FALSE'
+        conditions.append(f'''NOT EXISTS (SELECT 1 FROM delivery_hours_of_orders AS dhof
+            WHERE dhof.order_id = orders.order_id AND ({overlaps}))''')
+        args.extend(x for start, stop in working_hours for x in (stop, start))
+    if not conditions:
+        return 0
+    await cur.execute(f'''UPDATE orders SET orders.assigned_courier_id = NULL, orders.assignment_id = NULL
+        WHERE orders.is_completed = 0 AND orders.assigned_courier_id = %s AND ({" OR ".join(conditions)})''', args)
+    return cur.rowcount
+
+
+async def _deassign_over_capacity(cur: aiomysql.Cursor, courier_id: int, courier_type: str) -> int:
+    """
+    De-assigns the open orders of the courier its new type can`t carry together: the ones left assigned are chosen
+    by the solver within the carrying capacity of the type, as for a new assignment.
+    :return: number of de-assigned orders
+    """
+    await cur.execute('SELECT order_id, weight FROM orders WHERE assigned_courier_id = %s AND is_completed = 0 '
+                      'ORDER BY order_id', (courier_id,))
+    assigned = await cur.fetchall()
+    await cur.execute('SELECT max_weight FROM weights WHERE courier_type = %s', (courier_type,))
+    weight = await cur.fetchone()
+    max_weight = weight['max_weight'] if weight else 0
+    kept = set(solver.select_orders([(x['order_id'], x['weight']) for x in assigned], max_weight))
+    dropped = [x['order_id'] for x in assigned if x['order_id'] not in kept]
+    if dropped:
+        await cur.execute(f'''UPDATE orders SET assigned_courier_id = NULL, assignment_id = NULL
+            WHERE order_id IN ({", ".join(["%s"] * len(dropped))})''', dropped)
+    return len(dropped)
 
 
 async def patch_couriers_id_execute_queries(courier_id: str, json_request: Dict) -> (bool, Dict):
     """
     A coroutine for the associated handler-coroutine that 'talks' to the DB.
+    Regions and working hours are compared with the stored ones and only the changes are written,
+    then the orders of the current assignment the courier can`t deliver anymore, or can`t carry together
+    after its type changed, are de-assigned.
     :param courier_id: id of the courier retrieved from the URI
     :param json_request: dict with data to change to
     :return: tuple of bool and dict, bool indicates if everything was processed correctly,
     dict is a dict with all data on the updates courier
     """
-    logging.info(msg='patch_couriers_id_execute_queries: entered')
-    conn = await aiomysql.connect(host=cfg.DB_HOST, port=cfg.DB_PORT,
-                                  user=cfg.DB_USER, password=cfg.DB_PASSWORD,
-                                  db=cfg.DATABASE, cursorclass=aiomysql.DictCursor, autocommit=False)
-    # cursorclass=aiomysql.DictCursor: SELECT`s result will be presented in dicts
-    # each connection starts it`s own transaction so data can`t be corrupted
-
-    cur = await conn.cursor()
-    logging.debug(msg='patch_couriers_id_execute_queries: created connection and cursor')
+    logging.info('patch_couriers_id_execute_queries: entered')
+    courier_id = int(courier_id)
     try:
-        await conn.begin()
-        logging.debug(msg='patch_couriers_id_execute_queries: started transaction')
-        if 'courier_type' in json_request:
-            logging.debug(msg='patch_couriers_id_execute_queries: started to change courier_type')
-            await cur.execute('''UPDATE orders SET orders.assigned_courier_id = NULL, orders.assignment_id = NULL 
-            WHERE orders.weight > (SELECT max_weight FROM weights WHERE courier_type = %s) AND orders.is_completed = 0 
-            AND orders.assigned_courier_id = %s''',
-                              (json_request['courier_type'], courier_id))
-            await cur.execute('''UPDATE couriers SET courier_type = %s WHERE courier_id = %s''', (json_request['courier_type'], courier_id))
-            logging.debug(msg='patch_couriers_id_execute_queries: finished to change courier_type')
-
-        if 'regions' in json_request:
-            logging.debug(msg='patch_couriers_id_execute_queries: started to change regions')
-            await cur.execute('''DELETE FROM couriers_regions WHERE courier_id = %s''', (courier_id,))
-            await cur.executemany('''INSERT INTO couriers_regions (courier_id, region) VALUES (%s, %s)''',
-                                  tuple((courier_id, i) for i in json_request['regions']))
-            logging.debug(msg='patch_couriers_id_execute_queries: inserted new regions data')
-
-            await cur.execute('''UPDATE orders SET orders.assigned_courier_id = NULL, orders.assignment_id = NULL 
-                        WHERE region NOT IN (SELECT couriers_regions.region FROM couriers_regions WHERE courier_id = %s) 
-                        AND is_completed = 0 AND assigned_courier_id = %s''',
-                              (courier_id, courier_id))
-            logging.debug(msg='patch_couriers_id_execute_queries: de-assigned inappropriate deliveries')
-            logging.debug(msg='patch_couriers_id_execute_queries: finished to change regions')
-
-        if 'working_hours' in json_request:
-            logging.debug(msg='patch_couriers_id_execute_queries: started to change working hours')
-            await cur.execute('''DELETE FROM couriers_working_hours WHERE courier_id = %s''', (courier_id,))
-            await cur.executemany('''INSERT INTO couriers_working_hours (courier_id, time_range_start, time_range_stop)
-                                     VALUES (%s, STR_TO_DATE(%s, '%%H:%%i'), STR_TO_DATE(%s, '%%H:%%i'))''',
-                                  tuple((courier_id, *i.split('-')) for i in json_request['working_hours']))
-            logging.debug(f'patch_couriers_id_execute_queries: updated couriers_working_hours')
-
-            await cur.execute('''UPDATE orders SET orders.assigned_courier_id = NULL,
-            orders.assignment_id = NULL WHERE orders.order_id NOT IN
-                (SELECT DISTINCT dhof.order_id FROM (SELECT * FROM couriers_working_hours WHERE courier_id=%s) as cwh,
-                    delivery_hours_of_orders as dhof WHERE
-                        cwh.time_range_start <= dhof.time_range_start AND dhof.time_range_start <= cwh.time_range_stop AND
-                        cwh.time_range_stop <= dhof.time_range_stop OR
-                        cwh.time_range_start <= dhof.time_range_start AND dhof.time_range_start <= dhof.time_range_stop AND
-                        dhof.time_range_stop <= cwh.time_range_stop OR
-                        dhof.time_range_start <= cwh.time_range_start AND cwh.time_range_start <= dhof.time_range_stop AND
-                        dhof.time_range_stop <= cwh.time_range_stop OR
-                        dhof.time_range_start <= cwh.time_range_start AND cwh.time_range_start <= cwh.time_range_stop AND
-                        cwh.time_range_stop <= dhof.time_range_stop) AND
-                orders.assignment_id = (SELECT current_assignment_id FROM couriers WHERE courier_id = %s);''',
-                              (courier_id, courier_id))
-            logging.debug(f'patch_couriers_id_execute_queries: updated orders')
-
-            ids = await cur.fetchall()
-
-            await cur.executemany('''UPDATE orders SET assignment_id = (SELECT current_assignment_id FROM couriers WHERE courier_id = %s), 
-            assigned_courier_id = %s WHERE order_id = %s''',
-                                  tuple((courier_id, courier_id, x['order_id']) for x in ids))
-            # TODO: it's rather ineffective, I should think about optimizing it
-            logging.debug(msg='patch_couriers_id_execute_queries: finished to change working hours')
-
-            await cur.execute("SELECT order_id, assignment_id FROM orders WHERE assignment_id ="
-                              " (SELECT current_assignment_id FROM couriers WHERE courier_id = %s) AND is_completed = 0",
+        patch = validation.COURIER_PATCH(json_request)
+    except validation.ValidationError as error:
+        logging.info('patch_couriers_id_execute_queries: invalid patch: %s', error)
+        return False, {}
+    courier_type = patch.get('courier_type')
+    regions = patch.get('regions')
+    working_hours = patch.get('working_hours')
+
+    deassigned = []
+
+    async def work(cur: aiomysql.Cursor) -> tuple:
+        deassigned.clear()
+        # the lock on the courier keeps its assignment from being changed concurrently
+        await cur.execute('SELECT courier_type, current_assignment_id FROM couriers WHERE courier_id = %s FOR UPDATE',
+                          (courier_id,))
+        courier = await cur.fetchone()
+        if courier is None:
+            logging.info('patch_couriers_id_execute_queries: courier %s not found', courier_id)
+            return False, False
+        assigned = []
+        if cfg.MATCHING_INDEX_ENABLED and courier['current_assignment_id'] is not None:
+            # orders de-assigned by the patch become open again and have to be put back to the index
+            await cur.execute('SELECT order_id FROM orders WHERE assigned_courier_id = %s AND is_completed = 0',
                               (courier_id,))
+            assigned = [x['order_id'] for x in await cur.fetchall()]
+
+        # only the fields that narrowed down what the courier can deliver are checked against its orders
+        changed_type = changed_regions = changed_hours = None
+        if courier_type is not None and courier_type != courier['courier_type']:
+            await cur.execute('UPDATE couriers SET courier_type = %s WHERE courier_id = %s', (courier_type, courier_id))
+            changed_type = courier_type
+        if regions is not None and await _replace_regions(cur, courier_id, regions):
+            changed_regions = regions
+        if working_hours is not None and await _replace_working_hours(cur, courier_id, working_hours):
+            changed_hours = working_hours
 
-            data = await cur.fetchall()
-            if not data:
-                logging.info(f'patch de-assigned all remaining orders of courier {courier_id}, setting current_assignment_id to NULL')
-                # checking if assignment is empty after changes
-                await cur.execute("UPDATE couriers SET current_assignment_id = NULL WHERE courier_id = %s",
-                                  (courier_id,))
+        if courier['current_assignment_id'] is not None:
+            count = await _deassign_ineligible_orders(cur, courier_id, changed_type, changed_regions, changed_hours)
+            if changed_type is not None:
+                count += await _deassign_over_capacity(cur, courier_id, changed_type)
+            logging.debug('patch_couriers_id_execute_queries: de-assigned %s orders', count)
+            if count:
+                # the orders delivered before the patch finish the assignment if none is left to deliver
+                await _credit_finished_assignment(cur, courier['current_assignment_id'])
+                await cur.execute('''UPDATE couriers SET current_assignment_id = NULL WHERE courier_id = %s
+                    AND NOT EXISTS (SELECT 1 FROM orders WHERE orders.assignment_id = %s AND orders.is_completed = 0)''',
+                                  (courier_id, courier['current_assignment_id']))
+                if cur.rowcount:
+                    logging.info('patch de-assigned all remaining orders of courier %s, '
+                                 'setting current_assignment_id to NULL', courier_id)
+                deassigned.extend(await _select_open_orders(cur, assigned))
+        return True, True
 
+    try:
+        found = await _transaction('patch_courier', work)
+    except DBUnavailable:
+        raise
     except Exception as error:
-        await conn.rollback()
-        conn.close()
-        logging.info(msg=f'patch_couriers_id_execute_queries: an error occurred: {error}, rolled back')
+        logging.info('patch_couriers_id_execute_queries: an error occurred: %s, rolled back', error)
         return False, {}
-    else:
-        await conn.commit()
-        logging.info(msg='patch_couriers_id_execute_queries: patch is finished successfully, returning info')
-        await cur.execute('''SELECT * FROM couriers WHERE courier_id = %s''', (courier_id,))
-        id_type = await cur.fetchall()
-        await cur.execute('''SELECT region FROM couriers_regions WHERE courier_id = %s''', (courier_id,))
-        regions = await cur.fetchall()
-        await cur.execute('''SELECT time_range_start, time_range_stop FROM couriers_working_hours WHERE courier_id = %s''', (courier_id,))
-        working_hours = await cur.fetchall()
-        conn.close()
-        return True, {"courier_id": int(courier_id), "courier_type": id_type[0]['courier_type'], "regions": [x['region'] for x in regions],
-                      "working_hours": [str(z['time_range_start'])[:-3] + '-' + str(z['time_range_stop'])[:-3] for z in working_hours]}
+    if not found:
+        return False, {}
+    for order in deassigned:
+        matching.index.add(order)
+    _written((courier_id,))
+    logging.info('patch_couriers_id_execute_queries: patch is finished successfully, returning info')
+    # the profile read for the response is cached, so the next GET of the courier doesn`t query the DB
+    token = cache.profiles.token()
+    with _unavailable_on_errors('patch_couriers_id_execute_queries'):
+        profile = await _read(courier_id, lambda cur: _select_courier_profile(cur, courier_id))
+    if profile is None:
+        return False, {}
+    cache.profiles.put(courier_id, cache.make_profile(profile), token)
+    return True, {key: profile[key] for key in ('courier_id', 'courier_type', 'regions', 'working_hours')}
 
 
 async def post_orders_execute_queries(json_request: Dict) -> (bool, List[int]):
     """
     A coroutine for the associated handler-coroutine that 'talks' to the DB.
+    The whole batch is validated before a transaction is opened, then all valid orders are inserted
+    with a few multi-row INSERTs and a single commit.
     :param json_request: dict loaded from request via standard library, schema is specified in the docs
     :return: tuple of bool and list, bool indicates if everything was processed correctly, list is a list of orders' ids
     that were processed correctly (if all of them were),
     otherwise it`s a tuple of orders' ids during the processing of which errors were encountered
     """
-    logging.info(f'post_orders_execute_queries: json_request={json_request}; entered')
-    conn = await aiomysql.connect(host=cfg.DB_HOST, port=cfg.DB_PORT,
-                                  user=cfg.DB_USER, password=cfg.DB_PASSWORD,
-                                  db=cfg.DATABASE, cursorclass=aiomysql.DictCursor, autocommit=False)
-    cur = await conn.cursor()
-    validation_error = []
-    ok = []
-    required_data = {"order_id", "weight", "region", "delivery_hours"}
-
-    for order in json_request['data']:
-        await conn.begin()
-        if set(order.keys()) != required_data or type(order['order_id']) is not int or not (
-                type(order['weight']) is not float or type(order['weight']) is not int) or type(order['region']) is not int \
-                or type(order['delivery_hours']) is not list or any(type(x) is not str for x in order['delivery_hours']):
-            logging.info(f'post_orders_execute_queries: json_request={json_request}; invalid data on order id={order["order_id"]}')
-            validation_error.append(order['order_id'])
-            await conn.rollback()
-            continue
+    items = json_request['data']
+    logging.info('post_orders_execute_queries: %s orders in request, entered; payload: %s',
+                 len(items), logs.payload(json_request))
+    valid, invalid = validation.validate_batch(items, validation.ORDER)
+    if not valid:
+        logging.info('post_orders_execute_queries: no valid orders in request, returning')
+        return not invalid, validation.ids_at(items, 'order_id', invalid)
+    return await _post_orders([(validation.ids_at(items, 'order_id', range(len(items))), valid, invalid)])
 
-        logging.debug(
-            f'post_orders_execute_queries: json_request={json_request}; data on order id={order["order_id"]} '
-            f'has not been suspended, proceeding')
-        try:
-            await cur.execute('''INSERT INTO orders (order_id, weight, region, is_completed) VALUES (%s, %s, %s, %s)''',
-                              (order['order_id'], order['weight'], order['region'], 0))
-            logging.debug(
-                f'post_orders_execute_queries: json_request={json_request}; inserted into orders the order id={order["order_id"]}')
-            for dh in order['delivery_hours']:
-                ranges = dh.split('-')
-                start = ranges[0]
-                end = ranges[1]
-                await cur.execute('''INSERT INTO delivery_hours_of_orders (order_id, time_range_start, time_range_stop) VALUES 
-                (%s, STR_TO_DATE(%s, '%%H:%%i'), STR_TO_DATE(%s, '%%H:%%i'))''', (order['order_id'], start, end))
-            logging.debug(
-                f'post_orders_execute_queries: json_request={json_request}; inserted into delivery_hours_of_orders the order id={order["order_id"]}')
-        except Exception as error:
-            logging.debug(
-                f'post_orders_execute_queries: json_request={json_request}; during the processing of the order with id={order["order_id"]}'
-                f'an exception occurred: {error}')
-            validation_error.append(order['order_id'])
-            await conn.rollback()
 
-        else:
-            logging.debug(f'post_orders_execute_queries: json_request={json_request}; order id={order["order_id"]} '
-                          f'is fulfilled successfully')
-            ok.append(order['order_id'])
-            await conn.commit()
+async def post_orders_stream_execute_queries(batches: AsyncIterable[List]) -> (bool, List[int]):
+    """
+    post_orders_execute_queries for the orders streamed from the request, validated batch by batch as they are read,
+    then written in a single transaction.
+    :param batches: lists of orders in the order of the request, see streaming.request_batches
+    :return: see post_orders_execute_queries
+    :raise streaming.StreamFormatError: if the body of the request turns out to be malformed, nothing is written then
+    :raise streaming.StreamTimeoutError: if the client stops sending the body, nothing is written then
+    """
+    validated = await _read_validated_batches(batches, validation.ORDER, 'order_id')
+    return await _post_orders(validated)
 
-    if validation_error:
-        logging.info(f'post_orders_execute_queries: json_request={json_request}; request has invalid data in it, returning')
-        conn.close()
-        return False, validation_error
+
+async def _post_orders(batches: List[tuple]) -> (bool, List[int]):
+    """
+    :param batches: see _post_couriers
+    :return: see post_orders_execute_queries
+    """
+    all_ids = []
+
+    async def work(cur: aiomysql.Cursor) -> tuple:
+        all_ids.clear()
+        return True, await _write_batches(cur, batches, _insert_orders, 'orders', 'order_id', all_ids, 'orders_history')
+
+    try:
+        written, invalid = await _transaction('post_orders', work)
+    except DBUnavailable:
+        raise
+    except Exception as error:
+        logging.info('post_orders_execute_queries: an exception occurred: %s, rolled back', error)
+        return False, all_ids
+
+    for order_id, weight, region, hours in written:
+        if hours:
+            matching.index.add(matching.OpenOrder(order_id, weight, region, hours))
+
+    if invalid:
+        logging.info('post_orders_execute_queries: request has invalid data in it, returning')
+        return False, invalid
     else:
-        logging.info(f'post_orders_execute_queries: json_request={json_request}; request has been fulfilled successfully, returning')
-        conn.close()
-        return True, ok
+        logging.info('post_orders_execute_queries: request has been fulfilled successfully, returning')
+        return True, [row[0] for row in written]
+
+
+async def _select_assignable_orders(cur: aiomysql.Cursor, courier_data: Dict) -> List[Dict]:
+    """
+    Looks up the orders for the new assignment of the courier in the DB, used while the index isn`t loaded.
+    Nothing is locked here, only the orders chosen by the solver are claimed later.
+    :param courier_data: row of the courier from the table couriers
+    :return: list of dicts with order_id and weight
+    """
+    await cur.execute('''SELECT DISTINCT orders.order_id, orders.weight FROM couriers_working_hours AS cwh
+    JOIN delivery_hours_of_orders AS dhof
+        ON dhof.start_minute < cwh.stop_minute AND cwh.start_minute < dhof.stop_minute
+    JOIN orders ON orders.order_id = dhof.order_id
+    WHERE cwh.courier_id = %s AND orders.is_completed = 0 AND orders.assigned_courier_id IS NULL AND
+          orders.weight <= (SELECT max_weight FROM weights WHERE courier_type = %s) AND
+          orders.region IN (SELECT region FROM couriers_regions WHERE courier_id = %s)''',
+                      (courier_data['courier_id'], courier_data['courier_type'], courier_data['courier_id']))
+    # delivery windows overlapping the working hours are found by a range seek on the delivery_interval index,
+    # time ranges are half-open, so the ones that only touch each other don`t overlap
+
+    # these orders are not completed yet, have weight <= max_weight of the courier,
+    # their region is among the regions of the courier,
+    # their delivery hours overlap couriers' working hours, they are not assigned yet
+    return await cur.fetchall()
+
+
+async def _remaining_orders(cur: aiomysql.Cursor, assignment_id: int) -> Dict:
+    """
+    :return: {"orders": [{"id": int}], "assign_time": assignment_timestamp_str} of the orders of the assignment
+    that are not delivered yet
+    """
+    await cur.execute('''SELECT order_id FROM orders WHERE assignment_id = %s AND is_completed = 0''', (assignment_id,))
+    ids = await cur.fetchall()
+    await cur.execute('''SELECT assignment_timestamp FROM assignments WHERE assignment_id = %s''', (assignment_id,))
+    assignment_time = (await cur.fetchone())['assignment_timestamp']
+    return {'orders': [{'id': x['order_id']} for x in ids], 'assign_time': str(assignment_time.isoformat())}
+
+
+async def _select_current_assignment(cur: aiomysql.Cursor, courier_id: int) -> Optional[Dict]:
+    """
+    Reads the unfinished assignment of the courier without locking anything, see _remaining_orders.
+    :return: None if the courier is not found or has no current assignment
+    """
+    await cur.execute('SELECT current_assignment_id FROM couriers WHERE courier_id = %s', (courier_id,))
+    courier = await cur.fetchone()
+    if courier is None or courier['current_assignment_id'] is None:
+        return None
+    return await _remaining_orders(cur, courier['current_assignment_id'])
+
+
+async def _assign_orders(cur: aiomysql.Cursor, courier_id: int, reserved: List[matching.OpenOrder]) -> Optional[Dict]:
+    """
+    Creates the new assignment of the courier, or looks up the remaining orders of the current one, in the transaction
+    of the cursor. Orders are chosen by the solver, so their total weight fits the carrying capacity of the courier.
+    :param courier_id: id of the courier
+    :param reserved: orders taken out of the index of open orders are appended to it,
+    they are to be put back unless the transaction is committed
+    :return: ready-to-be-dumped info about assigned orders: {"orders": [{"id": int}], "assign_time": assignment_timestamp_str},
+    None if the courier is not found
+    """
+    # the lock on the courier keeps concurrent requests of the same courier from creating two assignments
+    await cur.execute('SELECT * FROM couriers WHERE courier_id = %s FOR UPDATE', (courier_id,))
+    courier_data = await cur.fetchone()
+    if not courier_data:
+        logging.info('_assign_orders: courier with id = %s not found', courier_id)
+        return None
+
+    cur_assignment = courier_data['current_assignment_id']
+    if cur_assignment is not None:
+        logging.info('_assign_orders: assignment of the courier %s is not finished yet, returning remaining orders', courier_id)
+        return await _remaining_orders(cur, cur_assignment)
+
+    logging.debug('_assign_orders: current assignment of the courier %s is None, looking up orders for the new one', courier_id)
+    await cur.execute('SELECT max_weight FROM weights WHERE courier_type = %s', (courier_data['courier_type'],))
+    weight = await cur.fetchone()
+    max_weight = weight['max_weight'] if weight else 0
+    use_index = matching.index.ready
+    if use_index:
+        candidates = await _reserve_index_candidates(cur, courier_data, max_weight, reserved)
+        chosen = solver.select_orders([(x.order_id, x.weight) for x in candidates], max_weight)
+    else:
+        candidates = await _select_assignable_orders(cur, courier_data)
+        chosen = solver.select_orders([(x['order_id'], x['weight']) for x in candidates], max_weight)
+
+    claimed = await _claim_orders(cur, chosen)
+    if use_index:
+        chosen_ids = set(chosen)
+        unclaimed = {x.order_id for x in candidates if x.order_id not in claimed}
+        reserved[:] = [x for x in reserved if x.order_id not in unclaimed]
+        for order in candidates:
+            if order.order_id in unclaimed and order.order_id not in chosen_ids:
+                matching.index.add(order)  # left out by the solver, so still open
+        stale = _matching_index_stale()
+        if len(claimed) != len(chosen):
+            # orders of this process are never claimed twice thanks to the reservation,
+            # so the rest was taken by another instance of the app or is not open at all
+            logging.warning('_assign_orders: %s orders of the index were not claimed, rebuilding the index',
+                            len(chosen) - len(claimed))
+            _schedule_matching_index_rebuild()
+        # the index of the only writer is complete, so an empty result is trusted unless the index is known to be stale
+        if len(claimed) < len(chosen) or stale:
+            claimed |= await _claim_missed_orders(cur, courier_data, max_weight, candidates, claimed, reserved)
+
+    if not claimed:
+        logging.info('_assign_orders: have found no appropriate orders for the courier %s', courier_id)
+        return {'orders': []}
+
+    logging.debug('_assign_orders: claimed %s orders for the courier %s, creating assignment', len(claimed), courier_id)
+    # the type is kept in the assignment, as it`s paid by the type the courier had when the orders were assigned
+    await cur.execute('''INSERT INTO assignments (courier_id, courier_type) VALUES (%s, %s)''',
+                      (courier_id, courier_data['courier_type']))
+    assignment_id = cur.lastrowid  # LAST_INSERT_ID() of this connection, not affected by concurrent assignments
+    await cur.execute('''UPDATE couriers SET current_assignment_id = %s WHERE courier_id = %s''', (assignment_id, courier_id))
+    await cur.execute(f'''UPDATE orders SET assignment_id = %s, assigned_courier_id = %s
+        WHERE order_id IN ({", ".join(["%s"] * len(claimed))})''', (assignment_id, courier_id, *claimed))
+
+    await cur.execute('''SELECT assignment_timestamp FROM assignments WHERE assignment_id = %s''', (assignment_id,))
+    assignment_time = (await cur.fetchone())['assignment_timestamp']
+    logging.info('_assign_orders: created new assignment of the courier %s', courier_id)
+    return {'orders': [{'id': x} for x in sorted(claimed)], 'assign_time': str(assignment_time.isoformat())}
+
+
+def _put_back(reserved: List[matching.OpenOrder]):
+    """
+    Returns the orders reserved by a transaction that was rolled back to the index of open orders.
+    """
+    for order in reserved:
+        matching.index.add(order)
+    reserved.clear()
 
 
 async def post_orders_assign_execute_queries(json_request: Dict) -> (bool, Dict):
@@ -280,100 +1223,256 @@ async def post_orders_assign_execute_queries(json_request: Dict) -> (bool, Dict)
     :return: tuple of bool and dict, bool indicates if everything was processed correctly,
     dict is a ready-to-be-dumped info about assigned orders: {"orders": [{"id": int}], "assign_time": assignment_timestamp_str}
     """
-    logging.info(f'post_orders_assign_execute_queries: json_request={json_request} entered')
-    conn = await aiomysql.connect(host=cfg.DB_HOST, port=cfg.DB_PORT,
-                                  user=cfg.DB_USER, password=cfg.DB_PASSWORD,
-                                  db=cfg.DATABASE, cursorclass=aiomysql.DictCursor, autocommit=False)
-    # cursorclass=aiomysql.DictCursor: SELECT`s result will be presented in dicts
-    # each connection starts it`s own transaction so data can`t be corrupted
+    try:
+        courier_id, = validation.ASSIGN(json_request)
+    except validation.ValidationError as error:
+        logging.info('post_orders_assign_execute_queries: invalid request: %s', error)
+        return False, {}
+    logging.info('post_orders_assign_execute_queries: courier_id=%s; entered', courier_id)
+    if cfg.DB_REPLICA_ASSIGN_READS:
+        # a courier asking again before the assignment is finished gets its remaining orders from a replica,
+        # the new assignments are created by the transaction on the primary below
+        try:
+            response = await _read(courier_id, lambda cur: _select_current_assignment(cur, courier_id), primary=False)
+        except aiomysql.Error as error:
+            logging.info('post_orders_assign_execute_queries: courier_id=%s; reading from a replica failed: %s',
+                         courier_id, error)
+            response = None
+        if response is not None:
+            return True, response
+    reserved = []  # orders taken out of the index of open orders, they`re put back unless the assignment is committed
+
+    async def work(cur: aiomysql.Cursor) -> tuple:
+        response = await _assign_orders(cur, courier_id, reserved)
+        return response is not None, response
 
-    cur = await conn.cursor()
     try:
-        await conn.begin()
-        await cur.execute('SELECT * FROM couriers WHERE courier_id = %s', (json_request['courier_id'],))
-        courier_data = await cur.fetchone()
-        if courier_data:
-            logging.debug(f'post_orders_assign_execute_queries: json_request={json_request}; '
-                          f'courier with id = {json_request["courier_id"]} is found')
-            cur_assignment = courier_data['current_assignment_id']
-            if cur_assignment is None:
-                logging.debug(f'post_orders_assign_execute_queries: json_request={json_request}; '
-                              f'current assignment of the courier is None, looking up orders for the new one')
-                await cur.execute('''SELECT timedzeroed.order_id FROM
-                (SELECT orders.* FROM (SELECT * FROM orders WHERE is_completed = 0 AND assigned_courier_id IS NULL) as orders
-                JOIN (SELECT DISTINCT dhof.order_id FROM (SELECT * FROM couriers_working_hours WHERE courier_id=%s) as cwh,
-                    delivery_hours_of_orders as dhof WHERE
-                        cwh.time_range_start <= dhof.time_range_start AND dhof.time_range_start <= cwh.time_range_stop AND
-                        cwh.time_range_stop <= dhof.time_range_stop OR
-                        cwh.time_range_start <= dhof.time_range_start AND dhof.time_range_start <= dhof.time_range_stop AND
-                        dhof.time_range_stop <= cwh.time_range_stop OR
-                        dhof.time_range_start <= cwh.time_range_start AND cwh.time_range_start <= dhof.time_range_stop AND
-                        dhof.time_range_stop <= cwh.time_range_stop OR
-                        dhof.time_range_start <= cwh.time_range_start AND cwh.time_range_start <= cwh.time_range_stop AND
-                        cwh.time_range_stop <= dhof.time_range_stop)
-                as timed
-                ON orders.order_id = timed.order_id) AS timedzeroed,
-                (SELECT max_weight FROM weights WHERE courier_type = (SELECT courier_type FROM couriers WHERE courier_id = %s)) AS wght
-                WHERE timedzeroed.weight <= wght.max_weight AND
-                      timedzeroed.region IN (SELECT region FROM couriers_regions WHERE courier_id=%s) FOR UPDATE''',
-                                  (json_request['courier_id'], json_request['courier_id'], json_request['courier_id']))
-
-                # these orders are not completed yet, have weight <= max_weight of the courier,
-                # their region is among the regions of the courier,
-                # their delivery hours overlap couriers' working hours, they are not assigned yet
-                ids = await cur.fetchall()
-
-                if not ids:
-                    logging.info(f"post_orders_assign_execute_queries: json_request={json_request}; "
-                                 f"have found no appropriate orders for the courier {json_request['courier_id']}, returning")
-                    await conn.rollback()
-                    conn.close()
-                    return True, {'orders': []}
-
-                logging.debug(f'''post_orders_assign_execute_queries: json_request={json_request}; selected orders, creating assignment''')
-                await cur.execute('''INSERT INTO assignments (assignment_id, assignment_timestamp) VALUES (DEFAULT, DEFAULT)''')
-                logging.debug(f'''post_orders_assign_execute_queries: json_request={json_request}; updating courier current assignment''')
-                await cur.execute('''UPDATE couriers SET current_assignment_id = (SELECT assignment_id FROM assignments 
-                ORDER BY assignment_id DESC LIMIT 1) WHERE courier_id = %s''', (json_request['courier_id'],))
-                logging.debug(f'''post_orders_assign_execute_queries: json_request={json_request}; updating orders''')
-                await cur.executemany('''UPDATE orders SET assignment_id = (SELECT assignment_id FROM assignments 
-                ORDER BY assignment_id DESC LIMIT 1), assigned_courier_id = %s WHERE order_id = %s''',
-                                      tuple((json_request['courier_id'], x['order_id']) for x in ids))
-
-                await cur.execute('''SELECT assignment_timestamp FROM assignments 
-                            WHERE assignment_id = (SELECT current_assignment_id FROM couriers WHERE courier_id = %s)''',
-                                  (json_request['courier_id'],))
-                assignment_time = await cur.fetchone()
-                assignment_time = assignment_time['assignment_timestamp']
-                logging.info(f'''post_orders_assign_execute_queries: json_request={json_request}; created new assignment, returning''')
-                await conn.commit()
-                conn.close()
-                return True, {'orders': [{'id': x['order_id']} for x in ids], 'assign_time': str(assignment_time.isoformat())}
+        response = await _transaction('assign', work, functools.partial(_put_back, reserved))
+    except DBUnavailable:
+        raise
+    except Exception as error:
+        logging.info('post_orders_assign_execute_queries: courier_id=%s; an exception occurred: %s, returning',
+                     courier_id, error)
+        return False, {}
+    if response is None:
+        return False, {}
+    _written((courier_id,))
+    return True, response
 
+
+async def post_orders_assign_batch_execute_queries(json_request: Dict) -> (bool, Dict):
+    """
+    A coroutine for the associated handler-coroutine that 'talks' to the DB.
+    Couriers are assigned one after another in a single transaction, so every order assigned to one of them
+    is already taken when the orders for the next one are looked up.
+    :param json_request: dict loaded from request via standard library: {"courier_ids": [int]}, repeated ids are
+    assigned once
+    :return: tuple of bool and list, bool indicates if everything was processed correctly,
+    list is a list of dicts {"courier_id": int, "orders": [{"id": int}], "assign_time": assignment_timestamp_str}
+    if it was, otherwise it`s a list of ids of the couriers that were not found
+    """
+    try:
+        courier_ids, = validation.ASSIGN_BATCH(json_request)
+    except validation.ValidationError as error:
+        logging.info('post_orders_assign_batch_execute_queries: invalid request: %s', error)
+        return False, []
+    logging.info('post_orders_assign_batch_execute_queries: %s couriers in request, entered; payload: %s',
+                 len(courier_ids), logs.payload(json_request))
+    reserved = []
+
+    async def work(cur: aiomysql.Cursor) -> tuple:
+        assignments = []
+        not_found = []
+        for courier_id in courier_ids:
+            response = await _assign_orders(cur, courier_id, reserved)
+            if response is None:
+                not_found.append(courier_id)
             else:
-                await cur.execute('''SELECT order_id FROM orders WHERE assignment_id = %s AND is_completed = 0''',
-                                  (cur_assignment,))
-                ids = await cur.fetchall()
-                await cur.execute('''SELECT assignment_timestamp FROM assignments 
-                WHERE assignment_id = (SELECT current_assignment_id FROM couriers WHERE courier_id = %s)''', (json_request['courier_id'],))
-                assignment_time = await cur.fetchone()
-                assignment_time = assignment_time['assignment_timestamp']
-                logging.info(f"post_orders_assign_execute_queries: json_request={json_request}; "
-                             f"assignment is not finished yet, returning with remaining orders")
-                await conn.commit()
-                conn.close()
-                return True, {'orders': [{'id': x['order_id']} for x in ids], 'assign_time': str(assignment_time.isoformat())}
-        else:
-            logging.info(f'post_orders_assign_execute_queries: json_request={json_request}; '
-                         f'courier with id = {json_request["courier_id"]} not found, returning')
-            await conn.rollback()
-            conn.close()
-            return False, {}
+                assignments.append({'courier_id': courier_id, **response})
+        if not_found:
+            return False, (False, not_found)
+        return True, (True, assignments)
+
+    try:
+        all_found, result = await _transaction('assign_batch', work, functools.partial(_put_back, reserved))
+    except DBUnavailable:
+        raise
     except Exception as error:
-        logging.info(f'post_orders_assign_execute_queries: json_request={json_request}; an exception occurred: {error}, returning')
-        await conn.rollback()
-        conn.close()
-        return False, {}
+        logging.info('post_orders_assign_batch_execute_queries: an exception occurred: %s, returning', error)
+        return False, []
+    if all_found:
+        _written(courier_ids)
+    return all_found, result
+
+
+async def _record_delivery(cur: aiomysql.Cursor, order: Dict, complete_time: datetime.datetime):
+    """
+    Adds the delivery of the order to the rating aggregates of its courier, in the transaction of the cursor.
+    The delivery takes the time since the previous completion in the same assignment, or since the assignment itself.
+    :param order: row of the order, locked by the transaction and not completed yet
+    :param complete_time: time of the completion, naive UTC
+    """
+    await cur.execute('''SELECT assignment_timestamp, last_completion_timestamp FROM assignments
+        WHERE assignment_id = %s FOR UPDATE''', (order['assignment_id'],))
+    assignment = await cur.fetchone()
+    previous = assignment['last_completion_timestamp'] or assignment['assignment_timestamp']
+    # completions may be reported out of order, the late ones are counted as instant
+    seconds = max(0, round((complete_time - previous).total_seconds()))
+    if complete_time > previous:
+        await cur.execute('''UPDATE assignments SET last_completion_timestamp = %s WHERE assignment_id = %s''',
+                          (complete_time, order['assignment_id']))
+    await cur.execute('''INSERT INTO couriers_regions_stats (courier_id, region, completed_count, delivery_seconds_sum)
+        VALUES (%s, %s, 1, %s) ON DUPLICATE KEY UPDATE completed_count = completed_count + 1,
+        delivery_seconds_sum = delivery_seconds_sum + VALUES(delivery_seconds_sum)''',
+                      (order['assigned_courier_id'], order['region'], seconds))
+
+
+async def _credit_finished_assignment(cur: aiomysql.Cursor, assignment_id: int) -> bool:
+    """
+    Adds the earnings for the assignment to the aggregates of its courier, in the transaction of the cursor,
+    if none of its orders is left to deliver and at least one of them was delivered.
+    Every assignment is credited only once.
+    :return: True if the assignment was credited now
+    """
+    await cur.execute('''SELECT SUM(is_completed = 0) AS remaining, SUM(is_completed) AS delivered FROM orders
+        WHERE assignment_id = %s''', (assignment_id,))
+    counts = await cur.fetchone()
+    if counts['remaining'] or not counts['delivered']:
+        return False
+    await cur.execute('''SELECT a.courier_id, COALESCE(a.courier_type, c.courier_type) AS courier_type, a.is_credited
+        FROM assignments AS a LEFT JOIN couriers AS c ON c.courier_id = a.courier_id
+        WHERE a.assignment_id = %s FOR UPDATE OF a''', (assignment_id,))
+    assignment = await cur.fetchone()
+    if assignment['is_credited'] or assignment['courier_id'] is None:
+        # assignments made before the aggregates were introduced are credited by backfill.py
+        return False
+    earnings = cfg.EARNINGS_BASE * cfg.EARNINGS_COEFFICIENTS.get(assignment['courier_type'], 0)
+    await cur.execute('''UPDATE assignments SET is_credited = 1 WHERE assignment_id = %s''', (assignment_id,))
+    await cur.execute('''INSERT INTO couriers_earnings (courier_id, completed_assignments, earnings) VALUES (%s, 1, %s)
+        ON DUPLICATE KEY UPDATE completed_assignments = completed_assignments + 1,
+        earnings = earnings + VALUES(earnings)''', (assignment['courier_id'], earnings))
+    return True
+
+
+async def _complete_order(cur: aiomysql.Cursor, courier_id: int, order_id: int,
+                          complete_time: datetime.datetime) -> (bool, bool):
+    """
+    Completes the order in the transaction of the cursor: marks it completed, adds the delivery to the aggregates
+    of the courier, credits the assignment and clears the current assignment of the courier if it`s finished.
+    :param complete_time: time of the completion, naive UTC
+    :return: tuple of bools, the first one indicates if the completion is valid, the second one if anything was written,
+    a repeated completion of the order is valid, but writes nothing
+    """
+    await cur.execute('''SELECT * FROM orders WHERE order_id = %s FOR UPDATE''', (order_id,))
+    data = await cur.fetchone()
+    logging.debug('_complete_order: order_id=%s; data on order: %s', order_id, data)
+    if not data:
+        # the order could be completed long ago and moved to the history by the archiver
+        await cur.execute('SELECT assigned_courier_id FROM orders_history WHERE order_id = %s', (order_id,))
+        archived = await cur.fetchone()
+        if archived and archived['assigned_courier_id'] == courier_id:
+            logging.info('_complete_order: order_id=%s; order is already archived', order_id)
+            return True, False
+        logging.info('_complete_order: order_id=%s; order not found', order_id)
+        return False, False
+    if data['assigned_courier_id'] != courier_id:
+        logging.info('_complete_order: order_id=%s; courier id assigned for this order doesn\'t match id in request',
+                     order_id)
+        return False, False
+    if data['is_completed']:
+        # repeated completion is answered the same way, but must not be counted twice
+        logging.info('_complete_order: order_id=%s; order is already completed', order_id)
+        return True, False
+
+    await cur.execute('''UPDATE orders SET is_completed = 1, completion_timestamp = %s WHERE order_id = %s''',
+                      (complete_time, order_id))
+    await _record_delivery(cur, data, complete_time)
+    await _credit_finished_assignment(cur, data['assignment_id'])
+
+    await cur.execute("SELECT order_id, assignment_id FROM orders WHERE assignment_id ="
+                      " (SELECT current_assignment_id FROM couriers WHERE courier_id = %s) AND is_completed = 0",
+                      (courier_id,))
+    if not await cur.fetchone():
+        logging.info('order %s was the last one in the assignment of the courier %s, '
+                     'setting current assignment to NULL', order_id, courier_id)
+        # repeated completion of the task from the previous assignment won`t trigger this,
+        # because current assignment is retrieved here
+        await cur.execute("UPDATE couriers SET current_assignment_id = NULL WHERE courier_id = %s", (courier_id,))
+    return True, True
+
+
+def _completed(courier_ids: Iterable[int], order_ids: Iterable[int]):
+    """
+    Updates the in-process state after the completions of the orders are committed.
+    """
+    _written(courier_ids)
+    # a completed order is never open, this only keeps an index that is out of sync from offering it
+    for order_id in order_ids:
+        matching.index.discard(order_id)
+
+
+async def complete_order(courier_id: int, order_id: int, complete_time: datetime.datetime) -> bool:
+    """
+    Completes the order in its own transaction.
+    :param complete_time: time of the completion, naive UTC
+    :return: True if the completion is valid
+    :raise DBUnavailable: see _transaction
+    """
+    async def work(cur: aiomysql.Cursor) -> tuple:
+        valid, written = await _complete_order(cur, courier_id, order_id, complete_time)
+        return written, (valid, written)
+
+    try:
+        valid, written = await _transaction('complete_order', work)
+    except DBUnavailable:
+        raise
+    except Exception as error:
+        logging.info('complete_order: order_id=%s; error occurred: %s', order_id, error)
+        return False
+    if not written:
+        return valid
+    _completed((courier_id,), (order_id,))
+    logging.debug('complete_order: order_id=%s; update is successful, returning', order_id)
+    return True
+
+
+async def complete_orders(completions: List[tuple]) -> List[bool]:
+    """
+    Completes the orders in a single transaction, so the whole group costs one commit instead of one per order.
+    Each completion is made after a savepoint and an error in it rolls back only that completion. The errors that are
+    retried, as they fail the transaction and not the completion, are retried for the whole group, see _transaction.
+    :param completions: list of (courier_id, order_id, complete_time), see validation.COMPLETE
+    :return: for every completion, in the order of the list, True if it`s valid
+    :raise aiomysql.Error: if the transaction fails as a whole, nothing is written then
+    :raise DBUnavailable: see _transaction
+    """
+    results = [False] * len(completions)
+    written = []
+
+    async def work(cur: aiomysql.Cursor) -> tuple:
+        results[:] = [False] * len(completions)
+        written.clear()
+        # every group locks the rows of the couriers and their orders in the same order,
+        # so concurrent groups wait for each other instead of deadlocking
+        for index in sorted(range(len(completions)), key=lambda i: completions[i][:2]):
+            courier_id, order_id, complete_time = completions[index]
+            await cur.execute('SAVEPOINT completion')
+            try:
+                results[index], changed = await _complete_order(cur, courier_id, order_id, complete_time)
+            except aiomysql.Error as error:
+                if _error_kind(error) is not None:
+                    raise
+                await cur.execute('ROLLBACK TO SAVEPOINT completion')
+                logging.info('complete_orders: order_id=%s; error occurred: %s, rolled back', order_id, error)
+                continue
+            if changed:
+                written.append(completions[index])
+        return True, None
+
+    await _transaction('complete_orders', work)
+    _completed({x[0] for x in written}, [x[1] for x in written])
+    logging.debug('complete_orders: %s completions, %s orders completed', len(completions), len(written))
+    return results
 
 
 async def post_orders_complete_execute_queries(json_request: Dict) -> (bool, Dict):
@@ -383,82 +1482,205 @@ async def post_orders_complete_execute_queries(json_request: Dict) -> (bool, Dic
     :return: tuple of bool and dict, bool indicates if everything was processed correctly,
     dict contains an order id if bool is true and is empty otherwise
     """
-    logging.debug(f'post_orders_complete_execute_queries: json_request={json_request}; entered')
-    conn = await aiomysql.connect(host=cfg.DB_HOST, port=cfg.DB_PORT,
-                                  user=cfg.DB_USER, password=cfg.DB_PASSWORD,
-                                  db=cfg.DATABASE, cursorclass=aiomysql.DictCursor, autocommit=False)
-    # cursorclass=aiomysql.DictCursor: SELECT`s result will be presented in dicts
-    # each connection starts it`s own transaction so data can`t be corrupted
-
-    cur = await conn.cursor()
     try:
-        await conn.begin()
-        logging.debug(f'post_orders_complete_execute_queries: json_request={json_request}; checking the order with id = {json_request["order_id"]}')
-        await cur.execute('''SELECT * FROM orders WHERE order_id = %s FOR UPDATE''', (json_request['order_id'],))
-        data = await cur.fetchone()
-        logging.debug(f'post_orders_complete_execute_queries: json_request={json_request}; data on order: {data}')
-
-        # TODO: validate timestamp via regex
-        timestamp = ' '.join((json_request['complete_time'][:-1].split('T')))
-
-        if data:
-            if data['assigned_courier_id'] == json_request['courier_id']:
-                logging.debug(f'post_orders_complete_execute_queries: json_request={json_request}; order is found and courier_id is valid')
-                await cur.execute('''UPDATE orders SET is_completed = 1, completion_timestamp = TIMESTAMP(%s) WHERE order_id = %s''',
-                                  (timestamp, json_request['order_id']))
-
-                await cur.execute("SELECT order_id, assignment_id FROM orders WHERE assignment_id ="
-                                  " (SELECT current_assignment_id FROM couriers WHERE courier_id = %s) AND is_completed = 0",
-                                  (json_request['courier_id'],))
-                data = await cur.fetchone()
-                if not data:
-                    logging.info(f'order {json_request["order_id"]} was the last one in the assignment '
-                                 f' of the courier {json_request["courier_id"]}, setting current assignment to NULL')
-                    # repeated completion of the task from the previous assignment won`t trigger this,
-                    # because current assignment is retrieved here
-                    await cur.execute("UPDATE couriers SET current_assignment_id = NULL WHERE courier_id = %s",
-                                      (json_request['courier_id'],))
-                await conn.commit()
-
-                logging.debug(f'post_orders_complete_execute_queries: json_request={json_request}; update is successful, returning')
-                conn.close()
-                return True, {'order_id': json_request['order_id']}
-            else:
-                logging.info(f'post_orders_complete_execute_queries: json_request={json_request};'
-                             f' courier id assigned for this order doesn\'t match id in request')
-                await conn.rollback()
-                conn.close()
-                return False, {}
-        else:
-            logging.info(f'post_orders_complete_execute_queries: json_request={json_request}; order not found')
-            await conn.rollback()
-            conn.close()
-            return False, {}
-
-    except Exception as error:
-        await conn.rollback()
-        logging.info(f'post_orders_complete_execute_queries: json_request={json_request}; error occurred: {error}')
-        conn.close()
+        courier_id, order_id, complete_time = validation.COMPLETE(json_request)
+    except validation.ValidationError as error:
+        logging.info('post_orders_complete_execute_queries: invalid request: %s', error)
         return False, {}
+    logging.debug('post_orders_complete_execute_queries: order_id=%s; entered', order_id)
+    if await complete_order(courier_id, order_id, complete_time):
+        return True, {'order_id': order_id}
+    return False, {}
+
+
+async def _select_courier_profile(cur: aiomysql.Cursor, courier_id: int) -> Optional[Dict]:
+    """
+    Rating and earnings are read from the aggregates maintained on completion of the orders,
+    so the number of rows read depends on the number of regions of the courier, not on the number of deliveries.
+    :return: {"courier_id", "courier_type", "regions", "working_hours", "rating" (only if anything is delivered),
+    "earnings"}, None if the courier is not found
+    """
+    await cur.execute('''SELECT c.courier_id, c.courier_type, ce.earnings FROM couriers AS c
+        LEFT JOIN couriers_earnings AS ce ON ce.courier_id = c.courier_id WHERE c.courier_id = %s''', (courier_id,))
+    courier = await cur.fetchone()
+    if not courier:
+        return None
+
+    await cur.execute('''SELECT region FROM couriers_regions WHERE courier_id = %s''', (courier_id,))
+    regs = await cur.fetchall()
+
+    await cur.execute('''SELECT start_minute, stop_minute FROM couriers_working_hours WHERE courier_id = %s''',
+                      (courier_id,))
+    whs = await cur.fetchall()
+
+    await cur.execute('''SELECT completed_count, delivery_seconds_sum FROM couriers_regions_stats
+        WHERE courier_id = %s''', (courier_id,))
+    stats = await cur.fetchall()
 
+    profile = {'courier_id': courier['courier_id'], 'courier_type': courier['courier_type'],
+               'regions': [x['region'] for x in regs],
+               'working_hours': [profiles.format_time_range(x['start_minute'], x['stop_minute']) for x in whs]}
+    rating = profiles.rating(stats)
+    if rating is not None:
+        profile['rating'] = rating
+    profile['earnings'] = int(courier['earnings'] or 0)
+    return profile
 
-async def get_couriers_id_execute_queries(courier_id):
-    conn = await aiomysql.connect(host=cfg.DB_HOST, port=cfg.DB_PORT,
-                                  user=cfg.DB_USER, password=cfg.DB_PASSWORD,
-                                  db=cfg.DATABASE, cursorclass=aiomysql.DictCursor, autocommit=False)
-    cur = await conn.cursor()
+
+async def get_couriers_id_execute_queries(courier_id) -> (bool, Optional[cache.Profile]):
+    """
+    A coroutine for the associated handler-coroutine that 'talks' to the DB.
+    Profiles are read through cache.profiles, so the DB is queried only on a miss, a replica if there is a healthy one.
+    :param courier_id: id of the courier retrieved from the URI
+    :return: tuple of bool and cache.Profile, bool indicates if the DB was queried successfully,
+    None instead of the profile if the courier is not found
+    :raise DBUnavailable: if the DB can`t be used now
+    """
+    courier_id = int(courier_id)
+    profile = cache.profiles.get(courier_id)
+    if profile is not None:
+        return True, profile
+    token = cache.profiles.token()
     try:
-        await cur.execute('''SELECT * FROM couriers WHERE courier_id = %s''', (courier_id,))
-        couriers = await cur.fetchall()
+        with _unavailable_on_errors('get_couriers_id_execute_queries'):
+            data = await _read(courier_id, lambda cur: _select_courier_profile(cur, courier_id))
+    except aiomysql.Error as error:
+        logging.info('get_couriers_id_execute_queries: courier_id=%s; error occurred: %s', courier_id, error)
+        return False, None
+    if data is None:
+        return True, None
+    profile = cache.make_profile(data)
+    cache.profiles.put(courier_id, profile, token)
+    return True, profile
 
-        await cur.execute('''SELECT * FROM couriers_regions WHERE courier_id = %s''', (courier_id,))
-        regs = await cur.fetchall()
 
-        await cur.execute('''SELECT * FROM couriers_working_hours WHERE courier_id = %s''', (courier_id,))
-        whs = await cur.fetchall()
-    except aiomysql.Error:
-        conn.close()
-        return False, []
-    else:
-        conn.close()
-        return True, [couriers, regs, [{i: str(x[i]) for i in x} for x in whs]]
+async def _export(page: Callable[[int, int], tuple], key: str, after: int, limit: Optional[int]) -> AsyncIterable[Dict]:
+    """
+    Reads the rows of an export page by page, in the order of the key. Every page is a query of its own
+    resuming after the last key of the previous one, so no transaction is kept open, and no connection borrowed,
+    for the whole export. The rows of a page are read by an unbuffered cursor as they are consumed,
+    so the memory used doesn`t depend on the size of the page.
+    Pages are read from a replica if there is a healthy one.
+    :param page: takes the key to start after and the number of rows, returns the query of the page and its arguments
+    :param key: column the rows are ordered by, unique
+    :param after: value of the key the export starts after
+    :param limit: number of rows to stop after, None for all
+    :return: rows of the pages
+    """
+    exported = 0
+    while limit is None or exported < limit:
+        size = cfg.EXPORT_PAGE_SIZE if limit is None else min(cfg.EXPORT_PAGE_SIZE, limit - exported)
+        query, args = page(after, size)
+        replica = _replica_for(None)
+        rows = 0
+        try:
+            async with acquire(None if replica is None else replica.pool) as conn:
+                cur = await conn.cursor(_InstrumentedSSCursor)
+                finished = False
+                try:
+                    await cur.execute(query, args)
+                    while True:
+                        batch = await cur.fetchmany(cfg.EXPORT_FETCH_SIZE)
+                        if not batch:
+                            break
+                        for row in batch:
+                            yield row
+                        rows += len(batch)
+                        after = batch[-1][key]
+                    finished = True
+                finally:
+                    if finished:
+                        await cur.close()
+                    else:
+                        # the rest of the result would have to be read before the connection can be used again
+                        conn.close()
+        except _REPLICA_ERRORS as error:
+            if replica is None or rows:
+                raise
+            replica.fail(error)  # nothing of the page was exported yet, it`s read again from the primary
+            metrics.db_retries.labels('replica').inc()
+            continue
+        metrics.db_reads.labels('primary' if replica is None else 'replica').inc()
+        exported += rows
+        if rows < size:
+            return
+
+
+def _filters(conditions: List[tuple]) -> (str, List):
+    """
+    :param conditions: (SQL condition with a placeholder, value or None if the filter is not used)
+    :return: the used conditions joined by AND, starting with AND, and their arguments
+    """
+    used = [(condition, value) for condition, value in conditions if value is not None]
+    return ''.join(f' AND {condition}' for condition, _ in used), [value for _, value in used]
+
+
+def _format_delivery_hours(concatenated: Optional[str]) -> List[str]:
+    """
+    :param concatenated: GROUP_CONCAT of start_minute-stop_minute pairs
+    """
+    if not concatenated:
+        return []
+    return [profiles.format_time_range(*map(int, x.split('-'))) for x in concatenated.split(',')]
+
+
+def _timestamp(value: Optional[datetime.datetime]) -> Optional[str]:
+    return None if value is None else value.isoformat()
+
+
+async def export_orders(filters: Dict) -> AsyncIterable[Dict]:
+    """
+    Orders, the archived ones included, in the order of their ids.
+    :param filters: validated by validation.EXPORT_ORDERS: after (resume token), limit, region, courier_id,
+    completed_from and completed_to (naive UTC, the orders completed in [from, to) only)
+    :return: ready-to-be-dumped orders {"order_id", "weight", "region", "delivery_hours", "courier_id",
+    "assignment_id", "completed", "complete_time"}
+    """
+    conditions, args = _filters([('region = %s', filters.get('region')),
+                                 ('assigned_courier_id = %s', filters.get('courier_id')),
+                                 ('completion_timestamp >= %s', filters.get('completed_from')),
+                                 ('completion_timestamp < %s', filters.get('completed_to'))])
+
+    def page(after: int, size: int) -> tuple:
+        # an order is moved to orders_history in the transaction of the archiver,
+        # so it`s found in one of the tables whichever pages are read before and after it`s moved
+        parts = [f'''(SELECT order_id, weight, region, assigned_courier_id, assignment_id, is_completed,
+            completion_timestamp, (SELECT GROUP_CONCAT(start_minute, '-', stop_minute) FROM {hours} AS h
+            WHERE h.order_id = o.order_id) AS delivery_hours
+            FROM {table} AS o WHERE order_id > %s{conditions} ORDER BY order_id LIMIT %s)'''
+                 for table, hours in (('orders', 'delivery_hours_of_orders'), ('orders_history', 'delivery_hours_history'))]
+        return f'{" UNION ALL ".join(parts)} ORDER BY order_id LIMIT %s', [after, *args, size] * 2 + [size]
+
+    async for row in _export(page, 'order_id', filters.get('after', 0), filters.get('limit')):
+        yield {'order_id': row['order_id'], 'weight': float(row['weight']), 'region': row['region'],
+               'delivery_hours': _format_delivery_hours(row['delivery_hours']), 'courier_id': row['assigned_courier_id'],
+               'assignment_id': row['assignment_id'], 'completed': bool(row['is_completed']),
+               'complete_time': _timestamp(row['completion_timestamp'])}
+
+
+async def export_assignments(filters: Dict) -> AsyncIterable[Dict]:
+    """
+    Assignments in the order of their ids, with the ids of their orders, the archived ones included.
+    :param filters: validated by validation.EXPORT_ASSIGNMENTS: after (resume token), limit, courier_id,
+    assigned_from and assigned_to (naive UTC, the assignments made in [from, to) only)
+    :return: ready-to-be-dumped assignments {"assignment_id", "courier_id", "courier_type", "assign_time",
+    "last_complete_time", "credited", "orders"}
+    """
+    conditions, args = _filters([('courier_id = %s', filters.get('courier_id')),
+                                 ('assignment_timestamp >= %s', filters.get('assigned_from')),
+                                 ('assignment_timestamp < %s', filters.get('assigned_to'))])
+
+    def page(after: int, size: int) -> tuple:
+        return f'''SELECT assignment_id, courier_id, courier_type, assignment_timestamp, last_completion_timestamp,
+            is_credited, CONCAT_WS(',',
+                (SELECT GROUP_CONCAT(order_id) FROM orders AS o WHERE o.assignment_id = a.assignment_id),
+                (SELECT GROUP_CONCAT(order_id) FROM orders_history AS oh WHERE oh.assignment_id = a.assignment_id)
+            ) AS order_ids
+            FROM assignments AS a WHERE assignment_id > %s{conditions} ORDER BY assignment_id LIMIT %s''', \
+            [after, *args, size]
+
+    async for row in _export(page, 'assignment_id', filters.get('after', 0), filters.get('limit')):
+        yield {'assignment_id': row['assignment_id'], 'courier_id': row['courier_id'], 'courier_type': row['courier_type'],
+               'assign_time': _timestamp(row['assignment_timestamp']),
+               'last_complete_time': _timestamp(row['last_completion_timestamp']), 'credited': bool(row['is_credited']),
+               'orders': sorted(map(int, row['order_ids'].split(','))) if row['order_ids'] else []}
@@ -0,0 +1,146 @@
+"""
+Group commit of POST /orders/complete (cfg.COMPLETE_GROUP_COMMIT). Completions are queued in-process and written
+together by db_connection.complete_orders in one transaction, so a group costs a single commit, one fsync of the redo
+log, instead of one per completion. A group is written cfg.COMPLETE_GROUP_WINDOW seconds after its first completion
+came or as soon as it has cfg.COMPLETE_GROUP_MAX_SIZE of them; the completions that come while a group is being written
+make up the next one, so under load the groups grow with the time a commit takes.
+Every request waits for the commit of its group and gets the result of its own completion, a response is never sent
+for a completion that isn`t durable yet. If the transaction of a group fails as a whole, e.g. it`s chosen as the victim
+of a deadlock, its completions are made again one by one.
+"""
+import asyncio
+import datetime
+import logging
+import time
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+import cfg
+import db_connection
+import metrics
+import validation
+
+
+class CompletionQueue:
+    """
+    Completions waiting to be written, with the task writing them group after group.
+    """
+
+    def __init__(self, window: float, max_size: int):
+        self.window = window
+        self.max_size = max_size
+        self.pending: List[tuple] = []  # (completion, future of its result, time it came)
+        self.arrived = asyncio.Event()  # set while anything is pending
+        self.full = asyncio.Event()  # set while a full group is pending
+        self.writing = False
+        self.task: Optional[asyncio.Task] = None
+
+    async def complete(self, courier_id: int, order_id: int, complete_time: datetime.datetime) -> bool:
+        """
+        :return: True if the completion is valid, once it`s committed
+        """
+        future = asyncio.get_event_loop().create_future()
+        self.pending.append(((courier_id, order_id, complete_time), future, time.monotonic()))
+        self.arrived.set()
+        if len(self.pending) >= self.max_size:
+            self.full.set()
+        return await future
+
+    async def run(self):
+        while True:
+            await self.arrived.wait()
+            waited = time.monotonic() - self.pending[0][2]
+            if waited < self.window:
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.window - waited)
+                except asyncio.TimeoutError:
+                    pass
+            group, self.pending = self.pending[:self.max_size], self.pending[self.max_size:]
+            if len(self.pending) < self.max_size:
+                self.full.clear()
+            if not self.pending:
+                self.arrived.clear()
+            self.writing = True
+            try:
+                await self.write(group)
+            except Exception as error:
+                logging.error('run: failed to write a group of %s completions: %s', len(group), error)
+                for _, future, _ in group:
+                    if not future.done():
+                        future.set_exception(error)
+            finally:
+                self.writing = False
+
+    async def write(self, group: List[tuple]):
+        completions = [x[0] for x in group]
+        metrics.completion_group_size.labels().observe(len(completions))
+        try:
+            results = await db_connection.complete_orders(completions)
+        except Exception as error:
+            logging.warning('write: group of %s completions failed: %s, completing them one by one',
+                            len(completions), error)
+            metrics.db_retries.labels('completion_group').inc()
+            results = []
+            for completion in completions:
+                try:
+                    results.append(await db_connection.complete_order(*completion))
+                except db_connection.DBUnavailable as unavailable:
+                    results.append(unavailable)  # the completions written before it are committed
+        for (_, future, _), result in zip(group, results):
+            if future.done():  # the request could be cancelled, the completion is committed all the same
+                continue
+            if isinstance(result, db_connection.DBUnavailable):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def drain(self):
+        """
+        Waits until the pending completions are written.
+        """
+        while self.pending or self.writing:
+            await asyncio.sleep(self.window or 0.001)
+
+
+queue: Optional[CompletionQueue] = None  # created on startup if cfg.COMPLETE_GROUP_COMMIT is on
+
+
+async def post_orders_complete_execute_queries(json_request: Dict) -> (bool, Dict):
+    """
+    db_connection.post_orders_complete_execute_queries with the completion queued to be written with its group.
+    :return: see db_connection.post_orders_complete_execute_queries
+    """
+    try:
+        courier_id, order_id, complete_time = validation.COMPLETE(json_request)
+    except validation.ValidationError as error:
+        logging.info('post_orders_complete_execute_queries: invalid request: %s', error)
+        return False, {}
+    if await queue.complete(courier_id, order_id, complete_time):
+        return True, {'order_id': order_id}
+    return False, {}
+
+
+async def start_group_commit(app: web.Application):
+    """
+    on_startup hook of the application, starts the writing of the queued completions.
+    :param app: application that is being started
+    """
+    global queue
+    if cfg.COMPLETE_GROUP_COMMIT:
+        queue = CompletionQueue(cfg.COMPLETE_GROUP_WINDOW, cfg.COMPLETE_GROUP_MAX_SIZE)
+        queue.task = asyncio.ensure_future(queue.run())
+        logging.info('start_group_commit: completions are written in groups of up to %s, window is %s s',
+                     cfg.COMPLETE_GROUP_MAX_SIZE, cfg.COMPLETE_GROUP_WINDOW)
+
+
+async def stop_group_commit(app: web.Application):
+    """
+    on_cleanup hook of the application, writes the completions still queued and stops, must run before the pool is closed.
+    :param app: application that is being shut down
+    """
+    global queue
+    if queue is not None:
+        await queue.drain()
+        queue.task.cancel()
+        queue = None
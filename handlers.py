@@ -1,73 +1,101 @@
 from aiohttp import web
 import db_connection
+import storage
+import cache
+import streaming
+import metrics
+import tracing
+import serialization
+import validation
 import cfg  # configure file
 import json
 import logging
 
 
+@web.middleware
+async def db_unavailable(request: web.Request, handler):
+    """
+    Answers 503 with Retry-After to the requests that failed because the DB was unavailable, instead of 400 or 500,
+    so the clients know the request was valid and may be repeated later.
+    """
+    try:
+        return await handler(request)
+    except db_connection.DBUnavailable as error:
+        metrics.db_unavailable.labels(error.reason).inc()
+        logging.warning('db_unavailable: request=%s; %s, raised 503', request, error)
+        raise web.HTTPServiceUnavailable(headers={'Retry-After': str(cfg.DB_RETRY_AFTER)})
+
+
 async def post_couriers(request: web.Request):
     """
     Handler for "POST /couriers" request. Registers received couriers. See the docs for the complete description.
-    aiohttp-level communication is done here, while the actual communication with the database is done in associated db_connection function
+    aiohttp-level communication is done here, while the actual work with the data is done by the storage backend, see storage.py
     :param request: HTTP-request passed by aiohttp
     :return: Response derived from web.StreamResponse
     """
-    logging.info(f'post_couriers: request={request}; entered')
+    logging.info('post_couriers: request=%s; entered', request)
     # VERB = 'POST'
     # URI = '/couriers'
-    try:
-        data = await request.json()
-    except json.decoder.JSONDecodeError:
-        logging.info(f'post_couriers: request={request}; invalid json, raised 400')
-        raise web.HTTPBadRequest
-    if type(data) is not dict or set(data.keys()) != {'data'}:
-        logging.info(f'post_couriers: request={request}; invalid json, raised 400')
-        raise web.HTTPBadRequest
+    if streaming.is_streamed(request):
+        # large bodies are parsed and validated batch by batch instead of being loaded at once
+        try:
+            all_valid, ids = await storage.backend.post_couriers_stream(streaming.request_batches(request))
+        except streaming.StreamFormatError as error:
+            logging.info('post_couriers: request=%s; malformed body: %s, raised 400', request, error)
+            raise web.HTTPBadRequest
+        except streaming.StreamTimeoutError as error:
+            logging.info('post_couriers: request=%s; %s, raised 408', request, error)
+            raise web.HTTPRequestTimeout
+    else:
+        try:
+            data = await request.json(loads=serialization.loads)
+        except json.decoder.JSONDecodeError:
+            logging.info('post_couriers: request=%s; invalid json, raised 400', request)
+            raise web.HTTPBadRequest
+        try:
+            validation.BATCH(data)
+        except validation.ValidationError:
+            logging.info('post_couriers: request=%s; invalid json, raised 400', request)
+            raise web.HTTPBadRequest
 
-    all_valid, ids = await db_connection.post_couriers_execute_queries(data)
+        all_valid, ids = await storage.backend.post_couriers(data)
     if all_valid:
-        logging.info(f'post_couriers: request={request}; request is valid and fulfilled, creating ok response')
+        logging.info('post_couriers: request=%s; request is valid and fulfilled, creating ok response', request)
         json_response = {"couriers": [{'id': x} for x in ids]}
-        return web.json_response(json.dumps(json_response), status=201, reason='Created')
+        return serialization.json_response(json_response, status=201, reason='Created')
     else:
-        logging.info(f'post_couriers: request={request}; validation error occurred, creating validation_error response')
+        logging.info('post_couriers: request=%s; validation error occurred, creating validation_error response', request)
         json_response = {'validation_error': {"couriers": [{'id': x} for x in ids]}}
-        return web.json_response(json.dumps(json_response), status=400, reason='Bad Request')
+        return serialization.json_response(json_response, status=400, reason='Bad Request')
 
 
 async def patch_couriers_id(request: web.Request):
     """
     Handler for "PATCH /couriers/{courier_id}" request. Changes data about courier with associated courier_id.
     See the docs for the complete description.
-    aiohttp-level communication is done here, while the actual communication with the database is done in associated db_connection function
+    aiohttp-level communication is done here, while the actual work with the data is done by the storage backend, see storage.py
     :param request: HTTP-request passed by aiohttp
     :return: Response derived from web.StreamResponse
     """
-    logging.info(f'patch_couriers_id: request={request}; entered')
+    logging.info('patch_couriers_id: request=%s; entered', request)
     # VERB = 'PATCH'
     # URI = r'/couriers/{courier_id: \d+}'
     try:
-        data = await request.json()
+        data = await request.json(loads=serialization.loads)
     except json.decoder.JSONDecodeError:
-        logging.info(msg=f'patch_couriers_id: request={request}; invalid json, raised 400')
-        raise web.HTTPBadRequest
-
-    required_data = {"courier_type", "regions", "working_hours"}
-    if set(data.keys()) - required_data:
-        logging.info(msg=f'patch_couriers_id: request={request}; extra columns in json, raised 400')
+        logging.info('patch_couriers_id: request=%s; invalid json, raised 400', request)
         raise web.HTTPBadRequest
-    # check if there are column names beyond the stated in the docs
 
-    cour_id = request.match_info.get('courier_id')
+    cour_id = int(request.match_info['courier_id'])  # the route lets only digits through
 
-    logging.debug(f'patch_couriers_id: request={request}; courier_id is {cour_id}')
+    logging.debug('patch_couriers_id: request=%s; courier_id is %s', request, cour_id)
 
-    all_valid, new_courier_data = await db_connection.patch_couriers_id_execute_queries(cour_id, data)
+    all_valid, new_courier_data = await storage.backend.patch_courier(cour_id, data)
     if all_valid:
-        logging.info(msg=f'patch_couriers_id: request={request}; request has been fulfilled, creating response')
-        return web.json_response(json.dumps(new_courier_data), status=200)
+        logging.info('patch_couriers_id: request=%s; request has been fulfilled, creating response', request)
+        return serialization.json_response(new_courier_data, status=200)
     else:
-        logging.info(msg=f'patch_couriers_id: request={request}; request is invalid, creating response')
+        logging.info('patch_couriers_id: request=%s; request is invalid, creating response', request)
         return web.Response(status=400)
 
 
@@ -75,89 +103,124 @@ async def post_orders(request: web.Request):
     """
     Handler for "POST /orders" request. Registers received couriers.
     See the docs for the complete description.
-    aiohttp-level communication is done here, while the actual communication with the database is done in associated db_connection function
+    aiohttp-level communication is done here, while the actual work with the data is done by the storage backend, see storage.py
     :param request: HTTP-request passed by aiohttp
     :return: Response derived from web.StreamResponse
     """
-    logging.info(f'post_orders: request={request}; entered')
+    logging.info('post_orders: request=%s; entered', request)
     # VERB = 'POST'
     # URI = '/orders'
-    try:
-        data = await request.json()
-    except json.decoder.JSONDecodeError:
-        logging.info(f'post_orders: request={request}; invalid json, raising 400')
-        raise web.HTTPBadRequest
-    if type(data) is not dict or set(data.keys()) != {'data'}:
-        logging.info(f'post_orders: request={request}; invalid json, raised 400')
-        raise web.HTTPBadRequest
+    if streaming.is_streamed(request):
+        # large bodies are parsed and validated batch by batch instead of being loaded at once
+        try:
+            all_valid, ids = await storage.backend.post_orders_stream(streaming.request_batches(request))
+        except streaming.StreamFormatError as error:
+            logging.info('post_orders: request=%s; malformed body: %s, raised 400', request, error)
+            raise web.HTTPBadRequest
+        except streaming.StreamTimeoutError as error:
+            logging.info('post_orders: request=%s; %s, raised 408', request, error)
+            raise web.HTTPRequestTimeout
+    else:
+        try:
+            data = await request.json(loads=serialization.loads)
+        except json.decoder.JSONDecodeError:
+            logging.info('post_orders: request=%s; invalid json, raising 400', request)
+            raise web.HTTPBadRequest
+        try:
+            validation.BATCH(data)
+        except validation.ValidationError:
+            logging.info('post_orders: request=%s; invalid json, raised 400', request)
+            raise web.HTTPBadRequest
 
-    all_valid, ids = await db_connection.post_orders_execute_queries(data)
+        all_valid, ids = await storage.backend.post_orders(data)
     if all_valid:
-        logging.info(f'post_orders: request={request}; request is valid and fulfilled, creating ok response')
+        logging.info('post_orders: request=%s; request is valid and fulfilled, creating ok response', request)
         json_response = {"orders": [{'id': x} for x in ids]}
-        return web.json_response(json.dumps(json_response), status=201, reason='Created')
+        return serialization.json_response(json_response, status=201, reason='Created')
     else:
-        logging.info(f'post_orders: request={request}; validation error occurred, creating validation_error response')
+        logging.info('post_orders: request=%s; validation error occurred, creating validation_error response', request)
         json_response = {'validation_error': {"orders": [{'id': x} for x in ids]}}
-        return web.json_response(json.dumps(json_response), status=400, reason='Bad Request')
+        return serialization.json_response(json_response, status=400, reason='Bad Request')
 
 
 async def post_orders_assign(request: web.Request):
     """
     Handler for "POST /orders/assign" request. Assigns all available and appropriate orders to the courier to be delivered.
     See the docs for the complete description.
-    aiohttp-level communication is done here, while the actual communication with the database is done in associated db_connection function
+    aiohttp-level communication is done here, while the actual work with the data is done by the storage backend, see storage.py
     :param request: HTTP-request passed by aiohttp
     :return: Response derived from web.StreamResponse
     """
-    logging.info(f'post_orders_assign: request={request}; entered')
+    logging.info('post_orders_assign: request=%s; entered', request)
     # VERB = 'POST'
     # URI = '/orders/assign'
     try:
-        data = await request.json()
+        data = await request.json(loads=serialization.loads)
     except json.decoder.JSONDecodeError:
-        logging.info(f'post_orders_assign: request={request}; invalid json, raised 400')
-        raise web.HTTPBadRequest
-
-    if set(data.keys()) != {'courier_id'} or type(data['courier_id']) is not int:
-        logging.info(f'post_orders_assign: request={request}; invalid json, raising 400')
+        logging.info('post_orders_assign: request=%s; invalid json, raised 400', request)
         raise web.HTTPBadRequest
 
-    all_valid, json_response = await db_connection.post_orders_assign_execute_queries(data)
+    all_valid, json_response = await storage.backend.assign(data)
 
     if all_valid:
-        logging.info(f'post_orders_assign: request={request}; request is valid and fulfilled, creating OK response')
-        return web.json_response(json.dumps(json_response), status=200)
+        logging.info('post_orders_assign: request=%s; request is valid and fulfilled, creating OK response', request)
+        return serialization.json_response(json_response, status=200)
     else:
-        logging.info(f'post_orders_assign: request={request}; validation error occurred, raising 400')
+        logging.info('post_orders_assign: request=%s; invalid json or validation error occurred, raising 400', request)
         raise web.HTTPBadRequest  #
 
 
-async def post_orders_complete(request: web.Request):
+async def post_orders_assign_batch(request: web.Request):
     """
-    Handler for "POST /orders/complete" request. Marks passed orders as completed.
-    See the docs for the complete description.
+    Handler for "POST /orders/assign/batch" request. Assigns available and appropriate orders to each of the couriers,
+    no order is given to two of them.
     aiohttp-level communication is done here, while the actual communication with the database is done in associated db_connection function
     :param request: HTTP-request passed by aiohttp
     :return: Response derived from web.StreamResponse
     """
+    logging.info('post_orders_assign_batch: request=%s; entered', request)
+    # VERB = 'POST'
+    # URI = '/orders/assign/batch'
     try:
-        data = await request.json()
+        data = await request.json(loads=serialization.loads)
     except json.decoder.JSONDecodeError:
-        logging.error(msg=f'post_orders_complete: request={request} invalid json, raised 400')
+        logging.info('post_orders_assign_batch: request=%s; invalid json, raised 400', request)
         raise web.HTTPBadRequest
 
-    if type(data) is not dict or set(data.keys()) != {"courier_id", "order_id", "complete_time"}:
-        logging.info(f'post_orders_complete: request={request}; invalid json, raised 400')
+    all_valid, result = await db_connection.post_orders_assign_batch_execute_queries(data)
+    if all_valid:
+        logging.info('post_orders_assign_batch: request=%s; request is valid and fulfilled, creating OK response', request)
+        return serialization.json_response({'couriers': result}, status=200)
+    elif result:
+        logging.info('post_orders_assign_batch: request=%s; unknown couriers in request, creating validation_error response', request)
+        json_response = {'validation_error': {"couriers": [{'id': x} for x in result]}}
+        return serialization.json_response(json_response, status=400, reason='Bad Request')
+    else:
+        logging.info('post_orders_assign_batch: request=%s; invalid json or error occurred, raising 400', request)
         raise web.HTTPBadRequest
 
-    all_valid, resp_data = await db_connection.post_orders_complete_execute_queries(data)
+
+async def post_orders_complete(request: web.Request):
+    """
+    Handler for "POST /orders/complete" request. Marks passed orders as completed.
+    See the docs for the complete description.
+    aiohttp-level communication is done here, while the actual work with the data is done by the storage backend, see storage.py
+    :param request: HTTP-request passed by aiohttp
+    :return: Response derived from web.StreamResponse
+    """
+    try:
+        data = await request.json(loads=serialization.loads)
+    except json.decoder.JSONDecodeError:
+        logging.error('post_orders_complete: request=%s invalid json, raised 400', request)
+        raise web.HTTPBadRequest
+
+    all_valid, resp_data = await storage.backend.complete(data)
 
     if all_valid:
-        logging.info(msg=f'post_orders_complete: request={request};  request has been fulfilled, creating response')
-        return web.json_response(json.dumps(resp_data), status=200)
+        logging.info('post_orders_complete: request=%s;  request has been fulfilled, creating response', request)
+        return serialization.json_response(resp_data, status=200)
     else:
-        logging.error(msg=f'post_orders_complete: request={request}; request is invalid, creating response')
+        logging.error('post_orders_complete: request=%s; request is invalid, creating response', request)
         raise web.HTTPBadRequest
 
 
@@ -166,10 +229,76 @@ async def get_root(request: web.Request):
 
 
 async def get_couriers_id(request: web.Request):
-    cour_id = request.match_info.get('courier_id')
+    cour_id = int(request.match_info['courier_id'])  # the route lets only digits through
 
-    all_valid, data = await db_connection.get_couriers_id_execute_queries(cour_id)
-    if all_valid:
-        return web.json_response(json.dumps(data), status=200)
-    else:
+    all_valid, profile = await storage.backend.get_courier(cour_id)
+    if not all_valid:
+        raise web.HTTPBadRequest
+    if profile is None:
+        raise web.HTTPNotFound
+    if cache.etag_matches(request.headers.get('If-None-Match'), profile.etag):
+        return web.Response(status=304, headers={'ETag': profile.etag})
+    # the profile is encoded once, when it`s read from the DB
+    return web.Response(body=profile.body, status=200, content_type=serialization.CONTENT_TYPE,
+                        headers={'ETag': profile.etag})
+
+
+async def get_orders_export(request: web.Request):
+    """
+    Handler for "GET /orders/export" request. Streams all orders, the completed and archived ones included, as NDJSON
+    in the order of their ids. The query may narrow them down by region, courier_id, completed_from and completed_to
+    (RFC 3339), stop after limit orders, and resume the export after the order_id of the last order received.
+    :param request: HTTP-request passed by aiohttp
+    :return: StreamResponse with the body written while the orders are read from the DB
+    """
+    try:
+        filters = validation.EXPORT_ORDERS(dict(request.query))
+    except validation.ValidationError as error:
+        logging.info('get_orders_export: request=%s; invalid query: %s, raised 400', request, error)
+        raise web.HTTPBadRequest
+    logging.info('get_orders_export: request=%s; exporting orders, filters: %s', request, filters)
+    return await streaming.write_ndjson(request, db_connection.export_orders(filters))
+
+
+async def get_assignments_export(request: web.Request):
+    """
+    Handler for "GET /assignments/export" request. Streams all assignments with the ids of their orders as NDJSON
+    in the order of their ids. The query may narrow them down by courier_id, assigned_from and assigned_to (RFC 3339),
+    stop after limit assignments, and resume the export after the assignment_id of the last assignment received.
+    :param request: HTTP-request passed by aiohttp
+    :return: StreamResponse with the body written while the assignments are read from the DB
+    """
+    try:
+        filters = validation.EXPORT_ASSIGNMENTS(dict(request.query))
+    except validation.ValidationError as error:
+        logging.info('get_assignments_export: request=%s; invalid query: %s, raised 400', request, error)
         raise web.HTTPBadRequest
+    logging.info('get_assignments_export: request=%s; exporting assignments, filters: %s', request, filters)
+    return await streaming.write_ndjson(request, db_connection.export_assignments(filters))
+
+
+async def get_metrics(request: web.Request):
+    """
+    Handler for "GET /metrics" request. Returns the metrics of this process in the Prometheus text format.
+    """
+    return web.Response(body=metrics.render().encode(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+async def get_ready(request: web.Request):
+    """
+    Handler for "GET /ready" request. The instance is ready once the schema is migrated, the pool of connections
+    is warmed up and the index of open orders is loaded, and until it starts shutting down.
+    """
+    if not request.app.get('ready'):
+        return serialization.json_response({'status': 'not ready'}, status=503)
+    return serialization.json_response({'status': 'ready', 'schema_version': request.app.get('schema_version')})
+
+
+async def get_admin_traces(request: web.Request):
+    """
+    Handler for "GET /admin/traces" request. Returns the traces of the slow and the explicitly traced requests
+    kept by this process, newest first.
+    """
+    if not tracing.authorized(request):
+        raise web.HTTPUnauthorized(headers={'WWW-Authenticate': 'Bearer'})
+    return serialization.json_response({'traces': tracing.recent()}, default=str)
@@ -0,0 +1,130 @@
+"""
+Logging of the app. Records are put into a queue on the event loop and written by a QueueListener thread,
+so the loop never waits for the I/O of the handlers. Every record carries the id of the request it was made in,
+so the records of a request are correlated by it instead of by dumps of its payload.
+Payloads are logged only for a sample of the requests (cfg.LOG_PAYLOAD_SAMPLE_RATE), see payload.
+Messages are to be passed in %-style with the arguments separate, so they`re formatted only if the level is enabled.
+"""
+import contextvars
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import reprlib
+from typing import Optional
+
+from aiohttp import web
+
+import cfg
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+request_id = contextvars.ContextVar('request_id', default='-')
+_payload_sampled = contextvars.ContextVar('payload_sampled', default=False)
+_request_ids = itertools.count(1)
+_listener: Optional[logging.handlers.QueueListener] = None
+
+_payload_repr = reprlib.Repr()
+_payload_repr.maxlevel = 4
+_payload_repr.maxlist = _payload_repr.maxdict = 10
+_payload_repr.maxstring = 100
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Adds the id of the current request to the records, it must run on the loop, where the context of the request is.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class _Payload:
+    __slots__ = ('_value',)
+
+    def __init__(self, value):
+        self._value = value
+
+    def __str__(self):
+        if not _payload_sampled.get():
+            return '<not sampled>'
+        return _payload_repr.repr(self._value)[:cfg.LOG_PAYLOAD_MAX_CHARS]
+
+
+def payload(value) -> _Payload:
+    """
+    :param value: payload of the request to be passed as an argument of a record
+    :return: object formatted as a shortened repr of the payload in the sampled requests and as a placeholder
+    in the rest of them, only when the record is actually emitted
+    """
+    return _Payload(value)
+
+
+def setup(level: str = None, stream=None, queued: bool = True):
+    """
+    Makes the root logger put the records into a queue written by a thread of QueueListener.
+    :param level: name of the level, cfg.LOG_LEVEL by default
+    :param stream: stream the records are written to, stderr by default
+    :param queued: False to write the records right away, in the process that forks the workers:
+    the thread of the listener doesn`t survive a fork
+    """
+    global _listener
+    stop()
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(RequestIdFilter())
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(logging.Formatter(cfg.LOG_FORMAT))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(level or cfg.LOG_LEVEL)
+    if not queued:
+        stream_handler.addFilter(RequestIdFilter())
+        root.addHandler(stream_handler)
+        return
+    root.addHandler(queue_handler)
+    _listener = logging.handlers.QueueListener(records, stream_handler)
+    _listener.start()
+
+
+def stop():
+    """
+    Writes the records left in the queue and stops the thread writing them.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def start_request(rid: Optional[str] = None) -> str:
+    """
+    Sets the id of the request handled in the current context and decides if its payload is logged.
+    :param rid: id of the request, a new one is made if it`s not passed
+    :return: id of the request
+    """
+    rid = (rid or f'{os.getpid()}-{next(_request_ids)}')[:64]
+    request_id.set(rid)
+    _payload_sampled.set(random.random() < cfg.LOG_PAYLOAD_SAMPLE_RATE)
+    return rid
+
+
+@web.middleware
+async def request_context(request: web.Request, handler):
+    """
+    Starts the context of the request with the id taken from its X-Request-ID header if there is one,
+    and returns the id in the X-Request-ID header of the response.
+    """
+    start_request(request.headers.get(REQUEST_ID_HEADER))
+    try:
+        response = await handler(request)
+    except web.HTTPException as error:
+        error.headers[REQUEST_ID_HEADER] = request_id.get()
+        raise
+    response.headers[REQUEST_ID_HEADER] = request_id.get()
+    return response
@@ -0,0 +1,198 @@
+"""
+In-process index of the orders that are open for assignment (not completed and not assigned),
+so the candidates for POST /orders/assign are found without scanning the orders in the DB.
+The index is only a hint: db_connection warms it up on startup, keeps it current on every change of the assignable
+orders and checks the candidates it returns against the DB when they are claimed.
+"""
+import bisect
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+MINUTES_IN_DAY = 24 * 60
+
+
+class OpenOrder:
+    __slots__ = ('order_id', 'weight', 'region', 'windows')
+
+    def __init__(self, order_id: int, weight: float, region: int, windows: List[Tuple[int, int]]):
+        self.order_id = order_id
+        self.weight = float(weight)
+        self.region = region
+        self.windows = windows  # delivery hours, list of half-open [start, stop) ranges of minutes of the day
+
+    def overlaps(self, hours: List[Tuple[int, int]]) -> bool:
+        return any(start < h_stop and h_start < stop for start, stop in self.windows for h_start, h_stop in hours)
+
+
+class IntervalTree:
+    """
+    Segment tree over the minutes of the day. Every [start, stop) range is stored in O(log D) nodes covering it,
+    so the ranges containing a minute are collected on the way from its leaf to the root. A range overlapping
+    [a, b) either contains minute a or starts inside [a, b), the latter is answered by a sorted list of starts,
+    so the overlap query takes O(log n + k).
+    """
+    __slots__ = ('_size', '_nodes', '_starts')
+
+    def __init__(self):
+        self._size = 1
+        while self._size < MINUTES_IN_DAY:
+            self._size *= 2
+        self._nodes = [None] * (2 * self._size)  # dicts {order_id: number of its ranges stored in the node}
+        self._starts = []  # sorted (start, order_id)
+
+    def _canonical_nodes(self, start: int, stop: int) -> Iterable[int]:
+        low, high = start + self._size, stop + self._size
+        while low < high:
+            if low & 1:
+                yield low
+                low += 1
+            if high & 1:
+                high -= 1
+                yield high
+            low //= 2
+            high //= 2
+
+    def add(self, order_id: int, start: int, stop: int):
+        for node in self._canonical_nodes(start, stop):
+            if self._nodes[node] is None:
+                self._nodes[node] = {}
+            self._nodes[node][order_id] = self._nodes[node].get(order_id, 0) + 1
+        bisect.insort(self._starts, (start, order_id))
+
+    def remove(self, order_id: int, start: int, stop: int):
+        for node in self._canonical_nodes(start, stop):
+            ids = self._nodes[node]
+            if ids[order_id] == 1:
+                del ids[order_id]
+            else:
+                ids[order_id] -= 1
+        index = bisect.bisect_left(self._starts, (start, order_id))
+        del self._starts[index]
+
+    def overlapping(self, start: int, stop: int, found: set):
+        """
+        Adds ids of the orders with a range overlapping [start, stop) to found.
+        """
+        node = start + self._size
+        while node:
+            if self._nodes[node]:
+                found.update(self._nodes[node])
+            node //= 2
+        low = bisect.bisect_left(self._starts, (start,))
+        high = bisect.bisect_left(self._starts, (stop,))
+        found.update(order_id for _, order_id in self._starts[low:high])
+
+
+class RegionIndex:
+    """
+    Open orders of one region, sorted by weight and stored in the interval tree by their delivery hours.
+    """
+    __slots__ = ('by_weight', 'windows')
+
+    def __init__(self):
+        self.by_weight = []  # sorted (weight, order_id)
+        self.windows = IntervalTree()
+
+    def add(self, order: OpenOrder):
+        bisect.insort(self.by_weight, (order.weight, order.order_id))
+        for start, stop in order.windows:
+            self.windows.add(order.order_id, start, stop)
+
+    def remove(self, order: OpenOrder):
+        del self.by_weight[bisect.bisect_left(self.by_weight, (order.weight, order.order_id))]
+        for start, stop in order.windows:
+            self.windows.remove(order.order_id, start, stop)
+
+    def __len__(self):
+        return len(self.by_weight)
+
+
+class OrderIndex:
+    """
+    Open orders indexed by region, then by weight and by delivery hours.
+    Changes made while the index is being rebuilt from the DB are journaled and replayed over the loaded snapshot.
+    """
+    SCAN_THRESHOLD = 64  # if no more orders of a region are light enough, their windows are checked one by one
+
+    def __init__(self):
+        self.ready = False  # the index is used by the assignment only after it`s loaded from the DB
+        self._orders: Dict[int, OpenOrder] = {}
+        self._regions: Dict[int, RegionIndex] = defaultdict(RegionIndex)
+        self._journal: Optional[list] = None  # (True, added OpenOrder) or (False, discarded order_id)
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, order_id: int):
+        return order_id in self._orders
+
+    def add(self, order: OpenOrder):
+        if self._journal is not None:
+            self._journal.append((True, order))
+        if order.order_id in self._orders:
+            return
+        self._orders[order.order_id] = order
+        self._regions[order.region].add(order)
+
+    def discard(self, order_id: int) -> Optional[OpenOrder]:
+        """
+        :return: removed order, None if it was not in the index
+        """
+        if self._journal is not None:
+            self._journal.append((False, order_id))
+        order = self._orders.pop(order_id, None)
+        if order is not None:
+            self._regions[order.region].remove(order)
+        return order
+
+    def candidates(self, regions: Iterable[int], max_weight: float, hours: List[Tuple[int, int]]) -> List[OpenOrder]:
+        """
+        :param regions: regions of the courier
+        :param max_weight: maximal weight of an order the courier can carry
+        :param hours: working hours of the courier as ranges of minutes of the day
+        :return: open orders matching the courier, sorted by weight
+        """
+        found = []
+        for region in regions:
+            region_index = self._regions.get(region)
+            if not region_index:
+                continue
+            light = bisect.bisect_right(region_index.by_weight, (max_weight, float('inf')))
+            if light <= self.SCAN_THRESHOLD:
+                # few orders are light enough, checking their windows is cheaper than querying the tree
+                found.extend(o for o in (self._orders[x] for _, x in region_index.by_weight[:light]) if o.overlaps(hours))
+            else:
+                ids = set()
+                for start, stop in hours:
+                    region_index.windows.overlapping(start, stop, ids)
+                found.extend(o for o in (self._orders[x] for x in ids) if o.weight <= max_weight)
+        found.sort(key=lambda o: (o.weight, o.order_id))
+        return found
+
+    def begin_rebuild(self):
+        """
+        Starts journaling the changes, must be called before the snapshot of open orders is read from the DB.
+        """
+        self._journal = []
+
+    def finish_rebuild(self, orders: Iterable[OpenOrder]):
+        """
+        Replaces the content of the index with the snapshot and replays the changes made since begin_rebuild.
+        """
+        journal, self._journal = self._journal or [], None
+        self._orders = {}
+        self._regions = defaultdict(RegionIndex)
+        for order in orders:
+            self.add(order)
+        for added, change in journal:
+            if added:
+                self.add(change)
+            else:
+                self.discard(change)
+        self.ready = True
+
+    def abort_rebuild(self):
+        self._journal = None
+
+
+index = OrderIndex()
@@ -0,0 +1,498 @@
+"""
+In-process storage engine of the API (cfg.STORAGE_BACKEND = 'memory'). Couriers, orders and assignments are records
+with __slots__ in dicts by their ids; the open orders are kept in a matching.OrderIndex, by region, by weight
+and in the interval tree by their delivery hours, so an assignment looks up its candidates the way the MySQL backend
+does with its index, and chooses among them by the same solver. Rating and earnings are aggregated on completion
+as in the tables couriers_regions_stats and couriers_earnings, and the encoded profile is kept until the courier
+changes. The event loop runs one operation at a time, there are no awaits inside of them, so every one is atomic.
+
+Durability: every write is appended to the journal (cfg.MEMORY_STORAGE_DIR/journal.ndjson) before it`s applied,
+fsynced if cfg.MEMORY_JOURNAL_FSYNC, and acknowledged only then. The journal keeps the writes, not their effects:
+the assignment keeps the orders the solver chose and the time, the rest is replayed by the same code that applied it.
+After cfg.MEMORY_SNAPSHOT_RECORDS writes the whole state is written to the snapshot (written aside and renamed over
+the previous one) and the journal is started anew. On startup the snapshot is loaded and the journal is replayed
+over it; a torn record at the end of the journal, the write a crash interrupted, is dropped, as it was never
+acknowledged. The state is kept by a single process, so the app is served by a single worker then.
+"""
+import datetime
+import logging
+import os
+from typing import AsyncIterable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+import cache
+import cfg
+import db_connection
+import matching
+import profiles
+import serialization
+import solver
+import storage
+import validation
+
+WEIGHTS = {'foot': 10, 'bike': 15, 'car': 50}  # carrying capacity by courier type, as the table weights is seeded
+JOURNAL_FILE = 'journal.ndjson'
+SNAPSHOT_FILE = 'snapshot.json'
+
+
+class Courier:
+    __slots__ = ('courier_id', 'courier_type', 'regions', 'working_hours', 'assignment', 'earnings', 'region_stats',
+                 'profile')
+
+    def __init__(self, courier_id: int, courier_type: str, regions: List[int], working_hours: List[Tuple[int, int]]):
+        self.courier_id = courier_id
+        self.courier_type = courier_type
+        self.regions = regions
+        self.working_hours = working_hours  # ranges of minutes of the day, in the order they were added
+        self.assignment: Optional[Assignment] = None  # current one, until none of its orders is left to deliver
+        self.earnings = 0
+        self.region_stats: Dict[int, list] = {}  # region -> [completed count, sum of delivery seconds]
+        self.profile: Optional[cache.Profile] = None  # encoded on the first GET after a change
+
+
+class Order:
+    __slots__ = ('order_id', 'weight', 'region', 'delivery_hours', 'courier_id', 'assignment', 'completed_at')
+
+    def __init__(self, order_id: int, weight: float, region: int, delivery_hours: List[Tuple[int, int]]):
+        self.order_id = order_id
+        self.weight = weight
+        self.region = region
+        self.delivery_hours = delivery_hours
+        self.courier_id: Optional[int] = None
+        self.assignment: Optional[Assignment] = None
+        self.completed_at: Optional[datetime.datetime] = None
+
+
+class Assignment:
+    __slots__ = ('assignment_id', 'courier_id', 'courier_type', 'assigned_at', 'last_completion', 'orders',
+                 'credited')
+
+    def __init__(self, assignment_id: int, courier_id: int, courier_type: str, assigned_at: datetime.datetime):
+        self.assignment_id = assignment_id
+        self.courier_id = courier_id
+        self.courier_type = courier_type  # the assignment is paid by the type the courier had when it was made
+        self.assigned_at = assigned_at
+        self.last_completion: Optional[datetime.datetime] = None
+        self.orders: List[Order] = []  # de-assigned orders are taken out
+        self.credited = False
+
+    def remaining(self) -> List[Order]:
+        return [x for x in self.orders if x.completed_at is None]
+
+
+def _stored(value: datetime.datetime) -> datetime.datetime:
+    """
+    :return: the time rounded to the second, as a TIMESTAMP column of MySQL stores it
+    """
+    return (value + datetime.timedelta(microseconds=500000)).replace(microsecond=0)
+
+
+def _hours(ranges: Iterable) -> List[Tuple[int, int]]:
+    return [(start, stop) for start, stop in ranges]
+
+
+def _overlaps(windows: Iterable[Tuple[int, int]], hours: Iterable[Tuple[int, int]]) -> bool:
+    # time ranges are half-open, so the ones that only touch each other don`t overlap
+    return any(start < h_stop and h_start < stop for start, stop in windows for h_start, h_stop in hours)
+
+
+class MemoryStorage(storage.Storage):
+    name = 'memory'
+
+    def __init__(self, directory: Optional[str]):
+        """
+        :param directory: where the journal and the snapshot are kept, None to keep nothing on disk
+        """
+        self.directory = directory
+        self.couriers: Dict[int, Courier] = {}
+        self.orders: Dict[int, Order] = {}
+        self.assignments: Dict[int, Assignment] = {}
+        self.open_orders = matching.OrderIndex()
+        self.open_orders.ready = True
+        self.sequence = 0  # number of the last write
+        self.last_assignment_id = 0
+        self._journal = None  # file the writes are appended to
+        self._journaled = 0  # writes in the journal since the snapshot
+
+    # persistence
+
+    def open(self):
+        """
+        Loads the snapshot, replays the journal over it and opens the journal for the writes that follow.
+        """
+        validation.COURIER_TYPES.update(WEIGHTS)
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'rb') as snapshot:
+                self._load_snapshot(serialization.loads(snapshot.read()))
+        journal_path = os.path.join(self.directory, JOURNAL_FILE)
+        replayed = 0
+        if os.path.exists(journal_path):
+            with open(journal_path, 'r+b') as journal:
+                valid_size = 0
+                for line in journal:
+                    try:
+                        record = serialization.loads(line) if line.endswith(b'\n') else None
+                    except ValueError:
+                        record = None
+                    if record is None:
+                        logging.warning('open: torn record at byte %s of the journal is dropped', valid_size)
+                        journal.truncate(valid_size)
+                        break
+                    valid_size += len(line)
+                    if record[0] <= self.sequence:
+                        continue  # written before the snapshot, the journal was not started anew yet
+                    self.sequence = record[0]
+                    self._apply(record[1:])
+                    replayed += 1
+        self._journaled = replayed
+        self._journal = open(journal_path, 'ab')
+        logging.info('open: %s couriers, %s orders, %s assignments loaded, %s writes replayed from the journal',
+                     len(self.couriers), len(self.orders), len(self.assignments), replayed)
+
+    def close(self):
+        if self._journal is not None:
+            self.snapshot()
+            self._journal.close()
+            self._journal = None
+
+    def _commit(self, record: list):
+        """
+        Journals the write and applies it to the state, the write is durable once this returns.
+        :raise db_connection.DBUnavailable: if the journal can`t be written, nothing is changed then
+        """
+        if self._journal is not None:
+            offset = self._journal.tell()
+            try:
+                self._journal.write(serialization.dumps([self.sequence + 1, *record]) + b'\n')
+                self._journal.flush()
+                if cfg.MEMORY_JOURNAL_FSYNC:
+                    os.fsync(self._journal.fileno())
+            except OSError as error:
+                try:
+                    self._journal.truncate(offset)
+                except OSError:
+                    pass
+                raise db_connection.DBUnavailable('journal', f'_commit: journal is not written: {error}') from error
+            self._journaled += 1
+        self.sequence += 1
+        self._apply(record)
+        if self._journal is not None and self._journaled >= cfg.MEMORY_SNAPSHOT_RECORDS:
+            self.snapshot()
+
+    def snapshot(self):
+        """
+        Writes the whole state to the snapshot and starts the journal anew.
+        """
+        state = {'sequence': self.sequence,
+                 'couriers': [[x.courier_id, x.courier_type, x.regions, x.working_hours, x.earnings,
+                               [[region, *stats] for region, stats in x.region_stats.items()],
+                               None if x.assignment is None else x.assignment.assignment_id]
+                              for x in self.couriers.values()],
+                 'assignments': [[x.assignment_id, x.courier_id, x.courier_type, x.assigned_at.isoformat(),
+                                  None if x.last_completion is None else x.last_completion.isoformat(), x.credited]
+                                 for x in self.assignments.values()],
+                 'orders': [[x.order_id, x.weight, x.region, x.delivery_hours, x.courier_id,
+                             None if x.assignment is None else x.assignment.assignment_id,
+                             None if x.completed_at is None else x.completed_at.isoformat()]
+                            for x in self.orders.values()]}
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        with open(path + '.tmp', 'wb') as snapshot:
+            snapshot.write(serialization.dumps(state))
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(path + '.tmp', path)
+        # the records of the journal are skipped by their sequence if the crash comes before it`s emptied
+        self._journal.truncate(0)
+        self._journal.seek(0)
+        self._journaled = 0
+        logging.info('snapshot: state after write %s is written', self.sequence)
+
+    def _load_snapshot(self, state: Dict):
+        self.sequence = state['sequence']
+        for assignment_id, courier_id, courier_type, assigned_at, last_completion, credited in state['assignments']:
+            assignment = Assignment(assignment_id, courier_id, courier_type, datetime.datetime.fromisoformat(assigned_at))
+            assignment.last_completion = None if last_completion is None else datetime.datetime.fromisoformat(last_completion)
+            assignment.credited = credited
+            self.assignments[assignment_id] = assignment
+            self.last_assignment_id = max(self.last_assignment_id, assignment_id)
+        for courier_id, courier_type, regions, hours, earnings, region_stats, assignment_id in state['couriers']:
+            courier = Courier(courier_id, courier_type, regions, _hours(hours))
+            courier.earnings = earnings
+            courier.region_stats = {region: [count, seconds] for region, count, seconds in region_stats}
+            courier.assignment = None if assignment_id is None else self.assignments[assignment_id]
+            self.couriers[courier_id] = courier
+        for order_id, weight, region, hours, courier_id, assignment_id, completed_at in state['orders']:
+            order = Order(order_id, weight, region, _hours(hours))
+            order.courier_id = courier_id
+            order.completed_at = None if completed_at is None else datetime.datetime.fromisoformat(completed_at)
+            if assignment_id is not None:
+                order.assignment = self.assignments[assignment_id]
+                order.assignment.orders.append(order)
+            elif order.delivery_hours:
+                self.open_orders.add(matching.OpenOrder(order_id, weight, region, order.delivery_hours))
+            self.orders[order_id] = order
+
+    # application of the journaled writes, the same for the live ones and the replayed ones
+
+    def _apply(self, record: list):
+        operation, *args = record
+        getattr(self, f'_apply_{operation}')(*args)
+
+    def _apply_couriers(self, rows: List[list]):
+        for courier_id, courier_type, regions, hours in rows:
+            self.couriers[courier_id] = Courier(courier_id, courier_type, regions, _hours(hours))
+
+    def _apply_orders(self, rows: List[list]):
+        for order_id, weight, region, hours in rows:
+            order = Order(order_id, weight, region, _hours(hours))
+            self.orders[order_id] = order
+            if order.delivery_hours:
+                self.open_orders.add(matching.OpenOrder(order_id, weight, region, order.delivery_hours))
+
+    def _apply_patch(self, courier_id: int, courier_type: Optional[str], regions: Optional[List[int]],
+                     hours: Optional[List[list]], overloaded: List[int] = ()):
+        """
+        :param overloaded: ids of the orders the new type can`t carry together with the rest, see patch_courier
+        """
+        courier = self.couriers[courier_id]
+        courier.profile = None
+        ineligible = self._ineligible(courier, courier_type, regions, hours)
+        if courier_type is not None:
+            courier.courier_type = courier_type
+        if regions is not None:
+            new = set(regions)
+            courier.regions = [x for x in courier.regions if x in new] + sorted(new.difference(courier.regions))
+        if hours is not None:
+            new = set(_hours(hours))
+            courier.working_hours = ([x for x in courier.working_hours if x in new]
+                                     + sorted(new.difference(courier.working_hours)))
+
+        assignment = courier.assignment
+        if assignment is None:
+            return
+        overloaded = set(overloaded)
+        deassigned = [x for x in assignment.remaining() if ineligible(x) or x.order_id in overloaded]
+        if not deassigned:
+            return
+        for order in deassigned:
+            order.courier_id = order.assignment = None
+            assignment.orders.remove(order)
+            self.open_orders.add(matching.OpenOrder(order.order_id, order.weight, order.region, order.delivery_hours))
+        # the orders delivered before the patch finish the assignment if none is left to deliver
+        self._credit(assignment)
+        if not assignment.remaining():
+            courier.assignment = None
+
+    @staticmethod
+    def _ineligible(courier: Courier, courier_type: Optional[str], regions: Optional[List[int]],
+                    hours: Optional[List[list]]) -> Callable[[Order], bool]:
+        """
+        :return: check of an order of the courier it can`t deliver after the patch; only the fields that narrowed down
+        what the courier can deliver are checked against its orders
+        """
+        changed_type = courier_type if courier_type is not None and courier_type != courier.courier_type else None
+        changed_regions = changed_hours = None
+        if regions is not None and not set(courier.regions).issubset(regions):
+            changed_regions = set(regions)
+        if hours is not None and not set(courier.working_hours).issubset(_hours(hours)):
+            changed_hours = set(_hours(hours))
+        max_weight = WEIGHTS.get(changed_type, 0)
+        return lambda x: (changed_type is not None and x.weight > max_weight
+                          or changed_regions is not None and x.region not in changed_regions
+                          or changed_hours is not None and not _overlaps(x.delivery_hours, changed_hours))
+
+    def _apply_assign(self, courier_id: int, assignment_id: int, assigned_at: str, order_ids: List[int]):
+        courier = self.couriers[courier_id]
+        assignment = Assignment(assignment_id, courier_id, courier.courier_type,
+                                datetime.datetime.fromisoformat(assigned_at))
+        for order_id in order_ids:
+            order = self.orders[order_id]
+            order.courier_id = courier_id
+            order.assignment = assignment
+            assignment.orders.append(order)
+            self.open_orders.discard(order_id)
+        self.assignments[assignment_id] = assignment
+        self.last_assignment_id = assignment_id
+        courier.assignment = assignment
+
+    def _apply_complete(self, courier_id: int, order_id: int, complete_time: str):
+        complete_time = datetime.datetime.fromisoformat(complete_time)
+        order = self.orders[order_id]
+        assignment = order.assignment
+        order.completed_at = _stored(complete_time)
+        # the delivery takes the time since the previous completion in the same assignment, or since the assignment
+        previous = assignment.last_completion or assignment.assigned_at
+        seconds = max(0, round((complete_time - previous).total_seconds()))  # the late ones are counted as instant
+        if complete_time > previous:
+            assignment.last_completion = _stored(complete_time)
+        courier = self.couriers[courier_id]
+        courier.profile = None
+        stats = courier.region_stats.setdefault(order.region, [0, 0])
+        stats[0] += 1
+        stats[1] += seconds
+        self._credit(assignment)
+        if courier.assignment is not None and not courier.assignment.remaining():
+            courier.assignment = None
+
+    def _credit(self, assignment: Assignment):
+        """
+        Adds the earnings for the assignment to its courier if none of its orders is left to deliver and at least one
+        of them was delivered, once.
+        """
+        if assignment.credited or not assignment.orders or assignment.remaining():
+            return
+        assignment.credited = True
+        courier = self.couriers[assignment.courier_id]
+        courier.earnings += cfg.EARNINGS_BASE * cfg.EARNINGS_COEFFICIENTS.get(assignment.courier_type, 0)
+        courier.profile = None
+
+    # operations of the API, see storage.Storage
+
+    async def post_couriers(self, json_request: Dict) -> (bool, List):
+        items = json_request['data']
+        return self._post('couriers', self.couriers, 'courier_id',
+                          [(items, *validation.validate_batch(items, validation.COURIER))])
+
+    async def post_couriers_stream(self, batches: AsyncIterable[List]) -> (bool, List):
+        # the whole body is read before anything is written, so a malformed one writes nothing
+        seen_ids = set()
+        return self._post('couriers', self.couriers, 'courier_id',
+                          [(items, *validation.validate_batch(items, validation.COURIER, seen_ids))
+                           async for items in batches])
+
+    async def post_orders(self, json_request: Dict) -> (bool, List[int]):
+        items = json_request['data']
+        return self._post('orders', self.orders, 'order_id', [(items, *validation.validate_batch(items, validation.ORDER))])
+
+    async def post_orders_stream(self, batches: AsyncIterable[List]) -> (bool, List[int]):
+        seen_ids = set()
+        return self._post('orders', self.orders, 'order_id',
+                          [(items, *validation.validate_batch(items, validation.ORDER, seen_ids))
+                           async for items in batches])
+
+    def _post(self, operation: str, registered: Dict, id_key: str, batches: List[tuple]) -> (bool, List):
+        """
+        Writes the valid items that are not registered yet.
+        :param batches: (items, valid, invalid) of the request, see validation.validate_batch
+        :return: see db_connection.post_couriers_execute_queries
+        """
+        rows = []
+        invalid_ids = []
+        for items, valid, invalid in batches:
+            invalid = list(invalid)
+            for index, row in valid:
+                if row[0] in registered:
+                    invalid.append(index)
+                elif operation == 'orders':
+                    rows.append([row[0], round(row[1], 2), *row[2:]])  # as decimal(5,2) keeps the weight
+                else:
+                    rows.append(list(row))
+            invalid_ids.extend(validation.ids_at(items, id_key, invalid))
+        if rows:
+            self._commit([operation, rows])
+        if invalid_ids:
+            return False, invalid_ids
+        return True, [row[0] for row in rows]
+
+    async def patch_courier(self, courier_id: int, json_request: Dict) -> (bool, Dict):
+        try:
+            patch = validation.COURIER_PATCH(json_request)
+        except validation.ValidationError as error:
+            logging.info('patch_courier: invalid patch: %s', error)
+            return False, {}
+        courier = self.couriers.get(courier_id)
+        if courier is None:
+            logging.info('patch_courier: courier %s not found', courier_id)
+            return False, {}
+        courier_type, regions, hours = patch.get('courier_type'), patch.get('regions'), patch.get('working_hours')
+        overloaded = []
+        if courier.assignment is not None and courier_type is not None and courier_type != courier.courier_type:
+            # the orders left must fit the capacity of the new type together, they are chosen by the solver here,
+            # so the journal keeps the choice and the replay doesn`t depend on cfg.ASSIGN_OBJECTIVE
+            ineligible = self._ineligible(courier, courier_type, regions, hours)
+            left = sorted((x.order_id, x.weight) for x in courier.assignment.remaining() if not ineligible(x))
+            kept = set(solver.select_orders(left, WEIGHTS.get(courier_type, 0)))
+            overloaded = [x for x, _ in left if x not in kept]
+        self._commit(['patch', courier_id, courier_type, regions, hours, overloaded])
+        profile = self._profile(courier)
+        return True, {key: profile.data[key] for key in ('courier_id', 'courier_type', 'regions', 'working_hours')}
+
+    async def assign(self, json_request: Dict) -> (bool, Dict):
+        try:
+            courier_id, = validation.ASSIGN(json_request)
+        except validation.ValidationError as error:
+            logging.info('assign: invalid request: %s', error)
+            return False, {}
+        courier = self.couriers.get(courier_id)
+        if courier is None:
+            logging.info('assign: courier with id = %s not found', courier_id)
+            return False, {}
+        if courier.assignment is None:
+            max_weight = WEIGHTS.get(courier.courier_type, 0)
+            candidates = self.open_orders.candidates(courier.regions, max_weight, courier.working_hours)
+            chosen = solver.select_orders([(x.order_id, x.weight) for x in candidates], max_weight)
+            if not chosen:
+                return True, {'orders': []}
+            assigned_at = datetime.datetime.utcnow().replace(microsecond=0)
+            self._commit(['assign', courier_id, self.last_assignment_id + 1, assigned_at.isoformat(), sorted(chosen)])
+        remaining = courier.assignment.remaining()
+        return True, {'orders': [{'id': x.order_id} for x in sorted(remaining, key=lambda x: x.order_id)],
+                      'assign_time': courier.assignment.assigned_at.isoformat()}
+
+    async def complete(self, json_request: Dict) -> (bool, Dict):
+        try:
+            courier_id, order_id, complete_time = validation.COMPLETE(json_request)
+        except validation.ValidationError as error:
+            logging.info('complete: invalid request: %s', error)
+            return False, {}
+        order = self.orders.get(order_id)
+        if order is None or order.courier_id != courier_id:
+            logging.info('complete: order_id=%s; order not found or assigned to another courier', order_id)
+            return False, {}
+        if order.completed_at is None:  # repeated completion is answered the same way, but must not be counted twice
+            self._commit(['complete', courier_id, order_id, complete_time.isoformat()])
+        return True, {'order_id': order_id}
+
+    async def get_courier(self, courier_id: int) -> (bool, Optional[cache.Profile]):
+        courier = self.couriers.get(courier_id)
+        if courier is None:
+            return True, None
+        return True, self._profile(courier)
+
+    def _profile(self, courier: Courier) -> cache.Profile:
+        if courier.profile is None:
+            data = {'courier_id': courier.courier_id, 'courier_type': courier.courier_type,
+                    'regions': sorted(courier.regions),  # in the order MySQL reads them by its covering indexes
+                    'working_hours': [profiles.format_time_range(*x) for x in sorted(courier.working_hours)]}
+            rating = profiles.rating([{'completed_count': count, 'delivery_seconds_sum': seconds}
+                                      for count, seconds in courier.region_stats.values()])
+            if rating is not None:
+                data['rating'] = rating
+            data['earnings'] = courier.earnings
+            courier.profile = cache.make_profile(data)
+        return courier.profile
+
+
+async def open_memory_storage(app: web.Application):
+    """
+    on_startup hook of the application, loads the state kept in cfg.MEMORY_STORAGE_DIR and makes it the backend.
+    :param app: application that is being started
+    """
+    engine = MemoryStorage(cfg.MEMORY_STORAGE_DIR)
+    engine.open()
+    storage.backend = engine
+
+
+async def close_memory_storage(app: web.Application):
+    """
+    on_cleanup hook of the application, writes the snapshot and closes the journal.
+    :param app: application that is being shut down
+    """
+    if isinstance(storage.backend, MemoryStorage):
+        storage.backend.close()
+        storage.backend = storage.MySQLStorage()
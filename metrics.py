@@ -0,0 +1,184 @@
+"""
+Metrics of the app in the Prometheus text format, served at GET /metrics.
+Every labelled child of a metric is created on its first use with all its buckets, after that recording a value
+only increments numbers, so the instrumentation of the hot path costs a dict lookup and a bisect.
+Labels are bounded: routes are taken by their patterns and queries by their statement and table, see db_connection.
+"""
+import bisect
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from aiohttp import web
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Family:
+    """
+    A metric with its children, one per combination of the values of the labels.
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.children: Dict[tuple, object] = {}
+        if not labelnames:
+            self.labels()  # the only child is exported from the start
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = Histogram(self.buckets) if self.kind == 'histogram' else Counter()
+            self.children[values] = child
+        return child
+
+    def samples(self) -> Iterable[Tuple[str, tuple, float]]:
+        for values, child in sorted(self.children.items()):
+            labels = tuple(zip(self.labelnames, values))
+            if self.kind == 'histogram':
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                    cumulative += count
+                    yield '_bucket', labels + (('le', _format_value(bound)),), cumulative
+                yield '_sum', labels, child.sum
+                yield '_count', labels, cumulative
+            else:
+                yield '', labels, child.value
+
+
+class CallbackFamily(Family):
+    """
+    A metric read at the time of the scrape from the state kept elsewhere, e.g. the pool of connections.
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: Tuple[str, ...],
+                 callback: Callable[[], Iterable[Tuple[tuple, float]]]):
+        super().__init__(name, documentation, kind, labelnames)
+        self.callback = callback
+
+    def samples(self) -> Iterable[Tuple[str, tuple, float]]:
+        for values, value in self.callback():
+            yield '', tuple(zip(self.labelnames, values)), value
+
+
+_families: List[Family] = []
+
+
+def _register(family: Family) -> Family:
+    _families.append(family)
+    return family
+
+
+def register_callback(name: str, documentation: str, kind: str, labelnames: Tuple[str, ...],
+                      callback: Callable[[], Iterable[Tuple[tuple, float]]]):
+    """
+    :param kind: 'counter' or 'gauge'
+    :param callback: returns (values of the labels, value) of every child of the metric
+    """
+    _register(CallbackFamily(name, documentation, kind, labelnames, callback))
+
+
+http_requests = _register(Family('http_requests_total', 'Requests served, by route and status.', 'counter',
+                                 ('method', 'route', 'status')))
+http_request_duration = _register(Family('http_request_duration_seconds', 'Time to serve a request, by route.',
+                                         'histogram', ('method', 'route')))
+db_query_duration = _register(Family('db_query_duration_seconds', 'Time spent in a query, by query.', 'histogram',
+                                     ('query',)))
+db_query_rows = _register(Family('db_query_rows_total', 'Rows returned or affected by a query, by query.', 'counter',
+                                 ('query',)))
+db_rollbacks = _register(Family('db_transaction_rollbacks_total', 'Transactions rolled back.', 'counter'))
+db_retries = _register(Family('db_transaction_retries_total', 'Statements or transactions run again, by reason.',
+                              'counter', ('reason',)))
+db_unavailable = _register(Family('db_unavailable_total', 'Requests answered 503 because the DB was unavailable, '
+                                   'by reason.', 'counter', ('reason',)))
+db_reads = _register(Family('db_reads_total', 'Reads routed between the primary and the replicas, by the server that '
+                             'served them.', 'counter', ('server',)))
+db_pool_acquire_wait = _register(Family('db_pool_acquire_wait_seconds', 'Time waited for a connection of the pool.',
+                                        'histogram'))
+admission_shed = _register(Family('admission_shed_total', 'Requests answered 503 by the admission control, by class '
+                                   'and reason.', 'counter', ('class', 'reason')))
+admission_wait = _register(Family('admission_wait_seconds', 'Time the admitted requests waited for their turn, '
+                                  'by class.', 'histogram', ('class',)))
+completion_group_size = _register(Family('completion_group_size', 'Completions written by one transaction '
+                                         'of the group commit.', 'histogram', buckets=SIZE_BUCKETS))
+
+
+def observe_query(name: str, seconds: float, rows: int):
+    db_query_duration.labels(name).observe(seconds)
+    db_query_rows.labels(name).inc(rows)
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def render() -> str:
+    lines = []
+    for family in _families:
+        lines.append(f'# HELP {family.name} {family.documentation}')
+        lines.append(f'# TYPE {family.name} {family.kind}')
+        for suffix, labels, value in family.samples():
+            if labels:
+                label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+                lines.append(f'{family.name}{suffix}{{{label_text}}} {_format_value(value)}')
+            else:
+                lines.append(f'{family.name}{suffix} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+@web.middleware
+async def middleware(request: web.Request, handler):
+    """
+    Records the latency and the status of every request under the pattern of its route.
+    """
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as error:
+        status = error.status
+        raise
+    finally:
+        route = request.match_info.route.resource
+        route = route.canonical if route is not None else 'unmatched'
+        http_request_duration.labels(request.method, route).observe(time.perf_counter() - start)
+        http_requests.labels(request.method, route, status).inc()
@@ -0,0 +1,335 @@
+"""
+Versioned migrations of the schema of the app. Every migration is applied once, in the order of its version,
+and recorded in the table schema_version. DDL statements of MySQL commit implicitly, so a migration interrupted
+halfway is applied again on the next start, every migration has to be safe to repeat.
+The schema is migrated on startup of the app (migrate_on_startup). When it`s already current that costs one query,
+so restarts of the instances don`t run any DDL. Instances started at once take turns through a named lock,
+only the first one migrates and the others find the schema current.
+Usage: python migrations.py
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, NamedTuple, Set
+
+import aiomysql
+from aiohttp import web
+
+import cfg
+
+_NO_SUCH_TABLE = 1146  # error code of MySQL
+
+
+async def create_tables(cur: aiomysql.Cursor):
+    """
+    Creates the tables of the app in their current form, the tables that already exist are left as they are.
+    :param cur: cursor of a connection using the database of the app
+    """
+    await cur.execute('''CREATE TABLE IF NOT EXISTS `weights` 
+        (
+            `courier_type` char(10) NOT NULL,
+            `max_weight` tinyint unsigned NOT NULL,
+            PRIMARY KEY (`courier_type`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci''')
+
+    await cur.execute('''INSERT IGNORE INTO `weights` VALUES ("foot", 10), ("bike", 15), ("car", 50)''')
+
+    await cur.execute('''CREATE TABLE IF NOT EXISTS `assignments` 
+        (
+            `assignment_id` mediumint unsigned NOT NULL AUTO_INCREMENT,
+            `assignment_timestamp` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            `courier_id` smallint unsigned DEFAULT NULL,
+            `courier_type` char(10) DEFAULT NULL,
+            `last_completion_timestamp` timestamp NULL DEFAULT NULL,
+            `is_credited` tinyint(1) NOT NULL DEFAULT 0,
+            PRIMARY KEY (`assignment_id`),
+            KEY `courier_id` (`courier_id`)
+        ) ENGINE=InnoDB AUTO_INCREMENT=8 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci''')
+
+    await cur.execute('''CREATE TABLE IF NOT EXISTS `couriers` 
+        (
+            `courier_id` smallint unsigned NOT NULL,
+            `courier_type` char(10) DEFAULT NULL,
+            `current_assignment_id` mediumint unsigned DEFAULT NULL,
+            PRIMARY KEY (`courier_id`),
+            KEY `courier_type` (`courier_type`),
+            KEY `current_assignment_id` (`current_assignment_id`),
+            CONSTRAINT `couriers_ibfk_1` FOREIGN KEY (`courier_type`) REFERENCES `weights` (`courier_type`) 
+            ON DELETE SET NULL ON UPDATE CASCADE,
+            CONSTRAINT `couriers_ibfk_2` FOREIGN KEY (`current_assignment_id`) REFERENCES `assignments` (`assignment_id`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci''')
+
+    await cur.execute('''CREATE TABLE IF NOT EXISTS `couriers_working_hours` 
+        (
+            `relation_id` mediumint unsigned NOT NULL AUTO_INCREMENT,
+            `courier_id` smallint unsigned NOT NULL,
+            `start_minute` smallint unsigned NOT NULL,
+            `stop_minute` smallint unsigned NOT NULL,
+            PRIMARY KEY (`relation_id`),
+            KEY `courier_id` (`courier_id`),
+            KEY `working_interval` (`courier_id`, `start_minute`, `stop_minute`),
+            CONSTRAINT `couriers_working_hours_ibfk_1` FOREIGN KEY (`courier_id`) REFERENCES `couriers` (`courier_id`) 
+            ON DELETE CASCADE ON UPDATE CASCADE
+        ) ENGINE=InnoDB AUTO_INCREMENT=35 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci''')
+
+    await cur.execute('''CREATE TABLE IF NOT EXISTS `couriers_regions` 
+        (
+            `relation_id` mediumint unsigned NOT NULL AUTO_INCREMENT,
+            `courier_id` smallint unsigned DEFAULT NULL,
+            `region` tinyint unsigned NOT NULL,
+              PRIMARY KEY (`relation_id`),
+              KEY `courier_id` (`courier_id`),
+              KEY `courier_region` (`courier_id`, `region`),
+              CONSTRAINT `couriers_regions_ibfk_1` FOREIGN KEY (`courier_id`) REFERENCES `couriers` (`courier_id`) ON DELETE CASCADE ON UPDATE CASCADE
+        ) ENGINE=InnoDB AUTO_INCREMENT=154 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci''')
+
+    await cur.execute('''CREATE TABLE IF NOT EXISTS `orders` 
+        (
+            `order_id` int unsigned NOT NULL AUTO_INCREMENT,
+            `weight` decimal(5,2) NOT NULL,
+            `region` tinyint unsigned NOT NULL,
+            `assigned_courier_id` smallint unsigned DEFAULT NULL,
+            `is_completed` tinyint(1) NOT NULL,
+            `assignment_id` mediumint unsigned DEFAULT NULL,
+            `completion_timestamp` timestamp NULL DEFAULT NULL,
+            PRIMARY KEY (`order_id`),
+            KEY `assigned_courier_id` (`assigned_courier_id`),
+            KEY `assignment_id` (`assignment_id`),
+            KEY `weight_index` (`weight`),
+            KEY `region_index` (`region`),
+            KEY `open_orders` (`is_completed`, `assigned_courier_id`, `region`, `weight`),
+            CONSTRAINT `orders_ibfk_1` FOREIGN KEY (`assigned_courier_id`) REFERENCES `couriers` (`courier_id`) 
+            ON DELETE SET NULL ON UPDATE CASCADE,
+            CONSTRAINT `orders_ibfk_2` FOREIGN KEY (`assignment_id`) REFERENCES `assignments` (`assignment_id`) 
+            ON DELETE SET NULL ON UPDATE CASCADE
+        ) ENGINE=InnoDB AUTO_INCREMENT=40 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci''')
+
+    await cur.execute('''CREATE TABLE IF NOT EXISTS `delivery_hours_of_orders` 
+        (
+            `order_id` int unsigned DEFAULT NULL,
+            `start_minute` smallint unsigned NOT NULL,
+            `stop_minute` smallint unsigned NOT NULL,
+            KEY `order_id` (`order_id`),
+            KEY `delivery_interval` (`start_minute`, `stop_minute`, `order_id`),
+            CONSTRAINT `delivery_hours_of_orders_ibfk_1` FOREIGN KEY (`order_id`) REFERENCES `orders` (`order_id`) 
+            ON DELETE CASCADE ON UPDATE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci''')
+
+    await cur.execute('''CREATE TABLE IF NOT EXISTS `couriers_regions_stats` 
+        (
+            `courier_id` smallint unsigned NOT NULL,
+            `region` tinyint unsigned NOT NULL,
+            `completed_count` int unsigned NOT NULL,
+            `delivery_seconds_sum` bigint unsigned NOT NULL,
+            PRIMARY KEY (`courier_id`, `region`),
+            CONSTRAINT `couriers_regions_stats_ibfk_1` FOREIGN KEY (`courier_id`) REFERENCES `couriers` (`courier_id`) 
+            ON DELETE CASCADE ON UPDATE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci''')
+
+    await cur.execute('''CREATE TABLE IF NOT EXISTS `couriers_earnings` 
+        (
+            `courier_id` smallint unsigned NOT NULL,
+            `completed_assignments` int unsigned NOT NULL,
+            `earnings` bigint unsigned NOT NULL,
+            PRIMARY KEY (`courier_id`),
+            CONSTRAINT `couriers_earnings_ibfk_1` FOREIGN KEY (`courier_id`) REFERENCES `couriers` (`courier_id`) 
+            ON DELETE CASCADE ON UPDATE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci''')
+
+
+async def migrate_time_ranges_to_minutes(cur: aiomysql.Cursor):
+    """
+    Converts TIME columns time_range_start and time_range_stop of the tables with working and delivery hours,
+    left by the previous versions of the schema, into start_minute and stop_minute, minutes of the day,
+    and adds the indexes the overlap search uses. Tables already in the current schema are left as they are.
+    :param cur: cursor of a connection using the database of the app
+    """
+    indexes = {'couriers_working_hours': 'ADD KEY `working_interval` (`courier_id`, `start_minute`, `stop_minute`)',
+               'delivery_hours_of_orders': 'ADD KEY `delivery_interval` (`start_minute`, `stop_minute`, `order_id`)'}
+    for table, index in indexes.items():
+        # every step is checked against the columns present, DDL commits implicitly, so the migration
+        # may have been interrupted between the steps; the final ALTER is atomic
+        columns = await _columns(cur, table)
+        if 'time_range_start' not in columns:
+            continue
+        # working hours could be stored as NULLs if STR_TO_DATE didn`t parse them, those never matched any order
+        await cur.execute(f'DELETE FROM `{table}` WHERE time_range_start IS NULL OR time_range_stop IS NULL')
+        added = [f'ADD COLUMN `{x}` smallint unsigned NOT NULL DEFAULT 0'
+                 for x in ('start_minute', 'stop_minute') if x not in columns]
+        if added:
+            await cur.execute(f'ALTER TABLE `{table}` {", ".join(added)}')
+        await cur.execute(f'''UPDATE `{table}` SET start_minute = TIME_TO_SEC(time_range_start) DIV 60,
+            stop_minute = TIME_TO_SEC(time_range_stop) DIV 60''')
+        await cur.execute(f'''ALTER TABLE `{table}` DROP COLUMN `time_range_start`, DROP COLUMN `time_range_stop`,
+            ALTER COLUMN `start_minute` DROP DEFAULT, ALTER COLUMN `stop_minute` DROP DEFAULT, {index}''')
+
+
+async def _columns(cur: aiomysql.Cursor, table: str) -> Set[str]:
+    """
+    :return: names of the columns the table has now
+    """
+    await cur.execute('''SELECT COLUMN_NAME AS name FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s''', (cfg.DATABASE, table))
+    return {x['name'] for x in await cur.fetchall()}
+
+
+async def migrate_assignments_for_stats(cur: aiomysql.Cursor):
+    """
+    Adds the columns the rating and earnings aggregates are maintained with to the assignments table
+    of the previous versions of the schema. They are filled for the existing assignments by backfill.py.
+    :param cur: cursor of a connection using the database of the app
+    """
+    await cur.execute('''SELECT COUNT(*) AS present FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s''', (cfg.DATABASE, 'assignments', 'is_credited'))
+    if (await cur.fetchone())['present']:
+        return
+    # columns appended to the table change only its metadata, the rows aren`t rewritten,
+    # the key on courier_id is added by migrate_indexes
+    await cur.execute('''ALTER TABLE `assignments` ADD COLUMN `courier_id` smallint unsigned DEFAULT NULL,
+        ADD COLUMN `courier_type` char(10) DEFAULT NULL,
+        ADD COLUMN `last_completion_timestamp` timestamp NULL DEFAULT NULL,
+        ADD COLUMN `is_credited` tinyint(1) NOT NULL DEFAULT 0, ALGORITHM=INSTANT''')
+
+
+# indexes missing from the tables created by the previous versions of the schema, table: {name: columns}
+INDEXES = {
+    # earnings and ratings of a courier are looked up by its assignments
+    'assignments': {'courier_id': ('courier_id',)},
+    # found missing by benchmark/plan_check.py: open orders of a region with the weight the courier can carry, and the open orders of a courier
+    'orders': {'open_orders': ('is_completed', 'assigned_courier_id', 'region', 'weight')},
+    # the IN (SELECT region ...) lookups of the assignment and the patch are answered from the index alone
+    'couriers_regions': {'courier_region': ('courier_id', 'region')},
+}
+
+
+async def migrate_indexes(cur: aiomysql.Cursor):
+    """
+    Adds the indexes of INDEXES that the tables created by the previous versions of the schema don`t have.
+    :param cur: cursor of a connection using the database of the app
+    """
+    for table, indexes in INDEXES.items():
+        await cur.execute('''SELECT DISTINCT INDEX_NAME AS name FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s''', (cfg.DATABASE, table))
+        present = {x['name'] for x in await cur.fetchall()}
+        missing = [f'ADD KEY `{name}` ({", ".join(f"`{x}`" for x in columns)})'
+                   for name, columns in indexes.items() if name not in present]
+        if missing:
+            # built online, the app keeps reading and writing the table meanwhile
+            await cur.execute(f'ALTER TABLE `{table}` {", ".join(missing)}, ALGORITHM=INPLACE, LOCK=NONE')
+
+
+async def create_history_tables(cur: aiomysql.Cursor):
+    """
+    Creates the tables the completed orders are moved to by archiver.py. They have no foreign keys,
+    the rows are only appended to them and read by backfill.py and the checks of the ids of new orders.
+    :param cur: cursor of a connection using the database of the app
+    """
+    await cur.execute('''CREATE TABLE IF NOT EXISTS `orders_history`
+        (
+            `order_id` int unsigned NOT NULL,
+            `weight` decimal(5,2) NOT NULL,
+            `region` tinyint unsigned NOT NULL,
+            `assigned_courier_id` smallint unsigned DEFAULT NULL,
+            `is_completed` tinyint(1) NOT NULL,
+            `assignment_id` mediumint unsigned DEFAULT NULL,
+            `completion_timestamp` timestamp NULL DEFAULT NULL,
+            PRIMARY KEY (`order_id`),
+            KEY `assigned_courier_id` (`assigned_courier_id`),
+            KEY `assignment_id` (`assignment_id`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci''')
+
+    await cur.execute('''CREATE TABLE IF NOT EXISTS `delivery_hours_history`
+        (
+            `order_id` int unsigned NOT NULL,
+            `start_minute` smallint unsigned NOT NULL,
+            `stop_minute` smallint unsigned NOT NULL,
+            KEY `order_id` (`order_id`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci''')
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[aiomysql.Cursor], Awaitable[None]]
+
+
+# ordered by version, new migrations are appended with the next version
+MIGRATIONS = (
+    Migration(1, 'create tables', create_tables),
+    Migration(2, 'time ranges in minutes of the day', migrate_time_ranges_to_minutes),
+    Migration(3, 'assignments keep the data of the rating and earnings', migrate_assignments_for_stats),
+    Migration(4, 'composite indexes of the open orders and regions', migrate_indexes),
+    Migration(5, 'history tables of the archived orders', create_history_tables),
+)
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def schema_version(cur: aiomysql.Cursor) -> int:
+    """
+    :return: version of the last migration applied to the database, 0 if none was
+    """
+    try:
+        await cur.execute('SELECT MAX(version) AS version FROM schema_version')
+    except aiomysql.ProgrammingError as error:
+        if error.args[0] == _NO_SUCH_TABLE:
+            return 0
+        raise
+    return (await cur.fetchone())['version'] or 0
+
+
+async def migrate() -> int:
+    """
+    Applies the migrations the database doesn`t have yet.
+    :return: version of the schema
+    :raise RuntimeError: if another instance didn`t finish migrating in cfg.MIGRATION_LOCK_TIMEOUT seconds
+    """
+    conn = await aiomysql.connect(host=cfg.DB_HOST, password=cfg.DB_PASSWORD, port=cfg.DB_PORT, user=cfg.DB_USER,
+                                  db=cfg.DATABASE, cursorclass=aiomysql.DictCursor, autocommit=True)
+    cur = await conn.cursor()
+    try:
+        version = await schema_version(cur)
+        if version >= LATEST_VERSION:
+            logging.info('migrate: schema is at version %s, nothing to migrate', version)
+            return version
+
+        lock = f'{cfg.DATABASE}.schema_version'
+        await cur.execute('SELECT GET_LOCK(%s, %s) AS locked', (lock, cfg.MIGRATION_LOCK_TIMEOUT))
+        if not (await cur.fetchone())['locked']:
+            raise RuntimeError(f'schema is being migrated by another instance for more than '
+                               f'{cfg.MIGRATION_LOCK_TIMEOUT} s')
+        try:
+            await cur.execute('''CREATE TABLE IF NOT EXISTS `schema_version`
+                (
+                    `version` smallint unsigned NOT NULL,
+                    `name` varchar(100) NOT NULL,
+                    `applied_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (`version`)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci''')
+            version = await schema_version(cur)  # the instance that held the lock could have migrated it meanwhile
+            for migration in MIGRATIONS:
+                if migration.version <= version:
+                    continue
+                logging.info('migrate: applying migration %s (%s)', migration.version, migration.name)
+                await migration.apply(cur)
+                await cur.execute('INSERT INTO schema_version (version, name) VALUES (%s, %s)',
+                                  (migration.version, migration.name))
+                version = migration.version
+        finally:
+            await cur.execute('SELECT RELEASE_LOCK(%s)', (lock,))
+        logging.info('migrate: schema is migrated to version %s', version)
+        return version
+    finally:
+        conn.close()
+
+
+async def migrate_on_startup(app: web.Application):
+    """
+    on_startup hook of the application, migrates the schema before the pool of connections is created.
+    :param app: application that is being started
+    """
+    app['schema_version'] = await migrate()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(migrate())
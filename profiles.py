@@ -0,0 +1,27 @@
+"""
+Fields of the courier profile returned by GET /couriers/{id} that are derived from the stored data,
+computed the same way by every storage backend.
+"""
+from typing import Dict, List, Optional
+
+import cfg
+
+
+def format_time_range(start: int, stop: int) -> str:
+    """
+    :return: range of time in HH:MM-HH:MM format made of minutes of the day
+    """
+    return f'{start // 60:02}:{start % 60:02}-{stop // 60:02}:{stop % 60:02}'
+
+
+def rating(region_stats: List[Dict]) -> Optional[float]:
+    """
+    :param region_stats: dicts with completed_count and delivery_seconds_sum of the courier in every region,
+    as the rows of couriers_regions_stats
+    :return: rating from 0 to 5 by the region with the fastest average delivery, None if nothing is delivered yet
+    """
+    averages = [x['delivery_seconds_sum'] / x['completed_count'] for x in region_stats if x['completed_count']]
+    if not averages:
+        return None
+    limit = cfg.RATING_MAX_DELIVERY_SECONDS
+    return round((limit - min(min(averages), limit)) / limit * 5, 2)
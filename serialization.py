@@ -0,0 +1,53 @@
+"""
+JSON encoding of the bodies of the requests and the responses. Every response is encoded once, straight into the bytes
+that are sent, by orjson if cfg.JSON_ENCODER is 'orjson' and it`s installed, by the json module of the standard library
+otherwise. Both produce the same compact JSON.
+"""
+import json
+import logging
+from typing import Callable, Optional
+
+from aiohttp import web
+
+import cfg
+
+CONTENT_TYPE = 'application/json'
+
+encoder = None  # name of the encoder in use
+dumps: Callable[..., bytes] = None  # dumps(value, default=None) -> bytes
+loads: Callable = None  # loads(bytes or str), raises json.JSONDecodeError
+
+
+def _json_dumps(value, default: Optional[Callable] = None) -> bytes:
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=default).encode()
+
+
+def use(name: str):
+    """
+    Makes dumps and loads use the named encoder, 'orjson' or 'json', falls back to json if orjson isn`t installed.
+    """
+    global encoder, dumps, loads
+    if name == 'orjson':
+        try:
+            import orjson
+        except ImportError:
+            logging.warning('use: orjson is not installed, encoding JSON by the json module')
+        else:
+            def orjson_dumps(value, default: Optional[Callable] = None) -> bytes:
+                return orjson.dumps(value, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+            encoder, dumps, loads = 'orjson', orjson_dumps, orjson.loads  # orjson.JSONDecodeError is a json.JSONDecodeError
+            return
+    encoder, dumps, loads = 'json', _json_dumps, json.loads
+
+
+def json_response(data, status: int = 200, reason: Optional[str] = None, headers: Optional[dict] = None,
+                  default: Optional[Callable] = None) -> web.Response:
+    """
+    :param default: called for the objects the encoder can`t serialize, see json.dumps
+    """
+    return web.Response(body=dumps(data, default), status=status, reason=reason, headers=headers,
+                        content_type=CONTENT_TYPE)
+
+
+use(cfg.JSON_ENCODER)
@@ -0,0 +1,241 @@
+"""
+Serving of the app by several processes. The master process migrates the schema, forks cfg.SERVER_WORKERS workers
+and supervises them. Every worker runs its own event loop (uvloop with cfg.SERVER_EVENT_LOOP = 'uvloop'),
+pool of connections and cache of profiles, and serves cfg.SERVER_PORT: the kernel spreads
+the connections among the workers bound with SO_REUSEPORT, or among the ones accepting on the socket bound
+by the master before forking (cfg.SERVER_REUSE_PORT = False).
+Workers report they are alive through a pipe every cfg.SERVER_HEARTBEAT_INTERVAL seconds. A worker that exits
+or stops reporting for cfg.SERVER_WORKER_TIMEOUT seconds (its loop is blocked) is killed and started again.
+On SIGTERM or SIGINT the master passes SIGTERM to the workers: they stop accepting connections,
+give the requests in flight cfg.SERVER_SHUTDOWN_TIMEOUT seconds to finish and close their pools.
+Metrics (GET /metrics) and traces (GET /admin/traces) are kept per worker, the one that accepted the connection
+answers. Only the first worker runs the archiver.
+The index of open orders (cfg.MATCHING_INDEX_ENABLED) is not shared: the orders posted to or de-assigned by one worker
+would reach the index of another only with its periodic rebuild, and the assignments it makes meanwhile would miss them.
+So with more than one worker the index is off and the orders are looked up in the DB.
+"""
+import asyncio
+import logging
+import os
+import selectors
+import signal
+import socket
+import time
+from typing import Dict, Optional
+
+from aiohttp import web
+
+import Application
+import cfg
+import logs
+import migrations
+
+_STABLE_UPTIME = 60  # seconds, a worker that lived that long resets the delay of the restarts
+_MAX_RESTART_DELAY = 60
+
+
+def new_event_loop() -> asyncio.AbstractEventLoop:
+    if cfg.SERVER_EVENT_LOOP == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            logging.warning('new_event_loop: uvloop is not installed, running on the asyncio loop')
+        else:
+            return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def _bind() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('0.0.0.0', cfg.SERVER_PORT))
+    sock.listen(128)
+    sock.setblocking(False)
+    return sock
+
+
+async def _heartbeat(fd: int):
+    while True:
+        os.write(fd, b'.')
+        await asyncio.sleep(cfg.SERVER_HEARTBEAT_INTERVAL)
+
+
+def _serve_worker(number: int, sock: Optional[socket.socket], heartbeat_fd: int):
+    """
+    Serves the app in the forked worker until SIGTERM, never returns.
+    """
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+    logs.setup()
+    if number:
+        cfg.ARCHIVE_ENABLED = False  # one archiver per instance of the app is enough
+    loop = new_event_loop()
+    asyncio.set_event_loop(loop)
+    runner = web.AppRunner(Application.make_app(), access_log=logging.getLogger('aiohttp.server'),
+                           handle_signals=False)
+    code = 0
+    try:
+        loop.run_until_complete(runner.setup())
+        if sock is None:
+            site = web.TCPSite(runner, port=cfg.SERVER_PORT, reuse_port=True,
+                               shutdown_timeout=cfg.SERVER_SHUTDOWN_TIMEOUT)
+        else:
+            site = web.SockSite(runner, sock, shutdown_timeout=cfg.SERVER_SHUTDOWN_TIMEOUT)
+        loop.run_until_complete(site.start())
+        logging.info('_serve_worker: worker %s (pid %s) serves port %s', number, os.getpid(), cfg.SERVER_PORT)
+
+        stopping = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, stopping.set)
+        loop.add_signal_handler(signal.SIGINT, stopping.set)
+        heartbeat = loop.create_task(_heartbeat(heartbeat_fd))
+        loop.run_until_complete(stopping.wait())
+        heartbeat.cancel()
+        logging.info('_serve_worker: worker %s is stopping', number)
+    except Exception as error:
+        logging.error('_serve_worker: worker %s failed: %s', number, error)
+        code = 1
+    finally:
+        try:
+            loop.run_until_complete(runner.cleanup())  # finishes the requests in flight, closes the pool
+        finally:
+            logs.stop()
+            os._exit(code)
+
+
+class _Worker:
+    __slots__ = ('number', 'pid', 'heartbeat_fd', 'started', 'last_beat')
+
+    def __init__(self, number: int, pid: int, heartbeat_fd: int):
+        self.number = number
+        self.pid = pid
+        self.heartbeat_fd = heartbeat_fd
+        self.started = time.monotonic()
+        self.last_beat = None  # no heartbeat is expected before the worker is started, e.g. the index is loaded
+
+
+class _Master:
+    def __init__(self, count: int, sock: Optional[socket.socket]):
+        self.count = count
+        self.sock = sock
+        self.workers: Dict[int, _Worker] = {}  # by pid
+        self.selector = selectors.DefaultSelector()
+        self.stopping = False
+        self.restart_delay = cfg.SERVER_RESTART_DELAY
+        self.restart_at: Dict[int, float] = {}  # numbers of the dead workers: when they are started again
+
+    def spawn(self, number: int):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            for worker in self.workers.values():
+                os.close(worker.heartbeat_fd)
+            _serve_worker(number, self.sock, write_fd)
+        os.close(write_fd)
+        os.set_blocking(read_fd, False)
+        worker = _Worker(number, pid, read_fd)
+        self.workers[pid] = worker
+        self.selector.register(read_fd, selectors.EVENT_READ, worker)
+        logging.info('spawn: started worker %s, pid %s', number, pid)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def read_heartbeats(self, timeout: float):
+        for key, _ in self.selector.select(timeout):
+            worker = key.data
+            try:
+                if os.read(worker.heartbeat_fd, 1024):
+                    worker.last_beat = time.monotonic()
+            except BlockingIOError:
+                pass
+
+    def kill_hung(self):
+        now = time.monotonic()
+        for worker in self.workers.values():
+            if worker.last_beat is not None and now - worker.last_beat > cfg.SERVER_WORKER_TIMEOUT:
+                logging.error('kill_hung: worker %s (pid %s) sent no heartbeat for %.0f s, killing it',
+                              worker.number, worker.pid, now - worker.last_beat)
+                os.kill(worker.pid, signal.SIGKILL)
+                worker.last_beat = None
+
+    def reap(self):
+        while self.workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            self.selector.unregister(worker.heartbeat_fd)
+            os.close(worker.heartbeat_fd)
+            if self.stopping:
+                continue
+            uptime = time.monotonic() - worker.started
+            if uptime > _STABLE_UPTIME:
+                self.restart_delay = cfg.SERVER_RESTART_DELAY
+            logging.error('reap: worker %s (pid %s) exited with status %s after %.0f s, restarting it in %s s',
+                          worker.number, pid, status, uptime, self.restart_delay)
+            self.restart_at[worker.number] = time.monotonic() + self.restart_delay
+            self.restart_delay = min(self.restart_delay * 2, _MAX_RESTART_DELAY)
+
+    def restart_dead(self):
+        now = time.monotonic()
+        for number, moment in list(self.restart_at.items()):
+            if moment <= now:
+                del self.restart_at[number]
+                self.spawn(number)
+
+    def run(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.stop)
+        for number in range(self.count):
+            self.spawn(number)
+        while not self.stopping:
+            self.read_heartbeats(cfg.SERVER_HEARTBEAT_INTERVAL)
+            self.reap()
+            self.kill_hung()
+            self.restart_dead()
+        self.shutdown()
+
+    def shutdown(self):
+        logging.info('shutdown: stopping %s workers', len(self.workers))
+        for pid in self.workers:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + cfg.SERVER_SHUTDOWN_TIMEOUT + 5
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in self.workers:
+            logging.error('shutdown: worker pid %s didn`t stop in time, killing it', pid)
+            os.kill(pid, signal.SIGKILL)
+        while self.workers:
+            self.reap()
+            time.sleep(0.1)
+
+
+def run():
+    """
+    Serves the app by cfg.SERVER_WORKERS processes, in this one if it`s 1.
+    """
+    count = cfg.SERVER_WORKERS or os.cpu_count()
+    if count != 1 and cfg.STORAGE_BACKEND == 'memory':
+        raise RuntimeError('the memory storage is kept by a single process, set SERVER_WORKERS to 1')
+    if count == 1:
+        asyncio.set_event_loop(new_event_loop())
+        Application.run()
+        return
+    logs.setup(queued=False)
+    if cfg.MATCHING_INDEX_ENABLED:
+        logging.warning('run: the index of open orders is not coherent across %s workers, it`s disabled', count)
+        cfg.MATCHING_INDEX_ENABLED = False  # read by the forked workers
+    # the workers find the schema current, so they don`t queue up on the lock of the migrations
+    loop = new_event_loop()
+    loop.run_until_complete(migrations.migrate())
+    loop.close()
+    sock = None if cfg.SERVER_REUSE_PORT else _bind()
+    _Master(count, sock).run()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,106 @@
+"""
+Selection of the orders for an assignment: the total weight of the assigned orders must not exceed
+the carrying capacity of the courier (max_weight of the courier type), not only the weight of each of them.
+Weights are handled in hundredths, the precision they are stored with in the DB.
+"""
+import bisect
+from typing import List, Tuple
+
+import cfg
+
+OBJECTIVE_ORDERS = 'orders'  # as many orders as possible, the heaviest of such sets
+OBJECTIVE_WEIGHT = 'weight'  # as much weight as possible
+
+
+def _hundredths(weight) -> int:
+    return round(float(weight) * 100)
+
+
+def _most_orders(candidates: List[Tuple[int, int]], capacity: int) -> List[Tuple[int, int]]:
+    """
+    Greedy by weight: the lightest orders give the largest number of them, then every chosen order, from the heaviest,
+    is swapped for the heaviest unchosen one that still fits, so the capacity is used as well as the count allows.
+    """
+    ordered = sorted(candidates, key=lambda x: x[1])
+    chosen = []
+    total = 0
+    for candidate in ordered:
+        if total + candidate[1] > capacity:
+            break
+        chosen.append(candidate)
+        total += candidate[1]
+    rest = ordered[len(chosen):]
+    rest_weights = [weight for _, weight in rest]
+    for i in range(len(chosen) - 1, -1, -1):
+        # the heaviest unchosen order that fits into the capacity left if the i-th one is taken out
+        j = bisect.bisect_right(rest_weights, capacity - total + chosen[i][1]) - 1
+        if j < 0 or rest_weights[j] <= chosen[i][1]:
+            continue
+        total += rest_weights[j] - chosen[i][1]
+        swapped = chosen[i]
+        chosen[i] = rest.pop(j)
+        del rest_weights[j]
+        k = bisect.bisect_left(rest_weights, swapped[1])
+        rest.insert(k, swapped)
+        rest_weights.insert(k, swapped[1])
+    return chosen
+
+
+def _most_weight_exact(candidates: List[Tuple[int, int]], capacity: int) -> List[Tuple[int, int]]:
+    """
+    Bounded subset-sum DP: bit w of reachable[i] tells if the weight w can be made of the first i candidates.
+    O(n * capacity / word size), used only for small sets of candidates.
+    """
+    mask = (1 << (capacity + 1)) - 1
+    reachable = [1]
+    for _, weight in candidates:
+        reachable.append((reachable[-1] | (reachable[-1] << weight)) & mask)
+    best = reachable[-1].bit_length() - 1
+    chosen = []
+    for i in range(len(candidates), 0, -1):
+        if not (reachable[i - 1] >> best) & 1:
+            chosen.append(candidates[i - 1])
+            best -= candidates[i - 1][1]
+    return chosen
+
+
+def _most_weight_greedy(candidates: List[Tuple[int, int]], capacity: int) -> List[Tuple[int, int]]:
+    """
+    First fit decreasing: the heaviest orders that still fit.
+    """
+    chosen = []
+    total = 0
+    for candidate in sorted(candidates, key=lambda x: -x[1]):
+        if total + candidate[1] <= capacity:
+            chosen.append(candidate)
+            total += candidate[1]
+    return chosen
+
+
+def select_orders(candidates: List[Tuple[int, float]], max_weight: float, objective: str = None,
+                  dp_max_candidates: int = None) -> List[int]:
+    """
+    :param candidates: list of (order_id, weight) of the orders that can be assigned to the courier
+    :param max_weight: carrying capacity of the courier
+    :param objective: OBJECTIVE_ORDERS or OBJECTIVE_WEIGHT, cfg.ASSIGN_OBJECTIVE by default
+    :param dp_max_candidates: largest number of candidates solved exactly for OBJECTIVE_WEIGHT,
+    cfg.ASSIGN_DP_MAX_CANDIDATES by default
+    :return: ids of the chosen orders sorted by weight, their total weight doesn`t exceed max_weight
+    """
+    objective = objective or cfg.ASSIGN_OBJECTIVE
+    dp_max_candidates = cfg.ASSIGN_DP_MAX_CANDIDATES if dp_max_candidates is None else dp_max_candidates
+    capacity = _hundredths(max_weight)
+    candidates = [(order_id, _hundredths(weight)) for order_id, weight in candidates
+                  if _hundredths(weight) <= capacity]
+    if sum(weight for _, weight in candidates) <= capacity:
+        chosen = candidates
+    elif objective == OBJECTIVE_ORDERS:
+        chosen = _most_orders(candidates, capacity)
+    elif objective == OBJECTIVE_WEIGHT:
+        if len(candidates) <= dp_max_candidates:
+            chosen = _most_weight_exact(candidates, capacity)
+        else:
+            chosen = _most_weight_greedy(candidates, capacity)
+    else:
+        raise ValueError(f'unknown objective of the assignment: {objective!r}')
+    return [order_id for order_id, _ in sorted(chosen, key=lambda x: (x[1], x[0]))]
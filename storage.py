@@ -0,0 +1,109 @@
+"""
+Storage backends of the API. The handlers run the six operations of the API (POST /couriers, PATCH /couriers/{id},
+POST /orders, POST /orders/assign, POST /orders/complete, GET /couriers/{id}) through the backend chosen by
+cfg.STORAGE_BACKEND: 'mysql', the aiomysql implementation of db_connection, or 'memory', the in-process engine
+of memory_storage, which needs no MySQL server, so local runs and benchmarks go without the network round trips.
+Every backend takes the same bodies of the requests and returns the same results, and it`s checked
+by tests/test_storage.py against both of them.
+"""
+import abc
+from typing import AsyncIterable, Dict, List, Optional
+
+import cache
+import db_connection
+import group_commit
+
+
+class Storage(abc.ABC):
+    """
+    Interface of a backend. The results are the ones of the coroutines of db_connection named in the docstrings,
+    the requests found invalid are answered by (False, ...), never by an exception.
+    A backend missing any of the operations can`t be instantiated.
+    """
+    name = None
+
+    @abc.abstractmethod
+    async def post_couriers(self, json_request: Dict) -> (bool, List):
+        """
+        See db_connection.post_couriers_execute_queries.
+        """
+
+    @abc.abstractmethod
+    async def post_couriers_stream(self, batches: AsyncIterable[List]) -> (bool, List):
+        """
+        See db_connection.post_couriers_stream_execute_queries.
+        """
+
+    @abc.abstractmethod
+    async def patch_courier(self, courier_id: int, json_request: Dict) -> (bool, Dict):
+        """
+        See db_connection.patch_couriers_id_execute_queries.
+        """
+
+    @abc.abstractmethod
+    async def post_orders(self, json_request: Dict) -> (bool, List[int]):
+        """
+        See db_connection.post_orders_execute_queries.
+        """
+
+    @abc.abstractmethod
+    async def post_orders_stream(self, batches: AsyncIterable[List]) -> (bool, List[int]):
+        """
+        See db_connection.post_orders_stream_execute_queries.
+        """
+
+    @abc.abstractmethod
+    async def assign(self, json_request: Dict) -> (bool, Dict):
+        """
+        See db_connection.post_orders_assign_execute_queries.
+        """
+
+    @abc.abstractmethod
+    async def complete(self, json_request: Dict) -> (bool, Dict):
+        """
+        See db_connection.post_orders_complete_execute_queries.
+        """
+
+    @abc.abstractmethod
+    async def get_courier(self, courier_id: int) -> (bool, Optional[cache.Profile]):
+        """
+        See db_connection.get_couriers_id_execute_queries.
+        """
+
+
+class MySQLStorage(Storage):
+    """
+    The operations run by db_connection against MySQL, the completions written by group_commit if it`s on.
+    The pool and the rest of the state of db_connection are set up by the hooks registered in Application.make_app.
+    """
+    name = 'mysql'
+
+    async def post_couriers(self, json_request: Dict) -> (bool, List):
+        return await db_connection.post_couriers_execute_queries(json_request)
+
+    async def post_couriers_stream(self, batches: AsyncIterable[List]) -> (bool, List):
+        return await db_connection.post_couriers_stream_execute_queries(batches)
+
+    async def patch_courier(self, courier_id: int, json_request: Dict) -> (bool, Dict):
+        return await db_connection.patch_couriers_id_execute_queries(courier_id, json_request)
+
+    async def post_orders(self, json_request: Dict) -> (bool, List[int]):
+        return await db_connection.post_orders_execute_queries(json_request)
+
+    async def post_orders_stream(self, batches: AsyncIterable[List]) -> (bool, List[int]):
+        return await db_connection.post_orders_stream_execute_queries(batches)
+
+    async def assign(self, json_request: Dict) -> (bool, Dict):
+        return await db_connection.post_orders_assign_execute_queries(json_request)
+
+    async def complete(self, json_request: Dict) -> (bool, Dict):
+        if group_commit.queue is not None:
+            # the completion is written by the transaction of its group, the response waits for its commit
+            return await group_commit.post_orders_complete_execute_queries(json_request)
+        return await db_connection.post_orders_complete_execute_queries(json_request)
+
+    async def get_courier(self, courier_id: int) -> (bool, Optional[cache.Profile]):
+        return await db_connection.get_couriers_id_execute_queries(courier_id)
+
+
+backend: Storage = MySQLStorage()  # replaced on startup by memory_storage.open_memory_storage if it`s chosen
@@ -0,0 +1,229 @@
+"""
+Streaming ingestion of the bodies of POST /couriers and POST /orders. Items are parsed from request.content chunk by
+chunk and handed to the storage backend in batches of cfg.STREAM_BATCH_SIZE, so neither the body nor the whole list
+of the parsed items is ever held in memory, only the rows validated from them. Two formats are streamed:
+ - NDJSON (Content-Type: application/x-ndjson), one item per line;
+ - the regular {"data": [...]} JSON, when it`s larger than cfg.STREAM_THRESHOLD_BYTES or of unknown length.
+The exports are streamed the other way, as NDJSON written chunk by chunk while the rows are read (write_ndjson).
+"""
+import asyncio
+import codecs
+import json
+import logging
+from typing import AsyncGenerator, AsyncIterator, Dict, List
+
+from aiohttp import web, StreamReader
+
+import cfg
+import logs
+import serialization
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+NDJSON_CONTENT_TYPES = {NDJSON_CONTENT_TYPE, 'application/jsonl'}
+_WHITESPACE = ' \t\n\r'
+
+
+class StreamFormatError(ValueError):
+    """
+    The body is not well-formed, the request is to be answered with 400 as a body that isn`t valid JSON.
+    """
+
+
+class StreamTimeoutError(Exception):
+    """
+    The client sent nothing of the body for cfg.STREAM_READ_TIMEOUT seconds, the request is to be answered with 408.
+    """
+
+
+async def _read(content: StreamReader) -> bytes:
+    """
+    :return: next chunk of the body, empty bytes at its end
+    :raise StreamTimeoutError: if nothing is received in cfg.STREAM_READ_TIMEOUT seconds
+    """
+    try:
+        return await asyncio.wait_for(content.read(cfg.STREAM_CHUNK_SIZE), timeout=cfg.STREAM_READ_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise StreamTimeoutError(f'nothing of the body received in {cfg.STREAM_READ_TIMEOUT} s')
+
+
+def is_streamed(request: web.Request) -> bool:
+    if request.content_type in NDJSON_CONTENT_TYPES:
+        return True
+    return request.content_length is None or request.content_length > cfg.STREAM_THRESHOLD_BYTES
+
+
+def request_batches(request: web.Request) -> AsyncIterator[List]:
+    """
+    :return: batches of items of the body of the request, in its order
+    """
+    if request.content_type in NDJSON_CONTENT_TYPES:
+        items = ndjson_items(request.content)
+    else:
+        items = data_array_items(request.content)
+    return batches(items, cfg.STREAM_BATCH_SIZE)
+
+
+async def batches(items: AsyncIterator, size: int) -> AsyncIterator[List]:
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def ndjson_items(content: StreamReader) -> AsyncIterator:
+    """
+    Parses one JSON value per line, empty lines are skipped.
+    """
+    buffer = b''
+    while True:
+        chunk = await _read(content)
+        if not chunk:
+            break
+        lines = (buffer + chunk).split(b'\n')
+        buffer = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield _loads(line)
+        if len(buffer) > cfg.STREAM_MAX_ITEM_BYTES:
+            raise StreamFormatError(f'line is longer than {cfg.STREAM_MAX_ITEM_BYTES} bytes')
+    if buffer.strip():
+        yield _loads(buffer)
+
+
+def _loads(line: bytes):
+    try:
+        return serialization.loads(line)
+    except ValueError as error:  # JSONDecodeError and UnicodeDecodeError
+        raise StreamFormatError(str(error))
+
+
+class _TextReader:
+    """
+    Decoded text of the body read on demand, with the position of the parser in it.
+    """
+
+    def __init__(self, content: StreamReader):
+        self._content = content
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.dropped = 0  # number of characters parsed and dropped from the text
+        self.eof = False
+
+    @property
+    def position(self) -> int:
+        return self.dropped + self.pos
+
+    async def read_more(self):
+        if self.pos > cfg.STREAM_CHUNK_SIZE:
+            # the parsed part is dropped, so only the item being parsed is kept
+            self.text = self.text[self.pos:]
+            self.dropped += self.pos
+            self.pos = 0
+        if len(self.text) - self.pos > cfg.STREAM_MAX_ITEM_BYTES:
+            raise StreamFormatError(f'item is longer than {cfg.STREAM_MAX_ITEM_BYTES} bytes')
+        chunk = await _read(self._content)
+        try:
+            self.text += self._decoder.decode(chunk, final=not chunk)
+        except UnicodeDecodeError as error:
+            raise StreamFormatError(str(error))
+        self.eof = not chunk
+
+    async def peek(self) -> str:
+        """
+        :return: next character that isn`t whitespace, empty string at the end of the body
+        """
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text) or self.eof:
+                return self.text[self.pos:self.pos + 1]
+            await self.read_more()
+
+    async def expect(self, token: str):
+        """
+        Consumes the token, which may be preceded by whitespace.
+        """
+        await self.peek()
+        while len(self.text) - self.pos < len(token) and not self.eof:
+            await self.read_more()
+        if not self.text.startswith(token, self.pos):
+            raise StreamFormatError(f'expected {token!r} at character {self.position}')
+        self.pos += len(token)
+
+
+async def data_array_items(content: StreamReader) -> AsyncIterator:
+    """
+    Parses the items of the "data" array of {"data": [...]} one by one, the object must have no other keys.
+    """
+    reader = _TextReader(content)
+    decoder = json.JSONDecoder()
+    await reader.expect('{')
+    await reader.expect('"data"')
+    await reader.expect(':')
+    await reader.expect('[')
+    if await reader.peek() == ']':
+        reader.pos += 1
+    else:
+        while True:
+            await reader.peek()
+            while True:
+                try:
+                    item, end = decoder.raw_decode(reader.text, reader.pos)
+                except json.JSONDecodeError as error:
+                    if reader.eof:
+                        raise StreamFormatError(str(error))
+                else:
+                    # a number at the end of the text read so far may continue in the next chunk
+                    if end < len(reader.text) or reader.eof:
+                        break
+                await reader.read_more()
+            reader.pos = end
+            yield item
+            separator = await reader.peek()
+            reader.pos += 1
+            if separator == ']':
+                break
+            if separator != ',':
+                raise StreamFormatError(f'expected "," or "]" at character {reader.position - 1}')
+    await reader.expect('}')
+    if await reader.peek():
+        raise StreamFormatError(f'extra data at character {reader.position}')
+
+
+async def write_ndjson(request: web.Request, items: AsyncGenerator[Dict, None]) -> web.StreamResponse:
+    """
+    Streams the items as the NDJSON body of the response, one item per line, in chunks of cfg.EXPORT_CHUNK_BYTES.
+    Every write waits until the client takes the data, so the items are read no faster than the client reads them.
+    If reading the items fails, the connection is closed without the end of the chunked body, so the client can tell
+    the response is incomplete and resume after the last item it got.
+    """
+    # the headers are sent before the body is, the middlewares can`t add theirs to the response returned
+    response = web.StreamResponse(status=200, headers={'Content-Type': NDJSON_CONTENT_TYPE,
+                                                       logs.REQUEST_ID_HEADER: logs.request_id.get()})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    chunk = bytearray()
+    written = 0
+    try:
+        async for item in items:
+            chunk += serialization.dumps(item)
+            chunk += b'\n'
+            if len(chunk) >= cfg.EXPORT_CHUNK_BYTES:
+                await response.write(bytes(chunk))
+                written += len(chunk)
+                chunk.clear()
+        if chunk:
+            await response.write(bytes(chunk))
+        await response.write_eof()
+    except Exception as error:
+        logging.warning('write_ndjson: export failed after %s bytes: %s, closing the connection', written, error)
+        if request.transport is not None:
+            request.transport.close()
+    finally:
+        await items.aclose()  # releases the connection to the DB at once if the client is gone
+    return response
@@ -0,0 +1,29 @@
+"""
+Fixtures shared by the tests. The tests of the MySQL backend run in the database TEST_DATABASE
+(candy_delivery_test by default) of the server TEST_DB_HOST, its tables are truncated; they are skipped
+if TEST_DB_HOST is not set.
+"""
+import os
+
+import pytest
+
+import cfg
+
+
+@pytest.fixture(autouse=True)
+def unsynced_journal(monkeypatch):
+    monkeypatch.setattr(cfg, 'MEMORY_JOURNAL_FSYNC', False)  # the durability of the files is not what`s checked
+
+
+@pytest.fixture
+def mysql(monkeypatch):
+    """
+    Points cfg at the test database, skips the test if there is none.
+    """
+    if not os.environ.get('TEST_DB_HOST'):
+        pytest.skip('TEST_DB_HOST is not set')
+    monkeypatch.setattr(cfg, 'DB_HOST', os.environ['TEST_DB_HOST'])
+    monkeypatch.setattr(cfg, 'DB_PORT', int(os.environ.get('TEST_DB_PORT', cfg.DB_PORT)))
+    monkeypatch.setattr(cfg, 'DB_USER', os.environ.get('TEST_DB_USER', cfg.DB_USER))
+    monkeypatch.setattr(cfg, 'DB_PASSWORD', os.environ.get('TEST_DB_PASSWORD', cfg.DB_PASSWORD))
+    monkeypatch.setattr(cfg, 'DATABASE', os.environ.get('TEST_DATABASE', 'candy_delivery_test'))
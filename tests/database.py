@@ -0,0 +1,25 @@
+"""
+The test database of the MySQL backend, see the fixture mysql of conftest.py.
+"""
+import cache
+import db_connection
+from benchmark import common
+
+
+async def empty_tables():
+    """
+    Empties the tables and the state of db_connection kept in the process, needs the pool to be initialized.
+    """
+    await common.truncate_tables()
+    cache.profiles.clear()
+    await db_connection.rebuild_matching_index()
+
+
+async def open_database():
+    """
+    Creates the schema if it`s missing, opens the pool of db_connection and empties the tables;
+    the pool is to be closed by db_connection.close_pool.
+    """
+    await common.prepare_database()
+    await db_connection.init_pool(None)
+    await empty_tables()
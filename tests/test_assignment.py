@@ -0,0 +1,128 @@
+"""
+Orders of a new assignment looked up in the index of open orders by db_connection._assign_orders,
+run over a fake cursor that answers the queries of the assignment.
+"""
+import asyncio
+import datetime
+
+import aiomysql
+import pytest
+
+import db_connection
+import matching
+
+COURIER = {'courier_id': 1, 'courier_type': 'foot', 'current_assignment_id': None}
+
+
+class FakeCursor:
+    """
+    Cursor of a DB with the courier COURIER carrying 10 kg in region 1 from 09:00 to 11:00.
+    :param weights: {order_id: weight} of the orders open in the DB
+    :param failing: the claim of the orders raises a deadlock if it`s true
+    """
+    def __init__(self, weights: dict, failing: bool = False):
+        self.weights = weights
+        self.failing = failing
+        self.queries = []
+        self.rows = []
+        self.lastrowid = None
+
+    async def execute(self, query: str, args=()):
+        self.queries.append(query)
+        self.rows = []
+        if query.startswith('SELECT * FROM couriers'):
+            self.rows = [COURIER]
+        elif query.startswith('SELECT max_weight'):
+            self.rows = [{'max_weight': 10}]
+        elif query.startswith('SELECT region'):
+            self.rows = [{'region': 1}]
+        elif query.startswith('SELECT start_minute'):
+            self.rows = [{'start_minute': 540, 'stop_minute': 660}]
+        elif query.startswith('SELECT order_id FROM orders WHERE order_id IN'):
+            if self.failing:
+                raise aiomysql.OperationalError(1213, 'Deadlock found when trying to get lock')
+            self.rows = [{'order_id': x} for x in args if x in self.weights]
+        elif query.startswith('SELECT DISTINCT'):
+            self.rows = [{'order_id': x, 'weight': w} for x, w in self.weights.items()]
+        elif query.startswith('INSERT INTO assignments'):
+            self.lastrowid = 1
+        elif query.startswith('SELECT assignment_timestamp'):
+            self.rows = [{'assignment_timestamp': datetime.datetime(2021, 1, 10, 10, 33, 1)}]
+
+    async def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    async def fetchall(self):
+        return self.rows
+
+    def probed(self) -> bool:
+        """
+        :return: True if the assignable orders were looked up in the DB
+        """
+        return any(x.startswith('SELECT DISTINCT') for x in self.queries)
+
+
+@pytest.fixture
+def index(monkeypatch):
+    """
+    Loaded index of open orders with the orders 1 (3 kg) and 2 (4 kg) of region 1, rebuilds are only counted.
+    """
+    loaded = matching.OrderIndex()
+    loaded.finish_rebuild([matching.OpenOrder(1, 3, 1, [(600, 700)]), matching.OpenOrder(2, 4, 1, [(500, 560)])])
+    monkeypatch.setattr(matching, 'index', loaded)
+    loaded.rebuilds = 0
+
+    def schedule():
+        loaded.rebuilds += 1
+    monkeypatch.setattr(db_connection, '_schedule_matching_index_rebuild', schedule)
+    return loaded
+
+
+def assign(cur: FakeCursor, reserved: list):
+    return asyncio.run(db_connection._assign_orders(cur, COURIER['courier_id'], reserved))
+
+
+def test_claimed_orders_are_reserved(index):
+    reserved = []
+    assert assign(FakeCursor({1: 3, 2: 4}), reserved)['orders'] == [{'id': 1}, {'id': 2}]
+    assert [x.order_id for x in reserved] == [1, 2]
+    assert len(index) == 0
+
+
+def test_failed_claim_puts_candidates_back(index):
+    reserved = []
+    with pytest.raises(aiomysql.OperationalError):
+        assign(FakeCursor({1: 3, 2: 4}, failing=True), reserved)
+    db_connection._put_back(reserved)
+    assert reserved == [] and 1 in index and 2 in index
+
+
+def test_lost_claim_is_not_put_back(index):
+    reserved = [matching.OpenOrder(7, 1, 2, [(0, 60)])]  # reserved by the previous courier of a batch
+    assert assign(FakeCursor({1: 3}), reserved)['orders'] == [{'id': 1}]
+    assert [x.order_id for x in reserved] == [7, 1]
+    assert 2 not in index and index.rebuilds == 1
+
+
+def test_empty_result_of_ready_index_is_trusted(index):
+    for order_id in (1, 2):
+        index.discard(order_id)
+    cur = FakeCursor({3: 1})  # written around the index, picked up by its next rebuild
+    assert assign(cur, [])['orders'] == []
+    assert not cur.probed()
+
+
+def test_lost_claim_is_made_up_from_db(index):
+    reserved = []
+    cur = FakeCursor({1: 3, 3: 5})
+    assert assign(cur, reserved)['orders'] == [{'id': 1}, {'id': 3}]
+    assert cur.probed() and index.rebuilds == 2  # order 3 was missing from the index too
+
+
+def test_stale_index_is_checked_against_db(index, monkeypatch):
+    monkeypatch.setattr(db_connection, '_matching_index_stale', lambda: True)
+    for order_id in (1, 2):
+        index.discard(order_id)
+    cur = FakeCursor({3: 1})
+    assert assign(cur, [])['orders'] == [{'id': 3}]
+    assert cur.probed()
@@ -0,0 +1,91 @@
+"""
+ETag matching and the profile cache of cache.py.
+"""
+import pytest
+
+import cache
+
+ETAG = '"abc"'
+
+
+@pytest.mark.parametrize('header, matches', [(None, False), ('', False), ('"abc"', True), ('W/"abc"', True),
+                                             ('"x", "abc"', True), ('"x",W/"abc"', True), ('*', True),
+                                             ('"abd"', False), ('abc', False), ('"x", "y"', False)])
+def test_etag_matches(header, matches):
+    assert cache.etag_matches(header, ETAG) is matches
+
+
+def test_etag_of_profile():
+    profile = cache.make_profile({'courier_id': 1, 'earnings': 0})
+    assert profile.etag == cache.make_profile({'courier_id': 1, 'earnings': 0}).etag
+    assert profile.etag != cache.make_profile({'courier_id': 1, 'earnings': 500}).etag
+    assert profile.etag.startswith('"') and profile.etag.endswith('"')
+    assert cache.etag_matches(profile.etag, profile.etag)
+
+
+def test_read_through():
+    profiles = cache.ProfileCache(maxsize=10, ttl=60)
+    profile = cache.make_profile({'courier_id': 1})
+    assert profiles.get(1) is None
+    assert profiles.put(1, profile, profiles.token())
+    assert profiles.get(1) is profile
+    profiles.invalidate([1])
+    assert profiles.get(1) is None
+    assert profiles.stats() == {'size': 0, 'hits': 1, 'misses': 2, 'evictions': 0, 'expirations': 0,
+                                'invalidations': 1}
+
+
+def test_read_racing_with_write_is_not_stored():
+    profiles = cache.ProfileCache(maxsize=10, ttl=60)
+    token = profiles.token()  # the read starts
+    profiles.invalidate([1])  # a write commits meanwhile
+    assert not profiles.put(1, cache.make_profile({'courier_id': 1}), token)
+    assert profiles.get(1) is None
+
+
+def test_write_of_another_courier_is_ignored():
+    profiles = cache.ProfileCache(maxsize=10, ttl=60)
+    token = profiles.token()  # the read of the courier 1 starts
+    profiles.invalidate([2])  # a write of the courier 2 commits meanwhile
+    assert profiles.put(1, cache.make_profile({'courier_id': 1}), token)
+    assert not profiles.put(2, cache.make_profile({'courier_id': 2}), token)
+    assert profiles.put(2, cache.make_profile({'courier_id': 2}), profiles.token())
+
+
+def test_forgotten_invalidations_are_assumed_recent(monkeypatch):
+    monkeypatch.setattr(cache.ProfileCache, 'TRACKED_INVALIDATIONS', 2)
+    profiles = cache.ProfileCache(maxsize=10, ttl=60)
+    token = profiles.token()
+    profiles.invalidate([1, 2, 3])  # the invalidation of the courier 1 is dropped
+    assert not profiles.put(1, cache.make_profile({'courier_id': 1}), token)
+    assert not profiles.put(4, cache.make_profile({'courier_id': 4}), token)
+    assert profiles.put(4, cache.make_profile({'courier_id': 4}), profiles.token())
+
+
+def test_clear_drops_reads_in_progress():
+    profiles = cache.ProfileCache(maxsize=10, ttl=60)
+    token = profiles.token()
+    profiles.clear()
+    assert not profiles.put(1, cache.make_profile({'courier_id': 1}), token)
+
+
+def test_least_recently_used_is_evicted():
+    profiles = cache.ProfileCache(maxsize=2, ttl=60)
+    for courier_id in (1, 2):
+        profiles.put(courier_id, cache.make_profile({'courier_id': courier_id}), profiles.token())
+    profiles.get(1)
+    profiles.put(3, cache.make_profile({'courier_id': 3}), profiles.token())
+    assert profiles.get(2) is None and profiles.get(1) is not None and profiles.get(3) is not None
+    assert profiles.evictions == 1
+
+
+def test_expired_profile_is_dropped():
+    profiles = cache.ProfileCache(maxsize=10, ttl=0)
+    profiles.put(1, cache.make_profile({'courier_id': 1}), profiles.token())
+    assert profiles.get(1) is None
+    assert profiles.expirations == 1 and len(profiles) == 0
+
+
+def test_disabled_cache():
+    profiles = cache.ProfileCache(maxsize=0, ttl=60)
+    assert not profiles.put(1, cache.make_profile({'courier_id': 1}), profiles.token())
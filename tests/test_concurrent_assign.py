@@ -0,0 +1,56 @@
+"""
+POST /orders/assign of many couriers with overlapping regions running in parallel against MySQL, with the orders
+matched by the index of open orders and by the DB: no order may be handed to two couriers and no assignment may
+exceed the capacity of its courier. Run only if TEST_DB_HOST is set, the throughput is measured by
+benchmark/concurrent_assign.py.
+"""
+import asyncio
+import random
+from collections import Counter
+from decimal import Decimal
+
+import pytest
+
+import db_connection
+import matching
+from benchmark import common
+from tests import database
+
+
+async def assign_in_parallel(rng: random.Random, use_index: bool):
+    await database.open_database()
+    try:
+        await db_connection.post_orders_execute_queries({'data': common.make_orders(rng, 2000, 3)})
+        couriers = common.make_couriers(rng, 100, 3)
+        await db_connection.post_couriers_execute_queries({'data': couriers})
+        if use_index:
+            await db_connection.rebuild_matching_index()
+        else:
+            matching.index = matching.OrderIndex()  # not loaded, so the orders are looked up in the DB
+
+        results = await asyncio.gather(*(db_connection.post_orders_assign_execute_queries({'courier_id': x['courier_id']})
+                                         for x in couriers))
+        assert all(all_valid for all_valid, _ in results), 'valid assigns failed'
+        handed = Counter(order['id'] for _, response in results for order in response['orders'])
+        doubled = [order_id for order_id, times in handed.items() if times > 1]
+        assert not doubled, f'orders handed to several couriers: {doubled[:10]}'
+
+        async with db_connection.acquire() as conn:
+            cur = await conn.cursor()
+            await cur.execute('''SELECT orders.assigned_courier_id, SUM(orders.weight) AS total, weights.max_weight
+                FROM orders JOIN couriers ON couriers.courier_id = orders.assigned_courier_id
+                JOIN weights ON weights.courier_type = couriers.courier_type
+                GROUP BY orders.assigned_courier_id, weights.max_weight''')
+            overloaded = [x for x in await cur.fetchall() if x['total'] > Decimal(x['max_weight'])]
+            await cur.execute('SELECT COUNT(*) AS assigned FROM orders WHERE assigned_courier_id IS NOT NULL')
+            in_db = (await cur.fetchone())['assigned']
+        assert not overloaded, f'assignments over the capacity: {overloaded[:10]}'
+        assert in_db == len(handed), f'{in_db} orders are assigned in the DB, {len(handed)} in the responses'
+    finally:
+        await db_connection.close_pool(None)
+
+
+@pytest.mark.parametrize('use_index', [True, False], ids=['index', 'db'])
+def test_no_order_is_assigned_twice(use_index, mysql, monkeypatch):
+    monkeypatch.setattr(matching, 'index', matching.index)  # the index replaced by the test is restored
+    asyncio.run(assign_in_parallel(random.Random(0), use_index))
@@ -0,0 +1,93 @@
+"""
+The index of open orders of matching.py checked against the plain filter of the orders it holds.
+"""
+import random
+
+import pytest
+
+import matching
+
+
+def random_windows(rng: random.Random, count: int):
+    windows = []
+    for _ in range(count):
+        start = rng.randrange(matching.MINUTES_IN_DAY - 1)
+        windows.append((start, rng.randint(start + 1, min(start + 240, matching.MINUTES_IN_DAY - 1))))
+    return windows
+
+
+def random_order(rng: random.Random, order_id: int) -> matching.OpenOrder:
+    return matching.OpenOrder(order_id, round(rng.uniform(0.01, 50), 2), rng.randint(1, 5),
+                              random_windows(rng, rng.randint(1, 3)))
+
+
+def expected(orders, regions, max_weight, hours):
+    found = [x for x in orders.values() if x.region in regions and x.weight <= max_weight and x.overlaps(hours)]
+    return sorted(found, key=lambda o: (o.weight, o.order_id))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_candidates(seed):
+    rng = random.Random(seed)
+    index = matching.OrderIndex()
+    orders = {}
+    for order_id in range(1, rng.randint(1, 400)):
+        orders[order_id] = random_order(rng, order_id)
+        index.add(orders[order_id])
+    for order_id in rng.sample(list(orders), len(orders) // 3):
+        assert index.discard(order_id) is orders.pop(order_id)
+    assert len(index) == len(orders)
+    for _ in range(20):
+        regions = rng.sample(range(1, 6), rng.randint(1, 3))
+        max_weight = rng.choice((10, 15, 50))
+        hours = random_windows(rng, rng.randint(1, 2))
+        assert index.candidates(regions, max_weight, hours) == expected(orders, regions, max_weight, hours)
+
+
+def test_touching_ranges_dont_overlap():
+    index = matching.OrderIndex()
+    index.add(matching.OpenOrder(1, 1, 1, [(660, 720)]))
+    assert index.candidates([1], 10, [(540, 660)]) == []
+    assert [x.order_id for x in index.candidates([1], 10, [(540, 661)])] == [1]
+
+
+def test_scan_and_tree_agree():
+    # more light orders in a region than SCAN_THRESHOLD are looked up in the interval tree
+    rng = random.Random(0)
+    index = matching.OrderIndex()
+    orders = {x: random_order(rng, x) for x in range(1, matching.OrderIndex.SCAN_THRESHOLD * 4)}
+    for order in orders.values():
+        order.region = 1
+        index.add(order)
+    hours = [(600, 700)]
+    assert index.candidates([1], 50, hours) == expected(orders, [1], 50, hours)
+    assert index.candidates([1], 1, hours) == expected(orders, [1], 1, hours)
+
+
+def test_interval_tree_overlapping():
+    rng = random.Random(0)
+    tree = matching.IntervalTree()
+    ranges = {}
+    for order_id in range(1, 300):
+        ranges[order_id] = random_windows(rng, 2)
+        for start, stop in ranges[order_id]:
+            tree.add(order_id, start, stop)
+    for order_id in range(1, 300, 2):
+        for start, stop in ranges.pop(order_id):
+            tree.remove(order_id, start, stop)
+    for start, stop in random_windows(rng, 50):
+        found = set()
+        tree.overlapping(start, stop, found)
+        assert found == {x for x, windows in ranges.items() if any(a < stop and start < b for a, b in windows)}
+
+
+def test_rebuild_replays_changes():
+    index = matching.OrderIndex()
+    index.add(matching.OpenOrder(1, 1, 1, [(0, 60)]))
+    index.begin_rebuild()
+    # changes made while the snapshot is read from the DB
+    index.discard(2)
+    index.add(matching.OpenOrder(3, 1, 1, [(0, 60)]))
+    index.finish_rebuild([matching.OpenOrder(1, 1, 1, [(0, 60)]), matching.OpenOrder(2, 1, 1, [(0, 60)])])
+    assert index.ready
+    assert [x.order_id for x in index.candidates([1], 10, [(0, 60)])] == [1, 3]
@@ -0,0 +1,98 @@
+"""
+PATCH of a courier with an open assignment, for every combination of the patched fields: the orders left assigned
+are checked against the ones the courier is still able to deliver, computed here (after a change of the type the ones
+left must also fit its carrying capacity together, as chosen by the solver), as well as the patched profile and
+the clearing of an emptied assignment. Run against the memory backend, and against MySQL if TEST_DB_HOST is set.
+The latency of the patches is measured by benchmark/patch_revalidation.py.
+"""
+import asyncio
+import itertools
+import random
+
+import pytest
+
+import solver
+from benchmark import common
+from tests.test_storage import assigned, courier, order, run_memory, run_mysql
+
+FIELDS = ('courier_type', 'regions', 'working_hours')
+COMBINATIONS = [x for size in range(1, len(FIELDS) + 1) for x in itertools.combinations(FIELDS, size)]
+MAX_WEIGHTS = {'foot': 10, 'bike': 15, 'car': 50}
+REGIONS = [1, 2, 3, 4]
+ALL_DAY = ['00:00-23:59']
+
+
+def minutes(time_range: str) -> tuple:
+    start, stop = ((int(x[:2]) * 60 + int(x[3:])) for x in time_range.split('-'))
+    return start, stop
+
+
+def eligible(orders: list, patch: dict) -> list:
+    """
+    :param orders: orders of the open assignment of the courier of type car working all day in REGIONS
+    :return: sorted ids of the orders left assigned after the patch
+    """
+    max_weight = MAX_WEIGHTS[patch.get('courier_type', 'car')]
+    regions = patch.get('regions', REGIONS)
+    hours = [minutes(x) for x in patch.get('working_hours', ALL_DAY)]
+    left = [x for x in orders if x['weight'] <= max_weight and x['region'] in regions and
+            any(a < stop and start < b for a, b in map(minutes, x['delivery_hours']) for start, stop in hours)]
+    if 'courier_type' in patch:
+        return sorted(solver.select_orders([(x['order_id'], x['weight']) for x in left], max_weight))
+    return sorted(x['order_id'] for x in left)
+
+
+def make_patch(rng: random.Random, fields: tuple) -> dict:
+    patch = {}
+    if 'courier_type' in fields:
+        patch['courier_type'] = 'bike'
+    if 'regions' in fields:
+        patch['regions'] = sorted(rng.sample(REGIONS, 2))
+    if 'working_hours' in fields:
+        patch['working_hours'] = common.random_time_ranges(rng, rng.randint(1, 2))
+    return patch
+
+
+def scenario(patch: dict, seed: int = 0):
+    """
+    :return: scenario of the backend test of the patch of a courier with an open assignment of 30 random orders
+    """
+    rng = random.Random(seed)
+    orders = [order(x, round(rng.uniform(0.01, 1.6), 2), rng.choice(REGIONS),
+                    common.random_time_ranges(rng, rng.randint(1, 2))) for x in range(1, 31)]
+
+    async def check(backend):
+        await backend.post_couriers({'data': [courier(1, 'car', REGIONS, ALL_DAY)]})
+        await backend.post_orders({'data': orders})
+        _, assignment = await backend.assign({'courier_id': 1})
+        assert assigned(assignment) == list(range(1, 31)), f'assignment: {assignment}'
+
+        all_valid, _ = await backend.patch_courier(1, patch)
+        assert all_valid, f'patch {patch} failed'
+        expected = eligible(orders, patch)
+        _, result = await backend.assign({'courier_id': 1})
+        if expected:
+            assert result == {'orders': [{'id': x} for x in expected], 'assign_time': assignment['assign_time']}, \
+                f'after the patch {patch}: {result}'
+        else:
+            assert result == {'orders': []}, f'the emptied assignment is left current: {result}'
+        _, profile = await backend.get_courier(1)
+        assert profile.data['courier_type'] == patch.get('courier_type', 'car')
+        assert sorted(profile.data['regions']) == patch.get('regions', REGIONS)
+        assert sorted(profile.data['working_hours']) == sorted(patch.get('working_hours', ALL_DAY))
+    return check
+
+
+SCENARIOS = [pytest.param(scenario(make_patch(random.Random(number), fields), number), id=' + '.join(fields))
+             for number, fields in enumerate(COMBINATIONS)]
+SCENARIOS.append(pytest.param(scenario({'regions': [5]}), id='regions, all orders de-assigned'))
+
+
+@pytest.mark.parametrize('check', SCENARIOS)
+def test_memory(check, tmp_path):
+    asyncio.run(run_memory(check, str(tmp_path)))
+
+
+@pytest.mark.parametrize('check', SCENARIOS)
+def test_mysql(check, mysql):
+    asyncio.run(run_mysql(check))
@@ -0,0 +1,41 @@
+"""
+Query plans of the statements of db_connection, see benchmark/plan_check.py: the walk over the output of
+EXPLAIN FORMAT=JSON is checked on canned plans, the plans of a seeded database only if TEST_DB_HOST is set.
+"""
+import argparse
+import asyncio
+
+import cfg
+from benchmark import plan_check
+
+
+def scanned(name: str, rows: int, access_type: str = 'ALL', **extra) -> dict:
+    return {'table': {'table_name': name, 'access_type': access_type, 'rows_examined_per_scan': rows,
+                      'rows_produced_per_join': rows, **extra}}
+
+
+def test_full_scan_is_found():
+    plan = plan_check.analyze({'query_block': {'nested_loop': [scanned('weights', 3), scanned('orders', 500)]}})
+    assert plan.full_scans == ['orders']  # weights has a row per courier type
+    assert plan.rows_examined == 3 + 3 * 500
+
+
+def test_rows_of_a_join_are_multiplied():
+    plan = plan_check.analyze({'query_block': {'ordering_operation': {'using_filesort': True, 'nested_loop': [
+        scanned('couriers_regions', 4, 'ref'), scanned('orders', 10, 'ref')]}}})
+    assert plan.full_scans == [] and plan.filesort
+    assert plan.rows_examined == 4 + 4 * 10
+
+
+def test_budget_of_the_assignment_lookup():
+    sql = 'SELECT DISTINCT ... FROM couriers_working_hours AS cwh JOIN delivery_hours_of_orders AS dhof ...'
+    assert plan_check.budget_of(sql, 1000, 100000) == 25000
+    assert plan_check.budget_of('SELECT * FROM couriers WHERE courier_id = ?', 1000, 100000) == 1000
+
+
+def test_plans_are_within_the_limits(mysql, monkeypatch):
+    monkeypatch.setattr(cfg, 'TRACE_EXPLAIN_THRESHOLD', cfg.TRACE_EXPLAIN_THRESHOLD)
+    monkeypatch.setattr(cfg, 'TRACE_MAX_SPANS', cfg.TRACE_MAX_SPANS)  # both are changed by the run
+    args = argparse.Namespace(start_mysql=None, couriers=500, orders=20000, regions=20, complete_share=0.5,
+                              rows_budget=1000, seed=0, verbose=False)
+    assert asyncio.run(plan_check.run(args)), 'statements with plans over the limits are printed'
@@ -0,0 +1,76 @@
+"""
+Invariants of the selection of the orders of an assignment by solver.select_orders, checked against
+the brute force over all subsets of small random sets of candidates.
+"""
+import itertools
+import random
+
+import pytest
+
+import solver
+
+
+def hundredths(weight) -> int:
+    return round(float(weight) * 100)
+
+
+def subsets(candidates):
+    for size in range(len(candidates) + 1):
+        yield from itertools.combinations(candidates, size)
+
+
+def random_candidates(rng: random.Random, count: int):
+    return [(order_id, round(rng.uniform(0.01, 20), 2)) for order_id in range(1, count + 1)]
+
+
+@pytest.mark.parametrize('seed', range(50))
+@pytest.mark.parametrize('objective', [solver.OBJECTIVE_ORDERS, solver.OBJECTIVE_WEIGHT])
+def test_capacity_is_kept(seed, objective):
+    rng = random.Random(seed)
+    candidates = random_candidates(rng, rng.randint(0, 40))
+    max_weight = rng.choice((10, 15, 50))
+    chosen = solver.select_orders(candidates, max_weight, objective)
+    weights = dict(candidates)
+    assert len(set(chosen)) == len(chosen) and set(chosen) <= weights.keys()
+    assert sum(hundredths(weights[x]) for x in chosen) <= max_weight * 100
+    assert chosen == sorted(chosen, key=lambda x: (hundredths(weights[x]), x))
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_most_orders(seed):
+    rng = random.Random(seed)
+    candidates = random_candidates(rng, rng.randint(1, 12))
+    chosen = solver.select_orders(candidates, 15, solver.OBJECTIVE_ORDERS)
+    best = max(len(x) for x in subsets(candidates) if sum(hundredths(w) for _, w in x) <= 1500)
+    assert len(chosen) == best
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_most_weight_exact(seed):
+    rng = random.Random(seed)
+    candidates = random_candidates(rng, rng.randint(1, 12))
+    chosen = solver.select_orders(candidates, 15, solver.OBJECTIVE_WEIGHT, dp_max_candidates=12)
+    weights = dict(candidates)
+    best = max(total for total in (sum(hundredths(w) for _, w in x) for x in subsets(candidates)) if total <= 1500)
+    assert sum(hundredths(weights[x]) for x in chosen) == best
+
+
+def test_all_fit():
+    candidates = [(3, 2.5), (1, 2.5), (2, 5)]
+    assert solver.select_orders(candidates, 10, solver.OBJECTIVE_ORDERS) == [1, 3, 2]
+    assert solver.select_orders(candidates, 10, solver.OBJECTIVE_WEIGHT) == [1, 3, 2]
+
+
+def test_weights_in_hundredths():
+    # 0.1 + 0.2 is above 0.3 in floats, not in the hundredths the weights are stored with
+    assert solver.select_orders([(1, 0.1), (2, 0.2)], 0.3, solver.OBJECTIVE_ORDERS) == [1, 2]
+
+
+def test_too_heavy_orders_are_left_out():
+    assert solver.select_orders([(1, 11), (2, 10)], 10, solver.OBJECTIVE_WEIGHT) == [2]
+    assert solver.select_orders([], 10) == []
+
+
+def test_unknown_objective():
+    with pytest.raises(ValueError):
+        solver.select_orders([(1, 5), (2, 6)], 10, 'profit')
@@ -0,0 +1,416 @@
+"""
+Conformance of the storage backends of storage.py: the same scenarios of the six operations (registration
+with invalid and already registered ids, profiles, patches, assignments within the capacity, regions and working hours,
+completions, de-assignment by a patch, earnings and rating, streamed bodies) are run against every backend,
+each from empty storage. The memory backend is also reopened from its journal, from its snapshot and from a journal
+with a torn last record. The MySQL backend is checked, and its results compared with the ones of the memory backend,
+only if TEST_DB_HOST is set, see conftest.py. The routes of the operations are also requested through the app
+served with either backend.
+
+    python -m pytest tests
+    TEST_DB_HOST=127.0.0.1 python -m pytest tests/test_storage.py
+"""
+import asyncio
+import datetime
+import os
+from typing import Dict, List
+
+import pytest
+from aiohttp import test_utils
+
+import Application
+import cache
+import cfg
+import db_connection
+import memory_storage
+import storage
+import streaming
+from benchmark import common
+from tests import database
+
+
+def courier(courier_id: int, courier_type: str, regions: List[int], hours: List[str]) -> Dict:
+    return {'courier_id': courier_id, 'courier_type': courier_type, 'regions': regions, 'working_hours': hours}
+
+
+def order(order_id: int, weight: float, region: int, hours: List[str]) -> Dict:
+    return {'order_id': order_id, 'weight': weight, 'region': region, 'delivery_hours': hours}
+
+
+def completion(courier_id: int, order_id: int, assign_time: str, minutes: int) -> Dict:
+    complete_time = datetime.datetime.fromisoformat(assign_time) + datetime.timedelta(minutes=minutes)
+    return {'courier_id': courier_id, 'order_id': order_id, 'complete_time': complete_time.isoformat() + 'Z'}
+
+
+def rating(*delivery_seconds: float) -> float:
+    average = sum(delivery_seconds) / len(delivery_seconds)
+    limit = cfg.RATING_MAX_DELIVERY_SECONDS
+    return round((limit - min(average, limit)) / limit * 5, 2)
+
+
+def earnings(courier_type: str) -> int:
+    return cfg.EARNINGS_BASE * cfg.EARNINGS_COEFFICIENTS[courier_type]
+
+
+def assigned(response: Dict) -> List[int]:
+    return [x['id'] for x in response['orders']]
+
+
+class Recorded:
+    """
+    The backend with the results of its operations kept, so they can be compared with the ones of another backend.
+    """
+
+    def __init__(self, backend: storage.Storage):
+        self.backend = backend
+        self.results = []
+
+    def __getattr__(self, name: str):
+        operation = getattr(self.backend, name)
+
+        async def call(*args):
+            result = await operation(*args)
+            self.results.append((name, comparable(result)))
+            return result
+        return call
+
+
+def comparable(value):
+    if isinstance(value, cache.Profile):
+        return value.data
+    if isinstance(value, tuple):
+        return tuple(comparable(x) for x in value)
+    if isinstance(value, dict):
+        return {key: '<time>' if key == 'assign_time' else comparable(x) for key, x in value.items()}
+    return value
+
+
+async def check_post_couriers(backend: Recorded):
+    result = await backend.post_couriers({'data': [courier(1, 'foot', [1], ['09:00-11:00']),
+                                                   courier(2, 'car', [1, 2], ['08:00-20:00'])]})
+    assert result == (True, [1, 2]), f'valid couriers: {result}'
+    result = await backend.post_couriers({'data': [courier(2, 'car', [3], ['08:00-20:00']),
+                                                   courier(3, 'bike', [2], ['10:00-11:00']),
+                                                   courier(4, 'plane', [2], ['10:00-11:00']),
+                                                   courier(3, 'bike', [2], ['10:00-11:00']),
+                                                   {'courier_id': 5}]})
+    assert result == (False, [2, 4, 3, 5]), f'registered, invalid and repeated ids: {result}'
+    _, profile = await backend.get_courier(3)
+    assert profile is not None, 'the valid courier of the invalid request is not written'
+    _, profile = await backend.get_courier(2)
+    assert profile.data['regions'] == [1, 2], 'the registered courier is overwritten'
+    result = await backend.post_couriers({'data': []})
+    assert result == (True, []), f'empty request: {result}'
+
+
+async def check_post_orders(backend: Recorded):
+    result = await backend.post_orders({'data': [order(1, 0.01, 1, ['10:00-12:00']), order(2, 50, 2, [])]})
+    assert result == (True, [1, 2]), f'valid orders: {result}'
+    result = await backend.post_orders({'data': [order(1, 3, 1, ['10:00-12:00']), order(3, 50.01, 1, ['10:00-12:00']),
+                                                 order(4, 3, 1, ['12:00-10:00']), order(5, 3, 1, ['10:00-12:00'])]})
+    assert result == (False, [1, 3, 4]), f'registered and invalid ids: {result}'
+
+
+async def check_profile(backend: Recorded):
+    await backend.post_couriers({'data': [courier(1, 'bike', [5, 2, 9], ['18:00-20:00', '08:30-12:00'])]})
+    result = await backend.get_courier(99)
+    assert result == (True, None), f'unknown courier: {result}'
+    ok, profile = await backend.get_courier(1)
+    expected = {'courier_id': 1, 'courier_type': 'bike', 'regions': [2, 5, 9],
+                'working_hours': ['08:30-12:00', '18:00-20:00'], 'earnings': 0}
+    assert ok and profile.data == expected, f'profile: {profile}'
+    await backend.post_couriers({'data': [courier(2, 'foot', [1], ['22:00-24:00', '00:00-02:00'])]})
+    _, profile = await backend.get_courier(2)
+    assert profile.data['working_hours'] == ['00:00-02:00', '22:00-24:00'], f'overnight working hours: {profile}'
+
+
+async def check_patch(backend: Recorded):
+    await backend.post_couriers({'data': [courier(1, 'foot', [1, 2], ['09:00-11:00'])]})
+    for patch in ({'courier_type': 'plane'}, {'regions': [1, -1]}, {'working_hours': ['9-11']}, {'name': 'x'}, []):
+        result = await backend.patch_courier(1, patch)
+        assert result == (False, {}), f'invalid patch {patch}: {result}'
+    result = await backend.patch_courier(99, {'courier_type': 'car'})
+    assert result == (False, {}), f'patch of an unknown courier: {result}'
+    ok, patched = await backend.patch_courier(1, {'regions': [3, 1], 'working_hours': ['12:00-13:00', '09:00-11:00']})
+    expected = {'courier_id': 1, 'courier_type': 'foot', 'regions': [1, 3], 'working_hours': ['09:00-11:00', '12:00-13:00']}
+    assert ok and patched == expected, f'patched courier: {patched}'
+    result = await backend.patch_courier(1, {})
+    assert result == (True, expected), f'empty patch: {result}'
+    _, profile = await backend.get_courier(1)
+    assert profile.data == {**expected, 'earnings': 0}, f'profile after the patch: {profile.data}'
+
+
+async def check_assign(backend: Recorded):
+    await backend.post_couriers({'data': [courier(1, 'foot', [1], ['09:00-11:00']),
+                                          courier(2, 'car', [1, 2], ['08:00-20:00']),
+                                          courier(3, 'bike', [9], ['00:00-23:59'])]})
+    await backend.post_orders({'data': [order(1, 3, 1, ['10:00-12:00']), order(2, 4, 1, ['10:30-11:30']),
+                                        order(3, 5, 1, ['08:00-09:01']), order(4, 11, 1, ['09:00-12:00']),
+                                        order(5, 2, 2, ['09:00-12:00']), order(6, 1, 1, ['11:00-12:00']),
+                                        order(7, 1, 1, []), order(8, 1, 9, ['23:59-24:00'])]})
+    for request in ({'courier_id': 'x'}, {'courier_id': 1, 'extra': 1}, {}):
+        result = await backend.assign(request)
+        assert result == (False, {}), f'invalid request {request}: {result}'
+    result = await backend.assign({'courier_id': 99})
+    assert result == (False, {}), f'unknown courier: {result}'
+
+    ok, first = await backend.assign({'courier_id': 1})
+    weights = {1: 3, 2: 4, 3: 5}
+    assert ok and set(assigned(first)) <= set(weights) and len(assigned(first)) == 2, f'assignment: {first}'
+    assert sum(weights[x] for x in assigned(first)) <= 10, f'assignment over the capacity: {first}'
+    assert assigned(first) == sorted(assigned(first)) and first['assign_time'], f'assignment: {first}'
+    result = await backend.assign({'courier_id': 1})
+    assert result == (True, first), f'repeated assignment: {result}'
+
+    ok, second = await backend.assign({'courier_id': 2})
+    expected = sorted({4, 5, 6} | set(weights) - set(assigned(first)))
+    assert ok and assigned(second) == expected, f'assignment of the rest: {second}, expected {expected}'
+    result = await backend.assign({'courier_id': 3})
+    assert result == (True, {'orders': []}), f'assignment without orders: {result}'
+    await backend.patch_courier(3, {'working_hours': ['00:00-24:00']})  # the last minute of the day is included
+    _, result = await backend.assign({'courier_id': 3})
+    assert assigned(result) == [8], f'assignment till the end of the day: {result}'
+
+
+async def check_complete(backend: Recorded):
+    await backend.post_couriers({'data': [courier(1, 'foot', [1], ['09:00-11:00']),
+                                          courier(2, 'foot', [1], ['09:00-11:00'])]})
+    await backend.post_orders({'data': [order(1, 3, 1, ['10:00-12:00']), order(2, 4, 1, ['10:00-12:00']),
+                                        order(3, 4, 2, ['10:00-12:00'])]})
+    _, assignment = await backend.assign({'courier_id': 1})
+    assert assigned(assignment) == [1, 2], f'assignment: {assignment}'
+    assign_time = assignment['assign_time']
+    for request in (completion(2, 1, assign_time, 10), completion(1, 3, assign_time, 10),
+                    completion(1, 99, assign_time, 10), {'courier_id': 1, 'order_id': 1},
+                    {**completion(1, 1, assign_time, 10), 'complete_time': '2021-01-10 10:33:01'}):
+        result = await backend.complete(request)
+        assert result == (False, {}), f'invalid completion {request}: {result}'
+
+    for _ in range(2):  # repeated completion is answered the same way
+        result = await backend.complete(completion(1, 1, assign_time, 10))
+        assert result == (True, {'order_id': 1}), f'completion: {result}'
+    _, profile = await backend.get_courier(1)
+    assert (profile.data.get('rating'), profile.data['earnings']) == (rating(600), 0), f'after one: {profile.data}'
+    result = await backend.assign({'courier_id': 1})
+    assert result == (True, {'orders': [{'id': 2}], 'assign_time': assign_time}), f'remaining orders: {result}'
+
+    result = await backend.complete(completion(1, 2, assign_time, 15))
+    assert result == (True, {'order_id': 2}), f'completion: {result}'
+    _, profile = await backend.get_courier(1)
+    expected = (rating(600, 300), earnings('foot'))
+    assert (profile.data.get('rating'), profile.data['earnings']) == expected, f'after the assignment: {profile.data}'
+    result = await backend.assign({'courier_id': 1})
+    assert result == (True, {'orders': []}), f'assignment after the finished one: {result}'
+    result = await backend.complete(completion(1, 1, assign_time, 20))
+    assert result == (True, {'order_id': 1}), f'completion of the finished assignment: {result}'
+    _, repeated = await backend.get_courier(1)
+    assert repeated.data == profile.data, f'repeated completion is counted: {repeated.data}'
+
+
+async def check_deassign(backend: Recorded):
+    await backend.post_couriers({'data': [courier(1, 'car', [1, 2], ['08:00-20:00']),
+                                          courier(2, 'foot', [2], ['09:00-12:00']),
+                                          courier(3, 'bike', [3], ['09:00-12:00'])]})
+    await backend.post_orders({'data': [order(1, 30, 1, ['10:00-12:00']), order(2, 5, 2, ['10:00-12:00']),
+                                        order(3, 6, 1, ['18:00-19:00']), order(4, 2, 3, ['09:30-10:00']),
+                                        order(5, 2, 3, ['11:00-11:30'])]})
+    _, assignment = await backend.assign({'courier_id': 1})
+    assert assigned(assignment) == [1, 2, 3], f'assignment: {assignment}'
+    await backend.complete(completion(1, 3, assignment['assign_time'], 30))
+
+    await backend.patch_courier(1, {'courier_type': 'foot'})  # the order of 30 kg can`t be carried anymore
+    result = await backend.assign({'courier_id': 1})
+    assert assigned(result[1]) == [2], f'after the type is patched: {result}'
+    await backend.patch_courier(1, {'regions': [1]})  # the last one left, the assignment is finished
+    result = await backend.assign({'courier_id': 1})
+    assert result == (True, {'orders': []}), f'after the regions are patched: {result}'
+    _, profile = await backend.get_courier(1)
+    assert profile.data['earnings'] == earnings('car'), f'the type of the assignment is not paid: {profile.data}'
+    result = await backend.assign({'courier_id': 2})
+    assert assigned(result[1]) == [2], f'de-assigned order is not open again: {result}'
+
+    _, assignment = await backend.assign({'courier_id': 3})
+    assert assigned(assignment) == [4, 5], f'assignment: {assignment}'
+    await backend.patch_courier(3, {'working_hours': ['09:00-11:00']})  # 11:00-11:30 only touches it
+    result = await backend.assign({'courier_id': 3})
+    assert result == (True, {'orders': [{'id': 4}], 'assign_time': assignment['assign_time']}), \
+        f'after the working hours are patched: {result}'
+    _, profile = await backend.get_courier(3)
+    assert profile.data['earnings'] == 0, f'unfinished assignment is paid: {profile.data}'
+
+    await backend.post_couriers({'data': [courier(4, 'car', [4], ['09:00-12:00'])]})
+    await backend.post_orders({'data': [order(x, 9, 4, ['10:00-12:00']) for x in range(6, 10)]})
+    _, assignment = await backend.assign({'courier_id': 4})
+    assert assigned(assignment) == [6, 7, 8, 9], f'assignment: {assignment}'
+    await backend.patch_courier(4, {'courier_type': 'foot'})  # each of them fits 10 kg, all of them don`t
+    result = await backend.assign({'courier_id': 4})
+    assert result == (True, {'orders': [{'id': 6}], 'assign_time': assignment['assign_time']}), \
+        f'after the type is patched, the orders left are over the capacity: {result}'
+
+
+async def batches(*lists: List, malformed: bool = False):
+    for items in lists:
+        yield items
+    if malformed:
+        raise streaming.StreamFormatError('body is cut off')
+
+
+async def check_streams(backend: Recorded):
+    result = await backend.post_couriers_stream(batches([courier(1, 'foot', [1], ['09:00-11:00'])],
+                                                        [courier(2, 'bike', [1], ['09:00-11:00']),
+                                                         courier(1, 'bike', [1], ['09:00-11:00'])]))
+    assert result == (False, [1]), f'id repeated in another batch: {result}'
+    try:
+        await backend.post_orders_stream(batches([order(1, 3, 1, ['10:00-12:00'])], malformed=True))
+    except streaming.StreamFormatError:
+        pass
+    else:
+        raise AssertionError('malformed body is accepted')
+    result = await backend.post_orders_stream(batches([order(1, 3, 1, ['10:00-12:00'])], [order(2, 3, 1, [])]))
+    assert result == (True, [1, 2]), f'orders of the malformed body are written: {result}'
+
+
+CHECKS = [check_post_couriers, check_post_orders, check_profile, check_patch, check_assign, check_complete,
+          check_deassign, check_streams]
+
+
+async def run_memory(check, directory: str) -> list:
+    """
+    :return: results of the operations of the scenario run against an empty memory backend
+    """
+    engine = memory_storage.MemoryStorage(directory)
+    engine.open()
+    try:
+        backend = Recorded(engine)
+        await check(backend)
+        return backend.results
+    finally:
+        engine.close()
+
+
+async def run_mysql(check) -> list:
+    """
+    :return: results of the operations of the scenario run against the emptied test database
+    """
+    await database.open_database()
+    try:
+        backend = Recorded(storage.MySQLStorage())
+        await check(backend)
+        return backend.results
+    finally:
+        await db_connection.close_pool(None)
+
+
+@pytest.mark.parametrize('check', CHECKS, ids=lambda x: x.__name__)
+def test_memory(check, tmp_path):
+    asyncio.run(run_memory(check, str(tmp_path)))
+
+
+@pytest.mark.parametrize('check', CHECKS, ids=lambda x: x.__name__)
+def test_mysql(check, mysql):
+    asyncio.run(run_mysql(check))
+
+
+@pytest.mark.parametrize('check', CHECKS, ids=lambda x: x.__name__)
+def test_backends_agree(check, mysql, tmp_path):
+    memory = asyncio.run(run_memory(check, str(tmp_path)))
+    for number, (x, y) in enumerate(zip(memory, asyncio.run(run_mysql(check)))):
+        assert x == y, f'operation {number} differs, memory: {x}, mysql: {y}'
+
+
+def state(engine: memory_storage.MemoryStorage) -> Dict:
+    """
+    :return: everything of the memory backend the operations can return
+    """
+    return {'sequence': engine.sequence,
+            'couriers': {x.courier_id: (engine._profile(x).data, None if x.assignment is None else (
+                x.assignment.assignment_id, x.assignment.assigned_at, [o.order_id for o in x.assignment.remaining()]))
+                         for x in engine.couriers.values()},
+            'open': sorted(x.order_id for x in engine.orders.values() if x.order_id in engine.open_orders)}
+
+
+@pytest.fixture
+def killed(monkeypatch, tmp_path) -> (str, Dict):
+    """
+    Runs a scenario over a memory backend with a snapshot every few writes, then drops it as if the process was
+    killed: the last writes are in the journal only.
+    :return: directory of the backend, its state before it was dropped
+    """
+    monkeypatch.setattr(cfg, 'MEMORY_SNAPSHOT_RECORDS', 5)
+    engine = memory_storage.MemoryStorage(str(tmp_path))
+    engine.open()
+    asyncio.run(check_deassign(Recorded(engine)))
+    assert engine._journaled, 'nothing is left in the journal, the replay is not checked'
+    engine._journal.close()
+    return str(tmp_path), state(engine)
+
+
+def reopened(directory: str) -> memory_storage.MemoryStorage:
+    engine = memory_storage.MemoryStorage(directory)
+    engine.open()
+    return engine
+
+
+def test_memory_replays_journal(killed):
+    directory, expected = killed
+    engine = reopened(directory)
+    assert state(engine) == expected
+    engine.close()
+
+
+def test_memory_drops_torn_record(killed):
+    directory, expected = killed
+    with open(os.path.join(directory, memory_storage.JOURNAL_FILE), 'ab') as journal:
+        journal.write(b'[1000,"complete",1,')  # the write a crash interrupted
+    engine = reopened(directory)
+    assert state(engine) == expected
+    ok, _ = asyncio.run(engine.patch_courier(2, {'regions': [2, 3]}))  # written after the torn record
+    assert ok
+    expected = state(engine)
+    engine._journal.close()
+    assert state(reopened(directory)) == expected
+
+
+def test_memory_loads_snapshot(killed):
+    directory, _ = killed
+    engine = reopened(directory)
+    expected = state(engine)
+    engine.close()  # writes the snapshot and empties the journal
+    engine = reopened(directory)
+    assert engine._journaled == 0, 'journal is not emptied by the snapshot'
+    assert state(engine) == expected
+    engine.close()
+
+
+async def check_routes(client: test_utils.TestClient):
+    response = await client.post('/couriers', json={'data': [courier(1, 'foot', [1], ['09:00-11:00'])]})
+    assert response.status == 201
+    for path, patch in (('/couriers/1/', {'regions': [2]}), ('/couriers/1', {'courier_type': 'bike'})):
+        response = await client.patch(path, json=patch)
+        assert response.status == 200, f'PATCH {path}: {await response.text()}'
+    response = await client.patch('/couriers/99/', json={'regions': [2]})
+    assert response.status == 400
+    response = await client.get('/couriers/1')
+    assert response.status == 200
+    assert await response.json() == {'courier_id': 1, 'courier_type': 'bike', 'regions': [2],
+                                     'working_hours': ['09:00-11:00'], 'earnings': 0}
+    response = await client.get('/couriers/99')
+    assert response.status == 404
+
+
+async def serve(prepare=None):
+    async with test_utils.TestClient(test_utils.TestServer(Application.make_app())) as client:
+        if prepare is not None:
+            await prepare()
+        await check_routes(client)
+
+
+def test_routes_memory(monkeypatch, tmp_path):
+    monkeypatch.setattr(cfg, 'STORAGE_BACKEND', 'memory')
+    monkeypatch.setattr(cfg, 'MEMORY_STORAGE_DIR', str(tmp_path))
+    asyncio.run(serve())
+
+
+def test_routes_mysql(mysql):
+    asyncio.run(common.prepare_database())
+    asyncio.run(serve(database.empty_tables))
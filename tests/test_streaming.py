@@ -0,0 +1,75 @@
+"""
+Streamed bodies of POST /couriers and /orders, see streaming.py: a body the client stops sending is answered with 408,
+and the body is read and validated whole before db_connection acquires a connection for the transaction.
+"""
+import asyncio
+
+import pytest
+from aiohttp import test_utils
+
+import Application
+import cfg
+import db_connection
+import streaming
+from tests.test_storage import courier
+
+
+class StalledContent:
+    """
+    Body of a request whose client sent the part and then stopped sending.
+    """
+
+    def __init__(self, part: bytes):
+        self.part = part
+
+    async def read(self, size: int) -> bytes:
+        if self.part:
+            part, self.part = self.part, b''
+            return part
+        await asyncio.sleep(60)
+
+
+async def consume(items):
+    return [x async for x in items]
+
+
+@pytest.fixture
+def read_timeout(monkeypatch):
+    monkeypatch.setattr(cfg, 'STREAM_READ_TIMEOUT', 0.01)
+
+
+@pytest.mark.parametrize('parse, part', [(streaming.ndjson_items, b'{"courier_id": 1}\n{"cour'),
+                                         (streaming.data_array_items, b'{"data": [{"courier_id": 1}, ')])
+def test_stalled_body_times_out(read_timeout, parse, part):
+    with pytest.raises(streaming.StreamTimeoutError):
+        asyncio.run(consume(parse(StalledContent(part))))
+
+
+def test_malformed_body_takes_no_connection(monkeypatch):
+    class Pool:
+        def acquire(self):
+            raise AssertionError('a connection is acquired before the body is read')
+    monkeypatch.setattr(db_connection, 'pool', Pool())
+
+    async def batches():
+        yield [courier(1, 'foot', [1], ['09:00-11:00'])]
+        raise streaming.StreamFormatError('body is cut off')
+
+    with pytest.raises(streaming.StreamFormatError):
+        asyncio.run(db_connection.post_couriers_stream_execute_queries(batches()))
+
+
+async def post_stalled_body() -> int:
+    async def body():
+        yield b'{"courier_id": 1, "courier_type": "foot", "regions": [1], "working_hours": []}\n'
+        await asyncio.sleep(60)
+
+    async with test_utils.TestClient(test_utils.TestServer(Application.make_app())) as client:
+        response = await client.post('/couriers', data=body(), headers={'Content-Type': streaming.NDJSON_CONTENT_TYPE})
+        return response.status
+
+
+def test_stalled_body_is_answered_408(read_timeout, monkeypatch, tmp_path):
+    monkeypatch.setattr(cfg, 'STORAGE_BACKEND', 'memory')
+    monkeypatch.setattr(cfg, 'MEMORY_STORAGE_DIR', str(tmp_path))
+    assert asyncio.run(post_stalled_body()) == 408
@@ -0,0 +1,166 @@
+"""
+Retries of the transactions of db_connection._transaction, run over a fake pool whose work fails with the errors
+of MySQL, and the 503 answered by handlers.db_unavailable once they run out. The deadlocks of the assigns and patches
+of the same couriers running in parallel are checked against MySQL if TEST_DB_HOST is set.
+"""
+import asyncio
+import random
+from collections import Counter
+
+import aiomysql
+import pytest
+from aiohttp import test_utils, web
+
+import cfg
+import db_connection
+import handlers
+import metrics
+from benchmark import common
+from tests import database
+
+DEADLOCK = aiomysql.OperationalError(1213, 'Deadlock found when trying to get lock; try restarting transaction')
+LOCK_WAIT_TIMEOUT = aiomysql.OperationalError(1205, 'Lock wait timeout exceeded; try restarting transaction')
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.begun = self.committed = self.rolled_back = 0
+
+    async def cursor(self):
+        return None
+
+    async def begin(self):
+        self.begun += 1
+
+    async def commit(self):
+        self.committed += 1
+
+    async def rollback(self):
+        self.rolled_back += 1
+
+    def get_transaction_status(self) -> bool:
+        return False
+
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConnection()
+
+    async def acquire(self):
+        return self.conn
+
+    def release(self, conn: FakeConnection):
+        pass
+
+
+@pytest.fixture
+def pool(monkeypatch) -> FakePool:
+    fake = FakePool()
+    monkeypatch.setattr(db_connection, 'pool', fake)
+    monkeypatch.setattr(cfg, 'DB_RETRY_ATTEMPTS', 3)
+    monkeypatch.setattr(cfg, 'DB_RETRY_BASE_DELAY', 0)
+    return fake
+
+
+def failing(*errors: Exception):
+    """
+    :return: work raising the errors one by one, then committing 'done'
+    """
+    left = list(errors)
+
+    async def work(cur):
+        if left:
+            raise left.pop(0)
+        return True, 'done'
+    return work
+
+
+def run(work, retried: bool = True) -> (object, int):
+    """
+    :return: result of the transaction, times rolled_back was called
+    """
+    calls = []
+    result = asyncio.run(db_connection._transaction('test', work, lambda: calls.append(1), retried))
+    return result, len(calls)
+
+
+@pytest.mark.parametrize('error, reason', [(DEADLOCK, 'deadlock'), (LOCK_WAIT_TIMEOUT, 'lock_wait_timeout')])
+def test_retried(pool, error, reason):
+    before = metrics.db_retries.labels(reason).value
+    assert run(failing(error, error)) == ('done', 2)
+    assert pool.conn.begun == 3 and pool.conn.rolled_back == 2 and pool.conn.committed == 1
+    assert metrics.db_retries.labels(reason).value == before + 2
+
+
+def test_retries_run_out(pool):
+    with pytest.raises(db_connection.DBUnavailable) as raised:
+        run(failing(DEADLOCK, LOCK_WAIT_TIMEOUT, DEADLOCK))
+    assert raised.value.reason == 'deadlock' and 'gave up after 3 attempts' in str(raised.value)
+    assert pool.conn.begun == 3 and pool.conn.committed == 0
+
+
+def test_streamed_work_is_not_retried(pool):
+    with pytest.raises(db_connection.DBUnavailable) as raised:
+        run(failing(DEADLOCK), retried=False)
+    assert raised.value.reason == 'deadlock' and pool.conn.begun == 1
+
+
+def test_other_errors_are_raised(pool):
+    with pytest.raises(ValueError):
+        run(failing(ValueError('bad row')))
+    assert pool.conn.begun == 1 and pool.conn.rolled_back == 1
+
+
+def test_rolled_back_work(pool):
+    async def work(cur):
+        return False, 'invalid'
+    assert run(work) == ('invalid', 1)
+    assert pool.conn.committed == 0 and pool.conn.rolled_back == 1
+
+
+def test_unavailable_is_answered_503():
+    async def handler(request):
+        raise db_connection.DBUnavailable('deadlock', 'assign: gave up after 5 attempts')
+
+    request = test_utils.make_mocked_request('POST', '/orders/assign')
+    with pytest.raises(web.HTTPServiceUnavailable) as raised:
+        asyncio.run(handlers.db_unavailable(request, handler))
+    assert raised.value.headers['Retry-After'] == str(cfg.DB_RETRY_AFTER)
+
+
+async def assign_and_patch(rng: random.Random, rounds: int) -> Counter:
+    """
+    :return: numbers of the requests by outcome: 'ok', '400' or '503 <reason>'
+    """
+    await database.open_database()
+    try:
+        await db_connection.post_orders_execute_queries({'data': common.make_orders(rng, 2000, 2)})
+        couriers = common.make_couriers(rng, 50, 2)
+        await db_connection.post_couriers_execute_queries({'data': couriers})
+        outcomes = Counter()
+
+        async def call(request):
+            try:
+                ok, _ = await request
+            except db_connection.DBUnavailable as error:
+                outcomes[f'503 {error.reason}'] += 1
+            else:
+                outcomes['ok' if ok else '400'] += 1
+
+        for _ in range(rounds):
+            requests = []
+            for x in couriers:
+                patch = {'regions': rng.sample([1, 2], rng.randint(1, 2)), 'courier_type': rng.choice(common.COURIER_TYPES)}
+                requests.append(db_connection.post_orders_assign_execute_queries({'courier_id': x['courier_id']}))
+                requests.append(db_connection.patch_couriers_id_execute_queries(x['courier_id'], patch))
+            rng.shuffle(requests)
+            await asyncio.gather(*(call(x) for x in requests))
+        return outcomes
+    finally:
+        await db_connection.close_pool(None)
+
+
+def test_deadlocks_are_retried(mysql):
+    outcomes = asyncio.run(assign_and_patch(random.Random(0), 3))
+    assert not outcomes['400'], f'valid requests were answered 400: {outcomes}'
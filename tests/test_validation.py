@@ -0,0 +1,91 @@
+"""
+Edge cases of the validators of the requests in validation.py.
+"""
+import datetime
+
+import pytest
+
+import profiles
+import validation
+
+
+@pytest.mark.parametrize('value, expected', [('09:00-11:00', (540, 660)), ('9:00-11:00', (540, 660)),
+                                             ('00:00-23:59', (0, 1439)), ('10:00-10:01', (600, 601)),
+                                             ('22:00-24:00', (1320, 1440)), ('00:00-24:00', (0, 1440))])
+def test_time_range(value, expected):
+    assert validation.time_range(value) == expected
+    assert profiles.format_time_range(*expected) == value.zfill(11)
+
+
+@pytest.mark.parametrize('value', ['22:00-02:00', '10:00-10:00', '24:00-24:30', '23:00-24:01', '24:00-24:00',
+                                   '23:00-25:00', '10:60-11:00', '10:00-11:0', '10:00 - 11:00', '10:00-11:00 ',
+                                   '１０:00-11:00', 540, None, ['09:00-11:00']])
+def test_invalid_time_range(value):
+    with pytest.raises(validation.ValidationError):
+        validation.time_range(value)
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2021-01-10T10:33:01.42Z', datetime.datetime(2021, 1, 10, 10, 33, 1, 420000)),
+    ('2021-01-10T10:33:01Z', datetime.datetime(2021, 1, 10, 10, 33, 1)),
+    ('2021-01-10T12:33:01.123456+02:00', datetime.datetime(2021, 1, 10, 10, 33, 1, 123456)),
+    ('2021-01-10T00:33:01-10:00', datetime.datetime(2021, 1, 10, 10, 33, 1)),
+])
+def test_timestamp(value, expected):
+    assert validation.timestamp(value) == expected
+
+
+@pytest.mark.parametrize('value', ['2021-01-10 10:33:01Z', '2021-01-10T10:33:01', '2021-02-30T10:33:01Z',
+                                   '2021-01-10T25:33:01Z', '2021-01-10T10:33:01.1234567Z', 1610274781])
+def test_invalid_timestamp(value):
+    with pytest.raises(validation.ValidationError):
+        validation.timestamp(value)
+
+
+@pytest.mark.parametrize('value', [True, -1, 256, 1.0, '1', None])
+def test_invalid_uint(value):
+    with pytest.raises(validation.ValidationError):
+        validation.uint(validation.TINYINT_MAX)(value)
+
+
+@pytest.mark.parametrize('value', ['', '-1', '+1', '1.0', '٣', '16777216', '00000000000'])
+def test_invalid_uint_string(value):
+    with pytest.raises(validation.ValidationError):
+        validation.uint_string(validation.MEDIUMINT_MAX)(value)
+
+
+def test_weight_bounds():
+    weight = validation.number(0.01, 50)
+    assert weight(0.01) == 0.01 and weight(50) == 50
+    for value in (0, 50.01, True, '1', None):
+        with pytest.raises(validation.ValidationError):
+            weight(value)
+
+
+def test_record_requires_exact_keys():
+    assert validation.ASSIGN({'courier_id': 1}) == (1,)
+    for value in ({}, {'courier_id': 1, 'extra': 1}, [1], None):
+        with pytest.raises(validation.ValidationError):
+            validation.ASSIGN(value)
+
+
+def test_partial_record():
+    validation.COURIER_TYPES.update(('foot', 'bike', 'car'))
+    assert validation.COURIER_PATCH({}) == {}
+    assert validation.COURIER_PATCH({'regions': [3, 1, 3]}) == {'regions': [3, 1]}
+    for value in ({'courier_type': 'plane'}, {'name': 'x'}, {'regions': [1, -1]}, []):
+        with pytest.raises(validation.ValidationError):
+            validation.COURIER_PATCH(value)
+
+
+def test_validate_batch():
+    validator = validation.record({'id': validation.uint(10)})
+    items = [{'id': 1}, {'id': 11}, {'id': 1}, 'x', {'id': 2}]
+    seen = set()
+    valid, invalid = validation.validate_batch(items, validator, seen)
+    assert valid == [(0, (1,)), (4, (2,))]
+    assert invalid == [1, 2, 3]
+    assert validation.ids_at(items, 'id', invalid) == [11, 1, None]
+    # an id of a previous batch of the same request is repeated
+    valid, invalid = validation.validate_batch([{'id': 2}, {'id': 3}], validator, seen)
+    assert valid == [(1, (3,))] and invalid == [0]
@@ -0,0 +1,144 @@
+"""
+Opt-in tracing of the SQL statements run for a request. A request is traced if it has the X-Debug-Trace header
+(cfg.TRACE_HEADER_ENABLED, off by default) or is sampled (cfg.TRACE_SAMPLE_RATE). The cursor of db_connection adds a span
+for every statement run while the request is handled: the fingerprint of the statement, number of its parameters,
+duration and rows, and the output of EXPLAIN if the statement took longer than cfg.TRACE_EXPLAIN_THRESHOLD.
+The trace is returned in the X-Debug-Trace header of the response if it was asked for with the header,
+and kept in a ring buffer served at GET /admin/traces (cfg.TRACE_ADMIN_ENABLED, off by default) if it was asked for
+or the request was slow. The traces show the statements and the plans of the queries, so with cfg.TRACE_TOKEN set
+the header is honoured and the traces are served only to the requests authorized by it.
+"""
+import collections
+import contextvars
+import functools
+import hmac
+import json
+import random
+import re
+import time
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+import cfg
+import logs
+
+TRACE_HEADER = 'X-Debug-Trace'
+
+_current = contextvars.ContextVar('trace', default=None)
+_recent = collections.deque(maxlen=cfg.TRACE_RING_SIZE)  # finished traces, newest last
+
+_PLACEHOLDER_LIST_RE = re.compile(r'\(\s*%s(?:\s*,\s*%s)+\s*\)')
+_LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|\b\d+(?:\.\d+)?\b|%s")
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(query: str) -> str:
+    """
+    :return: the statement with literals and placeholders replaced by ?, lists of them by (...), whitespace collapsed
+    """
+    query = _PLACEHOLDER_LIST_RE.sub('(...)', query)
+    query = _LITERAL_RE.sub('?', query)
+    return _WHITESPACE_RE.sub(' ', query).strip()
+
+
+class Trace:
+    __slots__ = ('request_id', 'method', 'path', 'requested', 'keep_statements', 'start', 'duration', 'status', 'spans',
+                 'dropped_spans')
+
+    def __init__(self, request_id: str, method: str, path: str, requested: bool, keep_statements: bool = False):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.requested = requested  # asked for with the header, so it`s returned in the response
+        self.keep_statements = keep_statements  # spans get the statements as they were sent, with the arguments
+        self.start = time.perf_counter()
+        self.duration = None
+        self.status = None
+        self.spans = []
+        self.dropped_spans = 0
+
+    def add_span(self, query: str, params: int, seconds: float, rows: int, failed: bool, explain: Optional[List[Dict]],
+                 statement: Optional[str] = None):
+        if len(self.spans) >= cfg.TRACE_MAX_SPANS:
+            self.dropped_spans += 1
+            return
+        span = {'sql': fingerprint(query), 'params': params, 'duration_ms': round(seconds * 1000, 3), 'rows': rows}
+        if failed:
+            span['failed'] = True
+        if explain is not None:
+            span['explain'] = explain
+        if self.keep_statements and statement is not None:
+            span['statement'] = statement
+        self.spans.append(span)
+
+    def to_dict(self) -> Dict:
+        return {'request_id': self.request_id, 'method': self.method, 'path': self.path, 'status': self.status,
+                'duration_ms': round(self.duration * 1000, 3), 'db_ms': round(sum(x['duration_ms'] for x in self.spans), 3),
+                'spans': self.spans, 'dropped_spans': self.dropped_spans}
+
+
+def current() -> Optional[Trace]:
+    """
+    :return: trace of the request handled in the current context, None if it`s not traced
+    """
+    return _current.get()
+
+
+def start(trace: Trace):
+    """
+    Makes the statements run in the current context be traced into the trace, outside of the requests as well.
+    """
+    _current.set(trace)
+
+
+def finish(trace: Trace):
+    _current.set(None)
+    trace.duration = time.perf_counter() - trace.start
+
+
+def recent() -> List[Dict]:
+    return [trace.to_dict() for trace in reversed(_recent)]
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, default=str, separators=(',', ':'))
+
+
+def authorized(request: web.Request) -> bool:
+    """
+    :return: True if the request may see traces: cfg.TRACE_TOKEN is not set, or it`s passed as the bearer token
+    """
+    if cfg.TRACE_TOKEN is None:
+        return True
+    return hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {cfg.TRACE_TOKEN}'.encode())
+
+
+@web.middleware
+async def middleware(request: web.Request, handler):
+    requested = cfg.TRACE_HEADER_ENABLED and TRACE_HEADER in request.headers and authorized(request)
+    if not requested and random.random() >= cfg.TRACE_SAMPLE_RATE:
+        return await handler(request)
+    trace = Trace(logs.request_id.get(), request.method, request.path, requested)
+    start(trace)
+    response = None
+    try:
+        response = await handler(request)
+        trace.status = response.status
+        return response
+    except web.HTTPException as error:
+        trace.status = error.status
+        response = error
+        raise
+    finally:
+        finish(trace)
+        if requested or trace.duration >= cfg.TRACE_SLOW_REQUEST_SECONDS:
+            _recent.append(trace)
+        if requested and response is not None:
+            header = _dumps(trace.to_dict())
+            if len(header) > cfg.TRACE_HEADER_MAX_BYTES:
+                # the whole trace stays available at GET /admin/traces
+                header = _dumps({'request_id': trace.request_id, 'truncated': True,
+                                 'duration_ms': round(trace.duration * 1000, 3), 'spans': len(trace.spans)})
+            response.headers[TRACE_HEADER] = header
@@ -0,0 +1,223 @@
+"""
+Validation of the bodies of the requests. The schemas of the endpoints at the bottom are compiled once, on import,
+into plain functions: each of them checks the types and the keys of a value and converts it into the form
+the DB stores (time ranges into minutes of the day, timestamps into naive UTC datetimes) in the same pass,
+raising ValidationError at the first invalid field.
+db_connection runs them before a transaction is opened, so invalid data is never sent to MySQL.
+"""
+import datetime
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+# bounds of the unsigned integer columns the ids and regions are stored in
+TINYINT_MAX = 255
+SMALLINT_MAX = 65535
+MEDIUMINT_MAX = 16777215
+INT_MAX = 4294967295
+
+COURIER_TYPES: Set[str] = set()  # courier types registered in the table weights, loaded by db_connection.init_pool
+
+Validator = Callable[[object], object]  # returns the converted value, raises ValidationError if it`s invalid
+
+
+class ValidationError(ValueError):
+    """
+    The value doesn`t match the schema.
+    """
+
+
+def uint(maximum: int) -> Validator:
+    def validate(value):
+        if type(value) is not int or not 0 <= value <= maximum:
+            raise ValidationError(f'not an integer from 0 to {maximum}: {value!r}')
+        return value
+    return validate
+
+
+def uint_string(maximum: int) -> Validator:
+    """
+    Unsigned integer passed as a string, e.g. in the query of the URL.
+    """
+    validate_uint = uint(maximum)
+
+    def validate(value):
+        if type(value) is not str or not value.isascii() or not value.isdigit() or len(value) > len(str(maximum)):
+            raise ValidationError(f'not an integer from 0 to {maximum}: {value!r}')
+        return validate_uint(int(value))
+    return validate
+
+
+def number(minimum: float, maximum: float) -> Validator:
+    def validate(value):
+        if type(value) not in (int, float) or not minimum <= value <= maximum:
+            raise ValidationError(f'not a number from {minimum} to {maximum}: {value!r}')
+        return value
+    return validate
+
+
+def one_of(choices: Set[str]) -> Validator:
+    """
+    :param choices: the set is looked up on every call, so it may be filled after the validator is compiled
+    """
+    def validate(value):
+        if type(value) is not str or value not in choices:
+            raise ValidationError(f'not one of {sorted(choices)}: {value!r}')
+        return value
+    return validate
+
+
+def array(value) -> List:
+    if type(value) is not list:
+        raise ValidationError(f'not a list: {value!r}')
+    return value
+
+
+def list_of(item: Validator, unique: bool = False) -> Validator:
+    """
+    :param unique: repeated items are dropped, the first occurrences are kept in their order
+    """
+    def validate(value):
+        if type(value) is not list:
+            raise ValidationError(f'not a list: {value!r}')
+        items = [item(x) for x in value]
+        return list(dict.fromkeys(items)) if unique else items
+    return validate
+
+
+_TIME_RANGE_RE = re.compile(r'(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})', re.ASCII)
+_TIME_RANGES_MAXSIZE = 100000
+_time_ranges: Dict[str, tuple] = {}  # parsed valid time ranges, clients send the same few of them over and over
+
+
+def time_range(value) -> (int, int):
+    """
+    :param value: range of time in HH:MM-HH:MM format, the end may be 24:00
+    :return: tuple of start and stop of the range as minutes of the day, the form time is stored in the DB
+    """
+    parsed = _time_ranges.get(value) if type(value) is str else None
+    if parsed is None:
+        parsed = _parse_time_range(value)
+        if len(_time_ranges) < _TIME_RANGES_MAXSIZE:
+            _time_ranges[value] = parsed
+    return parsed
+
+
+def _parse_time_range(value) -> (int, int):
+    match = _TIME_RANGE_RE.fullmatch(value) if type(value) is str else None
+    if not match:
+        raise ValidationError(f'invalid time range: {value!r}')
+    start_hours, start_minutes, stop_hours, stop_minutes = map(int, match.groups())
+    # 24:00 ends a range at the end of the day, the ranges are half-open, so the last minute is included
+    end_of_day = stop_hours == 24 and stop_minutes == 0
+    if start_hours > 23 or stop_hours > 23 and not end_of_day or start_minutes > 59 or stop_minutes > 59:
+        raise ValidationError(f'invalid time range: {value!r}')
+    start, stop = start_hours * 60 + start_minutes, stop_hours * 60 + stop_minutes
+    if start >= stop:
+        raise ValidationError(f'empty time range: {value!r}')
+    return start, stop
+
+
+_TIMESTAMP_RE = re.compile(r'(\d{4}-\d{2}-\d{2})T(\d{2}:\d{2}:\d{2})(?:\.(\d{1,6}))?(Z|[+-]\d{2}:\d{2})', re.ASCII)
+
+
+def timestamp(value) -> datetime.datetime:
+    """
+    :param value: RFC 3339 date and time, e.g. 2021-01-10T10:33:01.42Z
+    :return: naive datetime in UTC
+    """
+    match = _TIMESTAMP_RE.fullmatch(value) if type(value) is str else None
+    if not match:
+        raise ValidationError(f'invalid timestamp: {value!r}')
+    date, time, fraction, zone = match.groups()
+    zone = '+00:00' if zone == 'Z' else zone
+    # fromisoformat accepts only 3 or 6 digits of the fraction of the second
+    try:
+        parsed = datetime.datetime.fromisoformat(f'{date}T{time}.{(fraction or "").ljust(6, "0")}{zone}')
+    except ValueError:
+        raise ValidationError(f'invalid timestamp: {value!r}')
+    return parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def record(fields: Dict[str, Validator]) -> Callable[[object], tuple]:
+    """
+    :param fields: validators of the values by their keys, all keys are required and no other key is allowed
+    :return: validator returning the tuple of the converted values in the order of fields
+    """
+    # the validator is generated with the fields unrolled, it`s called for every item of the batches
+    namespace = {'keys': frozenset(fields), 'ValidationError': ValidationError}
+    calls = []
+    for number, (key, validate_field) in enumerate(fields.items()):
+        namespace[f'validate_{number}'] = validate_field
+        calls.append(f'validate_{number}(value[{key!r}])')
+    exec(f'''def validate(value):
+    if type(value) is not dict or value.keys() != keys:
+        raise ValidationError(f'not an object with the keys {{sorted(keys)}}')
+    return ({", ".join(calls)},)''', namespace)
+    return namespace['validate']
+
+
+def partial_record(fields: Dict[str, Validator]) -> Callable[[object], Dict]:
+    """
+    :param fields: validators of the values by their keys, any of the keys may be left out, no other key is allowed
+    :return: validator returning the dict of the converted values of the passed keys
+    """
+    keys = frozenset(fields)
+
+    def validate(value) -> Dict:
+        if type(value) is not dict or not value.keys() <= keys:
+            raise ValidationError(f'not an object with some of the keys {sorted(keys)}')
+        return {key: fields[key](x) for key, x in value.items()}
+    return validate
+
+
+def validate_batch(items: List, validator: Callable[[object], tuple],
+                   seen_ids: Optional[Set] = None) -> (List[tuple], List[int]):
+    """
+    Validates the whole batch in one pass. An id repeated in the batch is invalid everywhere but in its first occurrence,
+    as it would be in the DB.
+    :param validator: returns a tuple of the values to be written, starting with the id
+    :param seen_ids: ids of the valid items of the previous batches of the same request, updated with the ones of this batch
+    :return: tuple of the list of (index, values) of valid items and the list of indexes of invalid ones
+    """
+    valid = []
+    invalid = []
+    seen_ids = set() if seen_ids is None else seen_ids
+    for index, item in enumerate(items):
+        try:
+            row = validator(item)
+        except ValidationError:
+            invalid.append(index)
+            continue
+        if row[0] in seen_ids:
+            invalid.append(index)
+        else:
+            seen_ids.add(row[0])
+            valid.append((index, row))
+    return valid, invalid
+
+
+def ids_at(items: List, id_key: str, indexes: Iterable[int]) -> List:
+    """
+    :return: ids of the items with the passed indexes in the order of the request
+    """
+    return [items[i].get(id_key) if type(items[i]) is dict else None for i in sorted(indexes)]
+
+
+BATCH = record({'data': array})  # POST /couriers and /orders, the items are validated by COURIER and ORDER
+COURIER = record({'courier_id': uint(SMALLINT_MAX), 'courier_type': one_of(COURIER_TYPES),
+                  'regions': list_of(uint(TINYINT_MAX), unique=True), 'working_hours': list_of(time_range)})
+ORDER = record({'order_id': uint(INT_MAX), 'weight': number(0.01, 50), 'region': uint(TINYINT_MAX),
+                'delivery_hours': list_of(time_range)})
+COURIER_PATCH = partial_record({'courier_type': one_of(COURIER_TYPES), 'regions': list_of(uint(TINYINT_MAX), unique=True),
+                                'working_hours': list_of(time_range)})
+ASSIGN = record({'courier_id': uint(SMALLINT_MAX)})
+ASSIGN_BATCH = record({'courier_ids': list_of(uint(SMALLINT_MAX), unique=True)})
+COMPLETE = record({'courier_id': uint(SMALLINT_MAX), 'order_id': uint(INT_MAX), 'complete_time': timestamp})
+# GET /orders/export and /assignments/export, the values of the query of the URL; after is the resume token,
+# the id of the last item received
+EXPORT_ORDERS = partial_record({'after': uint_string(INT_MAX), 'limit': uint_string(INT_MAX),
+                                'region': uint_string(TINYINT_MAX), 'courier_id': uint_string(SMALLINT_MAX),
+                                'completed_from': timestamp, 'completed_to': timestamp})
+EXPORT_ASSIGNMENTS = partial_record({'after': uint_string(MEDIUMINT_MAX), 'limit': uint_string(INT_MAX),
+                                     'courier_id': uint_string(SMALLINT_MAX),
+                                     'assigned_from': timestamp, 'assigned_to': timestamp})